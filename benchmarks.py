@@ -0,0 +1,1136 @@
+import asyncio
+import collections
+import gc
+import itertools
+import multiprocessing
+import os
+import socket
+import tempfile
+import threading as mp
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import grpc
+from colorama import Fore, Style
+
+import chat_pb2
+import chat_pb2_grpc
+import engine
+import snapshot
+import storage
+import wire_protocol as wp
+import write_ahead_log
+from grpc_server import AsyncChatServer
+from grpc_server import ChatServer as gRPCChatServer
+from socket_server import ChatServer as SocketChatServer
+from socket_server import Reactor
+from sharded_server import ServeSharded
+
+
+def StartSocketServer(server, backlog=10):
+    """
+    Serves `server` on an ephemeral localhost port from a background thread.
+
+    Returns:
+        int: The port the server is listening on.
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("localhost", 0))
+    listener.listen(backlog)
+
+    def AcceptLoop():
+        while True:
+            c, addr = listener.accept()
+            mp.Thread(target=server.HandleNewConnection,
+                      args=(c, addr), daemon=True).start()
+
+    mp.Thread(target=AcceptLoop, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def StartAsyncioServer(server, backlog=100):
+    """
+    Serves `server` on an ephemeral localhost port from an event loop
+    running on a background thread.
+
+    Returns:
+        int: The port the server is listening on.
+    """
+    loop = asyncio.new_event_loop()
+    mp.Thread(target=loop.run_forever, daemon=True).start()
+    listener = asyncio.run_coroutine_threadsafe(
+        asyncio.start_server(server.HandleStream, "localhost", 0,
+                             backlog=backlog),
+        loop).result()
+    return listener.sockets[0].getsockname()[1]
+
+
+def StartReactorServer(server, backlog=1024, workers=8,
+                       max_connections=10000):
+    """
+    Serves `server` on an ephemeral localhost port from a `Reactor` running
+    on a background thread.
+
+    Returns:
+        int: The port the server is listening on.
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("localhost", 0))
+    listener.listen(backlog)
+    reactor = Reactor(server, listener, workers, max_connections)
+    mp.Thread(target=reactor.Run, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def ResidentMemory():
+    """
+    Returns the resident set size of this process in bytes, or 0 where
+    /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def CreateAccounts(stub, usernames):
+    """
+    Creates an account for every username and returns their tokens.
+    """
+    tokens = {}
+    for username in usernames:
+        resp = stub.CreateAccount(wp.encode.AccountCreateRequest(
+            version=1, username=username, password="pw", fullname=username))
+        tokens[username] = resp.auth_token
+    return tokens
+
+
+class DictMessageRequest:
+    """
+    The original message layout, kept for comparison: a per instance
+    `fields` dict, a `generated_error_code` attribute and every field
+    decoded eagerly into the instance `__dict__`.
+    """
+
+    def __init__(self, raw_bytes):
+        self.generated_error_code = None
+        self.fields = {
+            "version": int,
+            "auth_token": str,
+            "username": str,
+            "recipient_username": str,
+            "message": str
+        }
+        for field in self.fields.keys():
+            assert field not in self.__dict__
+            setattr(self, field, None)
+
+        payload = memoryview(raw_bytes)[wp.frame.HEADER.size:]
+        offset = 0
+        for field, cls in self.fields.items():
+            if cls is int:
+                val, = wp.frame.INT.unpack_from(payload, offset)
+                offset += wp.frame.INT.size
+            else:
+                size, = wp.frame.LENGTH.unpack_from(payload, offset)
+                offset += wp.frame.LENGTH.size
+                val = str(payload[offset:offset + size], "UTF-8")
+                offset += size
+            setattr(self, field, val)
+
+
+def MeasureDecoder(decode, raw, iterations):
+    """
+    Measures one way of decoding `raw` as a request the way a handler does,
+    reading only the token and username.
+
+    Returns:
+        tuple: (bytes allocated per decode, gc tracked objects allocated per
+        decode, microseconds per decode)
+    """
+    def Handle():
+        msg = decode(raw)
+        msg.auth_token
+        msg.username
+        return msg
+
+    # keep every decoded message alive so that nothing allocated by a decode
+    # is freed before it is counted; the generation 0 counter grows with
+    # every container object the collector has to track
+    gc.collect()
+    gc.disable()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    start_count = gc.get_count()[0]
+    live = [None] * iterations
+    for i in range(iterations):
+        live[i] = Handle()
+    tracked = (gc.get_count()[0] - start_count - 1) / iterations
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    gc.enable()
+    allocated = (after - before - 8 * iterations) / iterations
+    del live
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        Handle()
+    elapsed = (time.perf_counter() - start) / iterations * 1e6
+    return allocated, tracked, elapsed
+
+
+def MessageAllocationBenchmark(iterations=20000):
+    """
+    Compare memory and allocations per decoded MessageRequest for the
+    original dict based layout, the slotted messages and the pooled
+    messages used by the socket server receive loop.
+    """
+    raw = wp.encode.MessageRequest(version=1,
+                                   auth_token="0123456789abcdef0123456789",
+                                   username="aakamishra",
+                                   recipient_username="apumishra",
+                                   message="hi!" * 50)
+    pool = wp.message.MessagePool()
+    decoders = [
+        ("dict", DictMessageRequest),
+        ("slots", wp.socket_types.MessageRequest),
+        ("pooled", lambda raw: pool.Decode(wp.socket_types.MessageRequest,
+                                           raw)),
+    ]
+
+    print(f"{'layout':<8}{'bytes/decode':>14}{'gc objects/decode':>20}"
+          f"{'us/decode':>12}")
+    results = {}
+    for name, decode in decoders:
+        results[name] = MeasureDecoder(decode, raw, iterations)
+        allocated, tracked, elapsed = results[name]
+        print(f"{name:<8}{allocated:>14.1f}{tracked:>20.2f}"
+              f"{elapsed:>12.2f}")
+
+    assert results["slots"][1] < results["dict"][1]
+    assert results["pooled"][0] < results["slots"][0]
+    print(Fore.GREEN + "MessageAllocationBenchmark Passed" + Style.RESET_ALL)
+
+
+def BatchSendBenchmark(recipients=2000):
+    """
+    Compare sending one message to each of many recipients with one
+    MessageRequest per recipient against a single BatchMessageRequest.
+    """
+    port = StartSocketServer(SocketChatServer())
+    stub = wp.client_stub.ChatServerStub("localhost", port)
+    usernames = [f"user{i}" for i in range(recipients)]
+    tokens = CreateAccounts(stub, ["bot"] + usernames)
+
+    start = time.perf_counter()
+    for username in usernames:
+        resp = stub.SendMessage(wp.encode.MessageRequest(
+            version=1, auth_token=tokens["bot"], username="bot",
+            recipient_username=username, message="scheduled maintenance"))
+        assert len(resp.error_code) == 0
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    resp = stub.SendMessages(wp.encode.BatchMessageRequest(
+        version=1, auth_token=tokens["bot"], username="bot",
+        recipient_usernames=usernames,
+        messages=["scheduled maintenance"] * recipients))
+    batched = time.perf_counter() - start
+    assert resp.status_codes == [wp.message.STATUS_DELIVERED] * recipients
+    stub.Close()
+
+    print(f"{recipients} single sends: {single * 1000:.1f} ms")
+    print(f"1 batch of {recipients}: {batched * 1000:.1f} ms "
+          f"({single / batched:.0f}x faster)")
+    assert batched * 10 < single
+    print(Fore.GREEN + "BatchSendBenchmark Passed" + Style.RESET_ALL)
+
+
+def CompressionBenchmark(messages=5000, rounds=20, link_mbps=10):
+    """
+    Compare the bytes on the wire and the latency of draining a large inbox
+    with and without reply compression.
+
+    Loopback has practically unlimited bandwidth, so besides the measured
+    latency the benchmark also reports the projected latency on a
+    `link_mbps` link, where transfer time dominates.
+    """
+    inbox = [f"[notifier]: build {i} finished, 42 tests passed, 0 failed"
+             for i in range(messages)]
+    results = {}
+    for accept_compression in [False, True]:
+        server = SocketChatServer()
+        sck = socket.create_connection(("localhost",
+                                        StartSocketServer(server)))
+        flags = wp.frame.FLAG_ACCEPT_COMPRESSION if accept_compression else 0
+
+        sck.sendall(wp.frame.SetRequestId(wp.encode.AccountCreateRequest(
+            version=1, username="reader", password="pw", fullname="reader"),
+            1, flags))
+        token = wp.socket_types.AccountCreateReply(
+            wp.frame.ReadFrame(sck)).auth_token
+        request = wp.frame.SetRequestId(wp.encode.RefreshRequest(
+            version=1, auth_token=token, username="reader", wait_ms=0), 2,
+            flags)
+
+        wire_bytes = 0
+        elapsed = 0
+        for _ in range(rounds):
+            server.user_inbox["reader"] = list(inbox)
+            start = time.perf_counter()
+            sck.sendall(request)
+            reply = wp.frame.ReadFrame(sck, decompress=False)
+            msg = wp.socket_types.RefreshReply(reply).message
+            elapsed += time.perf_counter() - start
+            wire_bytes += len(reply)
+            assert msg.count("\n") == messages - 1
+        sck.close()
+
+        wire_bytes /= rounds
+        elapsed /= rounds
+        projected = elapsed + wire_bytes * 8 / (link_mbps * 1e6)
+        results[accept_compression] = (wire_bytes, elapsed, projected)
+
+    print(f"{'compression':<12}{'bytes/drain':>14}{'loopback ms':>14}"
+          f"{f'{link_mbps} Mbit/s ms':>16}")
+    for accept_compression, (wire_bytes, elapsed, projected) in \
+            results.items():
+        print(f"{'on' if accept_compression else 'off':<12}"
+              f"{wire_bytes:>14,.0f}{elapsed * 1000:>14.2f}"
+              f"{projected * 1000:>16.2f}")
+    assert results[True][0] * 4 < results[False][0]
+    assert results[True][2] < results[False][2]
+    print(Fore.GREEN + "CompressionBenchmark Passed" + Style.RESET_ALL)
+
+
+def ReplyWriteBenchmark(messages=5000, rounds=50):
+    """
+    Compare the memory allocated and the time taken to send a large reply
+    when the whole frame is copied to stamp its request id, against the
+    frame writer, which stamps a reused header and sends the payload
+    unchanged with sendmsg.
+    """
+    body = "\n".join(f"[notifier]: build {i} finished" for i in range(messages))
+    reply = wp.encode.RefreshReply(version=1, message=body, error_code="")
+    sender, receiver = socket.socketpair()
+
+    def Drain():
+        # reads into one fixed buffer so that only the sender allocates
+        buffer = bytearray(1 << 16)
+        while receiver.recv_into(buffer):
+            pass
+
+    drain = mp.Thread(target=Drain, daemon=True)
+    drain.start()
+    writer = wp.frame.FrameWriter(sender)
+    senders = [
+        ("copy", lambda i: sender.sendall(wp.frame.SetRequestId(reply, i))),
+        ("writer", lambda i: writer.Send(reply, i)),
+    ]
+
+    print(f"{'send':<8}{'reply bytes':>12}{'peak bytes':>18}"
+          f"{'us/send':>10}")
+    results = {}
+    for name, send in senders:
+        tracemalloc.start()
+        for i in range(1, rounds + 1):
+            send(i)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        start = time.perf_counter()
+        for i in range(1, rounds + 1):
+            send(i)
+        elapsed = (time.perf_counter() - start) / rounds * 1e6
+        results[name] = (peak, elapsed)
+        print(f"{name:<8}{len(reply):>12,}{peak:>18,}{elapsed:>10.1f}")
+    sender.close()
+    drain.join()
+    receiver.close()
+
+    assert results["writer"][0] * 10 < results["copy"][0]
+    print(Fore.GREEN + "ReplyWriteBenchmark Passed" + Style.RESET_ALL)
+
+
+def IdleConnectionBenchmark(connections=5000, requests=200):
+    """
+    Compare the threads, memory and request latency of the thread per
+    connection server, the asyncio server and the reactor while they hold
+    many idle connections.
+    """
+    results = {}
+    for mode, start in [("threads", StartSocketServer),
+                        ("asyncio", StartAsyncioServer),
+                        ("reactor", StartReactorServer)]:
+        port = start(SocketChatServer(), backlog=1024)
+        threads = mp.active_count()
+        memory = ResidentMemory()
+        idle = []
+        for _ in range(connections):
+            idle.append(socket.create_connection(("localhost", port)))
+
+        stub = wp.client_stub.ChatServerStub("localhost", port)
+        token = CreateAccounts(stub, ["reader"])["reader"]
+        request = wp.encode.RefreshRequest(version=1, auth_token=token,
+                                           username="reader", wait_ms=0)
+        start = time.perf_counter()
+        for _ in range(requests):
+            stub.DeliverMessages(request)
+        elapsed = (time.perf_counter() - start) / requests * 1e6
+        results[mode] = (mp.active_count() - threads,
+                         (ResidentMemory() - memory) / connections, elapsed)
+        stub.Close()
+        for sck in idle:
+            sck.close()
+
+    print(f"{connections} idle connections")
+    print(f"{'mode':<10}{'threads':>10}{'bytes/conn':>14}{'us/request':>14}")
+    for mode, (threads, memory, elapsed) in results.items():
+        print(f"{mode:<10}{threads:>10}{memory:>14,.0f}{elapsed:>14.1f}")
+    assert results["asyncio"][0] < 10 < results["threads"][0]
+    # the reactor thread, its worker pool, the idle connection reaper and
+    # the token sweeper
+    assert results["reactor"][0] <= 1 + 8 + 1 + 1
+    print(Fore.GREEN + "IdleConnectionBenchmark Passed" + Style.RESET_ALL)
+
+
+def SlowConsumerBenchmark(stalled=20, requests=500):
+    """
+    Measure the request latency of one client of the reactor while other
+    clients flood it with requests for large replies and never read them.
+    """
+    big_reply = wp.encode.LoginReply(version=1, error_code="",
+                                     auth_token="x" * 65536, fullname="")
+    results = {}
+    for count in (0, stalled):
+        server = SocketChatServer()
+        server.slow_consumer_timeout = 2.0
+        server.dispatcher.Register(wp.frame.OP_LOGIN, "Login",
+                                   lambda data: big_reply)
+        port = StartReactorServer(server)
+        memory = ResidentMemory()
+        flooders = []
+        for _ in range(count):
+            sck = socket.create_connection(("localhost", port))
+            sck.sendall(wp.encode.LoginRequest(
+                version=1, username="a", password="b") * 1000)
+            flooders.append(sck)
+
+        stub = wp.client_stub.ChatServerStub("localhost", port)
+        token = CreateAccounts(stub, ["reader"])["reader"]
+        request = wp.encode.RefreshRequest(version=1, auth_token=token,
+                                           username="reader", wait_ms=0)
+        latencies = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            stub.DeliverMessages(request)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        deadline = time.monotonic() + 10
+        while server.metrics.Counters().get(
+                "slow_consumers_evicted", 0) < count and \
+                time.monotonic() < deadline:
+            time.sleep(0.1)
+        results[count] = (latencies[len(latencies) // 2],
+                          latencies[int(len(latencies) * 0.99)],
+                          (ResidentMemory() - memory) / 2 ** 20,
+                          server.metrics.Counters().get(
+                              "slow_consumers_evicted", 0))
+        stub.Close()
+        for sck in flooders:
+            sck.close()
+
+    print(f"{'stalled':<10}{'p50 us':>10}{'p99 us':>10}{'MiB':>8}"
+          f"{'evicted':>10}")
+    for count, (p50, p99, memory, evicted) in results.items():
+        print(f"{count:<10}{p50 * 1e6:>10.1f}{p99 * 1e6:>10.1f}"
+              f"{memory:>8.1f}{evicted:>10}")
+    # 1000 unread 64 KiB replies per client would be over 60 MiB each
+    assert results[stalled][3] == stalled
+    assert results[stalled][2] < stalled * 8
+    print(Fore.GREEN + "SlowConsumerBenchmark Passed" + Style.RESET_ALL)
+
+
+def PushDeliveryBenchmark(messages=20, interval=0.1, poll_interval=0.5):
+    """
+    Compare how long messages take to reach a client that polls
+    `DeliverMessages` like `ClientApplication.ListenLoop` used to, one that
+    long polls and one that subscribes, and how many requests each makes
+    the server serve.
+    """
+    results = {}
+    for mode in ("poll", "long poll", "push"):
+        server = SocketChatServer()
+        port = StartReactorServer(server)
+        stub = wp.client_stub.ChatServerStub("localhost", port)
+        tokens = CreateAccounts(stub, ["sender", "reader"])
+        reader = wp.client_stub.ChatServerStub("localhost", port)
+        received = {}
+        done = mp.Event()
+
+        def Received(batch):
+            now = time.perf_counter()
+            for message in batch:
+                received[message.split(": ", 1)[1]] = now
+            if len(received) == messages:
+                done.set()
+
+        if mode == "push":
+            reader.Subscribe(wp.encode.SubscribeRequest(
+                version=1, auth_token=tokens["reader"], username="reader"),
+                Received)
+        else:
+            def Poll(reader, done, Received, wait_ms):
+                request = wp.encode.RefreshRequest(
+                    version=1, auth_token=tokens["reader"], username="reader",
+                    wait_ms=wait_ms)
+                while not done.is_set():
+                    resp = reader.DeliverMessages(request)
+                    if resp.error_code == "":
+                        Received(resp.message.split("\n"))
+                    if not wait_ms:
+                        time.sleep(poll_interval)
+            wait_ms = 1000 if mode == "long poll" else 0
+            poller = mp.Thread(target=Poll,
+                               args=(reader, done, Received, wait_ms))
+            poller.start()
+
+        sent = {}
+        for i in range(messages):
+            sent[str(i)] = time.perf_counter()
+            stub.SendMessage(wp.encode.MessageRequest(
+                version=1, auth_token=tokens["sender"], username="sender",
+                recipient_username="reader", message=str(i)))
+            time.sleep(interval)
+        done.wait(10)
+        if mode != "push":
+            poller.join()
+        latencies = sorted(received[i] - sent[i] for i in sent)
+        polls = server.metrics.Snapshot()["DeliverMessages"]["count"]
+        results[mode] = (latencies[len(latencies) // 2], latencies[-1], polls)
+        reader.Close()
+        stub.Close()
+
+    print(f"{'mode':<10}{'p50 ms':>10}{'max ms':>10}{'polls':>8}")
+    for mode, (p50, worst, polls) in results.items():
+        print(f"{mode:<10}{p50 * 1e3:>10.1f}{worst * 1e3:>10.1f}{polls:>8}")
+    assert results["push"][2] == 0
+    assert results["push"][0] < results["poll"][0]
+    assert results["long poll"][0] < results["poll"][0]
+    print(Fore.GREEN + "PushDeliveryBenchmark Passed" + Style.RESET_ALL)
+
+
+def GrpcStreamsBenchmark(streams=40, wait_ms=500, workers=10):
+    """
+    Hold `streams` long polling DeliverMessages streams open against the
+    threaded gRPC server with `workers` threads and against the grpc.aio
+    server, and time a Login on each while they wait.
+    """
+    results = {}
+    for mode in ("threads", "aio"):
+        if mode == "threads":
+            server = grpc.server(ThreadPoolExecutor(max_workers=workers))
+            chat_pb2_grpc.add_ChatServerServicer_to_server(gRPCChatServer(),
+                                                           server)
+            port = server.add_insecure_port("localhost:0")
+            server.start()
+        else:
+            loop = asyncio.new_event_loop()
+            mp.Thread(target=loop.run_forever, daemon=True).start()
+
+            async def Start():
+                server = grpc.aio.server()
+                chat_pb2_grpc.add_ChatServerServicer_to_server(
+                    AsyncChatServer(), server)
+                port = server.add_insecure_port("localhost:0")
+                await server.start()
+                return server, port
+
+            server, port = asyncio.run_coroutine_threadsafe(
+                Start(), loop).result()
+        channel = grpc.insecure_channel(f"localhost:{port}")
+        stub = chat_pb2_grpc.ChatServerStub(channel)
+        token = stub.CreateAccount(chat_pb2.AccountCreateRequest(
+            version=1, username="reader", password="pw",
+            fullname="reader")).auth_token
+
+        polls = [stub.DeliverMessages(chat_pb2.RefreshRequest(
+            version=1, auth_token=token, username="reader", wait_ms=wait_ms))
+            for _ in range(streams)]
+        # streams start as the client reads them
+        readers = ThreadPoolExecutor(streams)
+        for poll in polls:
+            readers.submit(list, poll)
+        time.sleep(0.5)
+        start = time.perf_counter()
+        stub.Login(chat_pb2.LoginRequest(version=1, username="reader",
+                                         password="pw"))
+        results[mode] = time.perf_counter() - start
+        readers.shutdown()
+        channel.close()
+        if mode == "threads":
+            server.stop(None)
+        else:
+            asyncio.run_coroutine_threadsafe(server.stop(None), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+
+    print(f"{'mode':<10}{'login ms':>10}")
+    for mode, latency in results.items():
+        print(f"{mode:<10}{latency * 1e3:>10.1f}")
+    # the threaded server only gets to the login once polls time out
+    assert results["threads"] > wait_ms / 2000
+    assert results["aio"] < results["threads"] / 10
+    print(Fore.GREEN + "GrpcStreamsBenchmark Passed" + Style.RESET_ALL)
+
+
+def ListInboxReplies(server, username):
+    """
+    The original gRPC inbox drain, kept for comparison: one lock
+    acquisition to check the length and another to `pop(0)` every message
+    from a list.
+    """
+    stripe = server.stripes.Of(username)
+    while server.CheckInboxLength(username=username) > 0:
+        with stripe.inbox_lock:
+            msg = stripe.user_inbox[username].pop(0)
+        yield chat_pb2.RefreshReply(version=1, error_code="", message=msg)
+
+
+def InboxDrainBenchmark(sizes=(10000, 30000, 100000)):
+    """
+    Time streaming inboxes of `sizes` messages out of the gRPC servicer,
+    with the original per message drain of a list and with the chunked
+    drain of a deque.
+    """
+    server = gRPCChatServer()
+    token = server.CreateAccount(chat_pb2.AccountCreateRequest(
+        version=1, username="reader", password="pw", fullname="reader"),
+        None).auth_token
+    request = chat_pb2.RefreshRequest(version=1, auth_token=token,
+                                      username="reader", wait_ms=0)
+    inboxes = server.stripes.Of("reader").user_inbox
+
+    print(f"{'messages':<10}{'list ms':>10}{'deque ms':>10}"
+          f"{'list us/msg':>13}{'deque us/msg':>14}")
+    results = {}
+    for size in sizes:
+        messages = [f"[writer]: message {i}" for i in range(size)]
+        inboxes["reader"] = list(messages)
+        start = time.perf_counter()
+        assert sum(1 for _ in ListInboxReplies(server, "reader")) == size
+        original = time.perf_counter() - start
+
+        inboxes["reader"] = collections.deque(messages)
+        start = time.perf_counter()
+        assert sum(1 for _ in server.DeliverMessages(request, None)) == size
+        chunked = time.perf_counter() - start
+        results[size] = (original / size, chunked / size)
+        print(f"{size:<10}{original * 1e3:>10.1f}{chunked * 1e3:>10.1f}"
+              f"{original / size * 1e6:>13.2f}{chunked / size * 1e6:>14.2f}")
+
+    # the cost per message stays flat as the backlog grows, where the
+    # original drain's grows with it
+    smallest, largest = min(sizes), max(sizes)
+    assert results[largest][1] < 2 * results[smallest][1]
+    assert results[largest][0] > 4 * results[largest][1]
+    print(Fore.GREEN + "InboxDrainBenchmark Passed" + Style.RESET_ALL)
+
+
+class CountingLock:
+    """
+    A lock that counts its acquisitions, and those that had to wait for
+    another thread to release it.
+    """
+
+    def __init__(self):
+        self.lock = mp.Lock()
+        self.acquired = 0
+        self.contended = 0
+
+    def acquire(self, blocking=True, timeout=-1):
+        if not self.lock.acquire(False):
+            if not blocking or not self.lock.acquire(True, timeout):
+                return False
+            self.contended += 1
+        self.acquired += 1
+        return True
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.lock.release()
+
+
+def LockStripingBenchmark(threads=(4, 16, 64), stripes=16, requests=1000):
+    """
+    Run logins, sends and refreshes of distinct users from many threads
+    against a server with a single stripe, i.e. one metadata lock and one
+    inbox lock, and against one with `stripes` stripes. Report the requests
+    per second and the share of lock acquisitions that had to wait.
+    """
+    print(f"{'threads':<10}{'stripes':>8}{'requests/s':>14}{'contended':>12}")
+    results = {}
+    for count in threads:
+        for stripe_count in (1, stripes):
+            server = SocketChatServer(stripes=stripe_count)
+            locks = []
+            for stripe in server.stripes:
+                stripe.metadata_lock = CountingLock()
+                stripe.inbox_lock = CountingLock()
+                locks += [stripe.metadata_lock, stripe.inbox_lock]
+
+            usernames = [f"user{i}" for i in range(count)]
+            frames = []
+            for i, username in enumerate(usernames):
+                token = wp.socket_types.AccountCreateReply(
+                    server.CreateAccount(wp.encode.AccountCreateRequest(
+                        version=1, username=username, password="pw",
+                        fullname=username))).auth_token
+                frames.append([
+                    wp.encode.LoginRequest(version=1, username=username,
+                                           password="pw"),
+                    wp.encode.MessageRequest(
+                        version=1, auth_token=token, username=username,
+                        recipient_username=usernames[(i + 1) % count],
+                        message="hi"),
+                    wp.encode.RefreshRequest(version=1, auth_token=token,
+                                             username=username, wait_ms=0)])
+            for lock in locks:
+                lock.acquired = lock.contended = 0
+
+            barrier = mp.Barrier(count + 1)
+
+            def Work(user_frames):
+                barrier.wait()
+                for _ in range(requests):
+                    for data in user_frames:
+                        server.Dispatch(data)
+
+            workers = [mp.Thread(target=Work, args=(user_frames,))
+                       for user_frames in frames]
+            for worker in workers:
+                worker.start()
+            barrier.wait()
+            start = time.perf_counter()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - start
+
+            rate = count * requests * 3 / elapsed
+            contended = sum(lock.contended for lock in locks) / \
+                sum(lock.acquired for lock in locks)
+            results[count, stripe_count] = contended
+            print(f"{count:<10}{stripe_count:>8}{rate:>14,.0f}"
+                  f"{contended:>12.2%}")
+
+    # with many users, unrelated requests mostly meet on different stripes
+    busiest = max(threads)
+    assert results[busiest, stripes] < results[busiest, 1] / 4
+    print(Fore.GREEN + "LockStripingBenchmark Passed" + Style.RESET_ALL)
+
+
+def WriteAheadLogBenchmark(clients=(1, 16, 64), requests=200,
+                           window=write_ahead_log.DEFAULT_WINDOW):
+    """
+    Send messages from many clients to a thread per connection server
+    without a write-ahead log and to one that logs them, committing every
+    `window` seconds. Report the messages per second and the records synced
+    per fsync, which group commit keeps growing with the number of requests
+    in flight.
+    """
+    print(f"{'clients':<10}{'log':>8}{'messages/s':>14}{'per fsync':>12}")
+    results = {}
+    for count in clients:
+        for logged in (False, True):
+            server = SocketChatServer()
+            if logged:
+                server.OpenLog(os.path.join(tempfile.mkdtemp(), "chat.wal"),
+                               window)
+            port = StartSocketServer(server, backlog=1024)
+            usernames = [f"user{i}" for i in range(count)]
+            stubs = [wp.client_stub.ChatServerStub("localhost", port)
+                     for _ in usernames]
+            tokens = CreateAccounts(stubs[0], usernames)
+            requests_of = [wp.encode.MessageRequest(
+                version=1, auth_token=tokens[username], username=username,
+                recipient_username=usernames[(i + 1) % count], message="hi")
+                for i, username in enumerate(usernames)]
+            if logged:
+                commits, records = server.wal.commits, server.wal.records
+
+            barrier = mp.Barrier(count + 1)
+
+            def Work(stub, request):
+                barrier.wait()
+                for _ in range(requests):
+                    stub.SendMessage(request)
+
+            workers = [mp.Thread(target=Work, args=work)
+                       for work in zip(stubs, requests_of)]
+            for worker in workers:
+                worker.start()
+            barrier.wait()
+            start = time.perf_counter()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - start
+
+            rate = count * requests / elapsed
+            results[count, logged] = rate
+            per_fsync = "-"
+            if logged:
+                # every reply waited for its message to be synced
+                assert server.wal.durable == server.wal.appended
+                per_fsync = (server.wal.records - records) / \
+                    (server.wal.commits - commits)
+                per_fsync = f"{per_fsync:.1f}"
+                server.wal.Close()
+            for stub in stubs:
+                stub.Close()
+            print(f"{count:<10}{'yes' if logged else 'no':>8}{rate:>14,.0f}"
+                  f"{per_fsync:>12}")
+
+    # with enough requests in flight, one fsync serves most of them
+    busiest = max(clients)
+    assert results[busiest, True] > results[busiest, False] * 0.7
+    print(Fore.GREEN + "WriteAheadLogBenchmark Passed" + Style.RESET_ALL)
+
+
+def StorageBackendBenchmark(clients=16, requests=200, accounts=20000,
+                            history=5):
+    """
+    Serve sends and refreshes from many clients with a thread per
+    connection server on each storage backend, and report the requests per
+    second. Then load `accounts` accounts with `history` messages each into
+    every backend and report the resident memory they take, which SQLite
+    keeps on disk rather than in RAM.
+    """
+    directory = tempfile.mkdtemp()
+    databases = itertools.count()
+    backends = {
+        "memory": lambda: None,
+        "sqlite": lambda: storage.SQLiteStorage(
+            os.path.join(directory, f"chat{next(databases)}.db")),
+    }
+
+    print(f"{'storage':<10}{'requests/s':>14}")
+    rates = {}
+    for name, Backend in backends.items():
+        server = SocketChatServer(storage=Backend())
+        port = StartSocketServer(server, backlog=1024)
+        usernames = [f"user{i}" for i in range(clients)]
+        stubs = [wp.client_stub.ChatServerStub("localhost", port)
+                 for _ in usernames]
+        tokens = CreateAccounts(stubs[0], usernames)
+        barrier = mp.Barrier(clients + 1)
+
+        def Work(stub, i, username):
+            send = wp.encode.MessageRequest(
+                version=1, auth_token=tokens[username], username=username,
+                recipient_username=usernames[(i + 1) % clients],
+                message="hi")
+            refresh = wp.encode.RefreshRequest(
+                version=1, auth_token=tokens[username], username=username,
+                wait_ms=0)
+            barrier.wait()
+            for _ in range(requests // 2):
+                stub.SendMessage(send)
+                stub.DeliverMessages(refresh)
+
+        workers = [mp.Thread(target=Work, args=(stub, i, username))
+                   for i, (stub, username)
+                   in enumerate(zip(stubs, usernames))]
+        for worker in workers:
+            worker.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for worker in workers:
+            worker.join()
+        rates[name] = clients * requests / (time.perf_counter() - start)
+        for stub in stubs:
+            stub.Close()
+        server.storage.Close()
+        print(f"{name:<10}{rates[name]:>14,.0f}")
+
+    print(f"{'storage':<10}{'accounts':>10}{'messages':>10}{'load s':>8}"
+          f"{'resident MB':>13}")
+    resident = {}
+    # SQLite first, so that memory freed by the other backend is not
+    # counted for it
+    for name in reversed(list(backends)):
+        server = SocketChatServer(storage=backends[name]())
+        backend = server.storage
+        before = ResidentMemory()
+        start = time.perf_counter()
+        for i in range(accounts):
+            username = f"user{i}"
+            backend.CreateAccount(username, "password", f"User {i}")
+            backend.Enqueue([(username, f"[user0]: message {j} " + "x" * 64)
+                             for j in range(history)])
+        elapsed = time.perf_counter() - start
+        assert backend.InboxLength(f"user{accounts - 1}") == history
+        resident[name] = ResidentMemory() - before
+        print(f"{name:<10}{accounts:>10}{accounts * history:>10}"
+              f"{elapsed:>8.1f}{resident[name] / 2 ** 20:>13.1f}")
+        backend.Close()
+
+    if resident["memory"]:
+        assert resident["sqlite"] < resident["memory"] / 4
+    print(Fore.GREEN + "StorageBackendBenchmark Passed" + Style.RESET_ALL)
+
+
+def SharedEngineBenchmark(accounts=20000, history=5, clients=8,
+                          requests=200):
+    """
+    Load the same `accounts` accounts with `history` messages each into a
+    socket server and a gRPC servicer with an engine each, as running both
+    transports takes today, and into a socket server and a servicer that
+    share one engine, and report the memory each deployment allocates.
+    Then have socket clients and gRPC callers message each other through
+    the shared engine and report the requests per second.
+    """
+    def Load(engines):
+        gc.collect()
+        tracemalloc.start()
+        for i in range(accounts):
+            for shared in engines:
+                shared.CreateAccount(engine.AccountRequest(
+                    f"user{i}", "password", f"User {i}"))
+        for shared in engines:
+            token = shared.token_hub["user0"][0]
+            for i in range(accounts):
+                shared.SendMessages(engine.SendRequest(
+                    "user0", token, [f"user{i}"] * history,
+                    [f"message {j} " + "x" * 64 for j in range(history)]))
+        allocated, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return allocated
+
+    print(f"{'deployment':<12}{'engines':>9}{'accounts':>10}"
+          f"{'allocated MB':>14}")
+    allocated = {}
+    socket_server = SocketChatServer()
+    servicer = gRPCChatServer()
+    allocated["separate"] = Load([socket_server.engine, servicer.engine])
+    engines = {"separate": 2}
+    del socket_server, servicer
+
+    shared = engine.Engine()
+    socket_server = SocketChatServer(engine=shared)
+    servicer = gRPCChatServer(engine=shared)
+    allocated["shared"] = Load([shared])
+    engines["shared"] = 1
+    for name in ["separate", "shared"]:
+        print(f"{name:<12}{engines[name]:>9}{accounts:>10}"
+              f"{allocated[name] / 2 ** 20:>14.1f}")
+    assert allocated["shared"] < allocated["separate"] * 0.6
+
+    # socket clients message gRPC users and gRPC callers message socket
+    # users, every request against the one engine
+    port = StartSocketServer(socket_server, backlog=1024)
+    usernames = [f"user{i}" for i in range(2 * clients)]
+    tokens = {username: shared.Login(engine.LoginRequest(
+        username, "password")).auth_token for username in usernames}
+    for username in usernames:
+        shared.TakeMessages(username)
+    barrier = mp.Barrier(2 * clients + 1)
+
+    def SocketWork(i):
+        username, peer = usernames[i], usernames[clients + i]
+        stub = wp.client_stub.ChatServerStub("localhost", port)
+        send = wp.encode.MessageRequest(
+            version=1, auth_token=tokens[username], username=username,
+            recipient_username=peer, message="hi")
+        refresh = wp.encode.RefreshRequest(
+            version=1, auth_token=tokens[username], username=username,
+            wait_ms=0)
+        barrier.wait()
+        for _ in range(requests // 2):
+            stub.SendMessage(send)
+            stub.DeliverMessages(refresh)
+        stub.Close()
+
+    def GrpcWork(i):
+        username, peer = usernames[clients + i], usernames[i]
+        send = chat_pb2.MessageRequest(
+            version=1, auth_token=tokens[username], username=username,
+            recipient_username=peer, message="hi")
+        refresh = chat_pb2.RefreshRequest(
+            version=1, auth_token=tokens[username], username=username,
+            wait_ms=0)
+        barrier.wait()
+        for _ in range(requests // 2):
+            servicer.SendMessage(send, None)
+            for _ in servicer.DeliverMessages(refresh, None):
+                pass
+
+    workers = [mp.Thread(target=SocketWork, args=(i,))
+               for i in range(clients)] + \
+        [mp.Thread(target=GrpcWork, args=(i,)) for i in range(clients)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    rate = 2 * clients * requests / (time.perf_counter() - start)
+    print(f"{2 * clients} clients across both transports: "
+          f"{rate:,.0f} requests/s")
+    print(Fore.GREEN + "SharedEngineBenchmark Passed" + Style.RESET_ALL)
+
+
+def ColdStartBenchmark(accounts=1000000, history=1000000, tail=10000):
+    """
+    Restart a socket server holding `accounts` accounts, one queued message
+    for every tenth of them, and `tail` messages logged since its last
+    snapshot: first from the snapshot and the log tail, then from a log of
+    every change, which also holds `history` messages sent and delivered
+    before. Report the time each restart takes.
+    """
+    directory = tempfile.mkdtemp()
+    server = SocketChatServer()
+    for i in range(accounts):
+        username = f"user{i}"
+        stripe = server.stripes.Of(username)
+        stripe.user_metadata_store[username] = ("password", f"User {i}")
+        stripe.created[username] = server.stripes.NextAccount()
+        stripe.user_inbox[username] = [f"[user0]: hello {i}"] \
+            if i % 10 == 0 else []
+    messages = [write_ahead_log.Record(write_ahead_log.ENQUEUE,
+                                       f"user{i % accounts}", f"[user0]: {i}")
+                for i in range(tail)]
+
+    snapshotted = os.path.join(directory, "snapshotted.wal")
+    data = snapshot.Encode(*snapshot.Capture(server))
+    snapshot.Write(snapshotted + snapshot.SNAPSHOT_SUFFIX, data)
+    log = write_ahead_log.WriteAheadLog(snapshotted)
+    log.Append(*messages)
+    log.Close()
+
+    replayed = os.path.join(directory, "replayed.wal")
+    log = write_ahead_log.WriteAheadLog(replayed)
+    for i in range(accounts):
+        log.Append(write_ahead_log.Record(write_ahead_log.CREATE_ACCOUNT,
+                                          f"user{i}", "password", f"User {i}"))
+        if i % 10 == 0:
+            log.Append(write_ahead_log.Record(
+                write_ahead_log.ENQUEUE, f"user{i}", f"[user0]: hello {i}"))
+    for i in range(history):
+        username = f"user{i % accounts}"
+        log.Append(write_ahead_log.Record(write_ahead_log.ENQUEUE, username,
+                                          f"[user0]: {i}"))
+        # after the message queued above when the account was created
+        log.Append(write_ahead_log.Record(write_ahead_log.DELIVER, username,
+                                          int(i % accounts % 10 == 0), 1))
+    log.Append(*messages)
+    log.Close()
+    expected = len(server.user_metadata_store)
+    del server
+
+    print(f"{accounts:,} accounts, {history:,} messages delivered and "
+          f"{tail:,} messages logged since the snapshot "
+          f"({len(data) / 2 ** 20:.0f} MiB)")
+    results = {}
+    for source, path in [("snapshot + tail", snapshotted),
+                         ("full log", replayed)]:
+        gc.collect()
+        start = time.perf_counter()
+        restarted = SocketChatServer()
+        restarted.snapshot_interval = 0
+        restarted.OpenLog(path)
+        results[source] = time.perf_counter() - start
+        assert len(restarted.user_metadata_store) == expected
+        assert list(restarted.user_inbox["user10"]) == ["[user0]: hello 10",
+                                                        "[user0]: 10"]
+        restarted.wal.Close()
+        del restarted
+        print(f"{source:<18}{results[source]:>8.2f}s")
+    assert results["snapshot + tail"] < results["full log"]
+    print(Fore.GREEN + "ColdStartBenchmark Passed" + Style.RESET_ALL)
+
+
+def FreePort():
+    with socket.socket() as sck:
+        sck.bind(("localhost", 0))
+        return sck.getsockname()[1]
+
+
+def ShardedClient(port, client, requests, results):
+    """
+    Sends `requests` messages between users of its own from a separate
+    process, so the client side is not limited by the benchmark's GIL.
+    """
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            stub = wp.client_stub.ChatServerStub("localhost", port)
+            break
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+    usernames = [f"client{client}-{i}" for i in range(8)]
+    tokens = CreateAccounts(stub, usernames)
+    sender = usernames[0]
+    start = time.perf_counter()
+    for i in range(requests):
+        stub.SendMessage(wp.encode.MessageRequest(
+            version=1, auth_token=tokens[sender], username=sender,
+            recipient_username=usernames[i % len(usernames)], message="hi"))
+    results.put(time.perf_counter() - start)
+    stub.Close()
+
+
+def ShardedThroughputBenchmark(processes=4, clients=8, requests=2000):
+    """
+    Compare the request throughput of one worker process with that of
+    `processes` sharded workers sharing a port.
+    """
+    results = {}
+    for count in (1, processes):
+        port = FreePort()
+        workers = ServeSharded("localhost", port, count, mode="reactor")
+        queue = multiprocessing.Queue()
+        senders = [multiprocessing.Process(
+            target=ShardedClient, args=(port, client, requests, queue))
+            for client in range(clients)]
+        for sender in senders:
+            sender.start()
+        elapsed = max(queue.get() for _ in senders)
+        for process in senders + workers:
+            process.terminate()
+            process.join()
+        results[count] = clients * requests / elapsed
+
+    print(f"{clients} clients, {os.cpu_count()} CPUs")
+    for count, rate in results.items():
+        print(f"{count} worker processes: {rate:,.0f} requests/s")
+    # each worker process needs a core of its own to scale, besides the
+    # clients
+    if os.cpu_count() >= 2 * processes:
+        assert results[processes] > 1.5 * results[1]
+    print(Fore.GREEN + "ShardedThroughputBenchmark Passed" + Style.RESET_ALL)
+
+
+if __name__ == "__main__":
+    print("Begin Benchmarks")
+    MessageAllocationBenchmark()
+    BatchSendBenchmark()
+    CompressionBenchmark()
+    ReplyWriteBenchmark()
+    IdleConnectionBenchmark()
+    SlowConsumerBenchmark()
+    PushDeliveryBenchmark()
+    GrpcStreamsBenchmark()
+    InboxDrainBenchmark()
+    LockStripingBenchmark()
+    WriteAheadLogBenchmark()
+    ColdStartBenchmark()
+    StorageBackendBenchmark()
+    SharedEngineBenchmark()
+    ShardedThroughputBenchmark()
@@ -13,7 +13,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\nchat.proto\x12\nhelloworld\"t\n\x0eMessageRequest\x12\x0f\n\x07version\x18\x01 \x01(\x05\x12\x12\n\nauth_token\x18\x02 \x01(\t\x12\x10\n\x08username\x18\x03 \x01(\t\x12\x1a\n\x12recipient_username\x18\x04 \x01(\t\x12\x0f\n\x07message\x18\x05 \x01(\t\"3\n\x0cMessageReply\x12\x0f\n\x07version\x18\x01 \x01(\x05\x12\x12\n\nerror_code\x18\x02 \x01(\t\"G\n\x0eRefreshRequest\x12\x0f\n\x07version\x18\x01 \x01(\x05\x12\x12\n\nauth_token\x18\x02 \x01(\t\x12\x10\n\x08username\x18\x03 \x01(\t\"D\n\x0cRefreshReply\x12\x0f\n\x07version\x18\x01 \x01(\x05\x12\x0f\n\x07message\x18\x02 \x01(\t\x12\x12\n\nerror_code\x18\x03 \x01(\t\"C\n\x0cLoginRequest\x12\x0f\n\x07version\x18\x01 \x01(\x05\x12\x10\n\x08username\x18\x02 \x01(\t\x12\x10\n\x08password\x18\x03 \x01(\t\"W\n\nLoginReply\x12\x0f\n\x07version\x18\x01 \x01(\x05\x12\x12\n\nerror_code\x18\x02 \x01(\t\x12\x12\n\nauth_token\x18\x03 \x01(\t\x12\x10\n\x08\x66ullname\x18\x04 \x01(\t\"]\n\x14\x41\x63\x63ountCreateRequest\x12\x0f\n\x07version\x18\x01 \x01(\x05\x12\x10\n\x08username\x18\x02 \x01(\t\x12\x10\n\x08password\x18\x03 \x01(\t\x12\x10\n\x08\x66ullname\x18\x04 \x01(\t\"_\n\x12\x41\x63\x63ountCreateReply\x12\x0f\n\x07version\x18\x01 \x01(\x05\x12\x12\n\nerror_code\x18\x02 \x01(\t\x12\x12\n\nauth_token\x18\x03 \x01(\t\x12\x10\n\x08\x66ullname\x18\x04 \x01(\t\"v\n\x12ListAccountRequest\x12\x0f\n\x07version\x18\x01 \x01(\x05\x12\x12\n\nauth_token\x18\x02 \x01(\t\x12\x10\n\x08username\x18\x03 \x01(\t\x12\x1a\n\x12number_of_accounts\x18\x04 \x01(\x05\x12\r\n\x05regex\x18\x05 \x01(\t\"N\n\x10ListAccountReply\x12\x0f\n\x07version\x18\x01 \x01(\x05\x12\x12\n\nerror_code\x18\x02 \x01(\t\x12\x15\n\raccount_names\x18\x03 \x01(\t\"M\n\x14\x44\x65leteAccountRequest\x12\x0f\n\x07version\x18\x01 \x01(\x05\x12\x12\n\nauth_token\x18\x02 \x01(\t\x12\x10\n\x08username\x18\x03 \x01(\t\"9\n\x12\x44\x65leteAccountReply\x12\x0f\n\x07version\x18\x01 \x01(\x05\x12\x12\n\nerror_code\x18\x02 \x01(\t2\xd7\x03\n\nChatServer\x12\x45\n\x0bSendMessage\x12\x1a.helloworld.MessageRequest\x1a\x18.helloworld.MessageReply\"\x00\x12K\n\x0f\x44\x65liverMessages\x12\x1a.helloworld.RefreshRequest\x1a\x18.helloworld.RefreshReply\"\x00\x30\x01\x12;\n\x05Login\x12\x18.helloworld.LoginRequest\x1a\x16.helloworld.LoginReply\"\x00\x12S\n\rCreateAccount\x12 .helloworld.AccountCreateRequest\x1a\x1e.helloworld.AccountCreateReply\"\x00\x12N\n\x0cListAccounts\x12\x1e.helloworld.ListAccountRequest\x1a\x1c.helloworld.ListAccountReply\"\x00\x12S\n\rDeleteAccount\x12 .helloworld.DeleteAccountRequest\x1a\x1e.helloworld.DeleteAccountReply\"\x00\x42\x36\n\x1aio.grpc.modules.chatserverB\x0f\x43hatServerProtoP\x01\xa2\x02\x04\x43HSRb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\nchat.proto\x12\nhelloworld\"t\n\x0eMessageRequest\x12\x0f\n\x07version\x18\x01 \x01(\x05\x12\x12\n\nauth_token\x18\x02 \x01(\t\x12\x10\n\x08username\x18\x03 \x01(\t\x12\x1a\n\x12recipient_username\x18\x04 \x01(\t\x12\x0f\n\x07message\x18\x05 \x01(\t\"3\n\x0cMessageReply\x12\x0f\n\x07version\x18\x01 \x01(\x05\x12\x12\n\nerror_code\x18\x02 \x01(\t\"X\n\x0eRefreshRequest\x12\x0f\n\x07version\x18\x01 \x01(\x05\x12\x12\n\nauth_token\x18\x02 \x01(\t\x12\x10\n\x08username\x18\x03 \x01(\t\x12\x0f\n\x07wait_ms\x18\x04 \x01(\x05\"D\n\x0cRefreshReply\x12\x0f\n\x07version\x18\x01 \x01(\x05\x12\x0f\n\x07message\x18\x02 \x01(\t\x12\x12\n\nerror_code\x18\x03 \x01(\t\"C\n\x0cLoginRequest\x12\x0f\n\x07version\x18\x01 \x01(\x05\x12\x10\n\x08username\x18\x02 \x01(\t\x12\x10\n\x08password\x18\x03 \x01(\t\"W\n\nLoginReply\x12\x0f\n\x07version\x18\x01 \x01(\x05\x12\x12\n\nerror_code\x18\x02 \x01(\t\x12\x12\n\nauth_token\x18\x03 \x01(\t\x12\x10\n\x08\x66ullname\x18\x04 \x01(\t\"]\n\x14\x41\x63\x63ountCreateRequest\x12\x0f\n\x07version\x18\x01 \x01(\x05\x12\x10\n\x08username\x18\x02 \x01(\t\x12\x10\n\x08password\x18\x03 \x01(\t\x12\x10\n\x08\x66ullname\x18\x04 \x01(\t\"_\n\x12\x41\x63\x63ountCreateReply\x12\x0f\n\x07version\x18\x01 \x01(\x05\x12\x12\n\nerror_code\x18\x02 \x01(\t\x12\x12\n\nauth_token\x18\x03 \x01(\t\x12\x10\n\x08\x66ullname\x18\x04 \x01(\t\"v\n\x12ListAccountRequest\x12\x0f\n\x07version\x18\x01 \x01(\x05\x12\x12\n\nauth_token\x18\x02 \x01(\t\x12\x10\n\x08username\x18\x03 \x01(\t\x12\x1a\n\x12number_of_accounts\x18\x04 \x01(\x05\x12\r\n\x05regex\x18\x05 \x01(\t\"N\n\x10ListAccountReply\x12\x0f\n\x07version\x18\x01 \x01(\x05\x12\x12\n\nerror_code\x18\x02 \x01(\t\x12\x15\n\raccount_names\x18\x03 \x01(\t\"M\n\x14\x44\x65leteAccountRequest\x12\x0f\n\x07version\x18\x01 \x01(\x05\x12\x12\n\nauth_token\x18\x02 \x01(\t\x12\x10\n\x08username\x18\x03 \x01(\t\"9\n\x12\x44\x65leteAccountReply\x12\x0f\n\x07version\x18\x01 \x01(\x05\x12\x12\n\nerror_code\x18\x02 \x01(\t2\xd7\x03\n\nChatServer\x12\x45\n\x0bSendMessage\x12\x1a.helloworld.MessageRequest\x1a\x18.helloworld.MessageReply\"\x00\x12K\n\x0f\x44\x65liverMessages\x12\x1a.helloworld.RefreshRequest\x1a\x18.helloworld.RefreshReply\"\x00\x30\x01\x12;\n\x05Login\x12\x18.helloworld.LoginRequest\x1a\x16.helloworld.LoginReply\"\x00\x12S\n\rCreateAccount\x12 .helloworld.AccountCreateRequest\x1a\x1e.helloworld.AccountCreateReply\"\x00\x12N\n\x0cListAccounts\x12\x1e.helloworld.ListAccountRequest\x1a\x1c.helloworld.ListAccountReply\"\x00\x12S\n\rDeleteAccount\x12 .helloworld.DeleteAccountRequest\x1a\x1e.helloworld.DeleteAccountReply\"\x00\x42\x36\n\x1aio.grpc.modules.chatserverB\x0f\x43hatServerProtoP\x01\xa2\x02\x04\x43HSRb\x06proto3')
 
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'chat_pb2', globals())
@@ -26,25 +26,25 @@ if _descriptor._USE_C_DESCRIPTORS == False:
   _MESSAGEREPLY._serialized_start=144
   _MESSAGEREPLY._serialized_end=195
   _REFRESHREQUEST._serialized_start=197
-  _REFRESHREQUEST._serialized_end=268
-  _REFRESHREPLY._serialized_start=270
-  _REFRESHREPLY._serialized_end=338
-  _LOGINREQUEST._serialized_start=340
-  _LOGINREQUEST._serialized_end=407
-  _LOGINREPLY._serialized_start=409
-  _LOGINREPLY._serialized_end=496
-  _ACCOUNTCREATEREQUEST._serialized_start=498
-  _ACCOUNTCREATEREQUEST._serialized_end=591
-  _ACCOUNTCREATEREPLY._serialized_start=593
-  _ACCOUNTCREATEREPLY._serialized_end=688
-  _LISTACCOUNTREQUEST._serialized_start=690
-  _LISTACCOUNTREQUEST._serialized_end=808
-  _LISTACCOUNTREPLY._serialized_start=810
-  _LISTACCOUNTREPLY._serialized_end=888
-  _DELETEACCOUNTREQUEST._serialized_start=890
-  _DELETEACCOUNTREQUEST._serialized_end=967
-  _DELETEACCOUNTREPLY._serialized_start=969
-  _DELETEACCOUNTREPLY._serialized_end=1026
-  _CHATSERVER._serialized_start=1029
-  _CHATSERVER._serialized_end=1500
+  _REFRESHREQUEST._serialized_end=285
+  _REFRESHREPLY._serialized_start=287
+  _REFRESHREPLY._serialized_end=355
+  _LOGINREQUEST._serialized_start=357
+  _LOGINREQUEST._serialized_end=424
+  _LOGINREPLY._serialized_start=426
+  _LOGINREPLY._serialized_end=513
+  _ACCOUNTCREATEREQUEST._serialized_start=515
+  _ACCOUNTCREATEREQUEST._serialized_end=608
+  _ACCOUNTCREATEREPLY._serialized_start=610
+  _ACCOUNTCREATEREPLY._serialized_end=705
+  _LISTACCOUNTREQUEST._serialized_start=707
+  _LISTACCOUNTREQUEST._serialized_end=825
+  _LISTACCOUNTREPLY._serialized_start=827
+  _LISTACCOUNTREPLY._serialized_end=905
+  _DELETEACCOUNTREQUEST._serialized_start=907
+  _DELETEACCOUNTREQUEST._serialized_end=984
+  _DELETEACCOUNTREPLY._serialized_start=986
+  _DELETEACCOUNTREPLY._serialized_end=1043
+  _CHATSERVER._serialized_start=1046
+  _CHATSERVER._serialized_end=1517
 # @@protoc_insertion_point(module_scope)
@@ -125,11 +125,13 @@ class RefreshReply(_message.Message):
     def __init__(self, version: _Optional[int] = ..., message: _Optional[str] = ..., error_code: _Optional[str] = ...) -> None: ...
 
 class RefreshRequest(_message.Message):
-    __slots__ = ["auth_token", "username", "version"]
+    __slots__ = ["auth_token", "username", "version", "wait_ms"]
     AUTH_TOKEN_FIELD_NUMBER: _ClassVar[int]
     USERNAME_FIELD_NUMBER: _ClassVar[int]
     VERSION_FIELD_NUMBER: _ClassVar[int]
+    WAIT_MS_FIELD_NUMBER: _ClassVar[int]
     auth_token: str
     username: str
     version: int
-    def __init__(self, version: _Optional[int] = ..., auth_token: _Optional[str] = ..., username: _Optional[str] = ...) -> None: ...
+    wait_ms: int
+    def __init__(self, version: _Optional[int] = ..., auth_token: _Optional[str] = ..., username: _Optional[str] = ..., wait_ms: _Optional[int] = ...) -> None: ...
@@ -8,6 +8,9 @@ import chat_pb2 as chat__pb2
 class ChatServerStub(object):
     """The greeting service definition.
     Sends a greeting
+
+    Rpcs annotated with a socket opcode are also carried by the socket wire
+    protocol, see wire_protocol/codegen.py.
     """
 
     def __init__(self, channel):
@@ -51,40 +54,49 @@ class ChatServerStub(object):
 class ChatServerServicer(object):
     """The greeting service definition.
     Sends a greeting
+
+    Rpcs annotated with a socket opcode are also carried by the socket wire
+    protocol, see wire_protocol/codegen.py.
     """
 
     def SendMessage(self, request, context):
-        """Missing associated documentation comment in .proto file."""
+        """socket opcode: 2
+        """
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
     def DeliverMessages(self, request, context):
-        """Missing associated documentation comment in .proto file."""
+        """socket opcode: 5
+        """
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
     def Login(self, request, context):
-        """Missing associated documentation comment in .proto file."""
+        """socket opcode: 1
+        """
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
     def CreateAccount(self, request, context):
-        """Missing associated documentation comment in .proto file."""
+        """socket opcode: 0
+        """
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
     def ListAccounts(self, request, context):
-        """Missing associated documentation comment in .proto file."""
+        """socket opcode: 3
+        """
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
     def DeleteAccount(self, request, context):
-        """Missing associated documentation comment in .proto file."""
+        """socket opcode: 4
+        """
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
@@ -132,6 +144,9 @@ def add_ChatServerServicer_to_server(servicer, server):
 class ChatServer(object):
     """The greeting service definition.
     Sends a greeting
+
+    Rpcs annotated with a socket opcode are also carried by the socket wire
+    protocol, see wire_protocol/codegen.py.
     """
 
     @staticmethod
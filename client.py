@@ -2,7 +2,6 @@ from __future__ import print_function
 
 import logging
 import threading as mp
-import time
 from tkinter import *
 from tkinter import simpledialog
 
@@ -15,6 +14,8 @@ import wire_protocol as wp
 ADDRESS = "localhost"  # "10.250.240.43"
 PORT = 50051
 MAX_CHAR_COUNT = 280
+# how long the server holds a poll for new messages open when there are none
+LONG_POLL_MS = 10000
 
 
 class ClientApplication:
@@ -43,6 +44,8 @@ class ClientApplication:
         self.address = address
         self.port = port
         self.listen_loop = None
+        # cancels the long poll in flight when the window closes
+        self.cancel_poll = None
         
         # create channel
         if self.use_grpc:
@@ -102,35 +105,67 @@ class ClientApplication:
         self.listen_loop.start()
         self.application_window.mainloop()
         event.set()
+        if self.cancel_poll is not None:
+            self.cancel_poll()
         self.listen_loop.join()
 
     def ListenLoop(self, event) -> None:
         """
         Listens for new messages intended for the client's user.
         If `use_grpc` is True, it listens for new messages using gRPC.
-        Otherwise, it continuously sends a `RefreshRequest` message to the
-        chat server and waits for a `RefreshReply` message.
-        If a new message is received, it is added to the `messages`
-        widget in the client application window.
+        Otherwise, it subscribes to the socket server, which then pushes
+        every message as it arrives.
+        Without a subscription it long polls: every `RefreshRequest` asks
+        the server to hold it for up to `LONG_POLL_MS` until a message
+        arrives, and the next one is sent as soon as it returns.
+        Every message received is added to the `messages` widget in the
+        client application window.
 
         Returns:
             None
         """
+        if not self.use_grpc:
+            resp = self.client_stub.Subscribe(
+                self.message_creator.SubscribeRequest(
+                    version=1, auth_token=self.token,
+                    username=self.username),
+                lambda messages: self.messages.insert(
+                    END, "\n".join(messages) + '\n'))
+            if not resp.error_code:
+                event.wait()
+                return
+
+        poll_stub = self.client_stub
+        if not self.use_grpc:
+            # the socket server answers a connection's requests in order,
+            # so polls get a connection of their own rather than holding
+            # up commands
+            poll_stub = wp.client_stub.ChatServerStub(self.address,
+                                                      self.port)
+            self.cancel_poll = poll_stub.Close
+
         while True:
             auth_msg_request = self.message_creator.RefreshRequest(
-                version=1, auth_token=self.token, username=self.username)
+                version=1, auth_token=self.token, username=self.username,
+                wait_ms=LONG_POLL_MS)
 
             if event.is_set():
                 break
-            if self.use_grpc:
-                for msg in self.client_stub.DeliverMessages(auth_msg_request):
-                    self.messages.insert(END, msg.message + '\n')
-            else:
-                msg = self.client_stub.DeliverMessages(auth_msg_request)
-                if not msg.error_code:
-                    self.messages.insert(END, msg.message + '\n')
-                
-            time.sleep(0.5)
+            try:
+                if self.use_grpc:
+                    poll = poll_stub.DeliverMessages(auth_msg_request)
+                    self.cancel_poll = poll.cancel
+                    for msg in poll:
+                        self.messages.insert(END, msg.message + '\n')
+                else:
+                    msg = poll_stub.DeliverMessages(auth_msg_request)
+                    if not msg.error_code:
+                        self.messages.insert(END, msg.message + '\n')
+            except (grpc.RpcError, ConnectionError):
+                # the poll was cancelled as the window closed
+                if event.is_set():
+                    break
+                raise
 
                
 
@@ -0,0 +1,702 @@
+# Generated by wire_protocol/codegen.py from protos/*.proto.  DO NOT EDIT!
+import time
+
+from colorama import Fore, Style
+
+import wire_protocol as wp
+
+
+def AccountCreateRequestRoundTripTest():
+    """
+    Test that AccountCreateRequest survives an encode / decode round trip.
+    """
+    raw = wp.encode.AccountCreateRequest(
+        version=7,
+        username='username é||',
+        password='password é||',
+        fullname='fullname é||',
+        request_id=42)
+    msg = wp.socket_types.AccountCreateRequest(raw)
+    assert msg.generated_error_code is None
+    assert msg.request_id == 42
+    assert msg.version == 7
+    assert msg.username == 'username é||'
+    assert msg.password == 'password é||'
+    assert msg.fullname == 'fullname é||'
+
+    # a truncated frame is rejected
+    msg = wp.socket_types.AccountCreateRequest(raw[:-1])
+    assert msg.generated_error_code is not None
+    print(Fore.GREEN + "AccountCreateRequestRoundTripTest Passed" + Style.RESET_ALL)
+
+
+def AccountCreateReplyRoundTripTest():
+    """
+    Test that AccountCreateReply survives an encode / decode round trip.
+    """
+    raw = wp.encode.AccountCreateReply(
+        version=7,
+        error_code='error_code é||',
+        auth_token='auth_token é||',
+        fullname='fullname é||',
+        request_id=42)
+    msg = wp.socket_types.AccountCreateReply(raw)
+    assert msg.generated_error_code is None
+    assert msg.request_id == 42
+    assert msg.version == 7
+    assert msg.error_code == 'error_code é||'
+    assert msg.auth_token == 'auth_token é||'
+    assert msg.fullname == 'fullname é||'
+
+    # a truncated frame is rejected
+    msg = wp.socket_types.AccountCreateReply(raw[:-1])
+    assert msg.generated_error_code is not None
+    print(Fore.GREEN + "AccountCreateReplyRoundTripTest Passed" + Style.RESET_ALL)
+
+
+def LoginRequestRoundTripTest():
+    """
+    Test that LoginRequest survives an encode / decode round trip.
+    """
+    raw = wp.encode.LoginRequest(
+        version=7,
+        username='username é||',
+        password='password é||',
+        request_id=42)
+    msg = wp.socket_types.LoginRequest(raw)
+    assert msg.generated_error_code is None
+    assert msg.request_id == 42
+    assert msg.version == 7
+    assert msg.username == 'username é||'
+    assert msg.password == 'password é||'
+
+    # a truncated frame is rejected
+    msg = wp.socket_types.LoginRequest(raw[:-1])
+    assert msg.generated_error_code is not None
+    print(Fore.GREEN + "LoginRequestRoundTripTest Passed" + Style.RESET_ALL)
+
+
+def LoginReplyRoundTripTest():
+    """
+    Test that LoginReply survives an encode / decode round trip.
+    """
+    raw = wp.encode.LoginReply(
+        version=7,
+        error_code='error_code é||',
+        auth_token='auth_token é||',
+        fullname='fullname é||',
+        request_id=42)
+    msg = wp.socket_types.LoginReply(raw)
+    assert msg.generated_error_code is None
+    assert msg.request_id == 42
+    assert msg.version == 7
+    assert msg.error_code == 'error_code é||'
+    assert msg.auth_token == 'auth_token é||'
+    assert msg.fullname == 'fullname é||'
+
+    # a truncated frame is rejected
+    msg = wp.socket_types.LoginReply(raw[:-1])
+    assert msg.generated_error_code is not None
+    print(Fore.GREEN + "LoginReplyRoundTripTest Passed" + Style.RESET_ALL)
+
+
+def MessageRequestRoundTripTest():
+    """
+    Test that MessageRequest survives an encode / decode round trip.
+    """
+    raw = wp.encode.MessageRequest(
+        version=7,
+        auth_token='auth_token é||',
+        username='username é||',
+        recipient_username='recipient_username é||',
+        message='message é||',
+        request_id=42)
+    msg = wp.socket_types.MessageRequest(raw)
+    assert msg.generated_error_code is None
+    assert msg.request_id == 42
+    assert msg.version == 7
+    assert msg.auth_token == 'auth_token é||'
+    assert msg.username == 'username é||'
+    assert msg.recipient_username == 'recipient_username é||'
+    assert msg.message == 'message é||'
+
+    # a truncated frame is rejected
+    msg = wp.socket_types.MessageRequest(raw[:-1])
+    assert msg.generated_error_code is not None
+    print(Fore.GREEN + "MessageRequestRoundTripTest Passed" + Style.RESET_ALL)
+
+
+def MessageReplyRoundTripTest():
+    """
+    Test that MessageReply survives an encode / decode round trip.
+    """
+    raw = wp.encode.MessageReply(
+        version=7,
+        error_code='error_code é||',
+        request_id=42)
+    msg = wp.socket_types.MessageReply(raw)
+    assert msg.generated_error_code is None
+    assert msg.request_id == 42
+    assert msg.version == 7
+    assert msg.error_code == 'error_code é||'
+
+    # a truncated frame is rejected
+    msg = wp.socket_types.MessageReply(raw[:-1])
+    assert msg.generated_error_code is not None
+    print(Fore.GREEN + "MessageReplyRoundTripTest Passed" + Style.RESET_ALL)
+
+
+def ListAccountRequestRoundTripTest():
+    """
+    Test that ListAccountRequest survives an encode / decode round trip.
+    """
+    raw = wp.encode.ListAccountRequest(
+        version=7,
+        auth_token='auth_token é||',
+        username='username é||',
+        number_of_accounts=18,
+        regex='regex é||',
+        request_id=42)
+    msg = wp.socket_types.ListAccountRequest(raw)
+    assert msg.generated_error_code is None
+    assert msg.request_id == 42
+    assert msg.version == 7
+    assert msg.auth_token == 'auth_token é||'
+    assert msg.username == 'username é||'
+    assert msg.number_of_accounts == 18
+    assert msg.regex == 'regex é||'
+
+    # a truncated frame is rejected
+    msg = wp.socket_types.ListAccountRequest(raw[:-1])
+    assert msg.generated_error_code is not None
+    print(Fore.GREEN + "ListAccountRequestRoundTripTest Passed" + Style.RESET_ALL)
+
+
+def ListAccountReplyRoundTripTest():
+    """
+    Test that ListAccountReply survives an encode / decode round trip.
+    """
+    raw = wp.encode.ListAccountReply(
+        version=7,
+        error_code='error_code é||',
+        account_names='account_names é||',
+        request_id=42)
+    msg = wp.socket_types.ListAccountReply(raw)
+    assert msg.generated_error_code is None
+    assert msg.request_id == 42
+    assert msg.version == 7
+    assert msg.error_code == 'error_code é||'
+    assert msg.account_names == 'account_names é||'
+
+    # a truncated frame is rejected
+    msg = wp.socket_types.ListAccountReply(raw[:-1])
+    assert msg.generated_error_code is not None
+    print(Fore.GREEN + "ListAccountReplyRoundTripTest Passed" + Style.RESET_ALL)
+
+
+def DeleteAccountRequestRoundTripTest():
+    """
+    Test that DeleteAccountRequest survives an encode / decode round trip.
+    """
+    raw = wp.encode.DeleteAccountRequest(
+        version=7,
+        auth_token='auth_token é||',
+        username='username é||',
+        request_id=42)
+    msg = wp.socket_types.DeleteAccountRequest(raw)
+    assert msg.generated_error_code is None
+    assert msg.request_id == 42
+    assert msg.version == 7
+    assert msg.auth_token == 'auth_token é||'
+    assert msg.username == 'username é||'
+
+    # a truncated frame is rejected
+    msg = wp.socket_types.DeleteAccountRequest(raw[:-1])
+    assert msg.generated_error_code is not None
+    print(Fore.GREEN + "DeleteAccountRequestRoundTripTest Passed" + Style.RESET_ALL)
+
+
+def DeleteAccountReplyRoundTripTest():
+    """
+    Test that DeleteAccountReply survives an encode / decode round trip.
+    """
+    raw = wp.encode.DeleteAccountReply(
+        version=7,
+        error_code='error_code é||',
+        request_id=42)
+    msg = wp.socket_types.DeleteAccountReply(raw)
+    assert msg.generated_error_code is None
+    assert msg.request_id == 42
+    assert msg.version == 7
+    assert msg.error_code == 'error_code é||'
+
+    # a truncated frame is rejected
+    msg = wp.socket_types.DeleteAccountReply(raw[:-1])
+    assert msg.generated_error_code is not None
+    print(Fore.GREEN + "DeleteAccountReplyRoundTripTest Passed" + Style.RESET_ALL)
+
+
+def RefreshRequestRoundTripTest():
+    """
+    Test that RefreshRequest survives an encode / decode round trip.
+    """
+    raw = wp.encode.RefreshRequest(
+        version=7,
+        auth_token='auth_token é||',
+        username='username é||',
+        wait_ms=7,
+        request_id=42)
+    msg = wp.socket_types.RefreshRequest(raw)
+    assert msg.generated_error_code is None
+    assert msg.request_id == 42
+    assert msg.version == 7
+    assert msg.auth_token == 'auth_token é||'
+    assert msg.username == 'username é||'
+    assert msg.wait_ms == 7
+
+    # a truncated frame is rejected
+    msg = wp.socket_types.RefreshRequest(raw[:-1])
+    assert msg.generated_error_code is not None
+    print(Fore.GREEN + "RefreshRequestRoundTripTest Passed" + Style.RESET_ALL)
+
+
+def RefreshReplyRoundTripTest():
+    """
+    Test that RefreshReply survives an encode / decode round trip.
+    """
+    raw = wp.encode.RefreshReply(
+        version=7,
+        message='message é||',
+        error_code='error_code é||',
+        request_id=42)
+    msg = wp.socket_types.RefreshReply(raw)
+    assert msg.generated_error_code is None
+    assert msg.request_id == 42
+    assert msg.version == 7
+    assert msg.message == 'message é||'
+    assert msg.error_code == 'error_code é||'
+
+    # a truncated frame is rejected
+    msg = wp.socket_types.RefreshReply(raw[:-1])
+    assert msg.generated_error_code is not None
+    print(Fore.GREEN + "RefreshReplyRoundTripTest Passed" + Style.RESET_ALL)
+
+
+def BatchMessageRequestRoundTripTest():
+    """
+    Test that BatchMessageRequest survives an encode / decode round trip.
+    """
+    raw = wp.encode.BatchMessageRequest(
+        version=7,
+        auth_token='auth_token é||',
+        username='username é||',
+        recipient_usernames=['recipient_usernames0 é||', 'recipient_usernames1 é||', 'recipient_usernames2 é||'],
+        messages=['messages0 é||', 'messages1 é||', 'messages2 é||'],
+        request_id=42)
+    msg = wp.socket_types.BatchMessageRequest(raw)
+    assert msg.generated_error_code is None
+    assert msg.request_id == 42
+    assert msg.version == 7
+    assert msg.auth_token == 'auth_token é||'
+    assert msg.username == 'username é||'
+    assert msg.recipient_usernames == ['recipient_usernames0 é||', 'recipient_usernames1 é||', 'recipient_usernames2 é||']
+    assert msg.messages == ['messages0 é||', 'messages1 é||', 'messages2 é||']
+
+    # a truncated frame is rejected
+    msg = wp.socket_types.BatchMessageRequest(raw[:-1])
+    assert msg.generated_error_code is not None
+    print(Fore.GREEN + "BatchMessageRequestRoundTripTest Passed" + Style.RESET_ALL)
+
+
+def BatchMessageReplyRoundTripTest():
+    """
+    Test that BatchMessageReply survives an encode / decode round trip.
+    """
+    raw = wp.encode.BatchMessageReply(
+        version=7,
+        error_code='error_code é||',
+        status_codes=[13, 13, 13],
+        request_id=42)
+    msg = wp.socket_types.BatchMessageReply(raw)
+    assert msg.generated_error_code is None
+    assert msg.request_id == 42
+    assert msg.version == 7
+    assert msg.error_code == 'error_code é||'
+    assert msg.status_codes == [13, 13, 13]
+
+    # a truncated frame is rejected
+    msg = wp.socket_types.BatchMessageReply(raw[:-1])
+    assert msg.generated_error_code is not None
+    print(Fore.GREEN + "BatchMessageReplyRoundTripTest Passed" + Style.RESET_ALL)
+
+
+def HandshakeRequestRoundTripTest():
+    """
+    Test that HandshakeRequest survives an encode / decode round trip.
+    """
+    raw = wp.encode.HandshakeRequest(
+        version=7,
+        protocol_versions=[18, 18, 18],
+        codecs=['codecs0 é||', 'codecs1 é||', 'codecs2 é||'],
+        compressions=['compressions0 é||', 'compressions1 é||', 'compressions2 é||'],
+        max_frame_size=14,
+        request_id=42)
+    msg = wp.socket_types.HandshakeRequest(raw)
+    assert msg.generated_error_code is None
+    assert msg.request_id == 42
+    assert msg.version == 7
+    assert msg.protocol_versions == [18, 18, 18]
+    assert msg.codecs == ['codecs0 é||', 'codecs1 é||', 'codecs2 é||']
+    assert msg.compressions == ['compressions0 é||', 'compressions1 é||', 'compressions2 é||']
+    assert msg.max_frame_size == 14
+
+    # a truncated frame is rejected
+    msg = wp.socket_types.HandshakeRequest(raw[:-1])
+    assert msg.generated_error_code is not None
+    print(Fore.GREEN + "HandshakeRequestRoundTripTest Passed" + Style.RESET_ALL)
+
+
+def HandshakeReplyRoundTripTest():
+    """
+    Test that HandshakeReply survives an encode / decode round trip.
+    """
+    raw = wp.encode.HandshakeReply(
+        version=7,
+        error_code='error_code é||',
+        protocol_version=16,
+        codec='codec é||',
+        compression='compression é||',
+        max_frame_size=14,
+        request_id=42)
+    msg = wp.socket_types.HandshakeReply(raw)
+    assert msg.generated_error_code is None
+    assert msg.request_id == 42
+    assert msg.version == 7
+    assert msg.error_code == 'error_code é||'
+    assert msg.protocol_version == 16
+    assert msg.codec == 'codec é||'
+    assert msg.compression == 'compression é||'
+    assert msg.max_frame_size == 14
+
+    # a truncated frame is rejected
+    msg = wp.socket_types.HandshakeReply(raw[:-1])
+    assert msg.generated_error_code is not None
+    print(Fore.GREEN + "HandshakeReplyRoundTripTest Passed" + Style.RESET_ALL)
+
+
+def ShardDeliveryRequestRoundTripTest():
+    """
+    Test that ShardDeliveryRequest survives an encode / decode round trip.
+    """
+    raw = wp.encode.ShardDeliveryRequest(
+        version=7,
+        recipient_usernames=['recipient_usernames0 é||', 'recipient_usernames1 é||', 'recipient_usernames2 é||'],
+        messages=['messages0 é||', 'messages1 é||', 'messages2 é||'],
+        request_id=42)
+    msg = wp.socket_types.ShardDeliveryRequest(raw)
+    assert msg.generated_error_code is None
+    assert msg.request_id == 42
+    assert msg.version == 7
+    assert msg.recipient_usernames == ['recipient_usernames0 é||', 'recipient_usernames1 é||', 'recipient_usernames2 é||']
+    assert msg.messages == ['messages0 é||', 'messages1 é||', 'messages2 é||']
+
+    # a truncated frame is rejected
+    msg = wp.socket_types.ShardDeliveryRequest(raw[:-1])
+    assert msg.generated_error_code is not None
+    print(Fore.GREEN + "ShardDeliveryRequestRoundTripTest Passed" + Style.RESET_ALL)
+
+
+def ShardDeliveryReplyRoundTripTest():
+    """
+    Test that ShardDeliveryReply survives an encode / decode round trip.
+    """
+    raw = wp.encode.ShardDeliveryReply(
+        version=7,
+        error_code='error_code é||',
+        status_codes=[13, 13, 13],
+        request_id=42)
+    msg = wp.socket_types.ShardDeliveryReply(raw)
+    assert msg.generated_error_code is None
+    assert msg.request_id == 42
+    assert msg.version == 7
+    assert msg.error_code == 'error_code é||'
+    assert msg.status_codes == [13, 13, 13]
+
+    # a truncated frame is rejected
+    msg = wp.socket_types.ShardDeliveryReply(raw[:-1])
+    assert msg.generated_error_code is not None
+    print(Fore.GREEN + "ShardDeliveryReplyRoundTripTest Passed" + Style.RESET_ALL)
+
+
+def ShardListRequestRoundTripTest():
+    """
+    Test that ShardListRequest survives an encode / decode round trip.
+    """
+    raw = wp.encode.ShardListRequest(
+        version=7,
+        number_of_accounts=18,
+        regex='regex é||',
+        request_id=42)
+    msg = wp.socket_types.ShardListRequest(raw)
+    assert msg.generated_error_code is None
+    assert msg.request_id == 42
+    assert msg.version == 7
+    assert msg.number_of_accounts == 18
+    assert msg.regex == 'regex é||'
+
+    # a truncated frame is rejected
+    msg = wp.socket_types.ShardListRequest(raw[:-1])
+    assert msg.generated_error_code is not None
+    print(Fore.GREEN + "ShardListRequestRoundTripTest Passed" + Style.RESET_ALL)
+
+
+def ShardListReplyRoundTripTest():
+    """
+    Test that ShardListReply survives an encode / decode round trip.
+    """
+    raw = wp.encode.ShardListReply(
+        version=7,
+        error_code='error_code é||',
+        account_names=['account_names0 é||', 'account_names1 é||', 'account_names2 é||'],
+        request_id=42)
+    msg = wp.socket_types.ShardListReply(raw)
+    assert msg.generated_error_code is None
+    assert msg.request_id == 42
+    assert msg.version == 7
+    assert msg.error_code == 'error_code é||'
+    assert msg.account_names == ['account_names0 é||', 'account_names1 é||', 'account_names2 é||']
+
+    # a truncated frame is rejected
+    msg = wp.socket_types.ShardListReply(raw[:-1])
+    assert msg.generated_error_code is not None
+    print(Fore.GREEN + "ShardListReplyRoundTripTest Passed" + Style.RESET_ALL)
+
+
+def PingRequestRoundTripTest():
+    """
+    Test that PingRequest survives an encode / decode round trip.
+    """
+    raw = wp.encode.PingRequest(
+        version=7,
+        nonce=5,
+        request_id=42)
+    msg = wp.socket_types.PingRequest(raw)
+    assert msg.generated_error_code is None
+    assert msg.request_id == 42
+    assert msg.version == 7
+    assert msg.nonce == 5
+
+    # a truncated frame is rejected
+    msg = wp.socket_types.PingRequest(raw[:-1])
+    assert msg.generated_error_code is not None
+    print(Fore.GREEN + "PingRequestRoundTripTest Passed" + Style.RESET_ALL)
+
+
+def PingReplyRoundTripTest():
+    """
+    Test that PingReply survives an encode / decode round trip.
+    """
+    raw = wp.encode.PingReply(
+        version=7,
+        error_code='error_code é||',
+        nonce=5,
+        request_id=42)
+    msg = wp.socket_types.PingReply(raw)
+    assert msg.generated_error_code is None
+    assert msg.request_id == 42
+    assert msg.version == 7
+    assert msg.error_code == 'error_code é||'
+    assert msg.nonce == 5
+
+    # a truncated frame is rejected
+    msg = wp.socket_types.PingReply(raw[:-1])
+    assert msg.generated_error_code is not None
+    print(Fore.GREEN + "PingReplyRoundTripTest Passed" + Style.RESET_ALL)
+
+
+def SubscribeRequestRoundTripTest():
+    """
+    Test that SubscribeRequest survives an encode / decode round trip.
+    """
+    raw = wp.encode.SubscribeRequest(
+        version=7,
+        auth_token='auth_token é||',
+        username='username é||',
+        request_id=42)
+    msg = wp.socket_types.SubscribeRequest(raw)
+    assert msg.generated_error_code is None
+    assert msg.request_id == 42
+    assert msg.version == 7
+    assert msg.auth_token == 'auth_token é||'
+    assert msg.username == 'username é||'
+
+    # a truncated frame is rejected
+    msg = wp.socket_types.SubscribeRequest(raw[:-1])
+    assert msg.generated_error_code is not None
+    print(Fore.GREEN + "SubscribeRequestRoundTripTest Passed" + Style.RESET_ALL)
+
+
+def SubscribeReplyRoundTripTest():
+    """
+    Test that SubscribeReply survives an encode / decode round trip.
+    """
+    raw = wp.encode.SubscribeReply(
+        version=7,
+        error_code='error_code é||',
+        request_id=42)
+    msg = wp.socket_types.SubscribeReply(raw)
+    assert msg.generated_error_code is None
+    assert msg.request_id == 42
+    assert msg.version == 7
+    assert msg.error_code == 'error_code é||'
+
+    # a truncated frame is rejected
+    msg = wp.socket_types.SubscribeReply(raw[:-1])
+    assert msg.generated_error_code is not None
+    print(Fore.GREEN + "SubscribeReplyRoundTripTest Passed" + Style.RESET_ALL)
+
+
+def PushRequestRoundTripTest():
+    """
+    Test that PushRequest survives an encode / decode round trip.
+    """
+    raw = wp.encode.PushRequest(
+        version=7,
+        sequence=8,
+        messages=['messages0 é||', 'messages1 é||', 'messages2 é||'],
+        request_id=42)
+    msg = wp.socket_types.PushRequest(raw)
+    assert msg.generated_error_code is None
+    assert msg.request_id == 42
+    assert msg.version == 7
+    assert msg.sequence == 8
+    assert msg.messages == ['messages0 é||', 'messages1 é||', 'messages2 é||']
+
+    # a truncated frame is rejected
+    msg = wp.socket_types.PushRequest(raw[:-1])
+    assert msg.generated_error_code is not None
+    print(Fore.GREEN + "PushRequestRoundTripTest Passed" + Style.RESET_ALL)
+
+
+def PushAckRoundTripTest():
+    """
+    Test that PushAck survives an encode / decode round trip.
+    """
+    raw = wp.encode.PushAck(
+        version=7,
+        error_code='error_code é||',
+        sequence=8,
+        request_id=42)
+    msg = wp.socket_types.PushAck(raw)
+    assert msg.generated_error_code is None
+    assert msg.request_id == 42
+    assert msg.version == 7
+    assert msg.error_code == 'error_code é||'
+    assert msg.sequence == 8
+
+    # a truncated frame is rejected
+    msg = wp.socket_types.PushAck(raw[:-1])
+    assert msg.generated_error_code is not None
+    print(Fore.GREEN + "PushAckRoundTripTest Passed" + Style.RESET_ALL)
+
+
+def ThroughputTest(iterations=20000):
+    """
+    Report encode / decode round trips per second for every message.
+    """
+    cases = [
+        (wp.encode.AccountCreateRequest, wp.socket_types.AccountCreateRequest,
+         dict(version=7, username='username é||', password='password é||', fullname='fullname é||')),
+        (wp.encode.AccountCreateReply, wp.socket_types.AccountCreateReply,
+         dict(version=7, error_code='error_code é||', auth_token='auth_token é||', fullname='fullname é||')),
+        (wp.encode.LoginRequest, wp.socket_types.LoginRequest,
+         dict(version=7, username='username é||', password='password é||')),
+        (wp.encode.LoginReply, wp.socket_types.LoginReply,
+         dict(version=7, error_code='error_code é||', auth_token='auth_token é||', fullname='fullname é||')),
+        (wp.encode.MessageRequest, wp.socket_types.MessageRequest,
+         dict(version=7, auth_token='auth_token é||', username='username é||', recipient_username='recipient_username é||', message='message é||')),
+        (wp.encode.MessageReply, wp.socket_types.MessageReply,
+         dict(version=7, error_code='error_code é||')),
+        (wp.encode.ListAccountRequest, wp.socket_types.ListAccountRequest,
+         dict(version=7, auth_token='auth_token é||', username='username é||', number_of_accounts=18, regex='regex é||')),
+        (wp.encode.ListAccountReply, wp.socket_types.ListAccountReply,
+         dict(version=7, error_code='error_code é||', account_names='account_names é||')),
+        (wp.encode.DeleteAccountRequest, wp.socket_types.DeleteAccountRequest,
+         dict(version=7, auth_token='auth_token é||', username='username é||')),
+        (wp.encode.DeleteAccountReply, wp.socket_types.DeleteAccountReply,
+         dict(version=7, error_code='error_code é||')),
+        (wp.encode.RefreshRequest, wp.socket_types.RefreshRequest,
+         dict(version=7, auth_token='auth_token é||', username='username é||', wait_ms=7)),
+        (wp.encode.RefreshReply, wp.socket_types.RefreshReply,
+         dict(version=7, message='message é||', error_code='error_code é||')),
+        (wp.encode.BatchMessageRequest, wp.socket_types.BatchMessageRequest,
+         dict(version=7, auth_token='auth_token é||', username='username é||', recipient_usernames=['recipient_usernames0 é||', 'recipient_usernames1 é||', 'recipient_usernames2 é||'], messages=['messages0 é||', 'messages1 é||', 'messages2 é||'])),
+        (wp.encode.BatchMessageReply, wp.socket_types.BatchMessageReply,
+         dict(version=7, error_code='error_code é||', status_codes=[13, 13, 13])),
+        (wp.encode.HandshakeRequest, wp.socket_types.HandshakeRequest,
+         dict(version=7, protocol_versions=[18, 18, 18], codecs=['codecs0 é||', 'codecs1 é||', 'codecs2 é||'], compressions=['compressions0 é||', 'compressions1 é||', 'compressions2 é||'], max_frame_size=14)),
+        (wp.encode.HandshakeReply, wp.socket_types.HandshakeReply,
+         dict(version=7, error_code='error_code é||', protocol_version=16, codec='codec é||', compression='compression é||', max_frame_size=14)),
+        (wp.encode.ShardDeliveryRequest, wp.socket_types.ShardDeliveryRequest,
+         dict(version=7, recipient_usernames=['recipient_usernames0 é||', 'recipient_usernames1 é||', 'recipient_usernames2 é||'], messages=['messages0 é||', 'messages1 é||', 'messages2 é||'])),
+        (wp.encode.ShardDeliveryReply, wp.socket_types.ShardDeliveryReply,
+         dict(version=7, error_code='error_code é||', status_codes=[13, 13, 13])),
+        (wp.encode.ShardListRequest, wp.socket_types.ShardListRequest,
+         dict(version=7, number_of_accounts=18, regex='regex é||')),
+        (wp.encode.ShardListReply, wp.socket_types.ShardListReply,
+         dict(version=7, error_code='error_code é||', account_names=['account_names0 é||', 'account_names1 é||', 'account_names2 é||'])),
+        (wp.encode.PingRequest, wp.socket_types.PingRequest,
+         dict(version=7, nonce=5)),
+        (wp.encode.PingReply, wp.socket_types.PingReply,
+         dict(version=7, error_code='error_code é||', nonce=5)),
+        (wp.encode.SubscribeRequest, wp.socket_types.SubscribeRequest,
+         dict(version=7, auth_token='auth_token é||', username='username é||')),
+        (wp.encode.SubscribeReply, wp.socket_types.SubscribeReply,
+         dict(version=7, error_code='error_code é||')),
+        (wp.encode.PushRequest, wp.socket_types.PushRequest,
+         dict(version=7, sequence=8, messages=['messages0 é||', 'messages1 é||', 'messages2 é||'])),
+        (wp.encode.PushAck, wp.socket_types.PushAck,
+         dict(version=7, error_code='error_code é||', sequence=8)),
+    ]
+    for encoder, decoder, kwargs in cases:
+        fields = list(kwargs)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            msg = decoder(encoder(**kwargs))
+            for field in fields:
+                getattr(msg, field)
+        elapsed = time.perf_counter() - start
+        print(f"{decoder.__name__}: "
+              f"{iterations / elapsed:,.0f} round trips/s")
+    print(Fore.GREEN + "ThroughputTest Passed" + Style.RESET_ALL)
+
+
+if __name__ == "__main__":
+    print("Begin Codec Tests for Sockets")
+    AccountCreateRequestRoundTripTest()
+    AccountCreateReplyRoundTripTest()
+    LoginRequestRoundTripTest()
+    LoginReplyRoundTripTest()
+    MessageRequestRoundTripTest()
+    MessageReplyRoundTripTest()
+    ListAccountRequestRoundTripTest()
+    ListAccountReplyRoundTripTest()
+    DeleteAccountRequestRoundTripTest()
+    DeleteAccountReplyRoundTripTest()
+    RefreshRequestRoundTripTest()
+    RefreshReplyRoundTripTest()
+    BatchMessageRequestRoundTripTest()
+    BatchMessageReplyRoundTripTest()
+    HandshakeRequestRoundTripTest()
+    HandshakeReplyRoundTripTest()
+    ShardDeliveryRequestRoundTripTest()
+    ShardDeliveryReplyRoundTripTest()
+    ShardListRequestRoundTripTest()
+    ShardListReplyRoundTripTest()
+    PingRequestRoundTripTest()
+    PingReplyRoundTripTest()
+    SubscribeRequestRoundTripTest()
+    SubscribeReplyRoundTripTest()
+    PushRequestRoundTripTest()
+    PushAckRoundTripTest()
+    ThroughputTest()
@@ -0,0 +1,476 @@
+"""
+Opcode dispatch for the socket server.
+
+A `Dispatcher` maps every opcode to a handler that takes a request frame and
+returns a reply frame, or None when the request is invalid and the connection
+must be closed. Middleware wraps those handlers once, when a handler is
+registered or a middleware is added, so serving a request is a single dict
+lookup followed by the prebuilt chain of calls.
+
+A middleware is any object with a `Wrap(opcode, name, handler)` method that
+returns a new handler, usually one that does some work and then calls
+`handler`. The first middleware added is the outermost one.
+"""
+import collections
+import struct
+import threading as mp
+import time
+
+import wire_protocol as wp
+
+ERROR_RATE_LIMITED = "ERROR Rate limit exceeded."
+ERROR_INVALID_TOKEN = "Invalid Token"
+
+# latencies are bucketed by powers of two microseconds: bucket i counts
+# requests that took less than 2**i us (and at least 2**(i - 1) us), the last
+# bucket everything slower
+HISTOGRAM_BUCKETS = 26
+
+# idle rate limit buckets dropped by one request at most; more than one, so
+# that eviction keeps up with the one bucket a request may add
+BUCKET_EVICTIONS = 2
+
+
+def ErrorReply(opcode: int, error_code: str) -> bytes:
+    """
+    Builds a reply frame for `opcode` that carries only an error code, the
+    frame counterpart of `wp.legacy.TextReply`.
+    """
+    fields = []
+    for name, kind in wp.socket_types.REPLY_TYPES[opcode].FIELDS:
+        if name == "version":
+            fields.append(wp.frame.Int(1))
+        elif name == "error_code":
+            fields.append(wp.frame.Str(error_code))
+        elif kind is int:
+            fields.append(wp.frame.Int(0))
+        elif kind is str:
+            fields.append(wp.frame.Str(""))
+        else:
+            # an empty repeated field
+            fields.append(wp.frame.LENGTH.pack(0))
+    return wp.frame.Encode(opcode, *fields)
+
+
+def ErrorCodeReader(reply_type):
+    """
+    Builds a function that reads the error code of a `reply_type` reply
+    frame, skipping over the fields before it without decoding the rest of
+    the reply, which may be a large message body.
+
+    Returns:
+        callable: Takes a reply frame and returns its error code, or "" if
+        `reply_type` is None or has no scalar fields up to its error code.
+    """
+    names = [name for name, _ in reply_type.FIELDS] if reply_type else []
+    if "error_code" not in names:
+        return lambda reply: ""
+    preceding = [kind for _, kind in
+                 reply_type.FIELDS[:names.index("error_code")]]
+    if any(kind not in (int, str) for kind in preceding):
+        return lambda reply: reply_type(reply).error_code
+
+    def ErrorCode(reply) -> str:
+        offset = wp.frame.HEADER.size
+        try:
+            for kind in preceding:
+                if kind is int:
+                    offset += wp.frame.INT.size
+                else:
+                    size, = wp.frame.LENGTH.unpack_from(reply, offset)
+                    offset += wp.frame.LENGTH.size + size
+            size, = wp.frame.LENGTH.unpack_from(reply, offset)
+        except struct.error:
+            return ""
+        offset += wp.frame.LENGTH.size
+        return str(reply[offset:offset + size], "UTF-8")
+
+    return ErrorCode
+
+
+class Dispatcher:
+    """
+    Registry of request handlers by opcode, with their middleware chains.
+
+    Args:
+        middleware (list): Middleware to wrap every handler in, outermost
+        first.
+    """
+
+    def __init__(self, middleware: list = ()):
+        self.middleware = list(middleware)
+        # opcode -> (name, handler) as registered
+        self.handlers = {}
+        # opcode -> handler wrapped in every middleware
+        self.chains = {}
+
+    def Register(self, opcode: int, name: str, handler) -> None:
+        """
+        Serves requests with `opcode` with `handler`, under `name` in
+        metrics and traces.
+        """
+        self.handlers[opcode] = (name, handler)
+        self.chains[opcode] = self.Chain(opcode, name, handler)
+
+    def Use(self, middleware) -> None:
+        """
+        Adds a middleware inside the ones already in use and rebuilds the
+        chains.
+        """
+        self.middleware.append(middleware)
+        for opcode, (name, handler) in self.handlers.items():
+            self.chains[opcode] = self.Chain(opcode, name, handler)
+
+    def Chain(self, opcode: int, name: str, handler):
+        def Handle(data):
+            try:
+                return handler(data)
+            except UnicodeDecodeError:
+                # fields are decoded lazily, so invalid text only
+                # surfaces once a handler reads it
+                print("Unable to decode the message")
+                return None
+
+        chain = Handle
+        for middleware in reversed(self.middleware):
+            chain = middleware.Wrap(opcode, name, chain)
+        return chain
+
+    def Dispatch(self, data: bytes):
+        """
+        Runs the handler chain for the opcode of a request frame.
+
+        Returns:
+            bytes: The reply frame, or None if the request was invalid and
+            the connection must be closed.
+        """
+        chain = self.chains.get(wp.frame.ParseHeader(data).opcode)
+        if chain is None:
+            # Invalid opcodes are dropped immediately, invalid opcodes
+            #  occur when a malicious / corrupted message is being sent
+            return None
+        return chain(data)
+
+
+class OpcodeStats:
+    """
+    Latency histogram and error counters of one opcode.
+
+    `error_codes` counts the replies by their non empty `error_code`, and
+    `dropped` the requests that were rejected without a reply.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.lock = mp.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.histogram = [0] * HISTOGRAM_BUCKETS
+        self.dropped = 0
+        self.error_codes = collections.Counter()
+
+    def Record(self, elapsed: float, error_code) -> None:
+        """
+        Records one request that took `elapsed` seconds. `error_code` is
+        None for a dropped request.
+        """
+        bucket = min(int(elapsed * 1e6).bit_length(), HISTOGRAM_BUCKETS - 1)
+        with self.lock:
+            self.count += 1
+            self.total += elapsed
+            self.histogram[bucket] += 1
+            if error_code is None:
+                self.dropped += 1
+            elif error_code:
+                self.error_codes[error_code] += 1
+
+    def Percentile(self, q: float) -> float:
+        """
+        Returns an upper bound, in seconds, on the latency of the fraction
+        `q` of requests, or 0 if there were none. The bound is the top of a
+        histogram bucket, so it is at most twice the true value.
+        """
+        with self.lock:
+            histogram = list(self.histogram)
+            count = self.count
+        if count == 0:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for bucket, n in enumerate(histogram):
+            seen += n
+            if seen >= rank:
+                break
+        return (1 << bucket) / 1e6
+
+    def Snapshot(self) -> dict:
+        with self.lock:
+            errors = sum(self.error_codes.values())
+            snapshot = {
+                "count": self.count,
+                "mean": self.total / self.count if self.count else 0.0,
+                "errors": errors,
+                "dropped": self.dropped,
+                "error_codes": dict(self.error_codes),
+            }
+        for q in (0.5, 0.99):
+            snapshot[f"p{round(q * 100)}"] = self.Percentile(q)
+        return snapshot
+
+
+class Metrics:
+    """
+    Per opcode request statistics, updated by `MetricsMiddleware`, named
+    counters of connection events, and gauges that hold the latest value of
+    a measurement, both updated by the server. All are safe to read from any
+    thread while the server runs.
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self.counters = collections.Counter()
+        self.gauges = {}
+        self.counters_lock = mp.Lock()
+
+    def Increment(self, counter: str, n: int = 1) -> None:
+        with self.counters_lock:
+            self.counters[counter] += n
+
+    def Counters(self) -> dict:
+        with self.counters_lock:
+            return dict(self.counters)
+
+    def SetGauge(self, gauge: str, value) -> None:
+        with self.counters_lock:
+            self.gauges[gauge] = value
+
+    def Gauges(self) -> dict:
+        with self.counters_lock:
+            return dict(self.gauges)
+
+    def Stats(self, opcode: int, name: str) -> OpcodeStats:
+        stats = self.stats.get(opcode)
+        if stats is None:
+            stats = self.stats.setdefault(opcode, OpcodeStats(name))
+        return stats
+
+    def Snapshot(self) -> dict:
+        """
+        Returns the statistics of every opcode with a handler, keyed by
+        handler name. Latencies are in seconds.
+        """
+        return {stats.name: stats.Snapshot()
+                for _, stats in sorted(list(self.stats.items()))}
+
+    def Report(self) -> str:
+        """
+        Formats `Snapshot` as a table, one line per opcode, followed by the
+        counters and the gauges.
+        """
+        lines = [f"{'opcode':<18}{'count':>10}{'p50 ms':>10}{'p99 ms':>10}"
+                 f"{'errors':>10}{'dropped':>10}"]
+        for name, s in self.Snapshot().items():
+            lines.append(f"{name:<18}{s['count']:>10}{s['p50'] * 1e3:>10.3f}"
+                         f"{s['p99'] * 1e3:>10.3f}{s['errors']:>10}"
+                         f"{s['dropped']:>10}")
+        for counter, value in sorted(self.Counters().items()):
+            lines.append(f"{counter:<28}{value:>10}")
+        for gauge, value in sorted(self.Gauges().items()):
+            lines.append(f"{gauge:<28}{value:>10}")
+        return "\n".join(lines)
+
+
+class MetricsMiddleware:
+    """
+    Times every request and counts its errors in `metrics`.
+    """
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    def Wrap(self, opcode: int, name: str, handler):
+        stats = self.metrics.Stats(opcode, name)
+        reply_type = wp.socket_types.REPLY_TYPES.get(opcode)
+        clock = time.perf_counter
+        ErrorCode = ErrorCodeReader(reply_type)
+
+        def Measure(data):
+            start = clock()
+            reply = None
+            try:
+                reply = handler(data)
+            finally:
+                elapsed = clock() - start
+                stats.Record(elapsed,
+                             None if reply is None else ErrorCode(reply))
+            return reply
+
+        return Measure
+
+
+class TracingMiddleware:
+    """
+    Keeps a trace of the most recent requests.
+
+    Every request adds a `(start, name, request_id, elapsed, outcome)`
+    record to `spans`, where `start` is a `time.time` timestamp and
+    `outcome` is "ok", "dropped" or the name of the exception raised. With
+    `slow_threshold` set, requests slower than that many seconds are also
+    printed as they finish.
+
+    Args:
+        capacity (int): How many of the latest spans to keep.
+        slow_threshold (float): Latency above which a request is printed,
+        or None to print nothing.
+    """
+
+    def __init__(self, capacity: int = 1024, slow_threshold: float = None):
+        self.spans = collections.deque(maxlen=capacity)
+        self.slow_threshold = slow_threshold
+
+    def Wrap(self, opcode: int, name: str, handler):
+        clock = time.perf_counter
+
+        def Trace(data):
+            start = time.time()
+            begin = clock()
+            outcome = "dropped"
+            try:
+                reply = handler(data)
+                if reply is not None:
+                    outcome = "ok"
+                return reply
+            except Exception as e:
+                outcome = type(e).__name__
+                raise
+            finally:
+                elapsed = clock() - begin
+                request_id = wp.frame.ParseHeader(data).request_id
+                self.spans.append((start, name, request_id, elapsed, outcome))
+                if self.slow_threshold is not None and \
+                        elapsed > self.slow_threshold:
+                    print(f"Slow request: {name} id={request_id} "
+                          f"{elapsed * 1e3:.1f} ms {outcome}")
+
+        return Trace
+
+
+class RateLimitMiddleware:
+    """
+    Limits how many requests each user may send, with a token bucket per
+    username.
+
+    A user may send `burst` requests at once and `rate` requests per second
+    after that. Requests over the limit get a reply with
+    `ERROR_RATE_LIMITED` and never reach their handler. Requests that carry
+    no username, or that cannot be decoded, are not limited.
+
+    A bucket that has filled up again is the same as no bucket, and one
+    left alone for `burst / rate` seconds has surely done so. Buckets are
+    kept in the order they were last used, and every request drops up to
+    `BUCKET_EVICTIONS` of the oldest ones that have been idle that long, so
+    idle users do not keep one each and no request pays for a sweep of
+    them all.
+
+    Args:
+        rate (float): Sustained requests per second per user.
+        burst (int): Size of each bucket.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        # username -> (tokens, time of last refill), least recently used
+        # first
+        self.buckets = collections.OrderedDict()
+        self.lock = mp.Lock()
+        self.message_pool = wp.message.MessagePool()
+        self.refill_time = burst / rate if rate > 0 else None
+
+    def Allow(self, username: str) -> bool:
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.pop(username, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[username] = (tokens, now)
+            if self.refill_time is not None:
+                self.EvictIdle(now)
+        return allowed
+
+    def EvictIdle(self, now: float) -> None:
+        """
+        Drops up to `BUCKET_EVICTIONS` of the least recently used buckets,
+        if they have been idle long enough to refill. Must be called with
+        `lock` held.
+        """
+        idle = now - self.refill_time
+        for _ in range(min(BUCKET_EVICTIONS, len(self.buckets))):
+            username, (_, last) = next(iter(self.buckets.items()))
+            if last > idle:
+                return
+            del self.buckets[username]
+
+    def Wrap(self, opcode: int, name: str, handler):
+        request_type = wp.socket_types.REQUEST_TYPES.get(opcode)
+        if request_type is None or \
+                "username" not in dict(request_type.FIELDS):
+            return handler
+        rejected = ErrorReply(opcode, ERROR_RATE_LIMITED)
+
+        def Limit(data):
+            request = self.message_pool.Decode(request_type, data)
+            try:
+                limited = not request.generated_error_code and \
+                    not self.Allow(request.username)
+            except UnicodeDecodeError:
+                # left to the handler chain, which drops the request
+                limited = False
+            if limited:
+                return rejected
+            return handler(data)
+
+        return Limit
+
+
+class AuthMiddleware:
+    """
+    Rejects requests with an invalid token before they reach their handler.
+
+    Handlers check tokens themselves as well, since they are also called
+    directly. Placed in front of a rate limit, this keeps requests with bad
+    tokens from using up their user's budget, and it spares handlers such as
+    `ListAccounts` from decoding and compiling the rest of a request that
+    will be refused anyway.
+
+    Args:
+        validate (callable): `validate(username, token)` returns a negative
+        number for an invalid token, like `ChatServer.ValidateToken`.
+    """
+
+    def __init__(self, validate):
+        self.validate = validate
+        self.message_pool = wp.message.MessagePool()
+
+    def Wrap(self, opcode: int, name: str, handler):
+        request_type = wp.socket_types.REQUEST_TYPES.get(opcode)
+        if request_type is None or \
+                "auth_token" not in dict(request_type.FIELDS):
+            return handler
+        rejected = ErrorReply(opcode, ERROR_INVALID_TOKEN)
+
+        def Authenticate(data):
+            request = self.message_pool.Decode(request_type, data)
+            try:
+                invalid = not request.generated_error_code and \
+                    self.validate(request.username, request.auth_token) < 0
+            except UnicodeDecodeError:
+                # left to the handler chain, which drops the request
+                invalid = False
+            if invalid:
+                return rejected
+            return handler(data)
+
+        return Authenticate
@@ -0,0 +1,811 @@
+"""
+The chat engine: accounts, tokens, messages, subscriptions and long polls,
+shared by every transport.
+
+An `Engine` holds the stripes, the storage backend and everything that
+works on them, and speaks in the typed requests and replies below rather
+than in any wire format. The socket server and the gRPC servicer are thin
+adapters (`EngineAdapter`) that decode their transport's requests into
+these, call the engine and encode its replies. Adapters given the same
+engine serve one set of users from one store, so both listeners can run in
+one process and their users can message each other.
+
+Operations validate the token of the requesting user themselves and report
+failures as the reply's `error_code`, which is empty on success. They return
+once their changes are made, but not yet on disk: the adapter waits for that
+with `Commit`, or awaits the write-ahead log on an event loop.
+"""
+import binascii
+import itertools
+import os
+import re
+import threading as mp
+import time
+from collections import defaultdict, deque
+from typing import NamedTuple
+
+import snapshot
+import write_ahead_log as wal
+from dispatcher import Metrics
+from storage import MemoryStorage
+from striping import DEFAULT_STRIPES, Stripe, Stripes, StripedView
+from token_expiry import DEFAULT_TOKEN_TTL, TokenSweeper
+from wire_protocol.message import STATUS_DELIVERED, STATUS_INVALID_RECIPIENT
+
+ERROR_NO_NEW_MESSAGE = "No new message"
+
+# most messages handed out in one push batch, and the size after which no
+# further message is added to it
+PUSH_BATCH = 256
+PUSH_BATCH_BYTES = 1024 * 1024
+
+
+class LoginRequest(NamedTuple):
+    username: str
+    password: str
+
+
+class AccountRequest(NamedTuple):
+    username: str
+    password: str
+    fullname: str
+
+
+class AccountReply(NamedTuple):
+    error_code: str
+    auth_token: str = ""
+    fullname: str = ""
+
+
+class AuthRequest(NamedTuple):
+    """
+    A request that only names its user, such as deleting the account.
+    """
+    username: str
+    auth_token: str
+
+
+class Reply(NamedTuple):
+    error_code: str
+
+
+class SendRequest(NamedTuple):
+    """
+    Messages from one user, each to the recipient at the same index.
+    """
+    username: str
+    auth_token: str
+    recipients: list
+    messages: list
+
+
+class SendReply(NamedTuple):
+    """
+    `STATUS_DELIVERED` or `STATUS_INVALID_RECIPIENT` per message.
+    """
+    error_code: str
+    status_codes: list = ()
+
+
+class ListRequest(NamedTuple):
+    """
+    Up to `limit` usernames that match `regex` from their start, or any
+    username if it is empty.
+    """
+    username: str
+    auth_token: str
+    regex: str = ""
+    limit: int = 100
+
+
+class ListReply(NamedTuple):
+    error_code: str
+    usernames: list = ()
+
+
+class RefreshRequest(NamedTuple):
+    """
+    The messages waiting for a user, at most `limit` of them (all if None),
+    waiting up to `wait` seconds for one if there are none.
+    """
+    username: str
+    auth_token: str
+    wait: float = 0.0
+    limit: int = None
+
+
+class RefreshReply(NamedTuple):
+    error_code: str
+    messages: list = ()
+
+
+class Subscription:
+    """
+    The messages pushed to a subscribed user, kept until the client
+    acknowledges them.
+
+    Messages are numbered from 1 as they are added. `unacked` holds the
+    (number, message) pairs not acknowledged yet, of which those numbered
+    above `sent` have not been pushed yet. `notify` is called, from any
+    thread, once new messages can be taken with `TakeBatch`.
+    """
+    __slots__ = ("username", "lock", "unacked", "next_sequence", "sent",
+                 "notify")
+
+    def __init__(self, username: str, notify):
+        self.username = username
+        self.lock = mp.Lock()
+        self.unacked = deque()
+        self.next_sequence = 1
+        self.sent = 0
+        self.notify = notify
+
+    def __len__(self) -> int:
+        return len(self.unacked)
+
+    def Add(self, messages: list) -> None:
+        """
+        Queues messages to push, without notifying the connection.
+        """
+        with self.lock:
+            for message in messages:
+                self.unacked.append((self.next_sequence, message))
+                self.next_sequence += 1
+
+    def TakeBatch(self):
+        """
+        Marks the next messages that have not been pushed yet as pushed.
+
+        Returns:
+            tuple: The number of the first message and the messages, or None
+            if there are none.
+        """
+        with self.lock:
+            unsent = self.next_sequence - 1 - self.sent
+            if unsent == 0:
+                return None
+            start = len(self.unacked) - unsent
+            batch = []
+            size = 0
+            for sequence, message in itertools.islice(
+                    self.unacked, start, start + PUSH_BATCH):
+                batch.append((sequence, message))
+                size += len(message)
+                if size >= PUSH_BATCH_BYTES:
+                    break
+            self.sent = batch[-1][0]
+        return batch[0][0], [message for _, message in batch]
+
+    def Ack(self, sequence: int) -> int:
+        """
+        Forgets the messages numbered up to `sequence`, which the client
+        has received.
+
+        Returns:
+            int: The number of messages forgotten.
+        """
+        acked = 0
+        with self.lock:
+            sequence = min(sequence, self.sent)
+            while self.unacked and self.unacked[0][0] <= sequence:
+                self.unacked.popleft()
+                acked += 1
+        return acked
+
+    def Drain(self) -> list:
+        """
+        Removes and returns every unacknowledged message, oldest first.
+        """
+        with self.lock:
+            messages = [message for _, message in self.unacked]
+            self.unacked.clear()
+            self.sent = self.next_sequence - 1
+        return messages
+
+
+class InboxWaiters:
+    """
+    The long polls waiting for a message to arrive in one user's inbox.
+
+    Threads block on `condition`, which shares the inbox lock of the user's
+    stripe, so a delivery only wakes the threads waiting on the inboxes it
+    added to. Polls served by an event loop cannot block a thread, and leave
+    a callback in `wakers` instead, see `Engine.AddWaker`. Guarded by the
+    inbox lock.
+    """
+    __slots__ = ("condition", "wakers")
+
+    def __init__(self, lock):
+        self.condition = mp.Condition(lock)
+        self.wakers = []
+
+
+class EngineStripe(Stripe):
+    """
+    A stripe of the engine's users. Besides the locks, and the accounts,
+    tokens and inboxes of a `MemoryStorage`, it keeps the subscriptions and
+    the long polls of its users, guarded by its `inbox_lock`. Inboxes are
+    deques, which are drained from the front.
+    """
+    __slots__ = ("subscriptions", "inbox_waiters")
+
+    def __init__(self):
+        super().__init__()
+        self.user_inbox = defaultdict(deque)
+        self.subscriptions = {}
+        self.inbox_waiters = {}
+
+
+class Engine:
+    """
+    The users of a chat server and every operation on them.
+
+    Args:
+        stripes (int): The number of stripes the users are partitioned
+        into, see `striping.py`.
+        storage (StorageBackend): Where accounts, tokens and inboxes are
+        kept, in the stripes if None.
+    """
+
+    def __init__(self, stripes: int = DEFAULT_STRIPES, storage=None):
+        # users are partitioned by username into stripes with a metadata
+        # lock and an inbox lock each, see `striping.py`
+        self.stripes = Stripes(stripes, EngineStripe)
+
+        # user metadata, tokens and inboxes, kept in the stripes unless
+        # another `storage.StorageBackend` is given; operations call it with
+        # the locks of the user's stripe held
+        self.storage = storage if storage is not None \
+            else MemoryStorage(self.stripes)
+
+        # views of every stripe's inboxes, metadata store (key - username,
+        # per value entry (password, name)) and token hub (usernames to
+        # token, timestamp pairs) in memory storage, for tools and tests
+        self.user_inbox = StripedView(self.stripes, "user_inbox")
+        self.user_metadata_store = StripedView(self.stripes,
+                                               "user_metadata_store")
+        self.token_hub = StripedView(self.stripes, "token_hub")
+        self.token_length = 15
+
+        # tokens expire `token_ttl` seconds after they are issued, and
+        # `sweeper` evicts expired ones from the token hub every
+        # `sweep_interval` seconds, `sweep_batch` per acquisition of a
+        # stripe's metadata lock; see `token_expiry.py`
+        self.token_ttl = DEFAULT_TOKEN_TTL
+        self.sweep_interval = 60.0
+        self.sweep_batch = 1000
+        self.sweeper = TokenSweeper(self)
+        # counters and gauges of the engine and of its adapters
+        self.metrics = Metrics()
+
+        # the write-ahead log that memory storage is recovered from after a
+        # restart, see `OpenLog`; None keeps it in memory only.
+        # `snapshotter` snapshots them every `snapshot_interval` seconds, 0
+        # for never, and deletes the log they cover; see `snapshot.py`
+        self.wal = None
+        self.snapshot_interval = 300.0
+        self.snapshotter = snapshot.Snapshotter(self)
+
+        # users whose messages are pushed to them, by username and guarded
+        # by their stripe's `inbox_lock`; see `Subscribe`. Pushed messages
+        # stay in the inbox until acknowledged, and at most `max_unacked` of
+        # them wait for a subscriber to acknowledge them, later ones wait
+        # unpushed for room
+        self.subscriptions = StripedView(self.stripes, "subscriptions")
+        self.max_unacked = 1000
+
+        # long polls waiting on empty inboxes, by username and guarded by
+        # their stripe's `inbox_lock`; a poll waits at most `max_wait`
+        # seconds, whatever it asks for
+        self.inbox_waiters = StripedView(self.stripes, "inbox_waiters")
+        self.max_wait = 30.0
+
+    def OpenLog(self, path: str, window: float = wal.DEFAULT_WINDOW) -> int:
+        """
+        Restores the engine's memory storage, which must not hold any
+        accounts yet, from the latest snapshot of the write-ahead log at
+        `path` and the log records after it, and logs every change from then
+        on. Replies wait for the changes they report to be on disk, which
+        the log commits in groups every `window` seconds.
+
+        Returns:
+            int: The number of log records replayed.
+        """
+        replayed = self.storage.OpenLog(path, window)
+        self.wal = self.storage.wal
+        self.snapshotter.Start()
+        return replayed
+
+    def Commit(self) -> None:
+        """
+        Waits until the changes the calling thread logged are on disk.
+        """
+        if self.wal is not None:
+            self.wal.Commit()
+
+    def GenerateToken(self) -> str:
+        """
+        Generates a token for authenticating user requests to a chat server.
+
+        Returns:
+            str: A token that can be used to authenticate user requests.
+        """
+        token = os.urandom(self.token_length)
+        return binascii.hexlify(token).decode()
+
+    def ValidatePassword(self, password: str) -> int:
+        """
+        Validates a password to ensure that it is a string.
+
+        Args:
+            password (str): The password to validate.
+
+        Returns:
+            int: Returns 0 if the password is a string, or -1 if it is not.
+        """
+        if not isinstance(password, str):
+            return -1
+        else:
+            return 0
+
+    def ValidateToken(self, username: str, token: str) -> int:
+        """
+        Validates a user token and checks if it has expired.
+
+        Args:
+            username (str): The username associated with the token.
+            token (str): The token to validate.
+
+        Returns:
+            int: Returns 0 if the token is valid and has not expired,
+            or -1 if it is invalid or has expired.
+        """
+        stripe = self.stripes.Of(username)
+        with stripe.metadata_lock:
+            issued = self.storage.Token(username)
+            if issued is None:
+                return -1
+            stored_token, timestamp = issued
+
+            if stored_token != token:
+                return -1
+
+            if time.time() - timestamp > self.token_ttl:
+                return -1
+
+            return 0
+
+    def CreateAccount(self, request: AccountRequest) -> AccountReply:
+        """
+        Registers a new user, with an empty inbox, and logs them in.
+
+        Returns:
+            AccountReply: The token of the new user and their full name.
+        """
+        username = request.username
+        stripe = self.stripes.Of(username)
+        with stripe.metadata_lock:
+            if self.storage.Account(username) is not None:
+                return AccountReply("ERROR Username Already Exists")
+
+            # get the password and do basic error checking
+            password = request.password
+            if self.ValidatePassword(password) < 0:
+                return AccountReply("ERROR Invalid Passcode")
+
+            # prepare metadata
+            fullname = request.fullname
+            token = self.GenerateToken()
+            timestamp = time.time()
+
+            with stripe.inbox_lock:
+                # create user metadata and chat inbox
+                self.storage.CreateAccount(username, password, fullname)
+                # register user in token hub / stores last given token
+                self.storage.IssueToken(username, token, timestamp)
+                self.sweeper.Start()
+        return AccountReply("", token, fullname)
+
+    def Login(self, request: LoginRequest) -> AccountReply:
+        """
+        Checks a user's password and issues them a new token, which
+        replaces the previous one.
+
+        Returns:
+            AccountReply: The new token and the user's full name.
+        """
+        username = request.username
+        stripe = self.stripes.Of(username)
+        with stripe.metadata_lock:
+            account = self.storage.Account(username)
+            if account is None:
+                return AccountReply("ERROR Username Invalid")
+
+            # basic password match
+            if request.password != account[0]:
+                return AccountReply("ERROR Password Invalid")
+
+            # generate new token
+            token = self.GenerateToken()
+            timestamp = time.time()
+
+            # register token in token hub
+            self.storage.IssueToken(username, token, timestamp)
+            self.sweeper.Start()
+            return AccountReply("", token, account[1])
+
+    def SendMessages(self, request: SendRequest) -> SendReply:
+        """
+        Delivers messages from one user, each prefixed with its sender. The
+        token is validated once and the inbox locks are taken once for the
+        whole batch.
+        """
+        username = request.username
+        if self.ValidateToken(username, request.auth_token) < 0:
+            return SendReply("Invalid Token")
+        prefix = f"[{username}]: "
+        return SendReply("", self.Deliver(
+            request.recipients,
+            [prefix + message for message in request.messages]))
+
+    def Deliver(self, recipients: list, messages: list) -> list:
+        """
+        Appends formatted messages to the inboxes of their recipients under
+        a single acquisition of the inbox locks of their stripes, taken in
+        ascending stripe order. Messages to subscribed recipients are pushed
+        to them too.
+
+        Args:
+            recipients (list): The recipient username of every message.
+            messages (list): The messages, already prefixed with their
+            sender.
+
+        Returns:
+            list: One status code per message, `STATUS_DELIVERED` or
+            `STATUS_INVALID_RECIPIENT` if the recipient does not exist.
+        """
+        status_codes = []
+        pushed = set()
+        wakers = []
+        deliveries = []
+        # messages of each recipient not held by a subscription, as of the
+        # latest message of the batch
+        waiting = {}
+        indices = [self.stripes.Index(recipient) for recipient in recipients]
+        with self.stripes.Locked(indices):
+            for index, recipient, message in zip(indices, recipients,
+                                                 messages):
+                stripe = self.stripes[index]
+                queued = waiting[recipient] if recipient in waiting \
+                    else self.Waiting(stripe, recipient)
+                if queued is None:
+                    status_codes.append(STATUS_INVALID_RECIPIENT)
+                    continue
+                subscription = stripe.subscriptions.get(recipient)
+                # messages that found no room with the subscriber earlier
+                # are still waiting, and go first
+                if subscription is not None and not queued and \
+                        len(subscription) < self.max_unacked:
+                    subscription.Add([message])
+                    pushed.add(subscription)
+                else:
+                    # long polls only ever wait on an empty inbox
+                    if not queued:
+                        wakers += self.WakeWaiters(recipient)
+                    queued += 1
+                waiting[recipient] = queued
+                deliveries.append((recipient, message))
+                status_codes.append(STATUS_DELIVERED)
+            if deliveries:
+                self.storage.Enqueue(deliveries)
+        for subscription in pushed:
+            subscription.notify()
+        for wake in wakers:
+            wake()
+        return status_codes
+
+    def FindAccounts(self, pattern, limit: int) -> list:
+        """
+        Lists up to `limit` usernames that match a compiled regex, or any
+        username if `pattern` is None.
+        """
+        list_of_usernames = self.storage.Usernames()
+
+        if pattern is not None:
+            list_of_usernames = list(filter(pattern.match, list_of_usernames))
+        return list_of_usernames[:limit]
+
+    def ListAccounts(self, request: ListRequest) -> ListReply:
+        """
+        Lists the usernames that match the request's regex, in the order
+        the accounts were created.
+        """
+        if self.ValidateToken(request.username, request.auth_token) < 0:
+            return ListReply("Invalid token")
+
+        # search using filter
+        pattern = None
+        if len(request.regex) != 0:
+            try:
+                pattern = re.compile(request.regex)
+            except Exception as e:
+                return ListReply(str(e))
+        return ListReply("", self.FindAccounts(pattern, request.limit))
+
+    def DeleteAccount(self, request: AuthRequest) -> Reply:
+        """
+        Deletes the user's account along with their token, inbox and
+        subscription. Their long polls return empty handed.
+        """
+        username = request.username
+        if self.ValidateToken(username, request.auth_token) < 0:
+            return Reply("Invalid token")
+
+        # delete all relevant metadata
+        stripe = self.stripes.Of(username)
+        with stripe.metadata_lock:
+            with stripe.inbox_lock:
+                self.storage.DeleteAccount(username)
+                stripe.subscriptions.pop(username, None)
+                wakers = self.WakeWaiters(username)
+                stripe.inbox_waiters.pop(username, None)
+
+        for wake in wakers:
+            wake()
+        return Reply("")
+
+    def Refresh(self, request: RefreshRequest) -> RefreshReply:
+        """
+        Takes the messages waiting for a user out of their inbox, first
+        waiting for one to arrive if there are none and the request asks to.
+
+        Returns:
+            RefreshReply: The messages, oldest first, or the error code
+            `ERROR_NO_NEW_MESSAGE` if there are none.
+        """
+        username = request.username
+        if self.ValidateToken(username, request.auth_token) < 0:
+            return RefreshReply("Invalid Token")
+        self.Wait(username, request.wait)
+        messages = self.TakeMessages(username, request.limit)
+        if not messages:
+            return RefreshReply(ERROR_NO_NEW_MESSAGE)
+        return RefreshReply("", messages)
+
+    def Wait(self, username: str, wait: float) -> None:
+        """
+        Blocks the calling thread until a message waits for a user, for at
+        most `wait` seconds, up to `max_wait`.
+        """
+        wait = min(wait, self.max_wait)
+        if wait <= 0:
+            return
+        stripe = self.stripes.Of(username)
+        with stripe.inbox_lock:
+            if self.Waiting(stripe, username) == 0:
+                self.Waiters(username).condition.wait_for(
+                    lambda: self.Waiting(stripe, username) != 0, wait)
+
+    def TakeMessages(self, username: str, limit: int = None) -> list:
+        """
+        Removes up to `limit` messages (all if None) from the front of a
+        user's inbox, past those pushed to a subscription and not
+        acknowledged yet, under one acquisition of its lock.
+
+        Returns:
+            list: The messages, oldest first, or an empty list once none are
+            left or the user no longer exists.
+        """
+        stripe = self.stripes.Of(username)
+        with stripe.inbox_lock:
+            subscription = stripe.subscriptions.get(username)
+            return self.storage.Take(
+                username, len(subscription) if subscription is not None
+                else 0, limit)
+
+    def ReturnMessages(self, username: str, messages: list) -> None:
+        """
+        Puts messages taken by `TakeMessages` but never delivered back at
+        the front of the inbox, e.g. when a client cancels its stream. A
+        subscription of the user starts over from the front of the inbox,
+        pushing its unacknowledged messages again.
+        """
+        stripe = self.stripes.Of(username)
+        with stripe.inbox_lock:
+            self.storage.Requeue(username, messages)
+            subscription = stripe.subscriptions.get(username)
+            if subscription is None:
+                return
+            subscription.Drain()
+            subscription.Add(self.storage.Peek(username, 0,
+                                               self.max_unacked))
+        subscription.notify()
+
+    def InboxLength(self, username: str) -> int:
+        """
+        Returns the number of messages in a user's inbox, 0 if there is no
+        such user.
+        """
+        stripe = self.stripes.Of(username)
+        with stripe.inbox_lock:
+            return self.storage.InboxLength(username) or 0
+
+    def Waiting(self, stripe, username: str):
+        """
+        Returns the number of messages in a user's inbox that are not held
+        by a subscription, or None if there is no such account. Must be
+        called with the `inbox_lock` of the user's stripe held.
+        """
+        queued = self.storage.InboxLength(username)
+        subscription = stripe.subscriptions.get(username)
+        if queued is None or subscription is None:
+            return queued
+        return queued - len(subscription)
+
+    def Waiters(self, username: str) -> InboxWaiters:
+        """
+        Returns the long polls waiting on a user's inbox, adding an entry
+        for the user on first use. Must be called with the `inbox_lock` of
+        the user's stripe held.
+        """
+        stripe = self.stripes.Of(username)
+        waiters = stripe.inbox_waiters.get(username)
+        if waiters is None:
+            waiters = InboxWaiters(stripe.inbox_lock)
+            stripe.inbox_waiters[username] = waiters
+        return waiters
+
+    def WakeWaiters(self, username: str) -> list:
+        """
+        Wakes the threads waiting on a user's inbox. Must be called with
+        the `inbox_lock` of the user's stripe held.
+
+        Returns:
+            list: The callbacks of the other long polls waiting on the
+            inbox, for the caller to run once it has released the lock.
+        """
+        waiters = self.stripes.Of(username).inbox_waiters.get(username)
+        if waiters is None:
+            return []
+        waiters.condition.notify_all()
+        wakers, waiters.wakers = waiters.wakers, []
+        return wakers
+
+    def AddWaker(self, username: str, wake) -> bool:
+        """
+        Starts a long poll that cannot block a thread, the event loop
+        counterpart of `Wait`: `wake` is called, from whichever thread
+        delivers it, once a message arrives. The poll withdraws `wake` with
+        `RemoveWaker` once woken or once its wait is over.
+
+        Returns:
+            bool: False if there is no reason to wait, because messages are
+            already waiting or the user does not exist.
+        """
+        stripe = self.stripes.Of(username)
+        with stripe.inbox_lock:
+            if self.Waiting(stripe, username) != 0:
+                return False
+            self.Waiters(username).wakers.append(wake)
+        return True
+
+    def RemoveWaker(self, username: str, wake) -> None:
+        """
+        Withdraws a callback left by `AddWaker`, unless a delivery has
+        already taken it.
+        """
+        stripe = self.stripes.Of(username)
+        with stripe.inbox_lock:
+            waiters = stripe.inbox_waiters.get(username)
+            if waiters is not None and wake in waiters.wakers:
+                waiters.wakers.remove(wake)
+
+    def Subscribe(self, subscription: Subscription) -> bool:
+        """
+        Starts pushing a user's messages to `subscription`, which replaces
+        any earlier subscription of the user. The messages in the inbox,
+        including any that the earlier subscription has not had
+        acknowledged, are added to it right away and stay in the inbox until
+        acknowledged.
+
+        Returns:
+            bool: False if the user does not exist.
+        """
+        username = subscription.username
+        stripe = self.stripes.Of(username)
+        with stripe.inbox_lock:
+            if self.storage.InboxLength(username) is None:
+                return False
+            previous = stripe.subscriptions.get(username)
+            if previous is not None:
+                # its unacknowledged messages are still at the front of
+                # the inbox, and are pushed again
+                previous.Drain()
+            subscription.Add(self.storage.Peek(username, 0,
+                                               self.max_unacked))
+            stripe.subscriptions[username] = subscription
+        return True
+
+    def Acknowledge(self, subscription: Subscription, sequence: int) -> None:
+        """
+        Removes the messages a subscriber acknowledged from its inbox, and
+        makes room for messages that wait for the subscriber to catch up.
+        """
+        username = subscription.username
+        stripe = self.stripes.Of(username)
+        with stripe.inbox_lock:
+            acked = subscription.Ack(sequence)
+            if stripe.subscriptions.get(username) is not subscription:
+                return
+            if acked:
+                # acknowledged messages leave the front of the inbox
+                self.storage.Take(username, 0, acked)
+            room = self.max_unacked - len(subscription)
+            waiting = self.storage.Peek(username, len(subscription), room) \
+                if room > 0 else []
+            if not waiting:
+                return
+            subscription.Add(waiting)
+        subscription.notify()
+
+    def Unsubscribe(self, subscription: Subscription) -> None:
+        """
+        Ends a subscription. The messages the client has not acknowledged
+        are still at the front of the inbox.
+        """
+        username = subscription.username
+        stripe = self.stripes.Of(username)
+        with stripe.inbox_lock:
+            if stripe.subscriptions.get(username) is subscription:
+                del stripe.subscriptions[username]
+            subscription.Drain()
+
+
+class Forward:
+    """
+    An attribute of a transport adapter that is the attribute of the same
+    name of its `engine`, both to read and to set.
+    """
+
+    def __set_name__(self, owner, name: str):
+        self.name = name
+
+    def __get__(self, adapter, owner=None):
+        if adapter is None:
+            return self
+        return getattr(adapter.engine, self.name)
+
+    def __set__(self, adapter, value) -> None:
+        setattr(adapter.engine, self.name, value)
+
+
+class EngineAdapter:
+    """
+    The base of the transport adapters, which serve an `Engine` kept in
+    `engine`. The engine's stores, settings and shared operations read and
+    set as the adapter's own, so that an adapter is configured and
+    inspected like a server that holds its users itself.
+    """
+    stripes = Forward()
+    storage = Forward()
+    user_inbox = Forward()
+    user_metadata_store = Forward()
+    token_hub = Forward()
+    subscriptions = Forward()
+    inbox_waiters = Forward()
+    metrics = Forward()
+    token_length = Forward()
+    token_ttl = Forward()
+    sweep_interval = Forward()
+    sweep_batch = Forward()
+    sweeper = Forward()
+    wal = Forward()
+    snapshot_interval = Forward()
+    snapshotter = Forward()
+    max_unacked = Forward()
+    max_wait = Forward()
+    OpenLog = Forward()
+    Commit = Forward()
+    GenerateToken = Forward()
+    ValidatePassword = Forward()
+    ValidateToken = Forward()
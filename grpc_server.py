@@ -1,97 +1,43 @@
-import binascii
-import datetime
+import argparse
+import asyncio
 import logging
-import os
-import re
-import threading as mp
-from collections import defaultdict
 from concurrent import futures
 import time 
 import grpc
 
 import chat_pb2
 import chat_pb2_grpc
-
-
-class ChatServer(chat_pb2_grpc.ChatServerServicer):
-    def __init__(self) -> None:
+import engine
+from engine import Engine, EngineAdapter
+from storage import SQLiteStorage
+from striping import DEFAULT_STRIPES
+from token_expiry import DEFAULT_TOKEN_TTL
+import write_ahead_log as wal
+
+
+class ChatServer(chat_pb2_grpc.ChatServerServicer, EngineAdapter):
+    """
+    The gRPC transport of a chat server. Its handlers turn RPCs into
+    requests to `engine` and its replies into protobuf messages.
+
+    Args:
+        stripes (int): The number of stripes of a new engine.
+        storage (StorageBackend): The storage of a new engine.
+        engine (Engine): The engine to serve, shared with any other
+        adapter given it, rather than a new one.
+    """
+
+    def __init__(self, stripes: int = DEFAULT_STRIPES, storage=None,
+                 engine=None) -> None:
         super().__init__()
-        self.user_inbox = defaultdict(lambda: [])
-
-        # format of metadata store
-        # key - username (must be unique)
-        # per value entry (password, name)
-        self.user_metadata_store = {}
-        self.token_length = 15
-
-        # token hub keys are usernames and the values are token, timestamp
-        # pairs
-        self.token_hub = {}
-
-        # keeping track of time by standardizing to UTC
-        self.utc_time_gen = datetime.datetime
-
-        # user metadata lock
-        self.metadata_lock = mp.Lock()
-
-        # inbox lock
-        self.inbox_lock = mp.Lock()
-
-    def ValidatePassword(self, password):
-        """
-        Validates a password to ensure that it is a string.
-
-        Args:
-            password (str): The password to validate.
-
-        Returns:
-            int: Returns 0 if the password is a string, or -1 if it is not.
-        """
-        if not isinstance(password, str):
-            return -1
-        else:
-            return 0
-
-    def GenerateToken(self):
-        """
-        Generates a token for authenticating user requests to a chat server.
-
-        Returns:
-            str: A token that can be used to authenticate user requests.
-        """
-
-        token = os.urandom(self.token_length)
-        return binascii.hexlify(token).decode()
-
-    def ValidateToken(self, username: str, token: str) -> int:
-        """
-        Validates a user token and checks if it has expired.
+        # the users and every operation on them, see `engine.py`; its
+        # stores and settings read as this servicer's own
+        self.engine = engine if engine is not None \
+            else Engine(stripes, storage)
 
-        Args:
-            username (str): The username associated with the token.
-            token (str): The token to validate.
-
-        Returns:
-            int: Returns 0 if the token is valid and has not expired,
-            or -1 if it is invalid or has expired.
-        """
-
-        with self.metadata_lock:
-            if username not in self.token_hub.keys():
-                return -1
-
-            stored_token, timestamp = self.token_hub[username]
-
-            if stored_token != token:
-                return -1
-
-            duration = self.utc_time_gen.now().timestamp() - timestamp
-            duration_in_hr = duration / 3600
-
-            if duration_in_hr > 1.0:
-                return -1
-
-            return 0
+        # most messages `DeliverMessages` takes out of an inbox per
+        # acquisition of its lock
+        self.delivery_chunk = 256
 
     def SendMessage(self, request, context) -> chat_pb2.MessageReply:
         """
@@ -107,38 +53,24 @@ class ChatServer(chat_pb2_grpc.ChatServerServicer):
             chat_pb2.MessageReply: A message reply object containing
             a version number and error code, if applicable.
 
-        The function first parses the request message from struct
-        using the `MessageRequest` object. It then validates the authentication token
-        and recipient username using the `ValidateToken` function. If the validation
-        fails, the function returns a `MessageReply` object with an appropriate error code.
+        The function hands the message to the engine as a batch of one
+        message. If the sender's token is invalid, the function returns a
+        `MessageReply` object with an appropriate error code.
 
-        If the authentication token and recipient username are valid,
-        the function appends the message to the recipient's
-        inbox and returns a `MessageReply` object with a success code.
-
-        The function uses the `inbox_lock` to protect access
-        to the inbox dictionaries and ensures that the inbox for the
-        recipient exists before attempting to append the message.
         If the recipient does not exist, the function returns a
         `MessageReply` object with an error code indicating an invalid recipient.
         """
-        token = request.auth_token
-        username = request.username
-        recipient = request.recipient_username
-        if self.ValidateToken(username=username,
-                              token=token) < 0:
+        reply = self.engine.SendMessages(engine.SendRequest(
+            request.username, request.auth_token,
+            [request.recipient_username], [request.message]))
+        if reply.error_code:
             return chat_pb2.MessageReply(version=1,
-                                         error_code="Invalid Token")
-
-        message_string = request.message
-        modified_string = f"[{username}]: {message_string}"
-
-        with self.inbox_lock:
-            if recipient not in self.user_inbox.keys():
-                return chat_pb2.MessageReply(version=1,
-                                             error_code="Invalid Recipient")
-            self.user_inbox[recipient].append(modified_string)
-            return chat_pb2.MessageReply(version=1, error_code="")
+                                         error_code=reply.error_code)
+        if reply.status_codes[0] == engine.STATUS_INVALID_RECIPIENT:
+            return chat_pb2.MessageReply(version=1,
+                                         error_code="Invalid Recipient")
+        self.Commit()
+        return chat_pb2.MessageReply(version=1, error_code="")
 
     def CheckInboxLength(self, username: str) -> int:
         """
@@ -153,8 +85,51 @@ class ChatServer(chat_pb2_grpc.ChatServerServicer):
             int: An integer representing the number
             of messages in the user's inbox.
         """
-        with self.inbox_lock:
-            return len(self.user_inbox[username])
+        return self.engine.InboxLength(username)
+
+    def TakeMessages(self, username: str) -> list:
+        """
+        Removes up to `delivery_chunk` messages from the front of a user's
+        inbox under one acquisition of its lock, leaving those pushed to a
+        socket subscriber.
+
+        Returns:
+            list: The messages, oldest first, or an empty list once the
+            inbox is empty or the user no longer exists.
+        """
+        return self.engine.TakeMessages(username, self.delivery_chunk)
+
+    def ReturnMessages(self, username: str, messages: list) -> None:
+        """
+        Puts messages taken by `TakeMessages` but never sent back at the
+        front of the inbox, e.g. when a client cancels its stream.
+        """
+        self.engine.ReturnMessages(username, messages)
+
+    def InboxReplies(self, username: str):
+        """
+        Yields a RefreshReply for every message in a user's inbox until it
+        is empty, taking them out `delivery_chunk` at a time. The inbox lock
+        is never held while yielding. A message counts as delivered once it
+        is yielded, and the rest of its chunk goes back to the inbox if the
+        stream is closed early. Every chunk taken or returned is committed
+        to the write-ahead log before the stream moves on.
+        """
+        chunk = self.TakeMessages(username)
+        while chunk:
+            self.Commit()
+            sent = 0
+            try:
+                for msg in chunk:
+                    sent += 1
+                    yield chat_pb2.RefreshReply(version=1,
+                                                error_code="",
+                                                message=msg)
+            finally:
+                if sent < len(chunk):
+                    self.ReturnMessages(username, chunk[sent:])
+                    self.Commit()
+            chunk = self.TakeMessages(username)
 
     def DeliverMessages(self, request, context) -> chat_pb2.RefreshReply:
         """
@@ -172,8 +147,11 @@ class ChatServer(chat_pb2_grpc.ChatServerServicer):
         This function validates the user request,
         and if the request is valid,
         it checks the user inbox for any new messages.
-        If there are new messages, it returns a RefreshReply object
-        with the messages and an empty inbox.
+        If the inbox is empty and the request has a `wait_ms`, it first
+        waits for a message to arrive for that long, up to `max_wait`.
+        If there are new messages, it streams a RefreshReply object
+        for each of them, taking them out of the inbox `delivery_chunk`
+        at a time, until the inbox is empty.
         If there are no new messages, it returns a
         RefreshReply object with an empty message and an error code.
         """
@@ -184,14 +162,9 @@ class ChatServer(chat_pb2_grpc.ChatServerServicer):
                                 token=token) < 0:
             return chat_pb2.RefreshReply(version=1,
                                             error_code="Invalid Token")
+        self.engine.Wait(username, request.wait_ms / 1000)
         # Check if there are any new messages
-        while self.CheckInboxLength(username=username) > 0:
-            with self.inbox_lock:
-                msg = self.user_inbox[username].pop(0)
-            # ended lock context before yield
-            yield chat_pb2.RefreshReply(version=1,
-                                        error_code="",
-                                        message=msg)
+        yield from self.InboxReplies(username)
 
     def Login(self, request, context) -> chat_pb2.LoginReply:
         """
@@ -216,35 +189,13 @@ class ChatServer(chat_pb2_grpc.ChatServerServicer):
         deserialized from the `raw_bytes` string before processing,
         and the LoginReply message is serialized before being returned.
         """
-        # get the given username and do basic error checking
-        username = request.username
-
-        with self.metadata_lock:
-            if username not in self.user_metadata_store.keys():
-                return chat_pb2.LoginReply(
-                    error_code="ERROR Username Invalid",
-                    auth_token="",
-                    fullname="")
-
-            # basic password match
-            password = request.password
-            if password != self.user_metadata_store[username][0]:
-                return chat_pb2.LoginReply(
-                    error_code="ERROR Password Invalid",
-                    auth_token="",
-                    fullname="")
-
-            # generate new token
-            token = self.GenerateToken()
-            timestamp = self.utc_time_gen.now().timestamp()
-
-            # register token in token hub
-            self.token_hub[username] = (token, timestamp)
-            return chat_pb2.LoginReply(
-                version=1,
-                error_code="",
-                auth_token=token,
-                fullname=self.user_metadata_store[username][1])
+        reply = self.engine.Login(engine.LoginRequest(request.username,
+                                                      request.password))
+        return chat_pb2.LoginReply(
+            version=1,
+            error_code=reply.error_code,
+            auth_token=reply.auth_token,
+            fullname=reply.fullname)
 
     def CreateAccount(self, request, context) -> chat_pb2.AccountCreateReply:
         """
@@ -258,40 +209,14 @@ class ChatServer(chat_pb2_grpc.ChatServerServicer):
             object that contains the version, error code,
             authentication token, and full name of the new user.
         """
-        # get the given username and do basic error checking
-        username = request.username
-
-        with self.metadata_lock:
-            if username in self.user_metadata_store.keys():
-                return chat_pb2.AccountCreateReply(
-                    version=1,
-                    error_code="ERROR Username Already Exists",
-                    auth_token="",
-                    fullname="")
-
-            # get the password and do basic error checking
-            password = request.password
-            if self.ValidatePassword(password) < 0:
-                return chat_pb2.AccountCreateReply(
-                    version=1, error_code="ERROR Invalid Passcode", auth_token="", fullname="")
-
-            # prepare metadata
-            fullname = request.fullname
-            token = self.GenerateToken()
-            timestamp = self.utc_time_gen.now().timestamp()
-
-            # create user metadata
-            self.user_metadata_store[username] = (password, fullname)
-            # register user in token hub / stores last given token
-            self.token_hub[username] = (token, timestamp)
-
-            with self.inbox_lock:
-                # create user chat inbox
-                self.user_inbox[username] = []
-                return chat_pb2.AccountCreateReply(version=1,
-                                                   error_code="",
-                                                   auth_token=token,
-                                                   fullname=fullname)
+        reply = self.engine.CreateAccount(engine.AccountRequest(
+            request.username, request.password, request.fullname))
+        if not reply.error_code:
+            self.Commit()
+        return chat_pb2.AccountCreateReply(version=1,
+                                           error_code=reply.error_code,
+                                           auth_token=reply.auth_token,
+                                           fullname=reply.fullname)
 
     def ListAccounts(self, request, context) -> chat_pb2.ListAccountReply:
         """
@@ -306,34 +231,15 @@ class ChatServer(chat_pb2_grpc.ChatServerServicer):
             chat_pb2.ListAccountReply: A socket type object containing the version,
             error code and a comma-separated list of filtered usernames.
         """
-        token = request.auth_token
-        username = request.username
-        if self.ValidateToken(username=username,
-                              token=token) < 0:
-            return chat_pb2.ListAccountReply(version=1,
-                                             error_code="Invalid token",
-                                             account_names="")
-        with self.metadata_lock:
-            list_of_usernames = self.user_metadata_store.keys()
-
-        filtered_list = list_of_usernames
-        # search using filter
+        # the regex may match anywhere in a username
         regex = request.regex
-        if len(regex) != 0:
-            r = None
-            try:
-                r = re.compile(f".*{regex}")
-            except Exception as e:
-                return chat_pb2.ListAccountReply(version=1,
-                                                 error_code=str(e),
-                                                 account_names="")
-            # filter based on compiled regex
-            filtered_list = list(filter(r.match, list_of_usernames))
-        filtered_string = ", ".join(filtered_list[:100])
-
-        return chat_pb2.ListAccountReply(version=1,
-                                         error_code="",
-                                         account_names=filtered_string)
+        reply = self.engine.ListAccounts(engine.ListRequest(
+            request.username, request.auth_token,
+            f".*{regex}" if len(regex) != 0 else "", 100))
+        return chat_pb2.ListAccountReply(
+            version=1,
+            error_code=reply.error_code,
+            account_names=", ".join(reply.usernames))
 
     def DeleteAccount(self, request, context) -> chat_pb2.DeleteAccountReply:
         """
@@ -349,33 +255,180 @@ class ChatServer(chat_pb2_grpc.ChatServerServicer):
             The message contains a version number, an error code (if any),
             and an empty string as a payload.
         """
+        reply = self.engine.DeleteAccount(engine.AuthRequest(
+            request.username, request.auth_token))
+        if not reply.error_code:
+            self.Commit()
+        return chat_pb2.DeleteAccountReply(version=1,
+                                           error_code=reply.error_code)
+
+
+class AsyncChatServer(ChatServer):
+    """
+    The chat servicer for a `grpc.aio` server, where every RPC runs on one
+    event loop rather than on a thread of its own.
+
+    The handlers are those of `ChatServer`. The engine never waits on
+    anything but briefly held locks, so they run on the event loop as they
+    are, except for `DeliverMessages`. Its long polls wait on a future per
+    poll, which a callback left with the engine (`Engine.AddWaker`)
+    resolves from whichever thread delivers the next message. A waiting
+    stream therefore costs no thread, and the number of streams held open
+    is bounded only by memory.
+    """
+
+    def Commit(self) -> None:
+        # handlers run on the event loop, which awaits `CommitAsync`
+        # instead of blocking on the log
+        pass
+
+    async def CommitAsync(self) -> None:
+        if self.wal is not None:
+            await self.wal.CommitAsync()
+
+    async def SendMessage(self, request, context) -> chat_pb2.MessageReply:
+        reply = ChatServer.SendMessage(self, request, context)
+        await self.CommitAsync()
+        return reply
+
+    async def Login(self, request, context) -> chat_pb2.LoginReply:
+        return ChatServer.Login(self, request, context)
+
+    async def CreateAccount(self, request,
+                            context) -> chat_pb2.AccountCreateReply:
+        reply = ChatServer.CreateAccount(self, request, context)
+        await self.CommitAsync()
+        return reply
+
+    async def ListAccounts(self, request,
+                           context) -> chat_pb2.ListAccountReply:
+        return ChatServer.ListAccounts(self, request, context)
+
+    async def DeleteAccount(self, request,
+                            context) -> chat_pb2.DeleteAccountReply:
+        reply = ChatServer.DeleteAccount(self, request, context)
+        await self.CommitAsync()
+        return reply
+
+    async def DeliverMessages(self, request, context):
+        """
+        Streams the messages in the user's inbox, the event loop
+        counterpart of `ChatServer.DeliverMessages`.
+        """
         token = request.auth_token
         username = request.username
-        if self.ValidateToken(username=username,
-                              token=token) < 0:
-            return chat_pb2.DeleteAccountReply(version=1,
-                                               error_code="Invalid token")
-
-        # delete all relevant metadata
-        with self.metadata_lock:
-            self.token_hub.pop(username)
-            self.user_metadata_store.pop(username)
-            with self.inbox_lock:
-                self.user_inbox.pop(username)
-                return chat_pb2.DeleteAccountReply(version=1,
-                                                   error_code="")
-
-
-def serve():
-    port = '50051'
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    chat_pb2_grpc.add_ChatServerServicer_to_server(ChatServer(), server)
+        if self.ValidateToken(username=username, token=token) < 0:
+            # like the threaded servicer, which returns its error reply
+            # from a generator, the stream ends without a message
+            return
+        wait = min(request.wait_ms / 1000, self.max_wait)
+        loop = asyncio.get_running_loop()
+        woken = loop.create_future()
+
+        def Wake():
+            loop.call_soon_threadsafe(
+                lambda: woken.done() or woken.set_result(None))
+
+        if wait > 0 and self.engine.AddWaker(username, Wake):
+            try:
+                await asyncio.wait_for(woken, wait)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self.engine.RemoveWaker(username, Wake)
+        replies = self.InboxReplies(username)
+        try:
+            for reply in replies:
+                # the chunk this reply was taken from is logged before
+                # any of it is sent
+                await self.CommitAsync()
+                yield reply
+        finally:
+            replies.close()
+            # the rest of a chunk returned by a cancelled stream
+            await self.CommitAsync()
+
+
+def start(port='50051', workers=100, servicer=None) -> grpc.Server:
+    """
+    Starts serving `servicer` from a thread pool in the background, e.g.
+    next to a socket server on the same engine.
+    """
+    # a waiting long poll holds one of the workers
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=workers))
+    chat_pb2_grpc.add_ChatServerServicer_to_server(servicer or ChatServer(),
+                                                   server)
     server.add_insecure_port('[::]:' + port)
     server.start()
     print("Server started, listening on " + port)
-    server.wait_for_termination()
+    return server
+
+
+def serve(port='50051', workers=100, servicer=None):
+    start(port, workers, servicer).wait_for_termination()
+
+
+async def serve_aio(port='50051', servicer=None):
+    server = grpc.aio.server()
+    chat_pb2_grpc.add_ChatServerServicer_to_server(
+        servicer or AsyncChatServer(), server)
+    server.add_insecure_port('[::]:' + port)
+    await server.start()
+    print("Server started on an event loop, listening on " + port)
+    await server.wait_for_termination()
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="gRPC chat server")
+    parser.add_argument("--port", default="50051")
+    parser.add_argument("--mode", choices=["threads", "aio"],
+                        default="threads",
+                        help="serve RPCs from a thread pool, or all of them "
+                        "from one grpc.aio event loop")
+    parser.add_argument("--workers", type=int, default=100,
+                        help="threads mode: threads serving requests, which "
+                        "bounds how many clients can long poll at once")
+    parser.add_argument("--stripes", type=int, default=DEFAULT_STRIPES,
+                        help="partitions of the users, each with its own "
+                        "locks")
+    parser.add_argument("--token-ttl", type=float, default=DEFAULT_TOKEN_TTL,
+                        help="seconds a login token stays valid")
+    parser.add_argument("--sweep-interval", type=float, default=60.0,
+                        help="seconds between evictions of expired tokens")
+    parser.add_argument("--storage", choices=["memory", "sqlite"],
+                        default="memory",
+                        help="keep accounts, tokens and inboxes in memory, "
+                        "or in the SQLite database at --database")
+    parser.add_argument("--database", default="chat.db",
+                        help="sqlite storage: the database file")
+    parser.add_argument("--wal", default=None,
+                        help="memory storage: write-ahead log to recover "
+                        "accounts and inboxes from and to log changes to")
+    parser.add_argument("--wal-window-ms", type=float,
+                        default=wal.DEFAULT_WINDOW * 1e3,
+                        help="milliseconds the log gathers changes for "
+                        "before syncing them to disk together")
+    parser.add_argument("--snapshot-interval", type=float, default=300.0,
+                        help="seconds between snapshots that compact the "
+                        "log, 0 to never take one")
+    args = parser.parse_args()
+    if args.storage != "memory" and args.wal is not None:
+        parser.error("--wal only applies to memory storage")
     logging.basicConfig()
-    serve()
+    servicer_type = AsyncChatServer if args.mode == "aio" else ChatServer
+    servicer = servicer_type(
+        args.stripes,
+        SQLiteStorage(args.database) if args.storage == "sqlite" else None)
+    servicer.snapshot_interval = args.snapshot_interval
+    if args.wal is not None:
+        started = time.perf_counter()
+        replayed = servicer.OpenLog(args.wal, args.wal_window_ms / 1e3)
+        print(f"Restored {len(servicer.user_metadata_store)} accounts from "
+              f"{args.wal}, replaying {replayed} log records, in "
+              f"{time.perf_counter() - started:.2f}s")
+    servicer.token_ttl = args.token_ttl
+    servicer.sweep_interval = args.sweep_interval
+    if args.mode == "aio":
+        asyncio.run(serve_aio(args.port, servicer))
+    else:
+        serve(args.port, args.workers, servicer)
@@ -0,0 +1,503 @@
+import argparse
+import heapq
+import itertools
+import multiprocessing
+import os
+import re
+import socket
+import tempfile
+import threading as mp
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import wire_protocol as wp
+from engine import Engine
+from socket_server import (ERROR_PUSH_UNAVAILABLE, ChatServer, ServeReactor,
+                           ServeThreads)
+
+
+# the reply to a forwarded request that the owning worker dropped: a frame
+# without a payload, which no reply type has; the forwarding worker drops
+# its own client's connection and the peer connection stays up
+DROPPED_REPLY = wp.frame.Encode(wp.frame.OP_PING)
+
+
+def IsDropped(reply: bytes) -> bool:
+    """
+    Returns whether a reply from another worker is `DROPPED_REPLY`, whatever
+    request id it was sent back with.
+    """
+    return len(reply) == wp.frame.HEADER.size
+
+
+def ShardOf(username: str, shards: int) -> int:
+    """
+    Returns the index of the worker that owns `username`.
+
+    The hash has to agree between processes, so Python's per process
+    randomized `hash` cannot be used.
+    """
+    return zlib.crc32(username.encode("UTF-8")) % shards
+
+
+class Deadlines:
+    """
+    Runs callbacks at their deadlines from one background thread, started
+    with the first callback, so that many waits cost a heap entry each
+    rather than a thread.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.ids = itertools.count()
+        self.condition = mp.Condition()
+        self.thread = None
+
+    def At(self, deadline: float, call) -> None:
+        """
+        Calls `call()` once `time.monotonic()` reaches `deadline`.
+        """
+        with self.condition:
+            heapq.heappush(self.heap, (deadline, next(self.ids), call))
+            if self.thread is None:
+                self.thread = mp.Thread(target=self.Run, daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def Run(self) -> None:
+        while True:
+            with self.condition:
+                while not self.heap or \
+                        self.heap[0][0] > time.monotonic():
+                    self.condition.wait(
+                        self.heap[0][0] - time.monotonic()
+                        if self.heap else None)
+                _, _, call = heapq.heappop(self.heap)
+            call()
+
+
+class ForwardedPoll(bytes):
+    """
+    A long poll that the worker a client is connected to has forwarded to
+    the worker that owns the user, see `ShardedChatServer.Park`. It stands
+    in for the request while the poll is parked, and `reply` resolves to
+    the owning worker's reply frame.
+    """
+
+
+class ShardedEngine(Engine):
+    """
+    The engine of one worker of a sharded socket server, which reaches the
+    users of other shards through their workers.
+
+    Args:
+        shard (int): The index of this worker.
+        shards (int): The number of workers.
+        peer: Returns the connection to the worker of a shard, see
+        `ShardedChatServer.Peer`.
+    """
+
+    def __init__(self, shard: int, shards: int, peer):
+        super().__init__()
+        self.shard = shard
+        self.shards = shards
+        self.peer = peer
+
+    def Deliver(self, recipients: list, messages: list) -> list:
+        """
+        Delivers to local inboxes directly and to every other worker's
+        inboxes with one `DeliverToShard` request per worker.
+        """
+        by_shard = {}
+        for i, recipient in enumerate(recipients):
+            by_shard.setdefault(ShardOf(recipient, self.shards), []).append(i)
+
+        status_codes = [wp.message.STATUS_INVALID_RECIPIENT] * len(recipients)
+        for shard, indices in by_shard.items():
+            shard_recipients = [recipients[i] for i in indices]
+            shard_messages = [messages[i] for i in indices]
+            if shard == self.shard:
+                codes = super().Deliver(shard_recipients, shard_messages)
+            else:
+                try:
+                    reply = wp.socket_types.ShardDeliveryReply(
+                        self.peer(shard).Call(wp.encode.ShardDeliveryRequest(
+                            version=1, recipient_usernames=shard_recipients,
+                            messages=shard_messages)))
+                    codes = reply.status_codes or []
+                except (OSError, ConnectionError) as e:
+                    print("Unable to reach worker", shard, ":", e)
+                    continue
+            for i, code in zip(indices, codes):
+                status_codes[i] = code
+        return status_codes
+
+    def FindAccounts(self, pattern, limit: int) -> list:
+        """
+        Lists matching accounts of every worker, local ones first.
+        """
+        usernames = super().FindAccounts(pattern, limit)
+        regex = pattern.pattern if pattern is not None else ""
+        for shard in range(self.shards):
+            if shard == self.shard or len(usernames) >= limit:
+                continue
+            try:
+                reply = wp.socket_types.ShardListReply(
+                    self.peer(shard).Call(wp.encode.ShardListRequest(
+                        version=1, number_of_accounts=limit - len(usernames),
+                        regex=regex)))
+            except (OSError, ConnectionError) as e:
+                print("Unable to reach worker", shard, ":", e)
+                continue
+            usernames += reply.account_names or []
+        return usernames[:limit]
+
+
+class ShardedChatServer(ChatServer):
+    """
+    One worker process of a sharded socket server.
+
+    Every worker serves clients on the same port and owns the accounts,
+    tokens and inboxes of the usernames that `ShardOf` maps to its shard.
+    A request about a user owned by another worker is forwarded unchanged
+    over that worker's Unix domain socket and its reply passed back. The
+    requesting user decides where a request runs, so its token is always
+    checked by the worker that issued it. Operations that reach other users
+    fan out from there: messages to recipients on other shards are delivered
+    with `DeliverToShard`, and account listings gather `ListShardAccounts`
+    results from every worker, both by its `ShardedEngine`.
+
+    Args:
+        shard (int): The index of this worker.
+        peer_paths (list): The IPC socket path of every worker, in shard
+        order, including this one.
+    """
+
+    def __init__(self, shard: int, peer_paths: list):
+        super().__init__(engine=ShardedEngine(shard, len(peer_paths),
+                                              self.Peer))
+        self.shard = shard
+        self.shards = len(peer_paths)
+        self.peer_paths = peer_paths
+        self.peers = [None] * self.shards
+        self.peers_lock = mp.Lock()
+        # runs client requests forwarded by other workers, see
+        # `HandlePeerConnection`; forwarded long polls wait parked in
+        # `deadlines` rather than on one of its threads
+        self.forwarded_executor = ThreadPoolExecutor(16)
+        self.deadlines = Deadlines()
+
+    def Peer(self, shard: int) -> wp.client_stub.ChatServerStub:
+        """
+        Returns a connection to another worker, opening it on first use.
+        Workers start at slightly different times, so opening the connection
+        is retried for a few seconds.
+        """
+        with self.peers_lock:
+            stub = self.peers[shard]
+            if stub is not None and stub.closed is None:
+                return stub
+            deadline = time.monotonic() + 5
+            while True:
+                try:
+                    stub = wp.client_stub.ChatServerStub(
+                        self.peer_paths[shard], None, compression=False,
+                        handshake=False)
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    if time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.05)
+            self.peers[shard] = stub
+            return stub
+
+    def OwnerOf(self, data: bytes):
+        """
+        Returns the shard of the user that a client request frame is from,
+        or None if the request is not about a user (or cannot be decoded)
+        and is handled where it arrived.
+        """
+        request_type = wp.socket_types.REQUEST_TYPES.get(
+            wp.frame.ParseHeader(data).opcode)
+        if request_type is None or \
+                "username" not in dict(request_type.FIELDS):
+            return None
+        request = self.message_pool.Decode(request_type, data)
+        if request.generated_error_code:
+            return None
+        return ShardOf(request.username, self.shards)
+
+    def Dispatch(self, data: bytes):
+        if isinstance(data, ForwardedPoll):
+            try:
+                reply = data.reply.result()
+            except (OSError, ConnectionError) as e:
+                print("Unable to reach worker", data.owner, ":", e)
+                return None
+            return None if IsDropped(reply) else reply
+        owner = self.OwnerOf(data)
+        if owner is None or owner == self.shard:
+            return super().Dispatch(data)
+        try:
+            reply = self.Peer(owner).Call(data)
+        except (OSError, ConnectionError) as e:
+            print("Unable to reach worker", owner, ":", e)
+            return None
+        return None if IsDropped(reply) else reply
+
+    def Subscribe(self, raw_bytes: str, live) -> wp.encode.SubscribeReply:
+        """
+        Subscribes users owned by this worker. Messages are pushed by the
+        worker that owns the recipient, so a client whose connection landed
+        on another worker is refused and keeps polling.
+        """
+        request = self.message_pool.Decode(
+            wp.socket_types.SubscribeRequest, raw_bytes)
+        if not request.generated_error_code and \
+                ShardOf(request.username, self.shards) != self.shard:
+            return wp.encode.SubscribeReply(
+                version=1, error_code=ERROR_PUSH_UNAVAILABLE)
+        return super().Subscribe(raw_bytes, live)
+
+    def Park(self, data: bytes, wake):
+        """
+        Parks long polls of users owned by this worker like any server, and
+        forwards those of other users straight away without waiting for
+        the reply, which the owning worker parks in turn. `wake` runs once
+        the reply arrives, and the connection then serves a
+        `ForwardedPoll` that stands for it.
+        """
+        request = self.message_pool.Decode(
+            wp.socket_types.RefreshRequest, data)
+        if request.generated_error_code or request.wait_ms <= 0:
+            return None
+        try:
+            username = request.username
+        except UnicodeDecodeError:
+            # dropped by the handler
+            return None
+        owner = ShardOf(username, self.shards)
+        if owner == self.shard:
+            return super().Park(data, wake)
+        if wp.frame.ParseHeader(data).flags & wp.frame.FLAG_COMPRESSED:
+            return None
+        try:
+            reply = self.Peer(owner).Submit(data)
+        except (OSError, ConnectionError) as e:
+            print("Unable to reach worker", owner, ":", e)
+            return None
+        poll = ForwardedPoll(data)
+        poll.owner = owner
+        poll.reply = reply
+        reply.add_done_callback(lambda reply: wake())
+        # the owning worker answers by the end of the wait, and the reply
+        # wakes the poll; the deadline only backs that up
+        return (username, min(request.wait_ms / 1000, self.max_wait) + 5,
+                poll)
+
+    def ParkForwarded(self, data: bytes, run) -> bool:
+        """
+        Holds back a long poll forwarded by another worker until its inbox
+        gets a message or its wait is over, without taking up a thread,
+        and then calls `run` with the request to serve.
+
+        Returns:
+            bool: Whether the request was parked.
+        """
+        # a delivery may wake the poll before `Park` returns, and waits
+        # for it to finish
+        lock = mp.Lock()
+        parked = []
+
+        def Resume():
+            with lock:
+                if not parked:
+                    return
+                username, _, request = parked.pop()
+            self.Unpark(username, Resume)
+            run(request)
+
+        with lock:
+            poll = ChatServer.Park(self, data, Resume)
+            if poll is None:
+                return False
+            parked.append(poll)
+        self.deadlines.At(time.monotonic() + poll[1], Resume)
+        return True
+
+    def DeliverToShard(self, raw_bytes: str) -> wp.encode.ShardDeliveryReply:
+        """
+        Appends messages forwarded by another worker to local inboxes.
+        """
+        request = self.message_pool.Decode(
+            wp.socket_types.ShardDeliveryRequest, raw_bytes)
+        if request.generated_error_code:
+            return wp.encode.ShardDeliveryReply(
+                version=1, error_code=request.generated_error_code,
+                status_codes=[])
+        status_codes = Engine.Deliver(self.engine,
+                                      request.recipient_usernames,
+                                      request.messages)
+        return wp.encode.ShardDeliveryReply(version=1, error_code="",
+                                            status_codes=status_codes)
+
+    def ListShardAccounts(self, raw_bytes: str) -> wp.encode.ShardListReply:
+        """
+        Lists local accounts for another worker's account listing.
+        """
+        request = self.message_pool.Decode(
+            wp.socket_types.ShardListRequest, raw_bytes)
+        if request.generated_error_code:
+            return wp.encode.ShardListReply(
+                version=1, error_code=request.generated_error_code,
+                account_names=[])
+        pattern = None
+        if request.regex:
+            try:
+                pattern = re.compile(request.regex)
+            except re.error as e:
+                return wp.encode.ShardListReply(version=1, error_code=str(e),
+                                                account_names=[])
+        usernames = Engine.FindAccounts(self.engine, pattern,
+                                        request.number_of_accounts)
+        return wp.encode.ShardListReply(version=1, error_code="",
+                                        account_names=usernames)
+
+    def HandlePeerConnection(self, c: socket.socket) -> None:
+        """
+        Serves requests forwarded by another worker.
+
+        `DeliverToShard` and `ListShardAccounts` only touch local state and
+        are answered on the spot. Forwarded client requests run on
+        `forwarded_executor` with the local handlers, without being
+        forwarded again, and may themselves wait for `DeliverToShard` or
+        `ListShardAccounts` replies from other workers. Running them off
+        this thread keeps every peer connection able to answer those at
+        any time, so two workers forwarding to each other cannot deadlock.
+        Forwarded long polls are parked (`ParkForwarded`) and only take a
+        thread of the pool once they have something to reply.
+
+        A forwarded request that is dropped is answered with
+        `DROPPED_REPLY`, so that only the client it came from is
+        disconnected. The connection is shared by every forwarded request
+        and is only closed by this thread, once the other worker closes it.
+        """
+        peer_ops = {
+            wp.frame.OP_DELIVER_TO_SHARD: self.DeliverToShard,
+            wp.frame.OP_LIST_SHARD_ACCOUNTS: self.ListShardAccounts,
+        }
+        writer = wp.frame.FrameWriter(c)
+        send_lock = mp.Lock()
+
+        def Reply(result, request_id):
+            if result is None:
+                result = DROPPED_REPLY
+            with send_lock:
+                try:
+                    writer.Send(result, request_id)
+                except OSError as e:
+                    print("Peer Connection Disrupted:", e)
+
+        def Forward(data, request_id):
+            Reply(ChatServer.Dispatch(self, data), request_id)
+
+        def Submit(data, request_id):
+            self.forwarded_executor.submit(Forward, data, request_id)
+
+        while True:
+            try:
+                data = wp.frame.ReadFrame(c)
+            except (OSError, wp.frame.FrameError) as e:
+                print("Peer Connection Disrupted:", e)
+                data = None
+            if data is None:
+                c.close()
+                return
+
+            header = wp.frame.ParseHeader(data)
+            if header.opcode in peer_ops:
+                Reply(peer_ops[header.opcode](data), header.request_id)
+            elif header.opcode != wp.frame.OP_REFRESH or \
+                    not self.ParkForwarded(
+                        data, lambda request, request_id=header.request_id:
+                        Submit(request, request_id)):
+                Submit(data, header.request_id)
+
+    def ListenForPeers(self) -> None:
+        """
+        Accepts connections from other workers on this worker's IPC socket
+        from a background thread.
+        """
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.peer_paths[self.shard])
+        listener.listen(self.shards)
+
+        def AcceptLoop():
+            while True:
+                c, _ = listener.accept()
+                mp.Thread(target=self.HandlePeerConnection, args=(c,),
+                          daemon=True).start()
+
+        mp.Thread(target=AcceptLoop, daemon=True).start()
+
+
+def RunWorker(shard: int, peer_paths: list, host: str, port: int,
+              mode: str, backlog: int, workers: int) -> None:
+    """
+    Entry point of one worker process.
+    """
+    chatServer = ShardedChatServer(shard, peer_paths)
+    chatServer.ListenForPeers()
+    if mode == "reactor":
+        ServeReactor(chatServer, host, port, backlog, workers,
+                     reuse_port=True)
+    else:
+        ServeThreads(chatServer, host, port, backlog, reuse_port=True)
+
+
+def ServeSharded(host: str, port: int, processes: int,
+                 mode: str = "threads", backlog: int = 1024,
+                 workers: int = 8) -> list:
+    """
+    Starts `processes` worker processes that share `port` through
+    SO_REUSEPORT, each owning one shard of the users.
+
+    Returns:
+        list: The started `multiprocessing.Process` objects.
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise OSError("SO_REUSEPORT is not supported on this platform")
+
+    ipc_dir = tempfile.mkdtemp(prefix="chat-shards-")
+    peer_paths = [os.path.join(ipc_dir, f"shard{i}.sock")
+                  for i in range(processes)]
+    children = []
+    for shard in range(processes):
+        child = multiprocessing.Process(
+            target=RunWorker, daemon=True,
+            args=(shard, peer_paths, host, port, mode, backlog, workers))
+        child.start()
+        children.append(child)
+    return children
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Socket chat server sharded across processes")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=50051)
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--mode", choices=["threads", "reactor"],
+                        default="reactor",
+                        help="how each worker serves its connections")
+    parser.add_argument("--backlog", type=int, default=1024)
+    parser.add_argument("--workers", type=int, default=8,
+                        help="reactor mode: handler threads per process")
+    args = parser.parse_args()
+
+    children = ServeSharded(args.host, args.port, args.processes, args.mode,
+                            args.backlog, args.workers)
+    for child in children:
+        child.join()
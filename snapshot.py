@@ -0,0 +1,307 @@
+"""
+Point in time snapshots of a chat server's accounts and inboxes, which bound
+how much of the write-ahead log a restart replays.
+
+A `Snapshotter` thread takes a snapshot every `snapshot_interval` seconds.
+It first rotates the log, so that everything logged so far sits in closed
+segments, then copies one stripe at a time under that stripe's locks,
+noting the number of the last record logged while the copy was made. Other
+stripes keep serving meanwhile. The copy is written to a temporary file,
+synced and renamed over the previous snapshot, and the segments it covers
+are deleted.
+
+On restart the snapshot is memory-mapped and loaded, and only log records
+that it does not cover are replayed: those numbered above the record number
+of the stripe the user was copied from, or, for users that did not exist
+when the snapshot was taken, above the lowest such number.
+
+The snapshot is a header followed by fixed width arrays and text columns:
+
+    header       magic, stripes, CRC-32 of the rest, accounts, messages
+    numbers      last record number per stripe      (stripes x int64)
+    created      creation number per account        (accounts x int64)
+    copied       stripe per account                 (accounts x uint32)
+    queued       messages per account               (accounts x uint32)
+    usernames    text column of `accounts` strings
+    passwords    text column of `accounts` strings
+    fullnames    text column of `accounts` strings
+    messages     text column of `messages` strings, by account
+
+A text column is the byte length of its UTF-8 text, the length in
+characters of every string (uint32 each) and the text. Loading decodes each
+column with one call and slices the strings out of it, rather than decoding
+string by string.
+"""
+import gc
+import itertools
+import mmap
+import os
+import struct
+import threading as mp
+import time
+import zlib
+from array import array
+
+import write_ahead_log as wal
+
+SNAPSHOT_HEADER = struct.Struct("<8sIIqq")
+SNAPSHOT_MAGIC = b"CHATSNP1"
+COLUMN_LENGTH = struct.Struct("<q")
+SNAPSHOT_SUFFIX = ".snapshot"
+
+# counters and gauges kept in the server's `metrics`
+SNAPSHOTS = "snapshots"
+SNAPSHOT_US = "snapshot_us"
+LAST_SNAPSHOT_US = "last_snapshot_us"
+SNAPSHOT_BYTES = "snapshot_bytes"
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def Capture(storage) -> tuple:
+    """
+    Copies the accounts and inboxes of every stripe of a `MemoryStorage`,
+    one stripe at a time under both of its locks.
+
+    Returns:
+        tuple: The number of the last log record of every stripe when it
+        was copied, and (creation number, stripe, username, password,
+        fullname, messages) for every account.
+    """
+    numbers = []
+    accounts = []
+    wal_ = storage.wal
+    for index, stripe in enumerate(storage.stripes):
+        with stripe.metadata_lock:
+            with stripe.inbox_lock:
+                # records of this stripe are only logged under its locks
+                numbers.append(wal_.appended if wal_ is not None else 0)
+                store = stripe.user_metadata_store
+                inboxes = stripe.user_inbox
+                for username, created in stripe.created.items():
+                    password, fullname = store[username]
+                    accounts.append((created, index, username, password,
+                                     fullname, list(inboxes[username])))
+    return numbers, accounts
+
+
+def TextColumn(strings: list) -> list:
+    text = "".join(strings).encode("UTF-8")
+    return [COLUMN_LENGTH.pack(len(text)),
+            array("I", map(len, strings)).tobytes(), text]
+
+
+def Encode(numbers: list, accounts: list) -> bytes:
+    """
+    Lays out captured stripes as a snapshot, header included.
+    """
+    accounts.sort()
+    messages = [message for account in accounts for message in account[5]]
+    parts = [array("q", numbers).tobytes(),
+             array("q", [account[0] for account in accounts]).tobytes(),
+             array("I", [account[1] for account in accounts]).tobytes(),
+             array("I", [len(account[5]) for account in accounts]).tobytes()]
+    for field in (2, 3, 4):
+        parts += TextColumn([account[field] for account in accounts])
+    parts += TextColumn(messages)
+    body = b"".join(parts)
+    return SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(numbers),
+                                zlib.crc32(body), len(accounts),
+                                len(messages)) + body
+
+
+def Write(path: str, data: bytes) -> None:
+    """
+    Replaces the snapshot at `path` with `data`, so that a crash leaves
+    either the old or the new snapshot behind.
+    """
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    wal.SyncDirectory(path)
+
+
+def ReadTextColumn(view, offset: int, count: int) -> tuple:
+    """
+    Reads a text column of `count` strings at `offset`.
+
+    Returns:
+        tuple: The strings and the offset past the column.
+    """
+    size, = COLUMN_LENGTH.unpack_from(view, offset)
+    offset += COLUMN_LENGTH.size
+    lengths = view[offset:offset + 4 * count].cast("I")
+    offset += 4 * count
+    text = str(view[offset:offset + size], "UTF-8")
+    offset += size
+    ends = list(itertools.accumulate(lengths))
+    strings = [text[start:end] for start, end in zip([0] + ends, ends)]
+    lengths.release()
+    return strings, offset
+
+
+def Load(path: str):
+    """
+    Memory-maps and decodes the snapshot at `path`.
+
+    Returns:
+        tuple: The stripe record numbers and the columns: creation numbers,
+        stripes, messages per account, usernames, passwords, fullnames and
+        messages, or None if there is no snapshot.
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        view = memoryview(mapped)
+        try:
+            magic, stripes, checksum, count, total = \
+                SNAPSHOT_HEADER.unpack_from(view, 0)
+            if magic != SNAPSHOT_MAGIC:
+                raise SnapshotError(f"{path} is not a snapshot")
+            offset = SNAPSHOT_HEADER.size
+            if zlib.crc32(view[offset:]) != checksum:
+                raise SnapshotError(f"{path} is corrupt")
+            columns = []
+            for code, length in [("q", stripes), ("q", count), ("I", count),
+                                 ("I", count)]:
+                column = array(code)
+                size = column.itemsize * length
+                column.frombytes(view[offset:offset + size])
+                columns.append(column)
+                offset += size
+            for length in (count, count, count, total):
+                strings, offset = ReadTextColumn(view, offset, length)
+                columns.append(strings)
+        finally:
+            view.release()
+    return columns
+
+
+def Restore(stripes, path: str) -> tuple:
+    """
+    Loads the snapshot at `path`, if there is one, into empty stripes.
+
+    Returns:
+        tuple: The record number each snapshot user is covered up to, the
+        record numbers of the stripes and the number of accounts loaded.
+    """
+    columns = Load(path)
+    if columns is None:
+        return {}, [], 0
+    numbers, created, copied, queued, usernames, passwords, fullnames, \
+        messages = columns
+    # one pass over the accounts, with everything that does not depend on
+    # the account looked up beforehand
+    stores = [(stripe.user_metadata_store, stripe.created, stripe.user_inbox,
+               stripe.user_inbox.default_factory) for stripe in stripes]
+    index = stripes.Index
+    offset = 0
+    for username, number, size, password, fullname in zip(
+            usernames, created, queued, passwords, fullnames):
+        metadata, numbered, inboxes, inbox = stores[index(username)]
+        metadata[username] = (password, fullname)
+        numbered[username] = number
+        inbox = inboxes[username] = inbox()
+        if size:
+            inbox.extend(messages[offset:offset + size])
+            offset += size
+    covered = dict(zip(usernames, map(numbers.__getitem__, copied)))
+    # accounts created from here on are numbered after the restored ones
+    stripes.account_numbers = itertools.count(created[-1] + 1 if created
+                                              else 0)
+    return covered, list(numbers), len(usernames)
+
+
+def Recover(stripes, path: str) -> tuple:
+    """
+    Restores the snapshot of the log at `path` and replays the records it
+    does not cover.
+
+    The collector is paused while millions of objects are created, which
+    would otherwise set off a full collection again and again, and the
+    restored objects are then frozen out of later collections. They hold no
+    reference cycles and are still freed once unreferenced.
+
+    Returns:
+        tuple: The number of accounts loaded from the snapshot, the number
+        of log records replayed, and the number of the last log record.
+    """
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        covered, numbers, loaded = Restore(stripes, path + SNAPSHOT_SUFFIX)
+        # users the snapshot does not hold are covered up to the stripe
+        # copied first, whichever stripe they belonged to
+        replayed, number = wal.Recover(stripes, path, covered,
+                                       min(numbers, default=0))
+    finally:
+        if collecting:
+            gc.enable()
+    gc.freeze()
+    # the snapshot may hold changes whose records never reached the log,
+    # and new records are numbered after them
+    return loaded, replayed, max([number] + numbers)
+
+
+class Snapshotter:
+    """
+    The background thread that snapshots a server and compacts its log.
+
+    The thread starts with the log, and takes a snapshot every
+    `snapshot_interval` seconds of the server, unless that is 0. Every
+    snapshot is counted and timed in the server's `metrics`.
+
+    Args:
+        server: The `ChatServer` to snapshot, whose `MemoryStorage` has its
+        log open.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.thread = None
+        self.lock = mp.Lock()
+
+    def Start(self) -> None:
+        if self.thread is not None or not self.server.snapshot_interval:
+            return
+        self.thread = mp.Thread(target=self.Run, daemon=True)
+        self.thread.start()
+
+    def Run(self) -> None:
+        while True:
+            time.sleep(self.server.snapshot_interval)
+            self.Take()
+
+    def Take(self) -> int:
+        """
+        Takes a snapshot and deletes the log segments it covers.
+
+        Returns:
+            int: The size of the snapshot in bytes.
+        """
+        server = self.server
+        with self.lock:
+            start = time.perf_counter()
+            rotated = server.wal.Rotate()
+            data = Encode(*Capture(server.storage))
+            path = server.wal.path
+            Write(path + SNAPSHOT_SUFFIX, data)
+            for number, segment in wal.Segments(path):
+                if number <= rotated:
+                    os.remove(segment)
+            wal.SyncDirectory(path)
+            elapsed = round((time.perf_counter() - start) * 1e6)
+
+        metrics = server.metrics
+        metrics.Increment(SNAPSHOTS)
+        metrics.Increment(SNAPSHOT_US, elapsed)
+        metrics.SetGauge(LAST_SNAPSHOT_US, elapsed)
+        metrics.SetGauge(SNAPSHOT_BYTES, len(data))
+        return len(data)
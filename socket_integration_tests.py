@@ -143,12 +143,13 @@ def RunClientThread(
     def Listen(app):
         # Create a request for a message refresh
         auth_msg_request = app.message_creator.RefreshRequest(
-            version=1, auth_token=app.token, username=app.username)
+            version=1, auth_token=app.token, username=app.username, wait_ms=0)
         # Calculate an expected value for the message
         expected_value = chr(((ord(app.username) - 97) + 3) % 4 + 97)
         while True:
             auth_msg_request = app.message_creator.RefreshRequest(
-                version=1, auth_token=app.token, username=app.username)
+                version=1, auth_token=app.token, username=app.username,
+                wait_ms=0)
 
             msg = app.client_stub.DeliverMessages(auth_msg_request)
 
@@ -1,94 +1,160 @@
-import binascii
-import datetime
-import os
-import re
+import argparse
+import asyncio
+import heapq
+import itertools
+import queue
+import select
+import selectors
 import socket
 import threading as mp
-from collections import defaultdict
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+import engine
 import wire_protocol as wp
-
-socket.setdefaulttimeout(60 * 60)
-
-
-class ChatServer:
-    def __init__(self):
-        super().__init__()
-        self.user_inbox = defaultdict(lambda: [])
-
-        # format of metadata store
-        # key - username (must be unique)
-        # per value entry (password, name)
-        self.user_metadata_store = {}
-        self.token_length = 15
-
-        # token hub keys are usernames and the values are token, timestamp
-        # pairs
-        self.token_hub = {}
-
-        # keeping track of time by standardizing to UTC
-        self.utc_time_gen = datetime.datetime
-
-        # user metadata lock
-        self.metadata_lock = mp.Lock()
-
-        # inbox lock
-        self.inbox_lock = mp.Lock()
-
-    def GenerateToken(self) -> str:
-        """
-        Generates a token for authenticating user requests to a chat server.
-
-        Returns:
-            str: A token that can be used to authenticate user requests.
-        """
-
-        token = os.urandom(self.token_length)
-        return binascii.hexlify(token).decode()
-
-    def ValidatePassword(self, password: str) -> int:
-        """
-        Validates a password to ensure that it is a string.
-
-        Args:
-            password (str): The password to validate.
-
-        Returns:
-            int: Returns 0 if the password is a string, or -1 if it is not.
+from dispatcher import (AuthMiddleware, Dispatcher, MetricsMiddleware,
+                        RateLimitMiddleware, TracingMiddleware)
+from engine import Engine, EngineAdapter
+from storage import SQLiteStorage
+from striping import DEFAULT_STRIPES
+from token_expiry import DEFAULT_TOKEN_TTL
+import write_ahead_log as wal
+
+# connection event counters kept in `ChatServer.metrics`
+READS_PAUSED = "reads_paused"
+SLOW_CONSUMERS_EVICTED = "slow_consumers_evicted"
+KEEPALIVE_PINGS_SENT = "keepalive_pings_sent"
+IDLE_CONNECTIONS_REAPED = "idle_connections_reaped"
+
+# the keepalive ping the server sends to silent connections
+KEEPALIVE = wp.encode.PingRequest(version=1, nonce=0)
+
+ERROR_PUSH_UNAVAILABLE = "ERROR Push is not available on this connection."
+
+
+class LiveConnection:
+    """
+    A client connection watched by the idle connection reaper.
+
+    The mode serving the connection calls `Touch` whenever the client sends
+    something, and supplies `ping` and `close`, which send a keepalive ping
+    and close the connection and may be called from the reaper thread.
+    `ping` is None while the client cannot answer a ping, e.g. on a text
+    connection. `threads` is the number of threads that serve only this
+    connection and end with it.
+
+    Connections that can carry pushed messages also get a `push` callable,
+    which sends whatever `subscription` has not pushed yet and may be called
+    from any thread.
+    """
+    __slots__ = ("last_active", "pinged", "ping", "close", "threads", "push",
+                 "subscription")
+
+    def __init__(self, ping, close, threads: int = 0):
+        self.last_active = time.monotonic()
+        self.pinged = False
+        self.ping = ping
+        self.close = close
+        self.threads = threads
+        self.push = None
+        self.subscription = None
+
+    def Touch(self) -> None:
+        self.last_active = time.monotonic()
+        self.pinged = False
+
+
+class Subscription(engine.Subscription):
+    """
+    A subscription whose messages are pushed down a socket connection.
+    `notify` is the connection's `LiveConnection.push`, which sends them as
+    PushRequest frames taken with `TakeFrame`.
+    """
+    __slots__ = ()
+
+    def TakeFrame(self):
         """
-
-        if not isinstance(password, str):
-            return -1
-        else:
-            return 0
-
-    def ValidateToken(self, username: str, token: str) -> int:
-        """
-        Validates a user token and checks if it has expired.
-
-        Args:
-            username (str): The username associated with the token.
-            token (str): The token to validate.
-
-        Returns:
-            int: Returns 0 if the token is valid and has not expired,
-            or -1 if it is invalid or has expired.
+        Returns a PushRequest frame with the next messages that have not
+        been pushed yet, or None if there are none.
         """
-        with self.metadata_lock:
-            if username not in self.token_hub.keys():
-                return -1
-            stored_token, timestamp = self.token_hub[username]
-
-            if stored_token != token:
-                return -1
-
-            duration = self.utc_time_gen.now().timestamp() - timestamp
-            duration_in_hr = duration / 3600
-
-            if duration_in_hr > 1.0:
-                return -1
-
-            return 0
+        batch = self.TakeBatch()
+        if batch is None:
+            return None
+        sequence, messages = batch
+        return wp.encode.PushRequest(version=1, sequence=sequence,
+                                     messages=messages)
+
+
+class ChatServer(EngineAdapter):
+    """
+    The socket transport of a chat server. Its handlers decode request
+    frames, run them on `engine` and encode the replies, and it serves the
+    connections themselves: handshakes, pushes, keepalives and slow or idle
+    clients.
+
+    Args:
+        stripes (int): The number of stripes of a new engine.
+        storage (StorageBackend): The storage of a new engine.
+        engine (Engine): The engine to serve, shared with any other
+        adapter given it, rather than a new one.
+    """
+
+    def __init__(self, stripes: int = DEFAULT_STRIPES, storage=None,
+                 engine=None):
+        super().__init__()
+        # the users and every operation on them, see `engine.py`; its
+        # stores and settings read as this server's own
+        self.engine = engine if engine is not None \
+            else Engine(stripes, storage)
+
+        # reusable request objects, one set per connection thread
+        self.message_pool = wp.message.MessagePool()
+
+        # replies with larger payloads are compressed for clients that accept
+        # compression
+        self.compression_threshold = wp.frame.COMPRESSION_THRESHOLD
+
+        # what a handshake may agree on, most preferred first
+        self.codecs = [wp.handshake.CODEC_BINARY, wp.handshake.CODEC_TEXT]
+        self.compressions = [wp.handshake.COMPRESSION_ZLIB]
+        self.max_frame_size = wp.frame.MAX_PAYLOAD_SIZE
+
+        # in asyncio mode, requests with these opcodes run on `executor`
+        # rather than on the event loop, when an executor is set
+        self.executor = None
+        self.offload_opcodes = {wp.frame.OP_LIST_ACCOUNTS}
+
+        # request handlers by opcode, every one timed into `metrics`; more
+        # middleware can be added with `dispatcher.Use`
+        self.dispatcher = Dispatcher([MetricsMiddleware(self.metrics)])
+        for opcode, handler in [
+                (wp.frame.OP_CREATE_ACCOUNT, self.CreateAccount),
+                (wp.frame.OP_LOGIN, self.Login),
+                (wp.frame.OP_SEND_MESSAGE, self.ReceiveMessage),
+                (wp.frame.OP_LIST_ACCOUNTS, self.ListAccounts),
+                (wp.frame.OP_DELETE_ACCOUNT, self.DeleteAccount),
+                (wp.frame.OP_REFRESH, self.DeliverMessages),
+                (wp.frame.OP_SEND_MESSAGES, self.ReceiveMessages),
+                (wp.frame.OP_PING, self.Ping)]:
+            self.dispatcher.Register(opcode, handler.__name__, handler)
+
+        # replies waiting for a client that reads them slowly: once
+        # `outbound_high_watermark` bytes are queued the connection is no
+        # longer read, until they drop to `outbound_low_watermark`, and a
+        # client that keeps the queue above the high watermark (or a send
+        # blocked) for `slow_consumer_timeout` seconds is disconnected
+        self.outbound_high_watermark = 1024 * 1024
+        self.outbound_low_watermark = 256 * 1024
+        self.slow_consumer_timeout = 10.0
+
+        # a connection that sends nothing for `idle_timeout` seconds is
+        # closed by a background reaper, which pings it halfway there so
+        # that live clients have something to answer; None never closes idle
+        # connections
+        self.idle_timeout = 300.0
+        self.live_connections = set()
+        self.live_lock = mp.Lock()
+        self.reaper = None
 
     def CreateAccount(self, raw_bytes: str) -> wp.encode.AccountCreateReply:
         """
@@ -102,7 +168,8 @@ class ChatServer:
             object that contains the version, error code,
             authentication token, and full name of the new user.
         """
-        request = wp.socket_types.AccountCreateRequest(raw_bytes)
+        request = self.message_pool.Decode(
+            wp.socket_types.AccountCreateRequest, raw_bytes)
         if request.generated_error_code:
             return wp.encode.AccountCreateReply(
                 version=1,
@@ -110,39 +177,12 @@ class ChatServer:
                 auth_token="",
                 fullname="")
 
-        username = request.username
-        with self.metadata_lock:
-            if username in self.user_metadata_store.keys():
-                return wp.encode.AccountCreateReply(
-                    version=1,
-                    error_code="ERROR Username Already Exists",
-                    auth_token="",
-                    fullname="")
-
-            # get the password and do basic error checking
-            password = request.password
-            if self.ValidatePassword(password) < 0:
-                return wp.encode.AccountCreateReply(
-                    version=1, error_code="ERROR Invalid Passcode", auth_token="", fullname="")
-
-            # prepare metadata
-            fullname = request.fullname
-            token = self.GenerateToken()
-            timestamp = self.utc_time_gen.now().timestamp()
-
-            # create user metadata
-            self.user_metadata_store[username] = (password, fullname)
-            # register user in token hub / stores last given token
-            self.token_hub[username] = (token, timestamp)
-
-            with self.inbox_lock:
-                # create user chat inbox
-                self.user_inbox[username] = []
-
-                return wp.encode.AccountCreateReply(version=1,
-                                                    error_code="",
-                                                    auth_token=token,
-                                                    fullname=fullname)
+        reply = self.engine.CreateAccount(engine.AccountRequest(
+            request.username, request.password, request.fullname))
+        return wp.encode.AccountCreateReply(version=1,
+                                            error_code=reply.error_code,
+                                            auth_token=reply.auth_token,
+                                            fullname=reply.fullname)
 
     def Login(self, raw_bytes: str) -> wp.socket_types.LoginReply:
         """
@@ -168,7 +208,8 @@ class ChatServer:
         and the LoginReply message is serialized before being returned.
         """
 
-        request = wp.socket_types.LoginRequest(raw_bytes)
+        request = self.message_pool.Decode(
+            wp.socket_types.LoginRequest, raw_bytes)
         if request.generated_error_code:
             return wp.encode.LoginReply(
                 version=1,
@@ -176,37 +217,13 @@ class ChatServer:
                 auth_token="",
                 fullname="")
 
-        # get the given username and do basic error checking
-        username = request.username
-
-        with self.metadata_lock:
-            if username not in self.user_metadata_store.keys():
-                return wp.encode.LoginReply(
-                    version=1,
-                    error_code="ERROR Username Invalid",
-                    auth_token="",
-                    fullname="")
-
-            # basic password match
-            password = request.password
-            if password != self.user_metadata_store[username][0]:
-                return wp.encode.LoginReply(
-                    version=1,
-                    error_code="ERROR Password Invalid",
-                    auth_token="",
-                    fullname="")
-
-            # generate new token
-            token = self.GenerateToken()
-            timestamp = self.utc_time_gen.now().timestamp()
-
-            # register token in token hub
-            self.token_hub[username] = (token, timestamp)
-            return wp.encode.LoginReply(
-                version=1,
-                error_code="",
-                auth_token=token,
-                fullname=self.user_metadata_store[username][1])
+        reply = self.engine.Login(engine.LoginRequest(request.username,
+                                                      request.password))
+        return wp.encode.LoginReply(
+            version=1,
+            error_code=reply.error_code,
+            auth_token=reply.auth_token,
+            fullname=reply.fullname)
 
     def ReceiveMessage(self, raw_bytes: str) -> wp.encode.MessageReply:
         """
@@ -223,54 +240,75 @@ class ChatServer:
             a version number and error code, if applicable.
 
         The function first parses the request message from the raw string buffer
-        using the `MessageRequest` object. It then validates the authentication token
-        and recipient username using the `ValidateToken` function. If the validation
-        fails, the function returns a `MessageReply` object with an appropriate error code.
-
-        If the authentication token and recipient username are valid,
-        the function appends the message to the recipient's
-        inbox and returns a `MessageReply` object with a success code.
+        using the `MessageRequest` object, and hands it to the engine as a
+        batch of one message. If the sender's token is invalid, the function
+        returns a `MessageReply` object with an appropriate error code.
 
-        The function uses the `inbox_lock` to protect access
-        to the inbox dictionaries and ensures that the inbox for the
-        recipient exists before attempting to append the message.
         If the recipient does not exist, the function returns a
         `MessageReply` object with an error code indicating an invalid recipient.
         """
 
-        request = wp.socket_types.MessageRequest(raw_bytes)
+        request = self.message_pool.Decode(
+            wp.socket_types.MessageRequest, raw_bytes)
         if request.generated_error_code:
             return wp.encode.MessageReply(
                 version=1, error_code=request.generated_error_code, )
 
-        token = request.auth_token
-        username = request.username
-        recipient = request.recipient_username
-
-        # note that validate token is protected by the metadata lock
-        if self.ValidateToken(username=username,
-                              token=token) < 0:
+        reply = self.engine.SendMessages(engine.SendRequest(
+            request.username, request.auth_token,
+            [request.recipient_username], [request.message]))
+        if reply.error_code:
             return wp.encode.MessageReply(version=1,
-                                          error_code="Invalid Token")
-
-        message_string = request.message
-        modified_string = f"[{username}]: {message_string}"
+                                          error_code=reply.error_code)
+        if reply.status_codes[0] == wp.message.STATUS_INVALID_RECIPIENT:
+            return wp.encode.MessageReply(version=1,
+                                          error_code="Invalid Recipient")
+        return wp.encode.MessageReply(version=1, error_code="")
 
-        # protect inbox access with lock
-        with self.inbox_lock:
+    def ReceiveMessages(self, raw_bytes: str) -> wp.encode.BatchMessageReply:
+        """
+        Receives a batch of messages from one user and stores each of them
+        in its recipient's inbox.
 
-            if recipient not in self.user_inbox.keys():
-                return wp.encode.MessageReply(version=1,
-                                              error_code="Invalid Recipient")
+        Args:
+            raw_bytes (str): A buffer holding a `BatchMessageRequest`, which
+            pairs every recipient username with the message sent to it.
 
-            self.user_inbox[recipient].append(modified_string)
-            return wp.encode.MessageReply(version=1, error_code="")
+        Returns:
+            wp.encode.BatchMessageReply: A reply with an error code for the
+            batch as a whole and one status code per message, in request order.
+
+        The sender's token is validated once for the whole batch and the
+        inbox locks are taken once to deliver every message, so a batch
+        costs about as much as a single `ReceiveMessage` call. Messages to
+        recipients that do not exist are reported with
+        `STATUS_INVALID_RECIPIENT` without failing the rest of the batch.
+        """
+        request = self.message_pool.Decode(
+            wp.socket_types.BatchMessageRequest, raw_bytes)
+        if request.generated_error_code:
+            return wp.encode.BatchMessageReply(
+                version=1, error_code=request.generated_error_code,
+                status_codes=[])
+
+        recipients = request.recipient_usernames
+        messages = request.messages
+        if len(recipients) != len(messages):
+            return wp.encode.BatchMessageReply(
+                version=1, error_code=wp.message.ERROR_ARGS_LENGTH,
+                status_codes=[])
+
+        reply = self.engine.SendMessages(engine.SendRequest(
+            request.username, request.auth_token, recipients, messages))
+        return wp.encode.BatchMessageReply(
+            version=1, error_code=reply.error_code,
+            status_codes=list(reply.status_codes))
 
     def ListAccounts(self, raw_bytes: str) -> wp.encode.ListAccountReply:
         """
         Validate the user's token, and return a list of usernames
         filtered by a regular expression.
-        The list is limited to a maximum of 100 usernames.
+        The list is limited to a maximum of 25 usernames.
 
         Args:
             raw_bytes (str): The raw string buffer containing the user request.
@@ -279,40 +317,18 @@ class ChatServer:
             wp.socket_types.ListAccountReply: A socket type object containing the version,
             error code and a comma-separated list of filtered usernames.
         """
-        request = wp.socket_types.ListAccountRequest(raw_bytes)
+        request = self.message_pool.Decode(
+            wp.socket_types.ListAccountRequest, raw_bytes)
         if request.generated_error_code:
             return wp.encode.ListAccountReply(
                 version=1, error_code=request.generated_error_code, account_names="")
 
-        token = request.auth_token
-        username = request.username
-        if self.ValidateToken(username=username,
-                              token=token) < 0:
-            return wp.encode.ListAccountReply(version=1,
-                                              error_code="Invalid token",
-                                              account_names="")
-
-        with self.metadata_lock:
-            list_of_usernames = self.user_metadata_store.keys()
-
-        filtered_list = list_of_usernames
-        # search using filter
-        regex = request.regex
-        if len(regex) != 0:
-            r = None
-            try:
-                r = re.compile(f"{regex}")
-            except Exception as e:
-                return wp.encode.ListAccountReply(version=1,
-                                                  error_code=str(e),
-                                                  account_names="")
-            # filter based on compiled regex
-            filtered_list = list(filter(r.match, list_of_usernames))
-        filtered_string = ", ".join(filtered_list[:25])
-
-        return wp.encode.ListAccountReply(version=1,
-                                          error_code="",
-                                          account_names=filtered_string)
+        reply = self.engine.ListAccounts(engine.ListRequest(
+            request.username, request.auth_token, request.regex, 25))
+        return wp.encode.ListAccountReply(
+            version=1,
+            error_code=reply.error_code,
+            account_names=", ".join(reply.usernames))
 
     def DeleteAccount(self, raw_bytes: str) -> wp.encode.DeleteAccountReply:
         """
@@ -328,28 +344,16 @@ class ChatServer:
             The message contains a version number, an error code (if any),
             and an empty string as a payload.
         """
-        request = wp.socket_types.DeleteAccountRequest(raw_bytes)
+        request = self.message_pool.Decode(
+            wp.socket_types.DeleteAccountRequest, raw_bytes)
         if request.generated_error_code:
             return wp.encode.DeleteAccountReply(
                 version=1, error_code=request.generated_error_code)
 
-        token = request.auth_token
-        username = request.username
-        if self.ValidateToken(username=username,
-                              token=token) < 0:
-            return wp.encode.DeleteAccountReply(version=1,
-                                                error_code="Invalid token")
-
-        # delete all relevant metadata
-        with self.metadata_lock:
-            self.token_hub.pop(username)
-            self.user_metadata_store.pop(username)
-
-            with self.inbox_lock:
-                self.user_inbox.pop(username)
-
-                return wp.encode.DeleteAccountReply(version=1,
-                                                    error_code="")
+        reply = self.engine.DeleteAccount(engine.AuthRequest(
+            request.username, request.auth_token))
+        return wp.encode.DeleteAccountReply(version=1,
+                                            error_code=reply.error_code)
 
     def DeliverMessages(self, raw_bytes: str) -> wp.encode.RefreshReply:
         """
@@ -366,44 +370,249 @@ class ChatServer:
         This function validates the user request,
         and if the request is valid,
         it checks the user inbox for any new messages.
+        If the inbox is empty and the request has a `wait_ms`, it waits for
+        a message to arrive for that long, up to `max_wait`.
         If there are new messages, it returns a RefreshReply object
         with the messages and an empty inbox.
         If there are no new messages, it returns a
         RefreshReply object with an empty message and an error code.
         """
 
-        request = wp.socket_types.RefreshRequest(raw_bytes)
+        request = self.message_pool.Decode(
+            wp.socket_types.RefreshRequest, raw_bytes)
         if request.generated_error_code:
             return wp.encode.RefreshReply(
                 version=1, message="", error_code=request.generated_error_code)
 
-        token = request.auth_token
+        reply = self.engine.Refresh(engine.RefreshRequest(
+            request.username, request.auth_token, request.wait_ms / 1000))
+        return wp.encode.RefreshReply(version=1,
+                                      message="\n".join(reply.messages),
+                                      error_code=reply.error_code)
+
+    def Park(self, data: bytes, wake):
+        """
+        Starts a long poll for a connection that cannot block a thread on
+        it, the event loop counterpart of the wait in `DeliverMessages`.
+
+        If `data` is a RefreshRequest that asks to wait on an empty inbox,
+        `wake` is left with the inbox, to be called from whichever thread
+        delivers the next message. The connection serves the request once
+        woken or once the wait is over, whichever comes first, and then
+        withdraws `wake` with `Unpark`.
+
+        Returns:
+            tuple: None if the request is to be served right away.
+            Otherwise the username, the longest wait in seconds, and the
+            request to serve at the end of it, which no longer asks to wait.
+        """
+        request = self.message_pool.Decode(
+            wp.socket_types.RefreshRequest, data)
+        if request.generated_error_code or request.wait_ms <= 0:
+            return None
+        try:
+            username = request.username
+            if self.ValidateToken(username=username,
+                                  token=request.auth_token) < 0:
+                return None
+        except UnicodeDecodeError:
+            # dropped by the handler
+            return None
+        if not self.engine.AddWaker(username, wake):
+            return None
+        return (username, min(request.wait_ms / 1000, self.max_wait),
+                wp.encode.RefreshRequest(
+                    version=request.version, auth_token=request.auth_token,
+                    username=username, wait_ms=0,
+                    request_id=request.request_id))
+
+    def Unpark(self, username: str, wake) -> None:
+        """
+        Withdraws a callback left by `Park`, unless a delivery has already
+        taken it.
+        """
+        self.engine.RemoveWaker(username, wake)
+
+    def Ping(self, raw_bytes: str) -> wp.encode.PingReply:
+        """
+        Answers a keepalive ping from a client with its nonce.
+        """
+        request = self.message_pool.Decode(
+            wp.socket_types.PingRequest, raw_bytes)
+        if request.generated_error_code:
+            return wp.encode.PingReply(
+                version=1, error_code=request.generated_error_code, nonce=0)
+        return wp.encode.PingReply(version=1, error_code="",
+                                   nonce=request.nonce)
+
+    def Subscribe(self, raw_bytes: str,
+                  live: LiveConnection) -> wp.encode.SubscribeReply:
+        """
+        Starts pushing a user's messages down the connection the request
+        arrived on.
+
+        The messages in the user's inbox, including any that an earlier
+        subscription of the user has not had acknowledged, are pushed right
+        away, and stay in the inbox until acknowledged. A connection carries
+        one subscription at a time.
+
+        Args:
+            raw_bytes (str): The serialized SubscribeRequest.
+            live (LiveConnection): The connection to push messages down.
+
+        Returns:
+            wp.encode.SubscribeReply: An empty error code once subscribed.
+        """
+        request = self.message_pool.Decode(
+            wp.socket_types.SubscribeRequest, raw_bytes)
+        if request.generated_error_code:
+            return wp.encode.SubscribeReply(
+                version=1, error_code=request.generated_error_code)
+
         username = request.username
         if self.ValidateToken(username=username,
-                              token=token) < 0:
-            return wp.encode.RefreshReply(version=1,
-                                          message="",
-                                          error_code="Invalid Token"
-                                          )
-        # Check if there are any new messages
-        with self.inbox_lock:
-            if len(self.user_inbox[username]) > 0:
-                msg = "\n".join(self.user_inbox[username])
-                self.user_inbox[username] = []
-                return wp.encode.RefreshReply(version=1,
-                                              message=msg,
-                                              error_code=""
-                                              )
-            else:
-                return wp.encode.RefreshReply(version=1,
-                                              message="",
-                                              error_code="No new message"
-                                              )
+                              token=request.auth_token) < 0:
+            return wp.encode.SubscribeReply(version=1,
+                                            error_code="Invalid Token")
+        if live is None or live.push is None:
+            return wp.encode.SubscribeReply(
+                version=1, error_code=ERROR_PUSH_UNAVAILABLE)
+
+        if live.subscription is not None:
+            self.Unsubscribe(live.subscription)
+        subscription = Subscription(username, live.push)
+        if not self.engine.Subscribe(subscription):
+            return wp.encode.SubscribeReply(version=1,
+                                            error_code="Invalid Token")
+        live.subscription = subscription
+        if len(subscription):
+            subscription.notify()
+        return wp.encode.SubscribeReply(version=1, error_code="")
+
+    def Acknowledge(self, raw_bytes: str, live: LiveConnection) -> None:
+        """
+        Handles a PushAck, removing the acknowledged messages from the inbox
+        and making room for messages that wait for the subscriber to catch
+        up.
+        """
+        request = self.message_pool.Decode(wp.socket_types.PushAck,
+                                           raw_bytes)
+        subscription = live.subscription if live is not None else None
+        if request.generated_error_code or subscription is None:
+            return
+        self.engine.Acknowledge(subscription, request.sequence)
+
+    def Unsubscribe(self, subscription: Subscription) -> None:
+        """
+        Ends a subscription. The messages the client has not acknowledged
+        are still at the front of the inbox.
+        """
+        self.engine.Unsubscribe(subscription)
+
+    def Track(self, ping, close, threads: int = 0) -> LiveConnection:
+        """
+        Starts watching a new connection for silence, starting the reaper
+        with the first connection. See `LiveConnection` for the arguments.
+        """
+        live = LiveConnection(ping, close, threads)
+        with self.live_lock:
+            self.live_connections.add(live)
+            if self.reaper is None and self.idle_timeout:
+                self.reaper = mp.Thread(target=self.ReapLoop, daemon=True)
+                self.reaper.start()
+        return live
+
+    def Untrack(self, live: LiveConnection) -> None:
+        """
+        Stops watching a closed connection and ends its subscription.
+        """
+        with self.live_lock:
+            self.live_connections.discard(live)
+        if live.subscription is not None:
+            self.Unsubscribe(live.subscription)
+            live.subscription = None
+
+    def ReapLoop(self) -> None:
+        """
+        Body of the reaper thread, which sweeps the connections four times
+        per idle timeout.
+        """
+        while self.idle_timeout:
+            time.sleep(self.idle_timeout / 4)
+            self.Reap()
+        with self.live_lock:
+            self.reaper = None
+
+    def Reap(self) -> int:
+        """
+        Pings the connections that have been silent for half the idle
+        timeout and closes those silent for all of it.
+
+        Returns:
+            int: The number of connections closed.
+        """
+        if not self.idle_timeout:
+            return 0
+        now = time.monotonic()
+        with self.live_lock:
+            live_connections = list(self.live_connections)
+
+        reaped = threads = 0
+        for live in live_connections:
+            idle = now - live.last_active
+            if idle > self.idle_timeout:
+                self.Untrack(live)
+                live.close()
+                reaped += 1
+                threads += live.threads
+            elif idle > self.idle_timeout / 2 and not live.pinged and \
+                    live.ping is not None:
+                live.pinged = True
+                live.ping()
+                self.metrics.Increment(KEEPALIVE_PINGS_SENT)
+
+        if reaped:
+            self.metrics.Increment(IDLE_CONNECTIONS_REAPED, reaped)
+            print(f"Reaped {reaped} idle connections, reclaiming {reaped} "
+                  f"sockets and {threads} threads")
+        return reaped
+
+    def Handshake(self, raw_bytes: str,
+                  settings: wp.handshake.ConnectionSettings
+                  ) -> wp.encode.HandshakeReply:
+        """
+        Agrees on the settings of a connection with the client.
+
+        Args:
+            raw_bytes (str): The serialized HandshakeRequest.
+            settings (wp.handshake.ConnectionSettings): The settings of the
+            connection the request arrived on, updated in place.
+
+        Returns:
+            wp.encode.HandshakeReply: The agreed settings, or an error code
+            if the client and server have nothing in common.
+        """
+        request = self.message_pool.Decode(
+            wp.socket_types.HandshakeRequest, raw_bytes)
+        error_code = request.generated_error_code
+        if not error_code:
+            error_code = wp.handshake.Negotiate(
+                request, settings, self.codecs, self.compressions)
+        return wp.encode.HandshakeReply(
+            version=1,
+            error_code=error_code,
+            protocol_version=settings.protocol_version,
+            codec=settings.codec,
+            compression=settings.compression,
+            max_frame_size=settings.max_frame_size)
 
     def HandleNewConnection(self, c: socket.socket, addr: tuple) -> None:
         """
         This method handles incoming connections and spins off new threads to handle requests.
 
+        Clients that predate framing are recognized by their first byte and
+        served in the text encoding, every other client speaks v2 frames.
+
         Args:
             c (socket.socket): The socket object used for communication with the client.
             addr (tuple): The IP address and port number of the client.
@@ -411,7 +620,31 @@ class ChatServer:
         Returns:
             None
         """
+        live = self.Track(None, lambda: Shutdown(c), threads=1)
+        try:
+            try:
+                prefix = c.recv(1, socket.MSG_PEEK)
+            except Exception as e:
+                print("Connection Disrupted:", e, " - softhandler resolved")
+                c.close()
+                return
+
+            if wp.legacy.IsTextRequest(prefix):
+                self.HandleTextConnection(c, live)
+            else:
+                self.HandleFrameConnection(c, live)
+        finally:
+            self.Untrack(live)
 
+    def HandleTextConnection(self, c: socket.socket,
+                             live: LiveConnection = None) -> None:
+        """
+        Serves a connection that speaks the version 1 text encoding, where
+        each `recv` holds exactly one request.
+        """
+        if live is not None:
+            # text clients have no way to answer a ping
+            live.ping = None
         while True:
             try:
                 data = c.recv(2048)
@@ -419,58 +652,982 @@ class ChatServer:
                 print("Connection Disrupted:", e, " - softhandler resolved")
                 c.close()
                 return
-            decoded = ""
-            try:
-                decoded = data.decode("UTF-8")
-            except UnicodeDecodeError:
-                print("Unable to decode the message")
-                c.close()
 
-            args = decoded.split("||")
-            if len(args) == 0:
+            if live is not None:
+                live.Touch()
+            result = self.HandleText(data)
+            if result is None or not self.SendReply(c, c.sendall, result):
                 c.close()
                 return
 
+    def HandleFrameConnection(self, c: socket.socket,
+                              live: LiveConnection = None) -> None:
+        """
+        Serves a connection that speaks v2 frames, starting with an optional
+        handshake.
+        """
+
+        settings = wp.handshake.ConnectionSettings(self.max_frame_size)
+        writer = wp.frame.FrameWriter(c)
+        # replies, pushed messages and keepalive pings are sent from
+        # different threads
+        send_lock = mp.Lock()
+        pusher = None
+        if live is not None:
+            live.ping = lambda: SendKeepalive(c, send_lock)
+            pusher = Pusher(c, send_lock, live, self)
+            live.push = pusher.Wake
+
+        try:
+            while True:
+                try:
+                    data = wp.frame.ReadFrame(
+                        c, max_payload=settings.max_frame_size,
+                        verify=not settings.negotiated)
+                except wp.frame.FrameError as e:
+                    # a malformed header leaves the stream unsynchronized,
+                    # so there is no way to find the start of the next frame
+                    print("Unable to decode the message:", e)
+                    c.close()
+                    return
+                except Exception as e:
+                    print("Connection Disrupted:", e, " - softhandler resolved")
+                    c.close()
+                    return
+
+                if data is None:
+                    c.close()
+                    return
+
+                if live is not None:
+                    live.Touch()
+                header = wp.frame.ParseHeader(data)
+                result, keep_open = self.HandleFrame(data, header, settings,
+                                                     live)
+                if result is not None:
+                    with send_lock:
+                        sent = self.SendReply(c, writer.Send, result,
+                                              header.request_id)
+                    if not sent:
+                        c.close()
+                        return
+                if not keep_open:
+                    c.close()
+                    return
+                if settings.codec == wp.handshake.CODEC_TEXT:
+                    return self.HandleTextConnection(c, live)
+        finally:
+            if pusher is not None:
+                pusher.Close()
+
+    def SendReply(self, c: socket.socket, send, *args) -> bool:
+        """
+        Sends a reply from a connection thread with `send(*args)`, giving up
+        on a client that does not take it within `slow_consumer_timeout`.
+
+        A thread per connection has no queue of its own: the socket's send
+        buffer holds the pending replies, and a client that stops reading
+        blocks only the thread serving it, which reads no more requests until
+        the send completes.
+
+        Returns:
+            bool: Whether the reply was sent. If not, the connection must be
+            closed.
+        """
+        timeout = c.gettimeout()
+        c.settimeout(self.slow_consumer_timeout)
+        try:
+            send(*args)
+            return True
+        except socket.timeout:
+            self.EvictSlowConsumer()
+        except OSError as e:
+            print("Connection Disrupted:", e, " - softhandler resolved")
+        finally:
+            c.settimeout(timeout)
+        return False
+
+    def EvictSlowConsumer(self) -> None:
+        """
+        Counts a client disconnected for not reading its replies.
+        """
+        print("Disconnecting a client that stopped reading its replies")
+        self.metrics.Increment(SLOW_CONSUMERS_EVICTED)
+
+    def HandleText(self, data: bytes):
+        """
+        Serves one request in the version 1 text encoding.
+
+        Returns:
+            bytes: The text reply, or None if the request was invalid and
+            the connection must be closed.
+        """
+        try:
+            request = wp.legacy.TextToFrame(data)
+        except wp.legacy.TextRequestError as e:
+            return e.reply
+        except UnicodeDecodeError:
+            print("Unable to decode the message")
+            return None
+        except wp.frame.FrameError:
+            # Invalid opcodes are dropped immediately, invalid opcodes
+            #  occur when a connection is being closed by the client,
+            #  or when a malicious / corrupted message is being sent
+            return None
+
+        result = self.Dispatch(request)
+        if result is None:
+            return None
+        return wp.legacy.FrameToText(result)
+
+    def HandleFrame(self, data: bytes, header: wp.frame.FrameHeader,
+                    settings: wp.handshake.ConnectionSettings,
+                    live: LiveConnection = None) -> tuple:
+        """
+        Serves one request frame and applies the connection settings to the
+        reply. `live` is the connection the frame arrived on, needed for
+        subscriptions.
+
+        Returns:
+            tuple: The reply frame (None if there is nothing to send) and
+            whether the connection stays open afterwards.
+        """
+        if header.flags & wp.frame.FLAG_ACCEPT_COMPRESSION:
+            settings.compression = wp.handshake.COMPRESSION_ZLIB
+        if header.opcode == wp.frame.OP_PING and header.request_id == 0:
+            # the answer to a keepalive ping, which only had to arrive
+            return None, True
+        if header.opcode == wp.frame.OP_PUSH_MESSAGES:
+            # clients only ever acknowledge pushes, with request id 0
+            if header.request_id != 0:
+                return None, False
+            self.Acknowledge(data, live)
+            return None, True
+
+        handshake_allowed = settings.handshake_allowed
+        settings.handshake_allowed = False
+        if header.opcode == wp.frame.OP_HANDSHAKE:
+            if not handshake_allowed:
+                return wp.encode.HandshakeReply(
+                    version=1,
+                    error_code=wp.handshake.ERROR_LATE_HANDSHAKE,
+                    protocol_version=settings.protocol_version,
+                    codec=settings.codec,
+                    compression=settings.compression,
+                    max_frame_size=settings.max_frame_size), True
+            result = self.Handshake(data, settings)
+            # without common settings the client cannot go on
+            return result, settings.negotiated
+
+        if header.opcode == wp.frame.OP_SUBSCRIBE:
+            result = self.Subscribe(data, live)
+        else:
+            result = self.Dispatch(data)
+        if result is None:
+            return None, False
+        if settings.compression == wp.handshake.COMPRESSION_ZLIB:
+            result = wp.frame.Compress(result, self.compression_threshold)
+        return result, True
+
+    def Dispatch(self, data: bytes):
+        """
+        Runs the handler for the opcode of a request frame through
+        `dispatcher`.
+
+        The reply is returned once the changes the request logged are on
+        disk. On a thread that deferred its commits (an event loop) it is
+        returned at once, and the caller awaits `wal.CommitAsync`.
+
+        Returns:
+            bytes: The reply frame, or None if the request was invalid and
+            the connection must be closed.
+        """
+        result = self.dispatcher.Dispatch(data)
+        self.Commit()
+        return result
+
+    async def HandleStream(self, reader: asyncio.StreamReader,
+                           writer: asyncio.StreamWriter) -> None:
+        """
+        Serves one connection on the event loop, the asyncio counterpart of
+        `HandleNewConnection`.
+
+        Handlers run on the event loop thread, except for the opcodes in
+        `offload_opcodes`, which run on `executor` when one is set so that
+        slow requests (such as listing accounts by regex) do not hold up
+        every other connection.
+
+        Replies are buffered by the transport. While more than the high
+        watermark is buffered no further request is read, and a client that
+        does not bring it down to the low watermark within
+        `slow_consumer_timeout` is disconnected. The idle connection reaper
+        pings and closes the connection through the event loop.
+
+        Args:
+            reader (asyncio.StreamReader): The incoming side of the
+            connection.
+            writer (asyncio.StreamWriter): The outgoing side of the
+            connection.
+
+        Returns:
+            None
+        """
+        loop = asyncio.get_running_loop()
+
+        if self.wal is not None:
+            # the event loop awaits its commits rather than blocking on them
+            self.wal.Defer()
+
+        async def Run(handler, opcode, *args):
+            if self.executor is not None and opcode in self.offload_opcodes:
+                return await loop.run_in_executor(self.executor, handler,
+                                                  *args)
+            result = handler(*args)
+            if self.wal is not None:
+                await self.wal.CommitAsync()
+            return result
+
+        writer.transport.set_write_buffer_limits(
+            high=self.outbound_high_watermark,
+            low=self.outbound_low_watermark)
+
+        async def Drain():
+            # drain only waits while more than the high watermark is
+            # buffered, and no further request is read until it returns
+            if writer.transport.get_write_buffer_size() > \
+                    self.outbound_high_watermark:
+                self.metrics.Increment(READS_PAUSED)
+            try:
+                await asyncio.wait_for(writer.drain(),
+                                       self.slow_consumer_timeout)
+            except asyncio.TimeoutError:
+                self.EvictSlowConsumer()
+                writer.transport.abort()
+                return False
+            return True
+
+        def Keepalive():
+            if not writer.is_closing():
+                writer.write(KEEPALIVE)
+
+        async def LongPoll(data):
+            # a long poll waits here rather than in its handler, which
+            # would block the event loop
+            woken = loop.create_future()
+
+            def Wake():
+                loop.call_soon_threadsafe(
+                    lambda: woken.done() or woken.set_result(None))
+
+            parked = self.Park(data, Wake)
+            if parked is None:
+                return data
+            username, timeout, request = parked
+            try:
+                await asyncio.wait_for(woken, timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self.Unpark(username, Wake)
+            return request
+
+        def Push():
+            # pushes are buffered by the transport like replies
+            subscription = live.subscription
+            while subscription is not None and not writer.is_closing():
+                push = subscription.TakeFrame()
+                if push is None:
+                    return
+                writer.write(push)
+
+        # the reaper runs on its own thread
+        live = self.Track(
+            None, lambda: loop.call_soon_threadsafe(writer.transport.abort))
+
+        async def ServeText(data):
+            live.ping = None
+            while True:
+                live.Touch()
+                opcode = int(data[:1]) if data[:1].isdigit() else None
+                result = await Run(self.HandleText, opcode, data)
+                if result is None:
+                    return
+                writer.write(result)
+                if not await Drain():
+                    return
+                data = await reader.read(2048)
+
+        try:
+            prefix = await reader.read(1)
+            if wp.legacy.IsTextRequest(prefix):
+                return await ServeText(prefix + await reader.read(2047))
+
+            if not prefix:
+                return
+            settings = wp.handshake.ConnectionSettings(self.max_frame_size)
+            live.ping = lambda: loop.call_soon_threadsafe(Keepalive)
+            live.push = lambda: loop.call_soon_threadsafe(Push)
+            while True:
+                data = await wp.frame.ReadFrameAsync(
+                    reader, max_payload=settings.max_frame_size,
+                    verify=not settings.negotiated, prefix=prefix)
+                prefix = b""
+                if data is None:
+                    return
+                live.Touch()
+
+                header = wp.frame.ParseHeader(data)
+                if header.opcode == wp.frame.OP_REFRESH:
+                    data = await LongPoll(data)
+                result, keep_open = await Run(self.HandleFrame, header.opcode,
+                                              data, header, settings, live)
+                if result is not None:
+                    writer.writelines(wp.frame.StampedSegments(
+                        result, header.request_id))
+                    if not await Drain():
+                        return
+                if not keep_open:
+                    return
+                if settings.codec == wp.handshake.CODEC_TEXT:
+                    return await ServeText(await reader.read(2048))
+        except wp.frame.FrameError as e:
+            print("Unable to decode the message:", e)
+        except Exception as e:
+            print("Connection Disrupted:", e, " - softhandler resolved")
+        finally:
+            self.Untrack(live)
+            writer.close()
+
+
+class ReactorConnection:
+    """
+    State of one client connection served by the `Reactor`.
+    """
+    __slots__ = ("sck", "settings", "text", "inbound", "outbound",
+                 "pending", "paused_at", "busy", "closing", "events", "live",
+                 "poll")
+
+    def __init__(self, sck: socket.socket, max_frame_size: int):
+        self.sck = sck
+        self.settings = wp.handshake.ConnectionSettings(max_frame_size)
+        # None until the first byte tells frames and text apart
+        self.text = None
+        self.inbound = bytearray()
+        # memoryviews of reply segments not yet written, `pending` bytes in
+        # all
+        self.outbound = []
+        self.pending = 0
+        # when the outbound queue went over the high watermark and reading
+        # stopped, None while the connection is read
+        self.paused_at = None
+        # whether a request of this connection is on a worker
+        self.busy = False
+        self.closing = False
+        # the events the connection is registered for, 0 if unregistered
+        self.events = 0
+        # the connection's entry with the idle connection reaper
+        self.live = None
+        # the parked long poll of the connection, see `Reactor.Park`
+        self.poll = None
+
+
+class Reactor:
+    """
+    Serves clients from one thread that multiplexes every socket with
+    `selectors`, and runs the handlers on a fixed size thread pool.
+
+    The reactor thread accepts connections, reads whatever has arrived and
+    writes replies without blocking. Once a complete request has arrived it
+    is handed to the pool, and the connection stops being read until the
+    reply has been queued. Requests of one connection are therefore handled
+    in order, and a client that floods the server is held back by its own
+    socket buffers rather than by server memory. Workers hand replies back
+    through a queue and wake the reactor up with a byte on a socket pair.
+
+    The server runs `workers` + 1 threads however many clients connect.
+    Connections beyond `max_connections` are closed as soon as they are
+    accepted.
+
+    Every connection queues its replies until the socket takes them. A
+    connection whose queue grows past the server's
+    `outbound_high_watermark` is not read, and no more of its requests are
+    run, until the queue drains to `outbound_low_watermark`. One that stays
+    paused for `slow_consumer_timeout` seconds is disconnected, so a client
+    that stops reading costs the server a bounded amount of memory and no
+    threads.
+
+    Long polls do not hold a worker while they wait. A RefreshRequest that
+    waits on an empty inbox is parked on the reactor thread, and handed to
+    the pool once a message arrives or its wait is over.
+    """
+
+    def __init__(self, chatServer: ChatServer, listener: socket.socket,
+                 workers: int = 8, max_connections: int = 1024):
+        self.chatServer = chatServer
+        self.listener = listener
+        self.listener.setblocking(False)
+        self.executor = ThreadPoolExecutor(workers)
+        self.max_connections = max_connections
+        self.connections = {}
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(listener, selectors.EVENT_READ)
+
+        # workers queue finished requests, and other threads calls to run on
+        # the reactor thread, and poke the reactor awake
+        self.completed = queue.SimpleQueue()
+        self.calls = queue.SimpleQueue()
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.wakeup_recv.setblocking(False)
+        self.wakeup_send.setblocking(False)
+        self.selector.register(self.wakeup_recv, selectors.EVENT_READ)
+        self.running = False
+        # connections not read because too many replies are queued
+        self.paused = set()
+        # (deadline, id, connection, poll) of parked long polls, in
+        # deadline order; polls that were woken early stay until their
+        # deadline
+        self.polls = []
+        self.poll_ids = itertools.count()
+
+    def Run(self) -> None:
+        """
+        Serves clients until `Stop` is called.
+        """
+        self.running = True
+        while self.running:
+            # wake up regularly to check on paused connections, and when
+            # the next long poll is due
+            timeout = 1.0 if self.paused else None
+            if self.polls:
+                due = max(self.polls[0][0] - time.monotonic(), 0)
+                timeout = due if timeout is None else min(timeout, due)
+            for key, events in self.selector.select(timeout):
+                if key.fileobj is self.listener:
+                    self.Accept()
+                elif key.fileobj is self.wakeup_recv:
+                    self.Complete()
+                else:
+                    conn = key.data
+                    if events & selectors.EVENT_WRITE:
+                        self.Flush(conn)
+                    if events & selectors.EVENT_READ and \
+                            conn.sck.fileno() != -1:
+                        self.Read(conn)
+            if self.paused:
+                self.EvictStalled()
+            if self.polls:
+                self.ExpirePolls()
+
+        for conn in list(self.connections.values()):
+            self.Close(conn)
+        self.selector.close()
+        self.executor.shutdown()
+        self.wakeup_recv.close()
+        self.wakeup_send.close()
+
+    def Stop(self) -> None:
+        """
+        Makes `Run` return after closing every connection. May be called
+        from any thread.
+        """
+        self.running = False
+        self.Wake()
+
+    def Post(self, call, *args) -> None:
+        """
+        Runs `call(*args)` on the reactor thread. May be called from any
+        thread.
+        """
+        self.calls.put((call, args))
+        self.Wake()
+
+    def Wake(self) -> None:
+        try:
+            self.wakeup_send.send(b"\0")
+        except BlockingIOError:
+            # a wakeup is already pending
+            pass
+
+    def Accept(self) -> None:
+        """
+        Accepts every pending connection, dropping those over the limit.
+        """
+        while True:
             try:
-                opcode = int(args[0])
-            except ValueError:
-                opcode = -1
-
-            opcode_map = {
-                0: self.CreateAccount,
-                1: self.Login,
-                2: self.ReceiveMessage,
-                3: self.ListAccounts,
-                4: self.DeleteAccount,
-                5: self.DeliverMessages
-            }
-
-            if opcode in opcode_map.keys():
-                result = opcode_map[opcode](data)
-                c.send(result)
-            else:
-                # Invalid opcodes are dropped immediately, invalid opcodes
-                #  occur when a connection is being closed by the client,
-                #  or when a malicious / corrupted message is being sent
+                c, addr = self.listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                # e.g. out of file descriptors during a connection storm
+                print("Unable to accept a connection:", e)
+                return
+            if len(self.connections) >= self.max_connections:
                 c.close()
+                continue
+            c.setblocking(False)
+            conn = ReactorConnection(c, self.chatServer.max_frame_size)
+            # pinged once it turns out to speak frames
+            conn.live = self.chatServer.Track(
+                None, lambda conn=conn: self.Post(self.Close, conn))
+            self.connections[c] = conn
+            self.Update(conn)
+
+    def Update(self, conn: ReactorConnection) -> None:
+        """
+        Registers the connection for the events it is waiting on: reads
+        while no request of it is on a worker, writes while replies are
+        pending.
+        """
+        events = 0
+        if not conn.busy and not conn.closing and conn.paused_at is None:
+            events |= selectors.EVENT_READ
+        if conn.outbound:
+            events |= selectors.EVENT_WRITE
+        if events == conn.events:
+            return
+        if conn.events == 0:
+            self.selector.register(conn.sck, events, conn)
+        elif events == 0:
+            self.selector.unregister(conn.sck)
+        else:
+            self.selector.modify(conn.sck, events, conn)
+        conn.events = events
+
+    def Close(self, conn: ReactorConnection) -> None:
+        if conn.sck.fileno() == -1:
+            return
+        if conn.poll is not None:
+            self.chatServer.Unpark(*conn.poll[:2])
+            conn.poll = None
+        self.chatServer.Untrack(conn.live)
+        if conn.events:
+            self.selector.unregister(conn.sck)
+            conn.events = 0
+        self.paused.discard(conn)
+        self.connections.pop(conn.sck, None)
+        conn.sck.close()
+
+    def Read(self, conn: ReactorConnection) -> None:
+        try:
+            data = conn.sck.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            print("Connection Disrupted:", e, " - softhandler resolved")
+            self.Close(conn)
+            return
+        if not data:
+            self.Close(conn)
+            return
+        conn.live.Touch()
+        conn.inbound += data
+        self.Next(conn)
+
+    def Next(self, conn: ReactorConnection) -> None:
+        """
+        Hands the next complete request of an idle connection to a worker.
+        """
+        if conn.busy or conn.closing or conn.paused_at is not None or \
+                not conn.inbound:
+            self.Update(conn)
+            return
+        if conn.text is None:
+            conn.text = wp.legacy.IsTextRequest(conn.inbound)
+            if not conn.text:
+                conn.live.ping = lambda: self.Post(self.Keepalive, conn)
+                conn.live.push = lambda: self.Post(self.Push, conn)
+
+        if conn.text:
+            # a text client sends one request at a time in one piece
+            request = bytes(conn.inbound)
+            conn.inbound.clear()
+            work = (self.HandleText, request)
+        else:
+            settings = conn.settings
+            if len(conn.inbound) < wp.frame.HEADER.size:
+                self.Update(conn)
                 return
+            try:
+                if settings.negotiated:
+                    length = wp.frame.ParseHeader(conn.inbound).length
+                    if length > settings.max_frame_size:
+                        raise wp.frame.FrameError(
+                            f"payload of {length} bytes exceeds limit")
+                else:
+                    length = wp.frame.DecodeHeader(
+                        conn.inbound, settings.max_frame_size).length
+            except wp.frame.FrameError as e:
+                print("Unable to decode the message:", e)
+                self.Close(conn)
+                return
+            end = wp.frame.HEADER.size + length
+            if len(conn.inbound) < end:
+                self.Update(conn)
+                return
+            request = bytes(conn.inbound[:end])
+            del conn.inbound[:end]
+            if wp.frame.ParseHeader(request).opcode == wp.frame.OP_REFRESH \
+                    and self.Park(conn, request):
+                return
+            work = (self.HandleFrame, conn, request)
 
+        conn.busy = True
+        self.Update(conn)
+        self.Submit(conn, *work)
 
-if __name__ == "__main__":
+    def Submit(self, conn: ReactorConnection, *work) -> None:
+        future = self.executor.submit(*work)
+        future.add_done_callback(
+            lambda future: self.Finish(conn, future))
+
+    def Park(self, conn: ReactorConnection, request: bytes) -> bool:
+        """
+        Holds a long poll back until its inbox gets a message or its wait
+        is over, without tying up a worker. The connection is not read in
+        the meantime, like while a worker has its request.
+
+        Returns:
+            bool: Whether the request was parked.
+        """
+        def Wake():
+            self.Post(self.Resume, conn)
+
+        parked = self.chatServer.Park(request, Wake)
+        if parked is None:
+            return False
+        username, timeout, request = parked
+        conn.poll = (username, Wake, request)
+        conn.busy = True
+        heapq.heappush(self.polls, (time.monotonic() + timeout,
+                                    next(self.poll_ids), conn, conn.poll))
+        self.Update(conn)
+        return True
+
+    def Resume(self, conn: ReactorConnection) -> None:
+        """
+        Hands a parked long poll to a worker, once woken or at the end of
+        its wait.
+        """
+        if conn.poll is None or conn.sck.fileno() == -1:
+            return
+        username, wake, request = conn.poll
+        conn.poll = None
+        self.chatServer.Unpark(username, wake)
+        self.Submit(conn, self.HandleFrame, conn, request)
+
+    def ExpirePolls(self) -> None:
+        """
+        Resumes the parked long polls whose wait is over.
+        """
+        now = time.monotonic()
+        while self.polls and self.polls[0][0] <= now:
+            _, _, conn, poll = heapq.heappop(self.polls)
+            if conn.poll is poll:
+                self.Resume(conn)
 
-    chatServer = ChatServer()
+    def HandleText(self, data: bytes) -> tuple:
+        """
+        Serves one text request on a worker thread, see `HandleFrame`.
+        """
+        result = self.chatServer.HandleText(data)
+        return result, result is not None
+
+    def HandleFrame(self, conn: ReactorConnection, data: bytes) -> tuple:
+        """
+        Serves one request frame on a worker thread.
+
+        Returns:
+            tuple: The reply segments (None if there is nothing to send) and
+            whether the connection stays open afterwards.
+        """
+        try:
+            data = wp.frame.Decompress(data, conn.settings.max_frame_size)
+        except wp.frame.FrameError as e:
+            print("Unable to decode the message:", e)
+            return None, False
+        header = wp.frame.ParseHeader(data)
+        result, keep_open = self.chatServer.HandleFrame(data, header,
+                                                        conn.settings,
+                                                        conn.live)
+        if result is not None:
+            result = wp.frame.StampedSegments(result, header.request_id)
+        if conn.settings.codec == wp.handshake.CODEC_TEXT:
+            conn.text = True
+            conn.live.ping = None
+        return result, keep_open
+
+    def Finish(self, conn: ReactorConnection, future) -> None:
+        """
+        Passes a finished request back to the reactor thread.
+        """
+        self.completed.put((conn, future))
+        self.Wake()
 
-    host = "0.0.0.0"
-    port = 50051
+    def Complete(self) -> None:
+        """
+        Queues the replies of finished requests on their connections.
+        """
+        try:
+            while self.wakeup_recv.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+        while not self.calls.empty():
+            call, args = self.calls.get()
+            call(*args)
+
+        while not self.completed.empty():
+            conn, future = self.completed.get()
+            if conn.sck.fileno() == -1:
+                continue
+            conn.busy = False
+            try:
+                result = future.result()
+            except Exception as e:
+                print("Unable to handle the request:", e)
+                result = (None, False)
+            segments, keep_open = result
+            if segments is not None:
+                if not isinstance(segments, list):
+                    segments = [segments]
+                segments = [memoryview(s).cast("B") for s in segments]
+                conn.outbound += segments
+                conn.pending += sum(len(s) for s in segments)
+                if conn.paused_at is None and conn.pending >= \
+                        self.chatServer.outbound_high_watermark:
+                    conn.paused_at = time.monotonic()
+                    self.paused.add(conn)
+                    self.chatServer.metrics.Increment(READS_PAUSED)
+            conn.closing = not keep_open
+            self.Flush(conn)
+
+    def Keepalive(self, conn: ReactorConnection) -> None:
+        """
+        Queues a keepalive ping on a connection for the reaper.
+        """
+        if conn.sck.fileno() == -1:
+            return
+        ping = memoryview(KEEPALIVE)
+        conn.outbound.append(ping)
+        conn.pending += len(ping)
+        self.Flush(conn)
+
+    def Push(self, conn: ReactorConnection) -> None:
+        """
+        Queues the messages pushed to a subscribed connection. They count
+        towards the outbound watermarks like replies.
+        """
+        subscription = conn.live.subscription
+        if conn.sck.fileno() == -1 or subscription is None:
+            return
+        while True:
+            push = subscription.TakeFrame()
+            if push is None:
+                break
+            conn.outbound.append(memoryview(push))
+            conn.pending += len(push)
+        self.Flush(conn)
+
+    def EvictStalled(self) -> None:
+        """
+        Disconnects the paused connections whose clients have not drained
+        their replies within the slow consumer timeout.
+        """
+        deadline = time.monotonic() - self.chatServer.slow_consumer_timeout
+        for conn in [conn for conn in self.paused
+                     if conn.paused_at < deadline]:
+            self.chatServer.EvictSlowConsumer()
+            self.Close(conn)
 
+    def Flush(self, conn: ReactorConnection) -> None:
+        """
+        Writes as much pending output as the socket takes without blocking.
+        """
+        outbound = conn.outbound
+        while outbound:
+            try:
+                sent = conn.sck.sendmsg(outbound[:wp.frame.MAX_SEGMENTS])
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                print("Connection Disrupted:", e, " - softhandler resolved")
+                self.Close(conn)
+                return
+            conn.pending -= sent
+            while outbound and sent >= len(outbound[0]):
+                sent -= len(outbound.pop(0))
+            if sent:
+                outbound[0] = outbound[0][sent:]
+
+        if conn.paused_at is not None and \
+                conn.pending <= self.chatServer.outbound_low_watermark:
+            conn.paused_at = None
+            self.paused.discard(conn)
+        if conn.closing and not outbound:
+            self.Close(conn)
+        else:
+            self.Next(conn)
+
+
+class Pusher:
+    """
+    Sends pushed messages on a connection served by its own thread.
+
+    The pushes are written by a second thread, started with the first one,
+    so that neither the connection's thread nor the threads that deliver
+    messages wait on a subscriber that reads slowly. The subscriber falls
+    behind instead, and once `ChatServer.max_unacked` messages wait for it
+    new ones stay in its inbox. A push that the subscriber does not take
+    within `ChatServer.slow_consumer_timeout` evicts it like a reply would,
+    so the connection's thread never waits on the send lock for longer.
+    """
+
+    def __init__(self, c: socket.socket, send_lock, live: LiveConnection,
+                 server: ChatServer):
+        self.c = c
+        self.send_lock = send_lock
+        self.live = live
+        self.server = server
+        self.wakeup = mp.Event()
+        self.lock = mp.Lock()
+        self.thread = None
+        self.closed = False
+
+    def Wake(self) -> None:
+        with self.lock:
+            if self.closed:
+                return
+            if self.thread is None:
+                self.thread = mp.Thread(target=self.Run, daemon=True)
+                self.thread.start()
+                self.live.threads += 1
+        self.wakeup.set()
+
+    def Close(self) -> None:
+        with self.lock:
+            self.closed = True
+        self.wakeup.set()
+
+    def Run(self) -> None:
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            if self.closed:
+                return
+            subscription = self.live.subscription
+            while subscription is not None:
+                push = subscription.TakeFrame()
+                if push is None:
+                    break
+                try:
+                    with self.send_lock:
+                        sent = SendWithin(self.c, push,
+                                          self.server.slow_consumer_timeout)
+                except OSError as e:
+                    print("Connection Disrupted:", e,
+                          " - softhandler resolved")
+                    Shutdown(self.c)
+                    return
+                if not sent:
+                    self.server.EvictSlowConsumer()
+                    Shutdown(self.c)
+                    return
+
+
+def Shutdown(c: socket.socket) -> None:
+    """
+    Ends a connection that another thread is blocked on, so that the
+    thread's `recv` returns and it closes the socket itself.
+    """
+    try:
+        c.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def SendWithin(c: socket.socket, frame: bytes, timeout: float) -> bool:
+    """
+    Sends a frame on a connection served by its own thread, from another
+    thread, giving up after `timeout` seconds. The socket is left in
+    blocking mode, since a timeout set on it would also apply to a `recv`
+    that the connection's thread starts meanwhile, so every write is made
+    with MSG_DONTWAIT and waits for room in between.
+
+    Returns:
+        bool: Whether the frame was sent. If not, part of it may have been,
+        and the connection must be closed.
+    """
+    deadline = time.monotonic() + timeout
+    view = memoryview(frame)
+    poller = None
+    while view:
+        try:
+            view = view[c.send(view, socket.MSG_DONTWAIT):]
+            continue
+        except BlockingIOError:
+            pass
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        if poller is None:
+            poller = select.poll()
+            poller.register(c, select.POLLOUT)
+        poller.poll(remaining * 1000)
+    return True
+
+
+def SendKeepalive(c: socket.socket, send_lock) -> None:
+    """
+    Sends a keepalive ping on a connection served by its own thread, from
+    the reaper thread. The ping is skipped while a reply is being sent and
+    never blocks the reaper: a client whose socket buffer is too full to
+    take it is not reading anyway.
+    """
+    if not send_lock.acquire(blocking=False):
+        return
+    try:
+        sent = c.send(KEEPALIVE, socket.MSG_DONTWAIT)
+    except OSError:
+        # including a full socket buffer
+        return
+    finally:
+        send_lock.release()
+    if sent < len(KEEPALIVE):
+        # a partial frame would desynchronize the stream
+        Shutdown(c)
+
+
+def Listen(host: str, port: int, backlog: int,
+           reuse_port: bool = False) -> socket.socket:
+    """
+    Opens the listening socket of a server.
+
+    Args:
+        reuse_port (bool): Whether to set SO_REUSEPORT, so that several
+        processes can listen on the same port and have the kernel spread
+        incoming connections between them.
+    """
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     s.bind((host, port))
 
     print("socket binded to port", port)
 
     # put the socket into listening mode
-    s.listen(10)
+    s.listen(backlog)
     print("socket is listening")
+    return s
+
+
+def ServeThreads(chatServer: ChatServer, host: str, port: int,
+                 backlog: int = 10, reuse_port: bool = False) -> None:
+    """
+    Serves clients with one thread per connection.
+    """
+    s = Listen(host, port, backlog, reuse_port)
 
     while True:
         # establish connection with client
@@ -480,3 +1637,167 @@ if __name__ == "__main__":
         # Start a new thread and return its identifier
         mp.Thread(target=chatServer.HandleNewConnection,
                   daemon=False, args=(c, addr)).start()
+
+
+async def ServeAsyncio(chatServer: ChatServer, host: str, port: int,
+                       backlog: int = 1024) -> None:
+    """
+    Serves clients from a single event loop. An idle connection costs a
+    coroutine and its stream buffers rather than a thread, so one process
+    can hold many thousands of mostly idle clients.
+    """
+    server = await asyncio.start_server(chatServer.HandleStream, host, port,
+                                        backlog=backlog)
+    print("socket is listening on port", port)
+    async with server:
+        await server.serve_forever()
+
+
+def ServeReactor(chatServer: ChatServer, host: str, port: int,
+                 backlog: int = 1024, workers: int = 8,
+                 max_connections: int = 1024,
+                 reuse_port: bool = False) -> None:
+    """
+    Serves clients from a `Reactor`, with a fixed number of threads.
+    """
+    s = Listen(host, port, backlog, reuse_port)
+    Reactor(chatServer, s, workers, max_connections).Run()
+
+
+def ReportMetrics(chatServer: ChatServer, interval: float) -> None:
+    """
+    Prints the per opcode request metrics every `interval` seconds from a
+    background thread.
+    """
+    def Report():
+        while True:
+            time.sleep(interval)
+            print(chatServer.metrics.Report(), flush=True)
+
+    mp.Thread(target=Report, daemon=True).start()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Socket chat server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=50051)
+    parser.add_argument("--mode", choices=["threads", "asyncio", "reactor"],
+                        default="threads",
+                        help="one thread per connection, one event loop, or "
+                             "a selector thread feeding a worker pool")
+    parser.add_argument("--backlog", type=int, default=None,
+                        help="pending connections the listener queues "
+                             "(default 10 in threads mode, 1024 otherwise)")
+    parser.add_argument("--offload-workers", type=int, default=0,
+                        help="asyncio mode: threads that run account "
+                             "listings off the event loop, 0 to disable")
+    parser.add_argument("--workers", type=int, default=8,
+                        help="reactor mode: handler threads")
+    parser.add_argument("--max-connections", type=int, default=1024,
+                        help="reactor mode: connections served at once, "
+                             "further ones are closed on accept")
+    parser.add_argument("--high-watermark", type=int, default=1024 * 1024,
+                        help="queued reply bytes at which a client is no "
+                             "longer read")
+    parser.add_argument("--low-watermark", type=int, default=256 * 1024,
+                        help="queued reply bytes at which reading resumes")
+    parser.add_argument("--slow-consumer-timeout", type=float, default=10.0,
+                        help="seconds a client may leave its replies "
+                             "unread before it is disconnected")
+    parser.add_argument("--idle-timeout", type=float, default=300.0,
+                        help="seconds of silence after which a connection "
+                             "is closed, 0 to keep idle connections open")
+    parser.add_argument("--auth", action="store_true",
+                        help="reject requests with invalid tokens before "
+                             "their handlers run")
+    parser.add_argument("--rate-limit", type=float, default=0,
+                        help="requests per second allowed per user, "
+                             "0 for no limit")
+    parser.add_argument("--rate-burst", type=int, default=50,
+                        help="requests a user may send at once when rate "
+                             "limited")
+    parser.add_argument("--trace-slow-ms", type=float, default=None,
+                        help="print requests slower than this")
+    parser.add_argument("--stats-interval", type=float, default=0,
+                        help="seconds between per opcode latency reports, "
+                             "0 to disable")
+    parser.add_argument("--stripes", type=int, default=DEFAULT_STRIPES,
+                        help="partitions of the users, each with its own "
+                             "locks")
+    parser.add_argument("--token-ttl", type=float, default=DEFAULT_TOKEN_TTL,
+                        help="seconds a login token stays valid")
+    parser.add_argument("--sweep-interval", type=float, default=60.0,
+                        help="seconds between evictions of expired tokens")
+    parser.add_argument("--storage", choices=["memory", "sqlite"],
+                        default="memory",
+                        help="keep accounts, tokens and inboxes in memory, "
+                             "or in the SQLite database at --database")
+    parser.add_argument("--database", default="chat.db",
+                        help="sqlite storage: the database file")
+    parser.add_argument("--wal", default=None,
+                        help="memory storage: write-ahead log to recover "
+                             "accounts and inboxes from and to log changes "
+                             "to")
+    parser.add_argument("--wal-window-ms", type=float,
+                        default=wal.DEFAULT_WINDOW * 1e3,
+                        help="milliseconds the log gathers changes for "
+                             "before syncing them to disk together")
+    parser.add_argument("--snapshot-interval", type=float, default=300.0,
+                        help="seconds between snapshots that compact the "
+                             "log, 0 to never take one")
+    parser.add_argument("--grpc-port", default=None,
+                        help="also serve the same users over gRPC on this "
+                             "port")
+    parser.add_argument("--grpc-workers", type=int, default=100,
+                        help="with --grpc-port: threads serving gRPC "
+                             "requests")
+    args = parser.parse_args()
+    if args.storage != "memory" and args.wal is not None:
+        parser.error("--wal only applies to memory storage")
+
+    chatServer = ChatServer(
+        args.stripes,
+        SQLiteStorage(args.database) if args.storage == "sqlite" else None)
+    chatServer.snapshot_interval = args.snapshot_interval
+    if args.wal is not None:
+        start = time.perf_counter()
+        replayed = chatServer.OpenLog(args.wal, args.wal_window_ms / 1e3)
+        print(f"Restored {len(chatServer.user_metadata_store)} accounts from "
+              f"{args.wal}, replaying {replayed} log records, in "
+              f"{time.perf_counter() - start:.2f}s")
+    chatServer.token_ttl = args.token_ttl
+    chatServer.sweep_interval = args.sweep_interval
+    chatServer.outbound_high_watermark = args.high_watermark
+    chatServer.outbound_low_watermark = args.low_watermark
+    chatServer.slow_consumer_timeout = args.slow_consumer_timeout
+    chatServer.idle_timeout = args.idle_timeout or None
+    if args.trace_slow_ms is not None:
+        chatServer.dispatcher.Use(TracingMiddleware(
+            slow_threshold=args.trace_slow_ms / 1e3))
+    if args.auth:
+        chatServer.dispatcher.Use(AuthMiddleware(chatServer.ValidateToken))
+    if args.rate_limit > 0:
+        chatServer.dispatcher.Use(RateLimitMiddleware(args.rate_limit,
+                                                      args.rate_burst))
+    if args.stats_interval > 0:
+        ReportMetrics(chatServer, args.stats_interval)
+    if args.grpc_port is not None:
+        # a gRPC servicer on the same engine, so that clients of either
+        # transport share accounts and inboxes
+        import grpc_server
+        # the gRPC server stops once it is garbage collected
+        grpc_listener = grpc_server.start(
+            args.grpc_port, args.grpc_workers,
+            grpc_server.ChatServer(engine=chatServer.engine))
+
+    if args.mode == "asyncio":
+        if args.offload_workers > 0:
+            chatServer.executor = ThreadPoolExecutor(args.offload_workers)
+        asyncio.run(ServeAsyncio(chatServer, args.host, args.port,
+                                 args.backlog or 1024))
+    elif args.mode == "reactor":
+        ServeReactor(chatServer, args.host, args.port, args.backlog or 1024,
+                     args.workers, args.max_connections)
+    else:
+        ServeThreads(chatServer, args.host, args.port, args.backlog or 10)
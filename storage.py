@@ -0,0 +1,529 @@
+"""
+Storage backends for the accounts, tokens and inboxes of the chat servers.
+
+Both servers keep their durable state behind a `StorageBackend`: account
+CRUD, token sessions, and inboxes that messages are enqueued to and drained
+from. `MemoryStorage` keeps it in the server's stripes, optionally made
+durable by a write-ahead log and snapshots (`OpenLog`). `SQLiteStorage`
+keeps it in an SQLite database, so that it can grow larger than RAM.
+
+Servers lock as before: a call that concerns one user is made with the locks
+of that user's stripe held, the `metadata_lock` for accounts and tokens, the
+`inbox_lock` for inboxes, and both to create or delete an account. A backend
+can therefore rely on the changes of one user reaching it one at a time and
+in order. Calls that concern every user (`Usernames`, `EvictTokens`) are
+made without any lock held, and the backend takes whatever it needs.
+
+An inbox is the queue of messages a user has not received yet, oldest first.
+Messages pushed to a subscriber stay at its front until they are
+acknowledged, so `Take` and `Peek` accept an offset past them.
+"""
+import abc
+import itertools
+import sqlite3
+import threading as mp
+import weakref
+
+import snapshot
+import write_ahead_log as wal
+from token_expiry import EvictTokens, IssueToken
+
+
+class StorageError(Exception):
+    pass
+
+
+class StorageBackend(abc.ABC):
+    """
+    The operations the chat servers need of their storage. See the module
+    docstring for the locks callers hold. A backend that misses one cannot
+    be constructed.
+    """
+
+    # accounts
+
+    @abc.abstractmethod
+    def Account(self, username: str):
+        """
+        Returns:
+            tuple: The (password, fullname) of a user, or None if there is
+            no such account.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def CreateAccount(self, username: str, password: str,
+                      fullname: str) -> None:
+        """
+        Adds an account that does not exist yet, with an empty inbox.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def DeleteAccount(self, username: str) -> None:
+        """
+        Removes an account along with its token and its inbox.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def Usernames(self) -> list:
+        """
+        Returns every username, in the order the accounts were created.
+        """
+        raise NotImplementedError
+
+    # token sessions
+
+    @abc.abstractmethod
+    def Token(self, username: str):
+        """
+        Returns:
+            tuple: The (token, timestamp) last issued to a user, or None.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def IssueToken(self, username: str, token: str,
+                   timestamp: float) -> None:
+        """
+        Registers `token` as the token of `username`, issued at `timestamp`.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def EvictTokens(self, issued_before: float, batch: int) -> tuple:
+        """
+        Evicts the tokens issued before `issued_before`, at most `batch` at
+        a time so that requests are not held up for long.
+
+        Returns:
+            tuple: The number of tokens evicted and the number left.
+        """
+        raise NotImplementedError
+
+    # inboxes
+
+    @abc.abstractmethod
+    def InboxLength(self, username: str):
+        """
+        Returns:
+            int: The number of messages in a user's inbox, or None if there
+            is no such account.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def Enqueue(self, deliveries: list) -> None:
+        """
+        Appends messages to the inboxes of existing accounts, as one batch.
+
+        Args:
+            deliveries (list): (recipient, message) pairs, in order.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def Peek(self, username: str, offset: int, limit: int) -> list:
+        """
+        Returns up to `limit` messages of an inbox, starting `offset`
+        messages from its front, without removing them.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def Take(self, username: str, offset: int = 0, limit: int = None) -> list:
+        """
+        Removes and returns up to `limit` messages of an inbox (all of them
+        if None), starting `offset` messages from its front. Returns an empty
+        list if there is no such account.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def Requeue(self, username: str, messages: list) -> None:
+        """
+        Puts messages taken but never delivered back at the front of an
+        inbox, in order, unless the account has been deleted since.
+        """
+        raise NotImplementedError
+
+    # durability
+
+    def OpenLog(self, path: str, window: float = wal.DEFAULT_WINDOW) -> int:
+        raise StorageError(f"{type(self).__name__} does not use a "
+                           "write-ahead log")
+
+    def Close(self) -> None:
+        pass
+
+
+class MemoryStorage(StorageBackend):
+    """
+    Keeps accounts, tokens and inboxes in the stores of `stripes`, the
+    layout described in `striping.py`. Inboxes are whatever sequence the
+    stripes' `user_inbox` creates: deques for the `EngineStripe` that the
+    socket and gRPC servers share through `engine.py`.
+
+    Changes are appended to `wal` once `OpenLog` has opened one.
+
+    Args:
+        stripes (Stripes): The stripes of the server.
+    """
+
+    def __init__(self, stripes):
+        self.stripes = stripes
+        self.wal = None
+
+    def OpenLog(self, path: str, window: float = wal.DEFAULT_WINDOW) -> int:
+        """
+        Restores the stripes, which must not hold any accounts yet, from the
+        latest snapshot of the write-ahead log at `path` and the log records
+        after it, and logs every change from then on.
+
+        Returns:
+            int: The number of log records replayed.
+        """
+        _, replayed, number = snapshot.Recover(self.stripes, path)
+        self.wal = wal.WriteAheadLog(path, window, number)
+        return replayed
+
+    def Log(self, *records: bytes) -> None:
+        if self.wal is not None:
+            self.wal.Append(*records)
+
+    def Close(self) -> None:
+        if self.wal is not None:
+            self.wal.Close()
+
+    def Account(self, username: str):
+        return self.stripes.Of(username).user_metadata_store.get(username)
+
+    def CreateAccount(self, username: str, password: str,
+                      fullname: str) -> None:
+        stripe = self.stripes.Of(username)
+        stripe.user_metadata_store[username] = (password, fullname)
+        stripe.created[username] = self.stripes.NextAccount()
+        stripe.user_inbox[username] = stripe.user_inbox.default_factory()
+        self.Log(wal.Record(wal.CREATE_ACCOUNT, username, password,
+                            fullname))
+
+    def DeleteAccount(self, username: str) -> None:
+        stripe = self.stripes.Of(username)
+        stripe.token_hub.pop(username, None)
+        stripe.user_metadata_store.pop(username)
+        stripe.created.pop(username)
+        stripe.user_inbox.pop(username)
+        self.Log(wal.Record(wal.DELETE_ACCOUNT, username))
+
+    def Usernames(self) -> list:
+        return self.stripes.Usernames()
+
+    def Token(self, username: str):
+        return self.stripes.Of(username).token_hub.get(username)
+
+    def IssueToken(self, username: str, token: str,
+                   timestamp: float) -> None:
+        IssueToken(self.stripes.Of(username), username, token, timestamp)
+
+    def EvictTokens(self, issued_before: float, batch: int) -> tuple:
+        """
+        Evicts expired tokens a stripe at a time, holding one stripe's
+        `metadata_lock` per `batch` of them, see `token_expiry.py`.
+        """
+        evicted = size = 0
+        for stripe in self.stripes:
+            popped = batch
+            while popped == batch:
+                with stripe.metadata_lock:
+                    popped, removed = EvictTokens(stripe, issued_before,
+                                                  batch)
+                    if popped < batch:
+                        size += len(stripe.token_hub)
+                evicted += removed
+        return evicted, size
+
+    def InboxLength(self, username: str):
+        inbox = self.stripes.Of(username).user_inbox.get(username)
+        return None if inbox is None else len(inbox)
+
+    def Enqueue(self, deliveries: list) -> None:
+        of = self.stripes.Of
+        for recipient, message in deliveries:
+            of(recipient).user_inbox[recipient].append(message)
+        if self.wal is not None:
+            self.wal.Append(*[wal.Record(wal.ENQUEUE, recipient, message)
+                              for recipient, message in deliveries])
+
+    def Peek(self, username: str, offset: int, limit: int) -> list:
+        inbox = self.stripes.Of(username).user_inbox.get(username)
+        if not inbox:
+            return []
+        return list(itertools.islice(inbox, offset, offset + limit))
+
+    def Take(self, username: str, offset: int = 0, limit: int = None) -> list:
+        inbox = self.stripes.Of(username).user_inbox.get(username)
+        if not inbox:
+            return []
+        end = len(inbox) if limit is None else min(len(inbox),
+                                                   offset + limit)
+        count = end - offset
+        if count <= 0:
+            return []
+        if isinstance(inbox, list):
+            if offset == 0 and end == len(inbox):
+                messages = inbox[:]
+                inbox.clear()
+            else:
+                messages = inbox[offset:end]
+                del inbox[offset:end]
+        else:
+            inbox.rotate(-offset)
+            popleft = inbox.popleft
+            messages = [popleft() for _ in range(count)]
+            inbox.rotate(offset)
+        self.Log(wal.Record(wal.DELIVER, username, offset, count))
+        return messages
+
+    def Requeue(self, username: str, messages: list) -> None:
+        inbox = self.stripes.Of(username).user_inbox.get(username)
+        if inbox is None or not messages:
+            return
+        if isinstance(inbox, list):
+            inbox[:0] = messages
+        else:
+            inbox.extendleft(reversed(messages))
+        self.Log(*[wal.Record(wal.RETURN, username, message)
+                   for message in reversed(messages)])
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    number INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL,
+    fullname TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS tokens (
+    username TEXT PRIMARY KEY,
+    token TEXT NOT NULL,
+    issued REAL NOT NULL) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tokens_by_issue ON tokens (issued);
+CREATE TABLE IF NOT EXISTS messages (
+    username TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    PRIMARY KEY (username, position)) WITHOUT ROWID;
+"""
+
+# statements are kept as constants so that every connection compiles each
+# of them once and reuses it from its statement cache
+SELECT_ACCOUNT = "SELECT password, fullname FROM accounts WHERE username = ?"
+INSERT_ACCOUNT = ("INSERT INTO accounts (username, password, fullname) "
+                  "VALUES (?, ?, ?)")
+DELETE_ACCOUNT = "DELETE FROM accounts WHERE username = ?"
+DELETE_TOKEN = "DELETE FROM tokens WHERE username = ?"
+DELETE_INBOX = "DELETE FROM messages WHERE username = ?"
+SELECT_USERNAMES = "SELECT username FROM accounts ORDER BY number"
+SELECT_TOKEN = "SELECT token, issued FROM tokens WHERE username = ?"
+UPSERT_TOKEN = ("INSERT OR REPLACE INTO tokens (username, token, issued) "
+                "VALUES (?, ?, ?)")
+EVICT_TOKENS = ("DELETE FROM tokens WHERE username IN "
+                "(SELECT username FROM tokens WHERE issued < ? LIMIT ?)")
+COUNT_TOKENS = "SELECT COUNT(*) FROM tokens"
+INBOX_LENGTH = ("SELECT (SELECT COUNT(*) FROM messages WHERE username = ?) "
+                "FROM accounts WHERE username = ?")
+INSERT_MESSAGE = ("INSERT INTO messages (username, position, message) "
+                  "VALUES (?, ?, ?)")
+SELECT_MESSAGES = ("SELECT position, message FROM messages WHERE "
+                   "username = ? ORDER BY position LIMIT ? OFFSET ?")
+DELETE_MESSAGES = ("DELETE FROM messages WHERE username = ? AND "
+                   "position BETWEEN ? AND ?")
+FIRST_POSITION = "SELECT MIN(position) FROM messages WHERE username = ?"
+LAST_POSITION = "SELECT MAX(position) FROM messages"
+
+
+class ConnectionHolder:
+    """
+    Holds a thread's SQLite connection in its thread-local storage, so that
+    the connection can be closed when the holder is collected with its thread.
+
+    Args:
+        db (sqlite3.Connection): The thread's connection.
+    """
+
+    __slots__ = ("db", "__weakref__")
+
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+
+
+class SQLiteStorage(StorageBackend):
+    """
+    Keeps accounts, tokens and inboxes in the SQLite database at `path`.
+
+    The database runs in WAL journal mode, so readers never wait on the
+    writer, with `synchronous` NORMAL by default: a commit reaches the
+    journal without an fsync of its own, and the journal is synced at
+    checkpoints. Every thread gets a connection of its own, whose compiled
+    statements are cached and reused. An operation is one transaction, and
+    a batch of messages (`Enqueue`) is inserted in one transaction too.
+
+    Messages are ordered by a position within their inbox: new messages are
+    numbered past every message ever stored, and requeued ones before the
+    front of their inbox.
+
+    Args:
+        path (str): The database file, created if it does not exist.
+        synchronous (str): The SQLite `synchronous` setting, FULL to sync
+        every commit.
+        timeout (float): Seconds a writer waits for another to finish.
+    """
+
+    def __init__(self, path: str, synchronous: str = "NORMAL",
+                 timeout: float = 30.0):
+        self.path = path
+        self.synchronous = synchronous
+        self.timeout = timeout
+        self.local = mp.local()
+        self.connections = set()
+        self.connections_lock = mp.Lock()
+        db = self.Connection()
+        db.execute("PRAGMA journal_mode = WAL")
+        db.executescript(SQLITE_SCHEMA)
+        last, = db.execute(LAST_POSITION).fetchone()
+        self.positions = itertools.count((last or 0) + 1)
+
+    def Connection(self) -> sqlite3.Connection:
+        """
+        Returns the calling thread's connection, opening it on first use. The
+        connection is closed once the thread exits and its thread-local
+        holder is collected, so short-lived threads do not leak one each.
+        """
+        holder = getattr(self.local, "holder", None)
+        if holder is None:
+            # transactions are begun explicitly, see `Transaction`
+            db = sqlite3.connect(self.path, timeout=self.timeout,
+                                 isolation_level=None,
+                                 check_same_thread=False,
+                                 cached_statements=64)
+            db.execute(f"PRAGMA synchronous = {self.synchronous}")
+            holder = ConnectionHolder(db)
+            closer = weakref.finalize(holder, self.Release, db)
+            closer.atexit = False
+            with self.connections_lock:
+                self.connections.add(closer)
+            self.local.holder = holder
+        return holder.db
+
+    def Release(self, db: sqlite3.Connection) -> None:
+        """
+        Closes a connection whose thread has exited.
+
+        Args:
+            db (sqlite3.Connection): The connection to close.
+        """
+        with self.connections_lock:
+            self.connections = {closer for closer in self.connections
+                                if closer.alive}
+        db.close()
+
+    def Transaction(self):
+        """
+        Begins a write transaction on the calling thread's connection, taking
+        the database's write lock up front so that it never has to be
+        upgraded halfway through.
+
+        Returns:
+            sqlite3.Connection: The connection, to use as a context manager
+            that commits on success and rolls back on an exception.
+        """
+        db = self.Connection()
+        db.execute("BEGIN IMMEDIATE")
+        return db
+
+    def Close(self) -> None:
+        with self.connections_lock:
+            connections, self.connections = self.connections, set()
+        for closer in connections:
+            closer()
+
+    def Account(self, username: str):
+        return self.Connection().execute(SELECT_ACCOUNT,
+                                         (username,)).fetchone()
+
+    def CreateAccount(self, username: str, password: str,
+                      fullname: str) -> None:
+        with self.Transaction() as db:
+            db.execute(INSERT_ACCOUNT, (username, password, fullname))
+
+    def DeleteAccount(self, username: str) -> None:
+        with self.Transaction() as db:
+            for statement in (DELETE_ACCOUNT, DELETE_TOKEN, DELETE_INBOX):
+                db.execute(statement, (username,))
+
+    def Usernames(self) -> list:
+        return [username for username, in
+                self.Connection().execute(SELECT_USERNAMES)]
+
+    def Token(self, username: str):
+        return self.Connection().execute(SELECT_TOKEN,
+                                         (username,)).fetchone()
+
+    def IssueToken(self, username: str, token: str,
+                   timestamp: float) -> None:
+        with self.Transaction() as db:
+            db.execute(UPSERT_TOKEN, (username, token, timestamp))
+
+    def EvictTokens(self, issued_before: float, batch: int) -> tuple:
+        """
+        Deletes expired tokens `batch` at a time, one transaction each. A
+        token issued meanwhile is newer than `issued_before`, so no stripe
+        lock is needed.
+        """
+        evicted = 0
+        removed = batch
+        while removed == batch:
+            with self.Transaction() as db:
+                removed = db.execute(EVICT_TOKENS,
+                                     (issued_before, batch)).rowcount
+            evicted += removed
+        size, = self.Connection().execute(COUNT_TOKENS).fetchone()
+        return evicted, size
+
+    def InboxLength(self, username: str):
+        row = self.Connection().execute(INBOX_LENGTH,
+                                        (username, username)).fetchone()
+        return None if row is None else row[0]
+
+    def Enqueue(self, deliveries: list) -> None:
+        positions = self.positions
+        with self.Transaction() as db:
+            db.executemany(INSERT_MESSAGE,
+                           [(recipient, next(positions), message)
+                            for recipient, message in deliveries])
+
+    def Peek(self, username: str, offset: int, limit: int) -> list:
+        return [message for _, message in self.Connection().execute(
+            SELECT_MESSAGES, (username, limit, offset))]
+
+    def Take(self, username: str, offset: int = 0, limit: int = None) -> list:
+        with self.Transaction() as db:
+            rows = db.execute(SELECT_MESSAGES, (
+                username, -1 if limit is None else limit, offset)).fetchall()
+            if rows:
+                db.execute(DELETE_MESSAGES,
+                           (username, rows[0][0], rows[-1][0]))
+        return [message for _, message in rows]
+
+    def Requeue(self, username: str, messages: list) -> None:
+        if not messages:
+            return
+        with self.Transaction() as db:
+            if db.execute(SELECT_ACCOUNT, (username,)).fetchone() is None:
+                return
+            first, = db.execute(FIRST_POSITION, (username,)).fetchone()
+            if first is None:
+                first = next(self.positions)
+            db.executemany(INSERT_MESSAGE, [
+                (username, first - len(messages) + i, message)
+                for i, message in enumerate(messages)])
@@ -0,0 +1,169 @@
+"""
+Lock striping for the per user state of the chat servers.
+
+A server's accounts, tokens and inboxes are partitioned into `Stripes`,
+each guarded by its own `metadata_lock` and `inbox_lock`, and a username
+always maps to the same stripe. Requests of users on different stripes never
+wait on each other's locks, so logins, token checks and sends of unrelated
+users no longer serialize behind two server wide locks.
+
+An operation that needs locks of several stripes at once takes every
+metadata lock before any inbox lock, and locks of one kind in ascending stripe
+index. See `docs/locking_design.md`.
+"""
+import contextlib
+import heapq
+import itertools
+import threading as mp
+from collections import defaultdict
+from collections.abc import MutableMapping
+
+DEFAULT_STRIPES = 16
+
+
+class Stripe:
+    """
+    The users of one stripe and the locks that guard them.
+
+    `user_metadata_store`, `token_hub`, `token_expiry` and `created` are
+    guarded by `metadata_lock`, `user_inbox` by `inbox_lock`. Servers
+    subclass it to keep further per user state next to the lock that guards
+    it.
+    """
+    __slots__ = ("metadata_lock", "inbox_lock", "user_metadata_store",
+                 "token_hub", "token_expiry", "created", "user_inbox")
+
+    def __init__(self):
+        self.metadata_lock = mp.Lock()
+        self.inbox_lock = mp.Lock()
+        # username -> (password, fullname)
+        self.user_metadata_store = {}
+        # username -> (token, timestamp)
+        self.token_hub = {}
+        # min-heap of (timestamp, username, token), see `token_expiry.py`
+        self.token_expiry = []
+        # username -> `Stripes.NextAccount` number, in creation order
+        self.created = {}
+        self.user_inbox = defaultdict(lambda: [])
+
+
+class Stripes:
+    """
+    The stripes of one server, with the mapping from usernames to them.
+
+    Usernames are assigned with Python's `hash`, which only has to agree
+    within one process.
+
+    Args:
+        count (int): The number of stripes.
+        stripe_type (type): The `Stripe` subclass to create them from.
+    """
+
+    def __init__(self, count: int = DEFAULT_STRIPES,
+                 stripe_type: type = Stripe):
+        if count < 1:
+            raise ValueError("at least one stripe is needed")
+        self.stripes = [stripe_type() for _ in range(count)]
+        self.account_numbers = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self.stripes)
+
+    def __iter__(self):
+        return iter(self.stripes)
+
+    def __getitem__(self, index: int) -> Stripe:
+        return self.stripes[index]
+
+    def Index(self, username: str) -> int:
+        return hash(username) % len(self.stripes)
+
+    def Of(self, username: str) -> Stripe:
+        """
+        Returns the stripe that holds `username`.
+        """
+        return self.stripes[self.Index(username)]
+
+    def NextAccount(self) -> int:
+        """
+        Numbers a new account. Accounts are numbered in the order they are
+        created, so that listings across stripes keep that order.
+        """
+        return next(self.account_numbers)
+
+    def Usernames(self) -> list:
+        """
+        Returns every username, in the order the accounts were created.
+
+        Stripes are read one after the other, holding one metadata lock at
+        a time, so a listing never stalls the whole server.
+        """
+        created = []
+        for stripe in self.stripes:
+            with stripe.metadata_lock:
+                created.append([(number, username) for username, number
+                                in stripe.created.items()])
+        return [username for _, username in heapq.merge(*created)]
+
+    @contextlib.contextmanager
+    def Locked(self, indices, kind: str = "inbox_lock"):
+        """
+        Holds the `kind` lock of every stripe in `indices`, acquired in
+        ascending stripe order and released in reverse.
+
+        Yields:
+            list: The locked stripes, in ascending order.
+        """
+        stripes = [self.stripes[i] for i in sorted(set(indices))]
+        with contextlib.ExitStack() as stack:
+            for stripe in stripes:
+                stack.enter_context(getattr(stripe, kind))
+            yield stripes
+
+
+class StripedView(MutableMapping):
+    """
+    A dict like view of one store across every stripe, e.g. all inboxes.
+
+    Takes no locks: handlers lock the stripe they work on and use its store
+    directly, while the view serves tests, benchmarks and tools that look at
+    a server as a whole. Membership tests and `get` never add a missing key,
+    even to a store with defaults.
+
+    Args:
+        stripes (Stripes): The stripes to look into.
+        store (str): The name of the store attribute of every stripe.
+    """
+
+    def __init__(self, stripes: Stripes, store: str):
+        self.stripes = stripes
+        self.store = store
+
+    def Store(self, key) -> dict:
+        return getattr(self.stripes.Of(key), self.store)
+
+    def __getitem__(self, key):
+        return self.Store(key)[key]
+
+    def __setitem__(self, key, value) -> None:
+        self.Store(key)[key] = value
+
+    def __delitem__(self, key) -> None:
+        del self.Store(key)[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self.Store(key)
+
+    def __iter__(self):
+        for stripe in self.stripes:
+            yield from list(getattr(stripe, self.store))
+
+    def __len__(self) -> int:
+        return sum(len(getattr(stripe, self.store))
+                   for stripe in self.stripes)
+
+    def get(self, key, default=None):
+        return self.Store(key).get(key, default)
+
+    def pop(self, key, *default):
+        return self.Store(key).pop(key, *default)
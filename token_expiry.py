@@ -0,0 +1,116 @@
+"""
+Expiry of the authentication tokens kept in a server's token hub.
+
+A token is valid for the server's `token_ttl` seconds after it was issued.
+`ValidateToken` refuses older tokens on its own, but without eviction every
+user who ever logged in would keep an entry in the hub. Each stripe therefore
+indexes the tokens it issues in a min-heap ordered by issue time
+(`Stripe.token_expiry`), and a `TokenSweeper` thread pops the expired ones
+every `sweep_interval` seconds. It evicts at most `sweep_batch` tokens per
+acquisition of a stripe's metadata lock, so a sweep over many expired tokens
+never holds up requests for long.
+
+A token replaced by a new login, or removed with its account, leaves its heap
+entry behind. The entry is dropped without touching the hub when it comes due.
+
+The heaps belong to `storage.MemoryStorage`, which evicts through
+`EvictTokens`; other backends evict expired tokens their own way, and the
+sweeper only asks the server's storage to do so.
+"""
+import heapq
+import threading as mp
+import time
+
+DEFAULT_TOKEN_TTL = 3600.0
+
+# counters and gauges kept in the server's `metrics`
+TOKEN_SWEEPS = "token_sweeps"
+TOKENS_EVICTED = "tokens_evicted"
+TOKEN_SWEEP_US = "token_sweep_us"
+LAST_TOKEN_SWEEP_US = "last_token_sweep_us"
+TOKEN_HUB_SIZE = "token_hub_size"
+
+
+def IssueToken(stripe, username: str, token: str, timestamp: float) -> None:
+    """
+    Registers `token` as the token of `username` and indexes it for expiry.
+    Must be called with the stripe's `metadata_lock` held.
+    """
+    stripe.token_hub[username] = (token, timestamp)
+    heapq.heappush(stripe.token_expiry, (timestamp, username, token))
+
+
+def EvictTokens(stripe, issued_before: float, limit: int) -> tuple:
+    """
+    Pops up to `limit` index entries of tokens issued before
+    `issued_before`, evicting those still in the hub. Must be called with
+    the stripe's `metadata_lock` held.
+
+    Returns:
+        tuple: The number of index entries popped and the number of tokens
+        evicted from the hub.
+    """
+    expiry = stripe.token_expiry
+    hub = stripe.token_hub
+    popped = evicted = 0
+    while popped < limit and expiry and expiry[0][0] < issued_before:
+        timestamp, username, token = heapq.heappop(expiry)
+        popped += 1
+        if hub.get(username) == (token, timestamp):
+            del hub[username]
+            evicted += 1
+    return popped, evicted
+
+
+class TokenSweeper:
+    """
+    The background thread that evicts a server's expired tokens.
+
+    The thread starts with the first token the server issues. Its settings
+    are read from the server on every sweep: `token_ttl`, `sweep_interval`
+    and `sweep_batch`. Every sweep counts its evictions and its duration in
+    the server's `metrics` and records the size of the token hub.
+
+    Args:
+        server: The `ChatServer` whose `storage` is swept.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.thread = None
+        self.lock = mp.Lock()
+
+    def Start(self) -> None:
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = mp.Thread(target=self.Run, daemon=True)
+                self.thread.start()
+
+    def Run(self) -> None:
+        while True:
+            time.sleep(self.server.sweep_interval)
+            self.Sweep()
+
+    def Sweep(self) -> int:
+        """
+        Evicts every token that has expired from the server's storage.
+
+        Returns:
+            int: The number of tokens evicted.
+        """
+        server = self.server
+        batch = server.sweep_batch
+        start = time.perf_counter()
+        issued_before = time.time() - server.token_ttl
+        evicted, size = server.storage.EvictTokens(issued_before, batch)
+        elapsed = round((time.perf_counter() - start) * 1e6)
+
+        metrics = server.metrics
+        metrics.Increment(TOKEN_SWEEPS)
+        metrics.Increment(TOKENS_EVICTED, evicted)
+        metrics.Increment(TOKEN_SWEEP_US, elapsed)
+        metrics.SetGauge(LAST_TOKEN_SWEEP_US, elapsed)
+        metrics.SetGauge(TOKEN_HUB_SIZE, size)
+        return evicted
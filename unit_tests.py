@@ -1,9 +1,113 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading as mp
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
 from colorama import Fore, Style
 
+import grpc
+
 import chat_pb2
+import chat_pb2_grpc
+import storage
+import striping
 import wire_protocol as wp
+import write_ahead_log
+from engine import Engine
+from dispatcher import (BUCKET_EVICTIONS, ERROR_INVALID_TOKEN,
+                        ERROR_RATE_LIMITED, AuthMiddleware, ErrorCodeReader,
+                        RateLimitMiddleware, TracingMiddleware)
+from grpc_server import AsyncChatServer
 from grpc_server import ChatServer as gRPCChatServer
 from socket_server import ChatServer as SocketChatServer
+from socket_server import (ERROR_PUSH_UNAVAILABLE, IDLE_CONNECTIONS_REAPED,
+                           KEEPALIVE_PINGS_SENT, READS_PAUSED,
+                           SLOW_CONSUMERS_EVICTED, LiveConnection, Reactor)
+from sharded_server import ShardedChatServer, ShardOf
+
+
+def StartSocketServer(server):
+    """
+    Serves `server` on an ephemeral localhost port from a background thread,
+    handling each connection on its own thread as socket_server.py does.
+
+    Returns:
+        int: The port the server is listening on.
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("localhost", 0))
+    listener.listen(10)
+
+    def AcceptLoop():
+        while True:
+            c, addr = listener.accept()
+            mp.Thread(target=server.HandleNewConnection,
+                      args=(c, addr), daemon=True).start()
+
+    mp.Thread(target=AcceptLoop, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def StartAsyncioServer(server):
+    """
+    Serves `server` on an ephemeral localhost port from an event loop
+    running on a background thread, as `socket_server.py --mode asyncio`
+    does.
+
+    Returns:
+        int: The port the server is listening on.
+    """
+    loop = asyncio.new_event_loop()
+    mp.Thread(target=loop.run_forever, daemon=True).start()
+    listener = asyncio.run_coroutine_threadsafe(
+        asyncio.start_server(server.HandleStream, "localhost", 0),
+        loop).result()
+    return listener.sockets[0].getsockname()[1]
+
+
+def StartReactorServer(server, workers=4, max_connections=1024):
+    """
+    Serves `server` on an ephemeral localhost port from a `Reactor` running
+    on a background thread.
+
+    Returns:
+        tuple: The port the server is listening on and the reactor.
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("localhost", 0))
+    listener.listen(1024)
+    reactor = Reactor(server, listener, workers, max_connections)
+    mp.Thread(target=reactor.Run, daemon=True).start()
+    return listener.getsockname()[1], reactor
+
+
+def StartAioServer(servicer):
+    """
+    Serves `servicer` with a `grpc.aio` server on an ephemeral localhost
+    port, from an event loop running on a background thread, as
+    `grpc_server.py --mode aio` does.
+
+    Returns:
+        tuple: The port the server is listening on and the server, which
+        stops once it is garbage collected.
+    """
+    loop = asyncio.new_event_loop()
+    mp.Thread(target=loop.run_forever, daemon=True).start()
+
+    async def Start():
+        server = grpc.aio.server()
+        chat_pb2_grpc.add_ChatServerServicer_to_server(servicer, server)
+        port = server.add_insecure_port("localhost:0")
+        await server.start()
+        return port, server
+
+    return asyncio.run_coroutine_threadsafe(Start(), loop).result()
 
 
 def GenerateTokenTest():
@@ -390,7 +494,8 @@ def DeliverMessageTest():
     msg = wp.encode.RefreshRequest(
         version=1,
         auth_token=second_resp.auth_token,
-        username="apumishra")
+        username="apumishra",
+        wait_ms=0)
 
     # Call the DeliverMessages method and assert that the returned message
     # matches the expected message
@@ -670,6 +775,2074 @@ def DeleteAccountTest():
     print(Fore.GREEN + "Socket DeleteAccountTest Passed" + Style.RESET_ALL)
 
 
+def FramingTest():
+    """
+    Test that the socket server reads exact frames, so that coalesced
+    requests and replies larger than a single recv are handled intact.
+    """
+    server = SocketChatServer()
+
+    # serve one end of a connected socket pair on a background thread
+    server_sck, client_sck = socket.socketpair()
+    mp.Thread(target=server.HandleNewConnection,
+              args=(server_sck, None), daemon=True).start()
+
+    # write two requests with a single call so that they arrive coalesced
+    first = wp.encode.AccountCreateRequest(version=1,
+                                           username="aakamishra",
+                                           password="hahaha",
+                                           fullname="Aakash Mishra")
+    second = wp.encode.AccountCreateRequest(version=1,
+                                            username="apumishra",
+                                            password="hahaha",
+                                            fullname="Apurva Mishra")
+    second = wp.frame.SetRequestId(second, 7)
+    client_sck.sendall(first + second)
+
+    first_resp = wp.socket_types.AccountCreateReply(
+        wp.frame.ReadFrame(client_sck))
+    second_resp = wp.socket_types.AccountCreateReply(
+        wp.frame.ReadFrame(client_sck))
+    assert len(first_resp.error_code) == 0
+    assert len(second_resp.error_code) == 0
+    # the reply carries the id of the request it answers
+    assert first_resp.request_id == 0
+    assert second_resp.request_id == 7
+
+    # send a message that is larger than any single recv and that contains
+    # the old field delimiter
+    body = "||".join(["x" * 100] * 1000)
+    client_sck.sendall(wp.encode.MessageRequest(
+        version=1,
+        username="aakamishra",
+        auth_token=first_resp.auth_token,
+        recipient_username="apumishra",
+        message=body))
+    resp = wp.socket_types.MessageReply(wp.frame.ReadFrame(client_sck))
+    assert len(resp.error_code) == 0
+
+    client_sck.sendall(wp.encode.RefreshRequest(
+        version=1,
+        auth_token=second_resp.auth_token,
+        username="apumishra",
+        wait_ms=0))
+    resp = wp.socket_types.RefreshReply(wp.frame.ReadFrame(client_sck))
+    assert resp.message == "[aakamishra]: " + body
+
+    # a truncated frame fails to decode instead of being misread
+    raw = wp.encode.LoginRequest(version=1,
+                                 username="aakamishra",
+                                 password="hahaha")
+    resp = wp.socket_types.LoginRequest(raw[:-1])
+    assert resp.generated_error_code is not None
+
+    client_sck.close()
+    print(Fore.GREEN + "Socket FramingTest Passed" + Style.RESET_ALL)
+
+
+def LazyDecodeTest():
+    """
+    Test that socket messages only convert the fields that are read.
+    """
+    raw = wp.encode.MessageRequest(version=1,
+                                   username="aakamishra",
+                                   auth_token="token",
+                                   recipient_username="apumishra",
+                                   message="x" * 10000)
+    msg = wp.socket_types.MessageRequest(raw)
+    assert msg.generated_error_code is None
+
+    # reading the small fields leaves the body undecoded
+    body_index = 4
+    assert msg.auth_token == "token"
+    assert msg.username == "aakamishra"
+    assert not isinstance(msg._state[body_index], str)
+
+    # the body is converted on first access and cached afterwards
+    assert msg.message == "x" * 10000
+    assert msg._state[body_index] is msg.message
+    assert msg.version == 1
+
+    # invalid text is only reported when the field is read
+    raw = wp.frame.Encode(2,
+                          wp.frame.Int(1),
+                          wp.frame.Str("token"),
+                          wp.frame.Str("aakamishra"),
+                          wp.frame.Str("apumishra"),
+                          wp.frame.LENGTH.pack(2) + b"\xff\xfe")
+    msg = wp.socket_types.MessageRequest(raw)
+    assert msg.generated_error_code is None
+    assert msg.recipient_username == "apumishra"
+    try:
+        msg.message
+        assert False
+    except UnicodeDecodeError:
+        pass
+
+    # fields of a message that failed to decode read as None
+    msg = wp.socket_types.MessageRequest(raw[:-1])
+    assert msg.generated_error_code is not None
+    assert msg.message is None
+    print(Fore.GREEN + "Socket LazyDecodeTest Passed" + Style.RESET_ALL)
+
+
+def MultiplexedStubTest():
+    """
+    Test that one socket stub can carry many requests in flight at once and
+    from several threads, with every reply delivered to its own caller.
+    """
+    port = StartSocketServer(SocketChatServer())
+    stub = wp.client_stub.ChatServerStub("localhost", port)
+
+    # pipeline a burst of requests without waiting on any reply
+    futures = []
+    for i in range(50):
+        futures.append(stub.Submit(wp.encode.AccountCreateRequest(
+            version=1,
+            username=f"user{i}",
+            password="hahaha",
+            fullname=f"User {i}")))
+    for i, future in enumerate(futures):
+        resp = wp.socket_types.AccountCreateReply(future.result(5))
+        assert len(resp.error_code) == 0
+        assert resp.fullname == f"User {i}"
+
+    # concurrent callers on the shared connection each get their own reply
+    failures = []
+
+    def Caller(i):
+        for _ in range(20):
+            resp = stub.Login(wp.encode.LoginRequest(version=1,
+                                                     username=f"user{i}",
+                                                     password="hahaha"))
+            if resp.fullname != f"User {i}":
+                failures.append(i)
+
+    threads = [mp.Thread(target=Caller, args=(i,)) for i in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(failures) == 0
+
+    # outstanding and later requests fail once the connection is gone
+    stub.Close()
+    try:
+        stub.Submit(wp.encode.LoginRequest(version=1,
+                                           username="user0",
+                                           password="hahaha"))
+        assert False
+    except ConnectionError:
+        pass
+    print(Fore.GREEN + "Socket MultiplexedStubTest Passed" + Style.RESET_ALL)
+
+
+def BatchSendMessageTest():
+    """
+    Test sending a batch of messages with a single socket request.
+    """
+    server = SocketChatServer()
+
+    # create a sender and two recipients
+    tokens = {}
+    for username in ["aakamishra", "apumishra", "jwaldo"]:
+        msg = wp.encode.AccountCreateRequest(version=1,
+                                             username=username,
+                                             password="hahaha",
+                                             fullname=username)
+        resp = wp.socket_types.AccountCreateReply(server.CreateAccount(msg))
+        tokens[username] = resp.auth_token
+
+    # one of the recipients does not exist, the rest are still delivered
+    msg = wp.encode.BatchMessageRequest(
+        version=1,
+        auth_token=tokens["aakamishra"],
+        username="aakamishra",
+        recipient_usernames=["apumishra", "nobody", "jwaldo", "apumishra"],
+        messages=["hi!", "hello?", "hey!", "bye!"])
+    resp = wp.socket_types.BatchMessageReply(server.ReceiveMessages(msg))
+    assert len(resp.error_code) == 0
+    assert resp.status_codes == [wp.message.STATUS_DELIVERED,
+                                 wp.message.STATUS_INVALID_RECIPIENT,
+                                 wp.message.STATUS_DELIVERED,
+                                 wp.message.STATUS_DELIVERED]
+    assert list(server.user_inbox["apumishra"]) == ["[aakamishra]: hi!",
+                                                    "[aakamishra]: bye!"]
+    assert list(server.user_inbox["jwaldo"]) == ["[aakamishra]: hey!"]
+
+    # the batch is rejected as a whole with a bad token
+    msg = wp.encode.BatchMessageRequest(
+        version=1,
+        auth_token=tokens["apumishra"],
+        username="aakamishra",
+        recipient_usernames=["jwaldo"],
+        messages=["hi!"])
+    resp = wp.socket_types.BatchMessageReply(server.ReceiveMessages(msg))
+    assert len(resp.error_code) > 0
+    assert resp.status_codes == []
+
+    # and when recipients and messages do not pair up
+    msg = wp.encode.BatchMessageRequest(
+        version=1,
+        auth_token=tokens["aakamishra"],
+        username="aakamishra",
+        recipient_usernames=["jwaldo", "apumishra"],
+        messages=["hi!"])
+    resp = wp.socket_types.BatchMessageReply(server.ReceiveMessages(msg))
+    assert len(resp.error_code) > 0
+
+    # check invalid buffer input
+    raw = server.ReceiveMessages("invalid-buffer".encode("ascii"))
+    resp = wp.socket_types.BatchMessageReply(raw)
+    assert len(resp.error_code) > 0
+    print(Fore.GREEN + "Socket BatchSendMessageTest Passed" + Style.RESET_ALL)
+
+
+def CompressionTest():
+    """
+    Test that large replies are compressed only for connections that
+    accept compression, and that compressed frames decode transparently.
+    """
+    # large payloads shrink and round trip, small payloads are left alone
+    body = "\n".join(f"[aakamishra]: message {i}" for i in range(500))
+    raw = wp.encode.RefreshReply(version=1, message=body, error_code="")
+    compressed = wp.frame.Compress(raw)
+    assert len(compressed) < len(raw) // 4
+    assert wp.frame.DecodeHeader(compressed).flags & wp.frame.FLAG_COMPRESSED
+    assert wp.frame.Decompress(compressed) == raw
+    assert wp.socket_types.RefreshReply(compressed).message == body
+
+    small = wp.encode.MessageReply(version=1, error_code="")
+    assert wp.frame.Compress(small) is small
+
+    # a corrupt compressed payload fails to decode
+    resp = wp.socket_types.RefreshReply(compressed[:-4])
+    assert resp.generated_error_code is not None
+
+    def DrainInbox(accept_compression):
+        server = SocketChatServer()
+        server_sck, client_sck = socket.socketpair()
+        mp.Thread(target=server.HandleNewConnection,
+                  args=(server_sck, None), daemon=True).start()
+        flags = wp.frame.FLAG_ACCEPT_COMPRESSION if accept_compression else 0
+
+        client_sck.sendall(wp.frame.SetRequestId(
+            wp.encode.AccountCreateRequest(version=1,
+                                           username="apumishra",
+                                           password="hahaha",
+                                           fullname="Apurva Mishra"),
+            1, flags))
+        resp = wp.socket_types.AccountCreateReply(
+            wp.frame.ReadFrame(client_sck))
+        server.user_inbox["apumishra"] = body.split("\n")
+
+        client_sck.sendall(wp.frame.SetRequestId(
+            wp.encode.RefreshRequest(version=1,
+                                     auth_token=resp.auth_token,
+                                     username="apumishra",
+                                     wait_ms=0),
+            2, flags))
+        reply = wp.frame.ReadFrame(client_sck, decompress=False)
+        client_sck.close()
+        return reply
+
+    reply = DrainInbox(accept_compression=True)
+    assert wp.frame.DecodeHeader(reply).flags & wp.frame.FLAG_COMPRESSED
+    assert len(reply) < len(raw) // 4
+    assert wp.socket_types.RefreshReply(reply).message == body
+
+    reply = DrainInbox(accept_compression=False)
+    assert not wp.frame.DecodeHeader(reply).flags & wp.frame.FLAG_COMPRESSED
+    assert wp.socket_types.RefreshReply(reply).message == body
+    print(Fore.GREEN + "Socket CompressionTest Passed" + Style.RESET_ALL)
+
+
+def HandshakeTest():
+    """
+    Test that the handshake agrees on connection settings, that frames
+    sent afterwards are served with them, and that clients speaking the
+    original text encoding are still served.
+    """
+    server = SocketChatServer()
+    server.max_frame_size = 1 << 20
+    port = StartSocketServer(server)
+
+    # the stub and the server agree on binary frames with compression and
+    # the smaller frame size limit
+    stub = wp.client_stub.ChatServerStub("localhost", port,
+                                         max_frame_size=1 << 16)
+    assert stub.settings.negotiated
+    assert stub.settings.protocol_version == wp.frame.PROTOCOL_VERSION
+    assert stub.settings.codec == wp.handshake.CODEC_BINARY
+    assert stub.settings.compression == wp.handshake.COMPRESSION_ZLIB
+    assert stub.settings.max_frame_size == 1 << 16
+    resp = stub.CreateAccount(wp.encode.AccountCreateRequest(
+        version=1, username="aakamishra", password="pw", fullname="Aakash"))
+    assert len(resp.error_code) == 0
+    stub.Close()
+
+    # without compression on offer none is used
+    stub = wp.client_stub.ChatServerStub("localhost", port, compression=False)
+    assert stub.settings.compression == wp.handshake.COMPRESSION_NONE
+    stub.Close()
+
+    # an offer without a common protocol version is rejected and the
+    # connection closed
+    sck = socket.create_connection(("localhost", port))
+    sck.sendall(wp.encode.HandshakeRequest(
+        version=1, protocol_versions=[9], codecs=["binary"],
+        compressions=[], max_frame_size=0))
+    reply = wp.socket_types.HandshakeReply(wp.frame.ReadFrame(sck))
+    assert reply.error_code == wp.handshake.ERROR_NO_COMMON_VERSION
+    assert wp.frame.ReadFrame(sck) is None
+    sck.close()
+
+    # a client that predates the handshake speaks the text encoding
+    sck = socket.create_connection(("localhost", port))
+    sck.sendall(b"0||1||apumishra||hahaha||Apurva Mishra")
+    args = sck.recv(1024).decode("UTF-8").split("||")
+    assert args[:3] == ["0", "1", ""]
+    token = args[3]
+    sck.sendall(f"5||1||{token}||apumishra".encode("UTF-8"))
+    assert sck.recv(1024) == b"5||1||||No new message"
+    sck.sendall(b"3||one||token||apumishra||10||.*")
+    assert sck.recv(1024) == \
+        f"3||1||{wp.message.ERROR_ARG_TYPE}||".encode("UTF-8")
+    sck.sendall(b"4||1||token")
+    assert sck.recv(1024) == \
+        f"4||1||{wp.message.ERROR_ARGS_LENGTH}".encode("UTF-8")
+    sck.close()
+
+    # the text codec can also be chosen in a handshake
+    sck = socket.create_connection(("localhost", port))
+    sck.sendall(wp.encode.HandshakeRequest(
+        version=1, protocol_versions=[wp.frame.PROTOCOL_VERSION],
+        codecs=["text"], compressions=[], max_frame_size=0))
+    reply = wp.socket_types.HandshakeReply(wp.frame.ReadFrame(sck))
+    assert reply.error_code == ""
+    assert reply.codec == wp.handshake.CODEC_TEXT
+    assert reply.max_frame_size == 1 << 20
+    sck.sendall(f"5||1||{token}||apumishra".encode("UTF-8"))
+    assert sck.recv(1024) == b"5||1||||No new message"
+    sck.close()
+    print(Fore.GREEN + "Socket HandshakeTest Passed" + Style.RESET_ALL)
+
+
+def ScatterGatherTest():
+    """
+    Test that segmented frames are written completely, even when they are
+    larger than the socket buffer and have more segments than one sendmsg
+    call takes, and that the frame writer stamps request ids without
+    touching the frame it was given.
+    """
+    sender, receiver = socket.socketpair()
+    sender.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    segments = [bytes([i % 256]) * 1000 for i in range(3000)]
+    expected = b"".join(segments)
+    received = bytearray(len(expected))
+    reader = mp.Thread(target=wp.frame.RecvInto,
+                       args=(receiver, memoryview(received)))
+    reader.start()
+    wp.frame.SendSegments(sender, segments)
+    reader.join()
+    assert received == expected
+    sender.close()
+    receiver.close()
+
+    # a joined frame and its segments go out as the same bytes
+    sender, receiver = socket.socketpair()
+    writer = wp.frame.FrameWriter(sender)
+    raw = wp.encode.RefreshReply(version=1, message="hi!" * 1000,
+                                 error_code="")
+    writer.Send(raw, 7, wp.frame.FLAG_ACCEPT_COMPRESSION)
+    writer.Send(wp.encode.RefreshReplySegments(
+        version=1, message="hi!" * 1000, error_code=""), 8)
+    first = wp.frame.ReadFrame(receiver)
+    second = wp.frame.ReadFrame(receiver)
+    assert wp.frame.DecodeHeader(first).request_id == 7
+    assert wp.frame.DecodeHeader(first).flags == \
+        wp.frame.FLAG_ACCEPT_COMPRESSION
+    assert wp.frame.DecodeHeader(raw).request_id == 0
+    assert wp.frame.DecodeHeader(second).request_id == 8
+    assert first[wp.frame.HEADER.size:] == raw[wp.frame.HEADER.size:]
+    assert second[wp.frame.HEADER.size:] == raw[wp.frame.HEADER.size:]
+    sender.close()
+    receiver.close()
+
+    # the stub sends segmented requests as they are
+    port = StartSocketServer(SocketChatServer())
+    stub = wp.client_stub.ChatServerStub("localhost", port)
+    for username in ["aakamishra", "apumishra"]:
+        resp = stub.CreateAccount(wp.encode.AccountCreateRequestSegments(
+            version=1, username=username, password="pw", fullname=username))
+        assert len(resp.error_code) == 0
+    resp = stub.SendMessages(wp.encode.BatchMessageRequestSegments(
+        version=1, auth_token=resp.auth_token, username="apumishra",
+        recipient_usernames=["aakamishra"] * 500,
+        messages=["hello"] * 500))
+    assert resp.status_codes == [wp.message.STATUS_DELIVERED] * 500
+    stub.Close()
+    print(Fore.GREEN + "Socket ScatterGatherTest Passed" + Style.RESET_ALL)
+
+
+def AsyncioServerTest():
+    """
+    Test that the asyncio server mode serves stub and text clients with the
+    regular handlers, offloads account listings to the executor, and holds
+    many connections without starting a thread for each.
+    """
+    server = SocketChatServer()
+    server.executor = ThreadPoolExecutor(2)
+    port = StartAsyncioServer(server)
+
+    stub = wp.client_stub.ChatServerStub("localhost", port)
+    assert stub.settings.negotiated
+    tokens = {}
+    for username in ["aakamishra", "apumishra"]:
+        resp = stub.CreateAccount(wp.encode.AccountCreateRequest(
+            version=1, username=username, password="pw", fullname=username))
+        assert len(resp.error_code) == 0
+        tokens[username] = resp.auth_token
+    resp = stub.SendMessage(wp.encode.MessageRequest(
+        version=1, auth_token=tokens["apumishra"], username="apumishra",
+        recipient_username="aakamishra", message="hi!" * 1000))
+    assert len(resp.error_code) == 0
+    resp = stub.DeliverMessages(wp.encode.RefreshRequest(
+        version=1, auth_token=tokens["aakamishra"], username="aakamishra",
+        wait_ms=0))
+    assert resp.message == "[apumishra]: " + "hi!" * 1000
+
+    # listings run on the executor's threads
+    handled_on = []
+    list_accounts = server.ListAccounts
+
+    def ListAccounts(raw_bytes):
+        handled_on.append(mp.current_thread().name)
+        return list_accounts(raw_bytes)
+
+    server.dispatcher.Register(wp.frame.OP_LIST_ACCOUNTS, "ListAccounts",
+                               ListAccounts)
+    resp = stub.ListAccounts(wp.encode.ListAccountRequest(
+        version=1, auth_token=tokens["apumishra"], username="apumishra",
+        number_of_accounts=10, regex="apu.*"))
+    assert resp.account_names == "apumishra"
+    assert handled_on[0].startswith("ThreadPoolExecutor")
+    stub.Close()
+
+    # a text client is served too
+    sck = socket.create_connection(("localhost", port))
+    sck.sendall(f"5||1||{tokens['aakamishra']}||aakamishra".encode("UTF-8"))
+    assert sck.recv(1024) == b"5||1||||No new message"
+    sck.close()
+
+    # idle connections do not cost a thread each
+    threads = mp.active_count()
+    idle = [socket.create_connection(("localhost", port)) for _ in range(200)]
+    stub = wp.client_stub.ChatServerStub("localhost", port)
+    resp = stub.Login(wp.encode.LoginRequest(
+        version=1, username="apumishra", password="pw"))
+    assert len(resp.error_code) == 0
+    assert mp.active_count() <= threads + 1
+    stub.Close()
+    for sck in idle:
+        sck.close()
+    server.executor.shutdown()
+    print(Fore.GREEN + "Socket AsyncioServerTest Passed" + Style.RESET_ALL)
+
+
+def ReactorServerTest():
+    """
+    Test that the reactor serves pipelined stub requests, large replies and
+    text clients from a fixed number of threads, and turns away
+    connections over its limit.
+    """
+    server = SocketChatServer()
+    threads = mp.active_count()
+    port, reactor = StartReactorServer(server, workers=4, max_connections=60)
+
+    stub = wp.client_stub.ChatServerStub("localhost", port)
+    assert stub.settings.negotiated
+    futures = [stub.Submit(wp.encode.AccountCreateRequest(
+        version=1, username=f"user{i}", password="pw", fullname="User"))
+        for i in range(50)]
+    tokens = [wp.socket_types.AccountCreateReply(f.result(5)).auth_token
+              for f in futures]
+    assert all(tokens)
+
+    # a reply far larger than the socket buffers is written in full
+    server.user_inbox["user0"] = ["hi!" * 100] * 5000
+    resp = stub.DeliverMessages(wp.encode.RefreshRequest(
+        version=1, auth_token=tokens[0], username="user0", wait_ms=0))
+    assert resp.message == "\n".join(["hi!" * 100] * 5000)
+
+    # text clients are served as well
+    sck = socket.create_connection(("localhost", port))
+    sck.sendall(f"5||1||{tokens[1]}||user1".encode("UTF-8"))
+    assert sck.recv(1024) == b"5||1||||No new message"
+    sck.close()
+
+    # many connections, a fixed number of threads
+    clients = [socket.create_connection(("localhost", port))
+               for _ in range(40)]
+    for i, sck in enumerate(clients):
+        sck.sendall(wp.encode.LoginRequest(version=1, username=f"user{i}",
+                                           password="pw", request_id=i + 1))
+    for i, sck in enumerate(clients):
+        reply = wp.frame.ReadFrame(sck)
+        assert wp.frame.DecodeHeader(reply).request_id == i + 1
+        assert wp.socket_types.LoginReply(reply).error_code == ""
+    # the reactor, its workers, the stub's reader, the idle reaper and the
+    # token sweeper
+    assert mp.active_count() <= threads + 1 + 4 + 1 + 1 + 1
+
+    # connections over the limit are closed straight away
+    extra = [socket.create_connection(("localhost", port))
+             for _ in range(30)]
+    closed = 0
+    for sck in extra:
+        sck.settimeout(0.5)
+        try:
+            if sck.recv(1) == b"":
+                closed += 1
+        except socket.timeout:
+            pass
+        except ConnectionResetError:
+            closed += 1
+    assert closed >= 10
+    for sck in clients + extra:
+        sck.close()
+
+    stub.Close()
+    reactor.Stop()
+    print(Fore.GREEN + "Socket ReactorServerTest Passed" + Style.RESET_ALL)
+
+
+def ShardedServerTest():
+    """
+    Test that workers of a sharded server forward requests to the worker
+    that owns the user, deliver messages across shards and list the
+    accounts of every shard, whichever worker a client connects to.
+    """
+    ipc_dir = tempfile.mkdtemp()
+    peer_paths = [os.path.join(ipc_dir, f"shard{i}.sock") for i in range(3)]
+    servers = [ShardedChatServer(i, peer_paths) for i in range(3)]
+    for server in servers:
+        server.ListenForPeers()
+    stubs = [wp.client_stub.ChatServerStub(
+        "localhost", StartSocketServer(server)) for server in servers]
+
+    usernames = [f"user{i}" for i in range(12)]
+    assert len({ShardOf(username, 3) for username in usernames}) == 3
+    tokens = {}
+    for i, username in enumerate(usernames):
+        resp = stubs[i % 3].CreateAccount(wp.encode.AccountCreateRequest(
+            version=1, username=username, password="pw", fullname=username))
+        assert len(resp.error_code) == 0
+        tokens[username] = resp.auth_token
+    # every account lives only on the worker that owns it
+    for username in usernames:
+        owner = ShardOf(username, 3)
+        for shard, server in enumerate(servers):
+            assert (username in server.user_metadata_store) == \
+                (shard == owner)
+
+    resp = stubs[1].SendMessage(wp.encode.MessageRequest(
+        version=1, auth_token=tokens["user0"], username="user0",
+        recipient_username="user7", message="hello"))
+    assert len(resp.error_code) == 0
+    resp = stubs[2].SendMessages(wp.encode.BatchMessageRequest(
+        version=1, auth_token=tokens["user0"], username="user0",
+        recipient_usernames=usernames + ["nobody"],
+        messages=["batch"] * 13))
+    assert resp.status_codes == [wp.message.STATUS_DELIVERED] * 12 + \
+        [wp.message.STATUS_INVALID_RECIPIENT]
+
+    resp = stubs[0].DeliverMessages(wp.encode.RefreshRequest(
+        version=1, auth_token=tokens["user7"], username="user7", wait_ms=0))
+    assert resp.message == "[user0]: hello\n[user0]: batch"
+    resp = stubs[0].ListAccounts(wp.encode.ListAccountRequest(
+        version=1, auth_token=tokens["user3"], username="user3",
+        number_of_accounts=25, regex="user1.*"))
+    assert sorted(resp.account_names.split(", ")) == \
+        ["user1", "user10", "user11"]
+
+    # tokens are checked by the owning worker
+    resp = stubs[1].DeliverMessages(wp.encode.RefreshRequest(
+        version=1, auth_token=tokens["user3"], username="user7", wait_ms=0))
+    assert resp.error_code == "Invalid Token"
+
+    # only the owning worker pushes messages, others leave the client polling
+    for shard, stub in enumerate(stubs):
+        resp = stub.Subscribe(wp.encode.SubscribeRequest(
+            version=1, auth_token=tokens["user7"], username="user7"),
+            lambda messages: None)
+        expected = "" if shard == ShardOf("user7", 3) \
+            else ERROR_PUSH_UNAVAILABLE
+        assert resp.error_code == expected
+    for stub in stubs:
+        stub.Close()
+    print(Fore.GREEN + "Socket ShardedServerTest Passed" + Style.RESET_ALL)
+
+
+def DispatcherTest():
+    """
+    Test that the socket server's dispatcher times every request per opcode,
+    counts error replies and dropped requests, and runs the auth, rate limit
+    and tracing middleware in front of the handlers.
+    """
+    server = SocketChatServer()
+    chains = dict(server.dispatcher.chains)
+    token = wp.socket_types.AccountCreateReply(server.Dispatch(
+        wp.encode.AccountCreateRequest(version=1, username="alice",
+                                       password="pw", fullname="Alice"))
+    ).auth_token
+    refresh = wp.encode.RefreshRequest(version=1, auth_token=token,
+                                       username="alice", wait_ms=0)
+    for _ in range(3):
+        server.Dispatch(refresh)
+    server.Dispatch(wp.encode.RefreshRequest(version=1, auth_token="bad",
+                                             username="alice", wait_ms=0))
+    # an unknown opcode is dropped before reaching any handler
+    assert server.Dispatch(wp.frame.Encode(200, wp.frame.Int(1))) is None
+    # the chains are built once, not per request
+    assert server.dispatcher.chains == chains
+
+    snapshot = server.metrics.Snapshot()
+    assert snapshot["CreateAccount"]["count"] == 1
+    assert snapshot["CreateAccount"]["errors"] == 0
+    refreshes = snapshot["DeliverMessages"]
+    assert refreshes["count"] == 4
+    assert refreshes["error_codes"] == {"No new message": 3,
+                                        "Invalid Token": 1}
+    assert 0 < refreshes["p50"] <= refreshes["p99"]
+    assert snapshot["Login"]["count"] == 0
+    assert "DeliverMessages" in server.metrics.Report()
+
+    # error codes are read without decoding the rest of the reply
+    ErrorCode = ErrorCodeReader(wp.socket_types.RefreshReply)
+    assert ErrorCode(wp.encode.RefreshReply(
+        version=1, message="x" * 4096, error_code="")) == ""
+    assert ErrorCode(wp.encode.RefreshReply(
+        version=1, message="", error_code="No new message")) == \
+        "No new message"
+    assert ErrorCodeReader(wp.socket_types.ListAccountReply)(
+        wp.encode.ListAccountReply(version=1, error_code="bad regex",
+                                   account_names=["a", "b"])) == "bad regex"
+    assert ErrorCodeReader(None)(b"") == ""
+
+    # requests that cannot be decoded are counted as dropped
+    bad = wp.encode.RefreshRequest(version=1, auth_token=token,
+                                   username="alice", wait_ms=0)
+    bad = bad[:-9] + b"\xff" + bad[-8:]
+    assert server.Dispatch(bad) is None
+    assert server.metrics.Snapshot()["DeliverMessages"]["dropped"] == 1
+
+    tracing = TracingMiddleware(capacity=2)
+    server.dispatcher.Use(tracing)
+    server.dispatcher.Use(AuthMiddleware(server.ValidateToken))
+    server.dispatcher.Use(RateLimitMiddleware(rate=0.001, burst=2))
+    resp = wp.socket_types.ListAccountReply(server.Dispatch(
+        wp.encode.ListAccountRequest(version=1, auth_token="bad",
+                                     username="alice",
+                                     number_of_accounts=1, regex="(")))
+    assert resp.error_code == ERROR_INVALID_TOKEN
+    replies = [wp.socket_types.RefreshReply(server.Dispatch(refresh))
+               for _ in range(3)]
+    assert [r.error_code for r in replies] == \
+        ["No new message", "No new message", ERROR_RATE_LIMITED]
+    assert [span[1] for span in tracing.spans] == \
+        ["DeliverMessages", "DeliverMessages"]
+    assert all(span[4] == "ok" for span in tracing.spans)
+    # undecodable requests get past both middleware and are dropped
+    assert server.Dispatch(bad) is None
+    assert server.metrics.Snapshot()["DeliverMessages"]["dropped"] == 2
+
+    # buckets idle for long enough to refill are evicted a few at a time,
+    # least recently used first
+    limiter = RateLimitMiddleware(rate=10, burst=2)
+    for i in range(50):
+        assert limiter.Allow(f"user{i}")
+    assert len(limiter.buckets) == 50
+    time.sleep(0.25)
+    assert limiter.Allow("user49")
+    assert limiter.Allow("alice")
+    assert len(limiter.buckets) == 51 - 2 * BUCKET_EVICTIONS
+    assert list(limiter.buckets)[:2] == \
+        [f"user{2 * BUCKET_EVICTIONS}", f"user{2 * BUCKET_EVICTIONS + 1}"]
+    for _ in range(30):
+        limiter.Allow("alice")
+    assert list(limiter.buckets) == ["user49", "alice"]
+    print(Fore.GREEN + "Socket DispatcherTest Passed" + Style.RESET_ALL)
+
+
+def SlowConsumerTest():
+    """
+    Test that in every socket server mode a client that stops reading its
+    replies is disconnected once the slow consumer timeout passes, while
+    other clients of the same server are still served.
+    """
+    big_reply = wp.encode.LoginReply(version=1, error_code="",
+                                     auth_token="x" * 32768, fullname="")
+    for mode in ["threads", "asyncio", "reactor"]:
+        server = SocketChatServer()
+        server.outbound_high_watermark = 65536
+        server.outbound_low_watermark = 16384
+        server.slow_consumer_timeout = 0.5
+        server.dispatcher.Register(wp.frame.OP_LOGIN, "Login",
+                                   lambda data: big_reply)
+        if mode == "threads":
+            port = StartSocketServer(server)
+        elif mode == "asyncio":
+            port = StartAsyncioServer(server)
+        else:
+            port, _ = StartReactorServer(server)
+
+        # pipeline many requests whose replies are never read
+        stalled = socket.socket()
+        stalled.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        stalled.connect(("localhost", port))
+        stalled.sendall(wp.encode.LoginRequest(
+            version=1, username="a", password="b") * 200)
+
+        stub = wp.client_stub.ChatServerStub("localhost", port)
+        resp = stub.CreateAccount(wp.encode.AccountCreateRequest(
+            version=1, username="alice", password="pw", fullname="Alice"))
+        assert len(resp.error_code) == 0
+
+        deadline = time.monotonic() + 10
+        while SLOW_CONSUMERS_EVICTED not in server.metrics.Counters():
+            assert time.monotonic() < deadline, mode
+            time.sleep(0.05)
+        if mode != "threads":
+            assert server.metrics.Counters()[READS_PAUSED] == 1
+
+        # the evicted connection ends after what was already delivered
+        stalled.settimeout(5)
+        try:
+            while stalled.recv(65536):
+                pass
+        except ConnectionResetError:
+            pass
+        stalled.close()
+
+        resp = stub.Login(wp.encode.LoginRequest(
+            version=1, username="alice", password="pw"))
+        assert resp.auth_token == "x" * 32768
+        stub.Close()
+    print(Fore.GREEN + "Socket SlowConsumerTest Passed" + Style.RESET_ALL)
+
+
+def KeepaliveTest():
+    """
+    Test that in every socket server mode silent connections are pinged and
+    then closed by the idle connection reaper, while a stub that answers
+    the pings keeps its connection, and that clients can ping the server.
+    """
+    for mode in ["threads", "asyncio", "reactor"]:
+        server = SocketChatServer()
+        server.idle_timeout = 0.8
+        if mode == "threads":
+            port = StartSocketServer(server)
+        elif mode == "asyncio":
+            port = StartAsyncioServer(server)
+        else:
+            port, _ = StartReactorServer(server)
+
+        stub = wp.client_stub.ChatServerStub("localhost", port)
+        resp = stub.Ping(wp.encode.PingRequest(version=1, nonce=7))
+        assert resp.error_code == "" and resp.nonce == 7
+
+        # a client that never sends anything, one that handshakes but does
+        # not answer pings and a text client
+        silent = socket.create_connection(("localhost", port))
+        deaf = wp.client_stub.ChatServerStub("localhost", port)
+        deaf.AnswerPing = lambda ping: None
+        text = socket.create_connection(("localhost", port))
+        text.sendall(b"5||1||token||nobody")
+        text.recv(1024)
+
+        deadline = time.monotonic() + 10
+        while server.metrics.Counters().get(IDLE_CONNECTIONS_REAPED, 0) < 3:
+            assert time.monotonic() < deadline, mode
+            time.sleep(0.05)
+        assert server.metrics.Counters()[KEEPALIVE_PINGS_SENT] >= 2
+        assert stub.pings_answered >= 1
+        for sck in (silent, text):
+            sck.settimeout(5)
+            assert sck.recv(1024) == b""
+            sck.close()
+        try:
+            deaf.DeliverMessages(wp.encode.RefreshRequest(
+                version=1, auth_token="", username="", wait_ms=0))
+            assert False, mode
+        except ConnectionError:
+            pass
+
+        # the stub that answered every ping is still connected
+        resp = stub.Ping(wp.encode.PingRequest(version=1, nonce=8))
+        assert resp.nonce == 8
+        assert len(server.live_connections) == 1
+        stub.Close()
+        deaf.Close()
+    print(Fore.GREEN + "Socket KeepaliveTest Passed" + Style.RESET_ALL)
+
+
+def PushTest():
+    """
+    Test that in every socket server mode a subscribed stub has its
+    messages pushed as they arrive, and that messages a subscriber has not
+    acknowledged go back to its inbox when its connection closes.
+    """
+    def WaitFor(condition, mode):
+        deadline = time.monotonic() + 5
+        while not condition():
+            assert time.monotonic() < deadline, mode
+            time.sleep(0.01)
+
+    for mode in ["threads", "asyncio", "reactor"]:
+        server = SocketChatServer()
+        server.max_unacked = 2
+        if mode == "threads":
+            port = StartSocketServer(server)
+        elif mode == "asyncio":
+            port = StartAsyncioServer(server)
+        else:
+            port, _ = StartReactorServer(server)
+        stub = wp.client_stub.ChatServerStub("localhost", port)
+        tokens = {}
+        for username in ["alice", "bob", "carol"]:
+            tokens[username] = stub.CreateAccount(
+                wp.encode.AccountCreateRequest(
+                    version=1, username=username, password="pw",
+                    fullname=username)).auth_token
+
+        def Send(recipient, message):
+            resp = stub.SendMessage(wp.encode.MessageRequest(
+                version=1, auth_token=tokens["bob"], username="bob",
+                recipient_username=recipient, message=message))
+            assert resp.error_code == ""
+
+        # a message that arrived before subscribing is pushed straight away
+        Send("alice", "early")
+        alice = wp.client_stub.ChatServerStub("localhost", port)
+        received = []
+        resp = alice.Subscribe(wp.encode.SubscribeRequest(
+            version=1, auth_token=tokens["alice"], username="alice"),
+            received.extend)
+        assert resp.error_code == ""
+        WaitFor(lambda: received == ["[bob]: early"], mode)
+        Send("alice", "one")
+        Send("alice", "two")
+        WaitFor(lambda: len(received) == 3, mode)
+        assert received[1:] == ["[bob]: one", "[bob]: two"]
+        WaitFor(lambda: len(server.subscriptions["alice"]) == 0, mode)
+        resp = alice.DeliverMessages(wp.encode.RefreshRequest(
+            version=1, auth_token=tokens["alice"], username="alice",
+            wait_ms=0))
+        assert resp.error_code == "No new message"
+
+        resp = alice.Subscribe(wp.encode.SubscribeRequest(
+            version=1, auth_token="bad", username="alice"), received.extend)
+        assert resp.error_code == "Invalid Token"
+        alice.Close()
+
+        # a subscriber that never acknowledges keeps at most max_unacked
+        # messages buffered, the rest wait unpushed; all of them stay in its
+        # inbox until acknowledged
+        carol = wp.client_stub.ChatServerStub("localhost", port)
+        pushed = []
+        carol.ReceivePush = lambda push: pushed.append(push)
+        carol.Subscribe(wp.encode.SubscribeRequest(
+            version=1, auth_token=tokens["carol"], username="carol"),
+            lambda messages: None)
+        for i in range(3):
+            Send("carol", f"m{i}")
+        WaitFor(lambda: len(pushed) == 2, mode)
+        assert len(server.subscriptions["carol"]) == 2
+        assert list(server.user_inbox["carol"]) == [f"[bob]: m{i}"
+                                                    for i in range(3)]
+        carol.Close()
+        WaitFor(lambda: "carol" not in server.subscriptions, mode)
+        resp = stub.DeliverMessages(wp.encode.RefreshRequest(
+            version=1, auth_token=tokens["carol"], username="carol",
+            wait_ms=0))
+        assert resp.message == "[bob]: m0\n[bob]: m1\n[bob]: m2"
+        stub.Close()
+    print(Fore.GREEN + "Socket PushTest Passed" + Style.RESET_ALL)
+
+
+def LongPollTest():
+    """
+    Test that a RefreshRequest with a wait on an empty inbox is held until
+    a message arrives for that user, and no other, or until the wait is
+    over, for the gRPC server and every socket server mode. In the
+    asynchronous socket modes, waiting polls must not hold up other
+    requests.
+    """
+    server = gRPCChatServer()
+    tokens = {}
+    for username in ["alice", "bob", "carol"]:
+        tokens[username] = server.CreateAccount(chat_pb2.AccountCreateRequest(
+            version=1, username=username, password="pw",
+            fullname=username), None).auth_token
+    executor = ThreadPoolExecutor(2)
+    polls = {}
+    for username in ["alice", "carol"]:
+        polls[username] = executor.submit(
+            lambda username: [m.message for m in server.DeliverMessages(
+                chat_pb2.RefreshRequest(
+                    version=1, auth_token=tokens[username],
+                    username=username, wait_ms=5000), None)], username)
+    time.sleep(0.2)
+    assert not polls["alice"].done()
+    server.SendMessage(chat_pb2.MessageRequest(
+        version=1, auth_token=tokens["bob"], username="bob",
+        recipient_username="alice", message="hi"), None)
+    assert polls["alice"].result(2) == ["[bob]: hi"]
+    assert not polls["carol"].done()
+    server.DeleteAccount(chat_pb2.DeleteAccountRequest(
+        version=1, auth_token=tokens["carol"], username="carol"), None)
+    assert polls["carol"].result(2) == []
+    start = time.monotonic()
+    assert list(server.DeliverMessages(chat_pb2.RefreshRequest(
+        version=1, auth_token=tokens["alice"], username="alice",
+        wait_ms=100), None)) == []
+    assert time.monotonic() - start >= 0.09
+    executor.shutdown()
+    print(Fore.GREEN + "gRPC LongPollTest Passed" + Style.RESET_ALL)
+
+    for mode in ["threads", "asyncio", "reactor"]:
+        server = SocketChatServer()
+        if mode == "threads":
+            port = StartSocketServer(server)
+        elif mode == "asyncio":
+            port = StartAsyncioServer(server)
+        else:
+            port, _ = StartReactorServer(server, workers=1)
+        stub = wp.client_stub.ChatServerStub("localhost", port)
+        tokens = {}
+        for username in ["alice", "bob", "carol"]:
+            tokens[username] = stub.CreateAccount(
+                wp.encode.AccountCreateRequest(
+                    version=1, username=username, password="pw",
+                    fullname=username)).auth_token
+
+        pollers = {}
+        polls = {}
+        for username in ["alice", "carol"]:
+            pollers[username] = wp.client_stub.ChatServerStub("localhost",
+                                                              port)
+            polls[username] = pollers[username].Submit(
+                wp.encode.RefreshRequest(
+                    version=1, auth_token=tokens[username],
+                    username=username, wait_ms=5000))
+        time.sleep(0.2)
+        assert not polls["alice"].done(), mode
+        # the reactor's only worker is free while both polls wait
+        start = time.monotonic()
+        resp = stub.SendMessage(wp.encode.MessageRequest(
+            version=1, auth_token=tokens["bob"], username="bob",
+            recipient_username="alice", message="hi"))
+        assert resp.error_code == ""
+        assert time.monotonic() - start < 1, mode
+        resp = wp.socket_types.RefreshReply(polls["alice"].result(2))
+        assert resp.message == "[bob]: hi", mode
+        assert not polls["carol"].done(), mode
+
+        stub.DeleteAccount(wp.encode.DeleteAccountRequest(
+            version=1, auth_token=tokens["carol"], username="carol"))
+        resp = wp.socket_types.RefreshReply(polls["carol"].result(2))
+        assert resp.message == "" and resp.error_code, mode
+
+        start = time.monotonic()
+        resp = pollers["alice"].DeliverMessages(wp.encode.RefreshRequest(
+            version=1, auth_token=tokens["alice"], username="alice",
+            wait_ms=100))
+        assert resp.error_code == "No new message", mode
+        assert time.monotonic() - start >= 0.09, mode
+        for poller in pollers.values():
+            poller.Close()
+        stub.Close()
+    print(Fore.GREEN + "Socket LongPollTest Passed" + Style.RESET_ALL)
+
+
+def AioServerTest():
+    """
+    Test that the grpc.aio servicer holds more long polling streams than
+    the threaded server has workers, keeps answering other RPCs while they
+    wait, and wakes each stream with the messages for its user.
+    """
+    port, server = StartAioServer(AsyncChatServer())
+    channel = grpc.insecure_channel(f"localhost:{port}")
+    stub = chat_pb2_grpc.ChatServerStub(channel)
+    usernames = [f"user{i}" for i in range(40)]
+    tokens = {}
+    for username in usernames:
+        resp = stub.CreateAccount(chat_pb2.AccountCreateRequest(
+            version=1, username=username, password="pw", fullname=username))
+        assert resp.error_code == ""
+        tokens[username] = resp.auth_token
+
+    def Poll(username, wait_ms=10000):
+        return [msg.message for msg in stub.DeliverMessages(
+            chat_pb2.RefreshRequest(version=1, auth_token=tokens[username],
+                                    username=username, wait_ms=wait_ms))]
+
+    executor = ThreadPoolExecutor(len(usernames))
+    polls = [executor.submit(Poll, username) for username in usernames]
+    time.sleep(0.5)
+    assert not any(poll.done() for poll in polls)
+    start = time.monotonic()
+    resp = stub.ListAccounts(chat_pb2.ListAccountRequest(
+        version=1, auth_token=tokens["user0"], username="user0",
+        number_of_accounts=100, regex="user1"))
+    assert resp.error_code == ""
+    assert time.monotonic() - start < 1
+
+    for username in usernames:
+        resp = stub.SendMessage(chat_pb2.MessageRequest(
+            version=1, auth_token=tokens["user0"], username="user0",
+            recipient_username=username, message=f"to {username}"))
+        assert resp.error_code == ""
+    for username, poll in zip(usernames, polls):
+        assert poll.result(5) == [f"[user0]: to {username}"]
+
+    # a poll that finds nothing ends empty once its wait is over
+    start = time.monotonic()
+    assert Poll("user1", wait_ms=100) == []
+    assert time.monotonic() - start >= 0.09
+    executor.shutdown()
+    channel.close()
+    print(Fore.GREEN + "gRPC AioServerTest Passed" + Style.RESET_ALL)
+
+
+def LockStripingTest():
+    """
+    Test that users on different stripes do not wait on each other's
+    locks, that a batch reaching several stripes is delivered whole, and
+    that listings keep the order accounts were created in across stripes.
+    """
+    for name, server in [("Socket", SocketChatServer(stripes=4)),
+                         ("gRPC", gRPCChatServer(stripes=4))]:
+        usernames = [f"user{i}" for i in range(12)]
+        tokens = {}
+        for username in usernames:
+            if name == "Socket":
+                resp = wp.socket_types.AccountCreateReply(
+                    server.CreateAccount(wp.encode.AccountCreateRequest(
+                        version=1, username=username, password="pw",
+                        fullname=username)))
+            else:
+                resp = server.CreateAccount(chat_pb2.AccountCreateRequest(
+                    version=1, username=username, password="pw",
+                    fullname=username), None)
+            assert resp.error_code == ""
+            tokens[username] = resp.auth_token
+        assert len({server.stripes.Index(u) for u in usernames}) > 1
+        blocked = usernames[0]
+        other = next(u for u in usernames if server.stripes.Index(u) !=
+                     server.stripes.Index(blocked))
+
+        # hold the stripe of one user while the other's token is checked
+        stripe = server.stripes.Of(blocked)
+        executor = ThreadPoolExecutor(2)
+        with stripe.metadata_lock:
+            free = executor.submit(server.ValidateToken, other,
+                                   tokens[other])
+            assert free.result(1) == 0
+            waiting = executor.submit(server.ValidateToken, blocked,
+                                      tokens[blocked])
+            time.sleep(0.1)
+            assert not waiting.done()
+        assert waiting.result(1) == 0
+        executor.shutdown()
+
+        if name == "Socket":
+            # one batch to every user lands in every stripe
+            resp = wp.socket_types.BatchMessageReply(server.ReceiveMessages(
+                wp.encode.BatchMessageRequest(
+                    version=1, auth_token=tokens[other], username=other,
+                    recipient_usernames=usernames + ["nobody"],
+                    messages=["hi!"] * (len(usernames) + 1))))
+            assert resp.status_codes == \
+                [wp.message.STATUS_DELIVERED] * len(usernames) + \
+                [wp.message.STATUS_INVALID_RECIPIENT]
+            for username in usernames:
+                assert list(server.user_inbox[username]) == \
+                    [f"[{other}]: hi!"]
+            resp = wp.socket_types.ListAccountReply(server.ListAccounts(
+                wp.encode.ListAccountRequest(
+                    version=1, auth_token=tokens[other], username=other,
+                    number_of_accounts=100, regex="")))
+        else:
+            resp = server.ListAccounts(chat_pb2.ListAccountRequest(
+                version=1, auth_token=tokens[other], username=other,
+                number_of_accounts=100, regex=""), None)
+        assert resp.account_names == ", ".join(usernames)
+        assert "nobody" not in server.user_inbox
+        print(Fore.GREEN + f"{name} LockStripingTest Passed" +
+              Style.RESET_ALL)
+
+
+def InboxDrainTest():
+    """
+    Test that gRPC DeliverMessages streams a backlog in order across
+    several chunks, and that a stream closed early puts the messages it
+    has not sent back at the front of the inbox.
+    """
+    for server in [gRPCChatServer(), AsyncChatServer()]:
+        server.delivery_chunk = 64
+        # the servicer's own handlers are coroutines in the aio variant
+        token = gRPCChatServer.CreateAccount(
+            server, chat_pb2.AccountCreateRequest(
+                version=1, username="reader", password="pw",
+                fullname="reader"), None).auth_token
+        request = chat_pb2.RefreshRequest(version=1, auth_token=token,
+                                          username="reader", wait_ms=0)
+        messages = [f"[writer]: {i}" for i in range(1000)]
+        server.user_inbox["reader"].extend(messages)
+
+        if isinstance(server, AsyncChatServer):
+            async def Read(count):
+                stream = server.DeliverMessages(request, None)
+                received = []
+                async for reply in stream:
+                    received.append(reply.message)
+                    if len(received) == count:
+                        break
+                await stream.aclose()
+                return received
+        else:
+            async def Read(count):
+                stream = server.DeliverMessages(request, None)
+                received = [reply.message for _, reply in zip(range(count),
+                                                               stream)]
+                stream.close()
+                return received
+
+        # stopping partway through the second chunk
+        assert asyncio.run(Read(100)) == messages[:100]
+        assert list(server.user_inbox["reader"]) == messages[100:]
+        assert asyncio.run(Read(len(messages))) == messages[100:]
+        assert len(server.user_inbox["reader"]) == 0
+    print(Fore.GREEN + "gRPC InboxDrainTest Passed" + Style.RESET_ALL)
+
+
+def TokenExpiryTest():
+    """
+    Test that tokens expire after the configured time to live, that a sweep
+    evicts expired tokens in batches while keeping ones renewed by a later
+    login, and that the background sweeper reports its work in `metrics`.
+    """
+    def Create(server, username):
+        if isinstance(server, SocketChatServer):
+            return wp.socket_types.AccountCreateReply(server.CreateAccount(
+                wp.encode.AccountCreateRequest(
+                    version=1, username=username, password="pw",
+                    fullname=username))).auth_token
+        return server.CreateAccount(chat_pb2.AccountCreateRequest(
+            version=1, username=username, password="pw", fullname=username),
+            None).auth_token
+
+    def Login(server, username):
+        if isinstance(server, SocketChatServer):
+            return wp.socket_types.LoginReply(server.Login(
+                wp.encode.LoginRequest(version=1, username=username,
+                                       password="pw"))).auth_token
+        return server.Login(chat_pb2.LoginRequest(
+            version=1, username=username, password="pw"), None).auth_token
+
+    for name, server in [("Socket", SocketChatServer(stripes=2)),
+                         ("gRPC", gRPCChatServer(stripes=2))]:
+        server.token_ttl = 0.3
+        server.sweep_batch = 3
+        usernames = [f"user{i}" for i in range(10)]
+        tokens = {username: Create(server, username)
+                  for username in usernames}
+        # replaces user0's token, leaving the first one in the index
+        tokens["user0"] = Login(server, "user0")
+        assert server.ValidateToken("user2", tokens["user2"]) == 0
+
+        time.sleep(0.35)
+        tokens["user1"] = Login(server, "user1")
+        assert server.ValidateToken("user2", tokens["user2"]) < 0
+        assert len(server.token_hub) == 10
+        assert server.sweeper.Sweep() == 9
+        assert list(server.token_hub) == ["user1"]
+        assert server.ValidateToken("user1", tokens["user1"]) == 0
+        assert sum(len(stripe.token_expiry) for stripe in server.stripes) == 1
+        assert server.metrics.Counters()["tokens_evicted"] == 9
+        assert server.metrics.Gauges()["token_hub_size"] == 1
+        # the accounts themselves stay
+        assert len(server.user_metadata_store) == 10
+        assert Login(server, "user2") != ""
+
+        # the background sweeper runs every `sweep_interval` seconds
+        server = SocketChatServer() if name == "Socket" else gRPCChatServer()
+        server.token_ttl = 0.1
+        server.sweep_interval = 0.05
+        Create(server, "user0")
+        deadline = time.monotonic() + 5
+        while "user0" in server.token_hub:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        assert server.metrics.Counters()["token_sweeps"] > 0
+        assert "token_sweep_us" in server.metrics.Counters()
+        print(Fore.GREEN + f"{name} TokenExpiryTest Passed" + Style.RESET_ALL)
+
+
+def WriteAheadLogTest():
+    """
+    Test that a server restarted on its write-ahead log gets back every
+    account and every undelivered message, in order, including messages
+    pushed but not acknowledged and messages returned by a cancelled
+    stream, and that a record torn by a crash is cut off.
+    """
+    def Socket(path):
+        server = SocketChatServer(stripes=4)
+        server.OpenLog(path, window=0.001)
+        return server
+
+    def gRPC(path):
+        server = gRPCChatServer(stripes=4)
+        server.OpenLog(path, window=0.001)
+        return server
+
+    def Inboxes(server):
+        return {username: list(server.user_inbox[username])
+                for username in server.stripes.Usernames()}
+
+    for name, Open in [("Socket", Socket), ("gRPC", gRPC)]:
+        path = os.path.join(tempfile.mkdtemp(), "chat.wal")
+        server = Open(path)
+        tokens = {}
+        for username in ["carol", "alice", "bob", "dave"]:
+            if name == "Socket":
+                tokens[username] = wp.socket_types.AccountCreateReply(
+                    server.Dispatch(wp.encode.AccountCreateRequest(
+                        version=1, username=username, password="pw",
+                        fullname=username.title()))).auth_token
+            else:
+                tokens[username] = server.CreateAccount(
+                    chat_pb2.AccountCreateRequest(
+                        version=1, username=username, password="pw",
+                        fullname=username.title()), None).auth_token
+        # every reply came after its records were synced
+        assert server.wal.durable == server.wal.appended == 4
+
+        def Send(recipient, message):
+            if name == "Socket":
+                server.Dispatch(wp.encode.MessageRequest(
+                    version=1, auth_token=tokens["alice"], username="alice",
+                    recipient_username=recipient, message=message))
+            else:
+                server.SendMessage(chat_pb2.MessageRequest(
+                    version=1, auth_token=tokens["alice"], username="alice",
+                    recipient_username=recipient, message=message), None)
+
+        for i in range(5):
+            Send("bob", f"m{i}")
+        Send("carol", "hello")
+        Send("dave", "bye")
+        if name == "Socket":
+            # bob is pushed m0 to m4 and acknowledges m0 and m1, then polls
+            # m5 and m6 while m2 to m4 are still unacknowledged
+            live = LiveConnection(None, None)
+            live.push = lambda: None
+            server.Subscribe(wp.encode.SubscribeRequest(
+                version=1, auth_token=tokens["bob"], username="bob"), live)
+            assert live.subscription.TakeFrame() is not None
+            server.Acknowledge(wp.encode.PushAck(
+                version=1, error_code="", sequence=2), live)
+            server.Unsubscribe(live.subscription)
+            live.subscription = None
+            server.Subscribe(wp.encode.SubscribeRequest(
+                version=1, auth_token=tokens["bob"], username="bob"), live)
+            server.max_unacked = 3
+            Send("bob", "m5")
+            Send("bob", "m6")
+            server.DeliverMessages(wp.encode.RefreshRequest(
+                version=1, auth_token=tokens["bob"], username="bob",
+                wait_ms=0))
+            expected_bob = ["[alice]: m2", "[alice]: m3", "[alice]: m4"]
+            server.Dispatch(wp.encode.DeleteAccountRequest(
+                version=1, auth_token=tokens["dave"], username="dave"))
+        else:
+            # bob's stream is cancelled after m0 and m1, returning the rest
+            # of its chunk, which is sent out again in a chunk of two
+            server.delivery_chunk = 2
+            replies = server.InboxReplies("bob")
+            assert next(replies).message == "[alice]: m0"
+            replies.close()
+            replies = server.InboxReplies("bob")
+            assert next(replies).message == "[alice]: m1"
+            replies.close()
+            expected_bob = [f"[alice]: m{i}" for i in range(2, 5)]
+            server.DeleteAccount(chat_pb2.DeleteAccountRequest(
+                version=1, auth_token=tokens["dave"], username="dave"), None)
+        server.Commit()
+        if name == "Socket":
+            # what bob has not acknowledged is still queued for him
+            assert [m for _, m in live.subscription.unacked] == expected_bob
+        else:
+            assert Inboxes(server)["bob"] == expected_bob
+        server.wal.Close()
+
+        restarted = Open(path)
+        assert restarted.stripes.Usernames() == ["carol", "alice", "bob"]
+        assert Inboxes(restarted) == {"carol": ["[alice]: hello"],
+                                      "alice": [], "bob": expected_bob}
+        assert restarted.user_metadata_store["alice"] == ("pw", "Alice")
+        # tokens are not logged, users log in again
+        assert len(restarted.token_hub) == 0
+        restarted.wal.Close()
+
+        # a crash in the middle of a write leaves a torn record behind
+        size = os.path.getsize(path)
+        record = write_ahead_log.Record(write_ahead_log.ENQUEUE, "bob", "m9")
+        with open(path, "ab") as f:
+            f.write(record[:-3])
+        torn = type(restarted)(stripes=4)
+        replayed = torn.OpenLog(path)
+        assert os.path.getsize(path) == size
+        assert Inboxes(torn) == Inboxes(restarted)
+        assert replayed == len(list(write_ahead_log.ReadRecords(
+            write_ahead_log.ReadLog(path)[1])))
+        torn.wal.Close()
+        print(Fore.GREEN + f"{name} WriteAheadLogTest Passed" +
+              Style.RESET_ALL)
+
+
+def SnapshotTest():
+    """
+    Test that snapshots taken while messages are being sent restore the
+    same accounts and inboxes as the full log, that they delete the log
+    segments they cover so that a restart replays only the records after
+    them, and that records logged after a restart are replayed too.
+    """
+    def Open(server_type, path):
+        server = server_type(stripes=4)
+        server.snapshot_interval = 0
+        replayed = server.OpenLog(path, window=0.001)
+        return server, replayed
+
+    def Inboxes(server):
+        return {username: list(server.user_inbox[username])
+                for username in server.stripes.Usernames()}
+
+    for name, server_type in [("Socket", SocketChatServer),
+                              ("gRPC", gRPCChatServer)]:
+        path = os.path.join(tempfile.mkdtemp(), "chat.wal")
+        server, _ = Open(server_type, path)
+        usernames = [f"user{i}" for i in range(12)]
+        tokens = {}
+
+        def Send(username, recipient, message):
+            if name == "Socket":
+                server.Dispatch(wp.encode.MessageRequest(
+                    version=1, auth_token=tokens[username],
+                    username=username, recipient_username=recipient,
+                    message=message))
+            else:
+                server.SendMessage(chat_pb2.MessageRequest(
+                    version=1, auth_token=tokens[username],
+                    username=username, recipient_username=recipient,
+                    message=message), None)
+
+        def Drain(username):
+            if name == "Socket":
+                server.DeliverMessages(wp.encode.RefreshRequest(
+                    version=1, auth_token=tokens[username],
+                    username=username, wait_ms=0))
+            else:
+                list(server.InboxReplies(username))
+
+        for username in usernames:
+            tokens[username] = wp.socket_types.AccountCreateReply(
+                server.CreateAccount(wp.encode.AccountCreateRequest(
+                    version=1, username=username, password="pw",
+                    fullname=username))).auth_token \
+                if name == "Socket" else server.CreateAccount(
+                    chat_pb2.AccountCreateRequest(
+                        version=1, username=username, password="pw",
+                        fullname=username), None).auth_token
+
+        def Work(i):
+            for j in range(150):
+                sender = usernames[(i + j) % len(usernames)]
+                Send(sender, usernames[(i * 7 + j) % len(usernames)],
+                     f"{i}-{j}")
+                if j % 20 == 0:
+                    Drain(usernames[(i + j + 3) % len(usernames)])
+
+        workers = [mp.Thread(target=Work, args=(i,)) for i in range(4)]
+        for worker in workers:
+            worker.start()
+        while any(worker.is_alive() for worker in workers):
+            server.snapshotter.Take()
+            time.sleep(0.01)
+        for worker in workers:
+            worker.join()
+        snapshot_size = server.snapshotter.Take()
+        assert snapshot_size > 0
+        Send("user1", "user2", "after the snapshot")
+        server.Commit()
+        expected = Inboxes(server)
+        logged = server.wal.appended
+        server.wal.Close()
+        assert server.metrics.Counters()["snapshots"] >= 2
+        # the snapshot covers every closed segment
+        assert write_ahead_log.Segments(path) == []
+
+        restarted, replayed = Open(server_type, path)
+        assert replayed == 1 < logged
+        assert Inboxes(restarted) == expected
+        assert restarted.user_metadata_store["user3"] == ("pw", "user3")
+        # records logged after the restart carry on the numbering
+        assert restarted.wal.appended == logged
+        tokens["user1"] = wp.socket_types.LoginReply(restarted.Login(
+            wp.encode.LoginRequest(version=1, username="user1",
+                                   password="pw"))).auth_token \
+            if name == "Socket" else restarted.Login(chat_pb2.LoginRequest(
+                version=1, username="user1", password="pw"), None).auth_token
+        server = restarted
+        Send("user1", "user0", "after the restart")
+        server.Commit()
+        expected = Inboxes(server)
+        server.wal.Close()
+
+        again, replayed = Open(server_type, path)
+        assert replayed == 2
+        assert Inboxes(again) == expected
+        assert expected["user0"][-1] == "[user1]: after the restart"
+        again.wal.Close()
+        print(Fore.GREEN + f"{name} SnapshotTest Passed" + Style.RESET_ALL)
+
+
+def StorageBackendTest():
+    """
+    Test that the memory and SQLite storage backends agree on accounts,
+    tokens and inboxes, and that both servers keep every account and
+    undelivered message in SQLite storage across a restart, including
+    messages pushed but not acknowledged and messages returned by a
+    cancelled stream.
+    """
+    # a backend missing an operation fails when it is created
+    class Incomplete(storage.StorageBackend):
+        def Account(self, username):
+            return None
+
+    try:
+        Incomplete()
+        assert False
+    except TypeError:
+        pass
+
+    directory = tempfile.mkdtemp()
+    backends = [("Memory list", storage.MemoryStorage(striping.Stripes(4))),
+                ("Memory deque", storage.MemoryStorage(
+                    gRPCChatServer(stripes=4).stripes)),
+                ("SQLite", storage.SQLiteStorage(
+                    os.path.join(directory, "backends.db")))]
+    for name, backend in backends:
+        for username in ["carol", "alice", "bob"]:
+            backend.CreateAccount(username, "pw", username.title())
+        assert backend.Account("alice") == ("pw", "Alice")
+        assert backend.Account("nobody") is None
+        assert backend.Usernames() == ["carol", "alice", "bob"]
+
+        backend.IssueToken("alice", "old", 1.0)
+        backend.IssueToken("bob", "new", 3.0)
+        backend.IssueToken("alice", "renewed", 5.0)
+        assert tuple(backend.Token("alice")) == ("renewed", 5.0)
+        assert backend.EvictTokens(4.0, 1) == (1, 1)
+        assert backend.Token("bob") is None
+
+        assert backend.InboxLength("bob") == 0
+        assert backend.InboxLength("nobody") is None
+        backend.Enqueue([("bob", f"m{i}") for i in range(5)] +
+                        [("carol", "hello")])
+        assert backend.InboxLength("bob") == 5
+        assert backend.Peek("bob", 1, 2) == ["m1", "m2"]
+        assert backend.Take("bob", 1, 2) == ["m1", "m2"]
+        assert backend.Take("bob", 0, 1) == ["m0"]
+        backend.Requeue("bob", ["m1", "m2"])
+        assert backend.Take("bob", 2) == ["m3", "m4"]
+        assert backend.Take("bob") == ["m1", "m2"]
+        assert backend.Take("bob") == []
+        backend.Requeue("bob", ["m9"])
+        backend.Enqueue([("bob", "m10")])
+        assert backend.Peek("bob", 0, 10) == ["m9", "m10"]
+
+        backend.DeleteAccount("carol")
+        assert backend.Account("carol") is None
+        assert backend.InboxLength("carol") is None
+        assert backend.Take("carol") == []
+        assert backend.Usernames() == ["alice", "bob"]
+        backend.Close()
+        print(Fore.GREEN + f"{name} StorageBackendTest Passed" +
+              Style.RESET_ALL)
+
+    for name, server_type in [("Socket", SocketChatServer),
+                              ("gRPC", gRPCChatServer)]:
+        path = os.path.join(directory, f"{name}.db")
+        server = server_type(stripes=4, storage=storage.SQLiteStorage(path))
+        tokens = {}
+        for username in ["alice", "bob"]:
+            if name == "Socket":
+                tokens[username] = wp.socket_types.AccountCreateReply(
+                    server.Dispatch(wp.encode.AccountCreateRequest(
+                        version=1, username=username, password="pw",
+                        fullname=username.title()))).auth_token
+            else:
+                tokens[username] = server.CreateAccount(
+                    chat_pb2.AccountCreateRequest(
+                        version=1, username=username, password="pw",
+                        fullname=username.title()), None).auth_token
+        for i in range(5):
+            if name == "Socket":
+                server.Dispatch(wp.encode.MessageRequest(
+                    version=1, auth_token=tokens["alice"], username="alice",
+                    recipient_username="bob", message=f"m{i}"))
+            else:
+                server.SendMessage(chat_pb2.MessageRequest(
+                    version=1, auth_token=tokens["alice"], username="alice",
+                    recipient_username="bob", message=f"m{i}"), None)
+        if name == "Socket":
+            # bob is pushed every message and acknowledges m0 and m1
+            live = LiveConnection(None, None)
+            live.push = lambda: None
+            server.Subscribe(wp.encode.SubscribeRequest(
+                version=1, auth_token=tokens["bob"], username="bob"), live)
+            assert live.subscription.TakeFrame() is not None
+            server.Acknowledge(wp.encode.PushAck(
+                version=1, error_code="", sequence=2), live)
+            assert len(live.subscription) == 3
+        else:
+            # bob's stream is cancelled after m0 and m1
+            server.delivery_chunk = 3
+            replies = server.InboxReplies("bob")
+            assert [next(replies).message for _ in range(2)] == \
+                ["[alice]: m0", "[alice]: m1"]
+            replies.close()
+        server.storage.Close()
+
+        restarted = server_type(stripes=4,
+                                storage=storage.SQLiteStorage(path))
+        assert restarted.storage.Usernames() == ["alice", "bob"]
+        assert restarted.storage.Peek("bob", 0, 10) == \
+            [f"[alice]: m{i}" for i in range(2, 5)]
+        # tokens are kept too, so users stay logged in
+        assert restarted.ValidateToken("bob", tokens["bob"]) == 0
+        restarted.token_ttl = 0
+        assert restarted.sweeper.Sweep() == 2
+        assert restarted.ValidateToken("bob", tokens["bob"]) < 0
+        restarted.storage.Close()
+        print(Fore.GREEN + f"{name} StorageBackendTest Passed" +
+              Style.RESET_ALL)
+
+
+def SharedEngineTest():
+    """
+    Test that a socket server and gRPC servicers given the same engine
+    serve one set of users: accounts, tokens and listings are shared, and
+    messages sent over one transport are refreshed, pushed and woken up for
+    over the other.
+    """
+    def WaitFor(condition):
+        deadline = time.monotonic() + 5
+        while not condition():
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+    shared = Engine()
+    socket_server = SocketChatServer(engine=shared)
+    servicer = gRPCChatServer(engine=shared)
+    assert socket_server.user_inbox is servicer.user_inbox
+    port = StartSocketServer(socket_server)
+    aio_port, aio_server = StartAioServer(AsyncChatServer(engine=shared))
+    channel = grpc.insecure_channel(f"localhost:{aio_port}")
+    grpc_stub = chat_pb2_grpc.ChatServerStub(channel)
+    stub = wp.client_stub.ChatServerStub("localhost", port)
+
+    alice = stub.CreateAccount(wp.encode.AccountCreateRequest(
+        version=1, username="alice", password="pw",
+        fullname="Alice")).auth_token
+    bob = servicer.CreateAccount(chat_pb2.AccountCreateRequest(
+        version=1, username="bob", password="pw", fullname="Bob"),
+        None).auth_token
+    resp = servicer.CreateAccount(chat_pb2.AccountCreateRequest(
+        version=1, username="alice", password="pw", fullname="Alice"), None)
+    assert resp.error_code == "ERROR Username Already Exists"
+    resp = stub.ListAccounts(wp.encode.ListAccountRequest(
+        version=1, auth_token=alice, username="alice",
+        number_of_accounts=100, regex=""))
+    assert resp.account_names == "alice, bob"
+    resp = servicer.ListAccounts(chat_pb2.ListAccountRequest(
+        version=1, auth_token=bob, username="bob",
+        number_of_accounts=100, regex="lic"), None)
+    assert resp.account_names == "alice"
+
+    # a token issued by one transport is accepted by the other
+    resp = grpc_stub.Login(chat_pb2.LoginRequest(
+        version=1, username="alice", password="pw"))
+    assert resp.fullname == "Alice"
+    alice = resp.auth_token
+    resp = servicer.SendMessage(chat_pb2.MessageRequest(
+        version=1, auth_token=bob, username="bob",
+        recipient_username="alice", message="hi"), None)
+    assert resp.error_code == ""
+    resp = stub.DeliverMessages(wp.encode.RefreshRequest(
+        version=1, auth_token=alice, username="alice", wait_ms=0))
+    assert resp.message == "[bob]: hi"
+
+    # gRPC messages are pushed to socket subscribers, and a gRPC refresh
+    # leaves the messages pushed but not acknowledged yet
+    pushed = []
+    subscriber = wp.client_stub.ChatServerStub("localhost", port)
+    # pushes are recorded but never acknowledged
+    subscriber.ReceivePush = lambda push: pushed.append(
+        wp.socket_types.PushRequest(push).messages)
+    resp = subscriber.Subscribe(wp.encode.SubscribeRequest(
+        version=1, auth_token=alice, username="alice"), lambda _: None)
+    assert resp.error_code == ""
+    servicer.SendMessage(chat_pb2.MessageRequest(
+        version=1, auth_token=bob, username="bob",
+        recipient_username="alice", message="pushed"), None)
+    WaitFor(lambda: pushed == [["[bob]: pushed"]])
+    assert [msg.message for msg in servicer.DeliverMessages(
+        chat_pb2.RefreshRequest(version=1, auth_token=alice,
+                                username="alice", wait_ms=0), None)] == []
+    subscriber.Close()
+    WaitFor(lambda: "alice" not in servicer.subscriptions)
+    assert list(servicer.user_inbox["alice"]) == ["[bob]: pushed"]
+
+    # a socket message wakes a gRPC long poll on the event loop
+    executor = ThreadPoolExecutor(1)
+    poll = executor.submit(lambda: [
+        msg.message for msg in grpc_stub.DeliverMessages(
+            chat_pb2.RefreshRequest(version=1, auth_token=bob,
+                                    username="bob", wait_ms=5000))])
+    time.sleep(0.2)
+    assert not poll.done()
+    resp = stub.SendMessage(wp.encode.MessageRequest(
+        version=1, auth_token=alice, username="alice",
+        recipient_username="bob", message="hello"))
+    assert resp.error_code == ""
+    assert poll.result(2) == ["[alice]: hello"]
+    executor.shutdown()
+
+    # an account deleted over gRPC is gone for socket clients too
+    servicer.DeleteAccount(chat_pb2.DeleteAccountRequest(
+        version=1, auth_token=bob, username="bob"), None)
+    resp = stub.Login(wp.encode.LoginRequest(
+        version=1, username="bob", password="pw"))
+    assert resp.error_code == "ERROR Username Invalid"
+    resp = stub.SendMessage(wp.encode.MessageRequest(
+        version=1, auth_token=alice, username="alice",
+        recipient_username="bob", message="bye"))
+    assert resp.error_code == "Invalid Recipient"
+    stub.Close()
+    channel.close()
+    del aio_server
+    print(Fore.GREEN + "Socket and gRPC SharedEngineTest Passed"
+          + Style.RESET_ALL)
+
+
+def GrpcCommandLineTest():
+    """
+    Test that `grpc_server.py --wal` serves clients, in both modes, and
+    that an account created over it is there after a restart.
+    """
+    directory = tempfile.mkdtemp()
+    for mode in ["threads", "aio"]:
+        path = os.path.join(directory, f"{mode}.wal")
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(("localhost", 0))
+        port = listener.getsockname()[1]
+        listener.close()
+
+        def Serve():
+            return subprocess.Popen(
+                [sys.executable, "grpc_server.py", "--port", str(port),
+                 "--mode", mode, "--wal", path],
+                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                cwd=os.path.dirname(os.path.abspath(__file__)))
+
+        for attempt in range(2):
+            server = Serve()
+            channel = grpc.insecure_channel(f"localhost:{port}")
+            stub = chat_pb2_grpc.ChatServerStub(channel)
+            try:
+                grpc.channel_ready_future(channel).result(timeout=10)
+                if attempt == 0:
+                    resp = stub.CreateAccount(chat_pb2.AccountCreateRequest(
+                        version=1, username="alice", password="pw",
+                        fullname="Alice"))
+                    assert resp.error_code == "", mode
+                else:
+                    resp = stub.Login(chat_pb2.LoginRequest(
+                        version=1, username="alice", password="pw"))
+                    assert resp.error_code == "" and \
+                        resp.fullname == "Alice", mode
+            except grpc.FutureTimeoutError:
+                server.kill()
+                raise AssertionError(server.communicate()[1].decode())
+            finally:
+                channel.close()
+                server.terminate()
+                server.wait()
+    print(Fore.GREEN + "gRPC GrpcCommandLineTest Passed" + Style.RESET_ALL)
+
+
+def ShardedLongPollTest():
+    """
+    Test that long polls of users owned by another worker of a sharded
+    server wait without holding a thread on either worker: the reactor
+    worker of the worker the client is connected to and the pool that
+    runs forwarded requests on the owning worker stay free for other
+    requests, and each poll returns its user's messages once they arrive.
+    """
+    ipc_dir = tempfile.mkdtemp()
+    peer_paths = [os.path.join(ipc_dir, f"shard{i}.sock") for i in range(2)]
+    servers = [ShardedChatServer(i, peer_paths) for i in range(2)]
+    for server in servers:
+        server.ListenForPeers()
+    servers[1].forwarded_executor = ThreadPoolExecutor(1)
+    port, _ = StartReactorServer(servers[0], workers=1)
+    stub = wp.client_stub.ChatServerStub("localhost", port)
+
+    # the users live on the worker the clients are not connected to
+    usernames = [username for username in (f"user{i}" for i in range(40))
+                 if ShardOf(username, 2) == 1][:5]
+    tokens = {}
+    for username in usernames:
+        resp = stub.CreateAccount(wp.encode.AccountCreateRequest(
+            version=1, username=username, password="pw", fullname=username))
+        assert resp.error_code == ""
+        tokens[username] = resp.auth_token
+
+    pollers = {}
+    polls = {}
+    for username in usernames[:4]:
+        pollers[username] = wp.client_stub.ChatServerStub("localhost", port)
+        polls[username] = pollers[username].Submit(wp.encode.RefreshRequest(
+            version=1, auth_token=tokens[username], username=username,
+            wait_ms=5000))
+    time.sleep(0.3)
+    assert not any(poll.done() for poll in polls.values())
+
+    # neither the reactor's only worker nor the owner's only forwarding
+    # thread is held by the waiting polls
+    start = time.monotonic()
+    resp = stub.Login(wp.encode.LoginRequest(
+        version=1, username=usernames[4], password="pw"))
+    assert resp.error_code == ""
+    sender = resp.auth_token
+    assert time.monotonic() - start < 1
+    for username in usernames[:3]:
+        resp = stub.SendMessage(wp.encode.MessageRequest(
+            version=1, auth_token=sender, username=usernames[4],
+            recipient_username=username, message=f"to {username}"))
+        assert resp.error_code == ""
+    assert time.monotonic() - start < 1
+    for username in usernames[:3]:
+        resp = wp.socket_types.RefreshReply(polls[username].result(2))
+        assert resp.message == f"[{usernames[4]}]: to {username}"
+    assert not polls[usernames[3]].done()
+
+    # a poll that finds nothing ends once its wait is over
+    start = time.monotonic()
+    resp = stub.DeliverMessages(wp.encode.RefreshRequest(
+        version=1, auth_token=sender, username=usernames[4], wait_ms=200))
+    assert resp.error_code == "No new message"
+    assert time.monotonic() - start >= 0.19
+    resp = stub.DeliverMessages(wp.encode.RefreshRequest(
+        version=1, auth_token="bad", username=usernames[4], wait_ms=5000))
+    assert resp.error_code == "Invalid Token"
+    for poller in pollers.values():
+        poller.Close()
+    stub.Close()
+    print(Fore.GREEN + "Socket ShardedLongPollTest Passed" + Style.RESET_ALL)
+
+
+def SQLiteConnectionTest():
+    """
+    Test that SQLite storage closes the connection a thread opened once the
+    thread exits, and closes the remaining ones on Close.
+    """
+    path = os.path.join(tempfile.mkdtemp(), "chat.db")
+    backend = storage.SQLiteStorage(path)
+    opened = []
+    for _ in range(8):
+        thread = mp.Thread(
+            target=lambda: opened.append(backend.Connection()))
+        thread.start()
+        thread.join()
+    # only the constructing thread's connection is still open
+    assert len(backend.connections) == 1
+    for db in opened:
+        try:
+            db.execute("SELECT 1")
+            assert False
+        except storage.sqlite3.ProgrammingError:
+            pass
+    db = backend.Connection()
+    backend.Close()
+    assert not backend.connections
+    try:
+        db.execute("SELECT 1")
+        assert False
+    except storage.sqlite3.ProgrammingError:
+        pass
+    print(Fore.GREEN + "SQLiteConnectionTest Passed" + Style.RESET_ALL)
+
+
+def GrpcDeliveryCommitTest():
+    """
+    Test that the gRPC servicers commit the log records of the messages
+    they stream out, and of those a closed stream returns, before moving on.
+    """
+    for name, server_type in [("Threaded", gRPCChatServer),
+                              ("Async", AsyncChatServer)]:
+        server = server_type(stripes=4)
+        server.OpenLog(os.path.join(tempfile.mkdtemp(), "chat.wal"),
+                       window=0.05)
+        tokens = {username: gRPCChatServer.CreateAccount(
+            server, chat_pb2.AccountCreateRequest(
+                version=1, username=username, password="pw",
+                fullname=username.title()), None).auth_token
+            for username in ["alice", "bob"]}
+        for i in range(5):
+            gRPCChatServer.SendMessage(server, chat_pb2.MessageRequest(
+                version=1, auth_token=tokens["alice"], username="alice",
+                recipient_username="bob", message=f"m{i}"), None)
+        server.wal.Commit()
+        token = tokens["bob"]
+        server.delivery_chunk = 2
+        request = chat_pb2.RefreshRequest(version=1, auth_token=token,
+                                          username="bob", wait_ms=0)
+        if name == "Threaded":
+            replies = server.DeliverMessages(request, None)
+            assert next(replies).message == "[alice]: m0"
+            assert server.wal.durable == server.wal.appended
+            replies.close()
+            assert server.wal.durable == server.wal.appended
+        else:
+            async def Stream():
+                server.wal.Defer()
+                replies = server.DeliverMessages(request, None)
+                assert (await replies.__anext__()).message == "[alice]: m0"
+                assert server.wal.durable == server.wal.appended
+                await replies.aclose()
+                assert server.wal.durable == server.wal.appended
+            asyncio.run(Stream())
+        assert list(server.user_inbox["bob"]) == \
+            [f"[alice]: m{i}" for i in range(1, 5)]
+        server.wal.Close()
+        print(Fore.GREEN + f"{name} GrpcDeliveryCommitTest Passed" +
+              Style.RESET_ALL)
+
+
+def ClientStubFailureTest():
+    """
+    Test that a socket client stub survives a push callback that raises,
+    and forgets requests that time out.
+    """
+    def WaitFor(condition):
+        deadline = time.monotonic() + 5
+        while not condition():
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+    server = SocketChatServer()
+    port = StartSocketServer(server)
+    stub = wp.client_stub.ChatServerStub("localhost", port)
+    tokens = {username: stub.CreateAccount(wp.encode.AccountCreateRequest(
+        version=1, username=username, password="pw",
+        fullname=username)).auth_token for username in ["alice", "bob"]}
+    received = []
+
+    def Receive(messages):
+        received.extend(messages)
+        raise ValueError("callback failed")
+
+    alice = wp.client_stub.ChatServerStub("localhost", port)
+    alice.Subscribe(wp.encode.SubscribeRequest(
+        version=1, auth_token=tokens["alice"], username="alice"), Receive)
+    for message in ["one", "two"]:
+        stub.SendMessage(wp.encode.MessageRequest(
+            version=1, auth_token=tokens["bob"], username="bob",
+            recipient_username="alice", message=message))
+        WaitFor(lambda: len(received) == ["one", "two"].index(message) + 1)
+    # the reader thread kept going and acknowledged both pushes
+    WaitFor(lambda: len(server.subscriptions["alice"]) == 0)
+    resp = alice.DeliverMessages(wp.encode.RefreshRequest(
+        version=1, auth_token=tokens["alice"], username="alice", wait_ms=0))
+    assert resp.error_code == "No new message"
+    alice.Close()
+
+    # a request that times out leaves nothing pending
+    def SlowLogin(data):
+        time.sleep(0.3)
+        return wp.encode.LoginReply(version=1, error_code="",
+                                    auth_token="", fullname="")
+
+    server.dispatcher.Register(wp.frame.OP_LOGIN, "Login", SlowLogin)
+    stub.timeout = 0.05
+    try:
+        stub.Login(wp.encode.LoginRequest(version=1, username="alice",
+                                          password="pw"))
+        assert False
+    except FutureTimeoutError:
+        pass
+    assert not stub.pending
+    stub.timeout = None
+    resp = stub.DeliverMessages(wp.encode.RefreshRequest(
+        version=1, auth_token=tokens["alice"], username="alice", wait_ms=0))
+    assert resp.error_code == "No new message"
+    stub.Close()
+    print(Fore.GREEN + "Socket ClientStubFailureTest Passed" +
+          Style.RESET_ALL)
+
+
+def ShardedDroppedRequestTest():
+    """
+    Test that a forwarded request the owning worker drops only drops the
+    client it came from: the forwarding worker gets its answer, and later
+    requests forwarded over the same peer connection are still served.
+    """
+    ipc_dir = tempfile.mkdtemp()
+    peer_paths = [os.path.join(ipc_dir, f"shard{i}.sock") for i in range(2)]
+    servers = [ShardedChatServer(i, peer_paths) for i in range(2)]
+    for server in servers:
+        server.ListenForPeers()
+    username = next(username for username in (f"user{i}" for i in range(40))
+                    if ShardOf(username, 2) == 1)
+    resp = wp.socket_types.AccountCreateReply(servers[0].Dispatch(
+        wp.encode.AccountCreateRequest(version=1, username=username,
+                                       password="pw", fullname=username)))
+    assert resp.error_code == ""
+
+    # a password that is not UTF-8
+    bad = wp.frame.Encode(wp.frame.OP_LOGIN, wp.frame.Int(1),
+                          wp.frame.Str(username),
+                          wp.frame.LENGTH.pack(2) + b"\xff\xfe")
+    # requests run on a pool so that one that hangs fails the test
+    executor = ThreadPoolExecutor(1)
+    for _ in range(2):
+        assert executor.submit(servers[0].Dispatch, bad).result(5) is None
+        resp = wp.socket_types.LoginReply(executor.submit(
+            servers[0].Dispatch, wp.encode.LoginRequest(
+                version=1, username=username, password="pw")).result(5))
+        assert resp.error_code == ""
+    executor.shutdown(wait=False)
+    assert servers[0].peers[1].closed is None
+    print(Fore.GREEN + "Socket ShardedDroppedRequestTest Passed" +
+          Style.RESET_ALL)
+
+
+def WriteAheadLogFailureTest():
+    """
+    Test that a write-ahead log whose file cannot be written fails the
+    commits waiting on it and every later append, instead of leaving them
+    waiting forever.
+    """
+    class FailingFile:
+        def __init__(self, log):
+            self.log = log
+
+        def write(self, data):
+            raise OSError(28, "No space left on device")
+
+        def close(self):
+            self.log.close()
+
+    path = os.path.join(tempfile.mkdtemp(), "chat.wal")
+    log = write_ahead_log.WriteAheadLog(path, window=0.05)
+    log.file = FailingFile(log.file)
+    record = write_ahead_log.Record(write_ahead_log.ENQUEUE, "bob", "m0")
+
+    async def CommitAsync():
+        log.Defer()
+        log.Append(record)
+        await log.CommitAsync()
+
+    with ThreadPoolExecutor(1) as executor:
+        waiting = executor.submit(lambda: asyncio.run(CommitAsync()))
+        time.sleep(0.01)
+        log.Append(record)
+        try:
+            log.Commit()
+            assert False
+        except write_ahead_log.LogError as e:
+            assert "No space left on device" in str(e)
+        try:
+            waiting.result(5)
+            assert False
+        except write_ahead_log.LogError as e:
+            assert "No space left on device" in str(e)
+    try:
+        log.Append(record)
+        assert False
+    except write_ahead_log.LogError:
+        pass
+    assert log.durable == 0
+    log.Close()
+    print(Fore.GREEN + "WriteAheadLogFailureTest Passed" + Style.RESET_ALL)
+
+
+def SlowSubscriberTest():
+    """
+    Test that a subscriber served by its own thread that stops reading its
+    pushes is disconnected once the slow consumer timeout passes, like a
+    client that stops reading its replies, even while its connection's
+    thread waits to send a reply.
+    """
+    server = SocketChatServer()
+    server.slow_consumer_timeout = 0.5
+    port = StartSocketServer(server)
+    stub = wp.client_stub.ChatServerStub("localhost", port)
+    tokens = {username: stub.CreateAccount(wp.encode.AccountCreateRequest(
+        version=1, username=username, password="pw",
+        fullname=username)).auth_token for username in ["alice", "bob"]}
+
+    stalled = socket.socket()
+    stalled.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    stalled.connect(("localhost", port))
+    stalled.sendall(wp.encode.SubscribeRequest(
+        version=1, auth_token=tokens["alice"], username="alice",
+        request_id=1))
+    for i in range(200):
+        resp = stub.SendMessage(wp.encode.MessageRequest(
+            version=1, auth_token=tokens["bob"], username="bob",
+            recipient_username="alice", message=f"{i}" * 32768))
+        assert resp.error_code == ""
+    # the connection's thread now has a reply to send as well
+    stalled.sendall(wp.encode.PingRequest(version=1, nonce=1,
+                                          request_id=2))
+
+    deadline = time.monotonic() + 10
+    while SLOW_CONSUMERS_EVICTED not in server.metrics.Counters():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    stalled.settimeout(5)
+    try:
+        while stalled.recv(65536):
+            pass
+    except ConnectionResetError:
+        pass
+    stalled.close()
+    # the messages that were never acknowledged are back in the inbox
+    deadline = time.monotonic() + 5
+    while "alice" in server.subscriptions:
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    assert len(server.user_inbox["alice"]) == 200
+    stub.Close()
+    print(Fore.GREEN + "Socket SlowSubscriberTest Passed" + Style.RESET_ALL)
+
+
 if __name__ == "__main__":
     print("Begin Unit Tests for Sockets and gRPC")
     GenerateTokenTest()
@@ -680,5 +2853,36 @@ if __name__ == "__main__":
     DeliverMessageTest()
     ListAccountsTest()
     DeleteAccountTest()
+    FramingTest()
+    LazyDecodeTest()
+    MultiplexedStubTest()
+    BatchSendMessageTest()
+    CompressionTest()
+    HandshakeTest()
+    ScatterGatherTest()
+    AsyncioServerTest()
+    ReactorServerTest()
+    ShardedServerTest()
+    DispatcherTest()
+    SlowConsumerTest()
+    KeepaliveTest()
+    PushTest()
+    LongPollTest()
+    AioServerTest()
+    LockStripingTest()
+    InboxDrainTest()
+    TokenExpiryTest()
+    WriteAheadLogTest()
+    SnapshotTest()
+    StorageBackendTest()
+    SharedEngineTest()
+    GrpcCommandLineTest()
+    ShardedLongPollTest()
+    SQLiteConnectionTest()
+    GrpcDeliveryCommitTest()
+    ClientStubFailureTest()
+    ShardedDroppedRequestTest()
+    WriteAheadLogFailureTest()
+    SlowSubscriberTest()
     print("Final Result:")
     print(Fore.GREEN + "Passed 42/42 Tests!")
@@ -1,3 +1,7 @@
+from . import frame
+from . import message
+from . import handshake
 from . import socket_types
 from . import encode
+from . import legacy
 from . import client_stub
\ No newline at end of file
@@ -1,41 +1,290 @@
+import itertools
 import socket
+import threading
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from . import encode
+from . import frame
 from . import socket_types
+from .handshake import (CODEC_BINARY, COMPRESSION_NONE, COMPRESSION_ZLIB,
+                        ConnectionSettings)
 
 class ChatServerStub:
+    """
+    Client side of the socket wire protocol.
+
+    Every request is tagged with a fresh request id and written to the
+    shared connection, and a background reader thread hands each reply to
+    the future registered under its id. Any number of requests can be in
+    flight at once and the stub may be used from several threads: the
+    blocking methods below wait only for their own reply, and `Submit`
+    returns the future directly for callers that want to pipeline.
+
+    With `compression` enabled the stub asks the server to compress large
+    replies and compresses its own large requests. Compressed frames are
+    inflated transparently before they reach the caller.
+
+    With `handshake` enabled (the default) the stub opens the connection
+    with a Handshake request and keeps the agreed settings in `settings`;
+    the stub raises ConnectionError if the server rejects the handshake.
+    Without it the stub behaves like a client that predates handshakes and
+    requests compression on every frame instead.
 
-    def __init__(self, host, port):
+    With `port` None, `host` is the path of a Unix domain socket to connect
+    to instead of a TCP host name.
+
+    The reader thread answers the server's keepalive pings on its own, so
+    an idle stub is not disconnected as long as its process is alive. After
+    `Subscribe` it also receives and acknowledges pushed messages.
+    """
+
+    def __init__(self, host, port, timeout=None, compression=True,
+                 handshake=True, max_frame_size=frame.MAX_PAYLOAD_SIZE):
         self.host = host
         self.port = port
-        self.sck = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # seconds a blocking call waits for its reply, None waits forever
+        self.timeout = timeout
+        self.compression = compression
+        self.flags = 0
+        if compression:
+            self.flags = frame.FLAG_ACCEPT_COMPRESSION
+        self.settings = ConnectionSettings(max_frame_size)
+        if port is None:
+            self.sck = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sck.connect(host)
+        else:
+            self.sck = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sck.connect((host,port))
+        self.writer = frame.FrameWriter(self.sck)
+        if handshake:
+            self.Handshake()
+
+        # request ids cycle through 1 .. 2**32 - 1, 0 is reserved for frames
+        # that do not belong to a request
+        self.request_ids = itertools.count()
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.closed = None
+        # keepalive pings from the server answered by the reader thread
+        self.pings_answered = 0
+        # called with every list of messages the server pushes
+        self.on_messages = None
+
+        self.reader = threading.Thread(target=self.ReadLoop, daemon=True)
+        self.reader.start()
+
+    def Handshake(self) -> None:
+        """
+        Offers this stub's settings to the server and adopts the agreed
+        ones. Must run before the reader thread starts.
+        """
+        compressions = [COMPRESSION_NONE]
+        if self.compression:
+            compressions.insert(0, COMPRESSION_ZLIB)
+        self.writer.Send(encode.HandshakeRequestSegments(
+            version=1,
+            protocol_versions=[frame.PROTOCOL_VERSION],
+            codecs=[CODEC_BINARY],
+            compressions=compressions,
+            max_frame_size=self.settings.max_frame_size))
+        try:
+            reply_bytes = frame.ReadFrame(self.sck)
+        except (OSError, frame.FrameError) as e:
+            self.sck.close()
+            raise ConnectionError(f"handshake failed: {e}") from e
+        if reply_bytes is None:
+            self.sck.close()
+            raise ConnectionError("server closed the connection")
+        reply = socket_types.HandshakeReply(reply_bytes)
+        if reply.generated_error_code or reply.error_code:
+            self.sck.close()
+            raise ConnectionError(
+                reply.generated_error_code or reply.error_code)
+
+        self.settings.protocol_version = reply.protocol_version
+        self.settings.codec = reply.codec
+        self.settings.compression = reply.compression
+        self.settings.max_frame_size = reply.max_frame_size
+        self.settings.negotiated = True
+        # the server already knows whether to compress
+        self.flags = 0
+        self.compression = reply.compression == COMPRESSION_ZLIB
+
+    def Submit(self, request) -> Future:
+        """
+        Sends a request frame without waiting for its reply.
+
+        Args:
+            request (bytes or list): A request frame built by
+            `wire_protocol.encode`, or the segments of one from a
+            `...Segments` encoder, which are sent without being joined.
+
+        Returns:
+            Future: Resolves to the raw reply frame, or fails with
+            ConnectionError if the connection is lost first.
+        """
+        future = Future()
+        with self.pending_lock:
+            if self.closed is not None:
+                raise ConnectionError(self.closed)
+            request_id = next(self.request_ids) % 0xFFFFFFFF + 1
+            self.pending[request_id] = future
+        future.request_id = request_id
 
-        self.sck.connect((host,port))
+        if self.compression:
+            if isinstance(request, list) and \
+                    sum(map(len, request)) > \
+                    frame.HEADER.size + frame.COMPRESSION_THRESHOLD:
+                request = b"".join(request)
+            if not isinstance(request, list):
+                request = frame.Compress(request)
+        try:
+            with self.send_lock:
+                self.writer.Send(request, request_id, self.flags)
+        except OSError as e:
+            with self.pending_lock:
+                self.pending.pop(request_id, None)
+            raise ConnectionError(e) from e
+        return future
+
+    def Call(self, request):
+        """
+        Sends a request frame and waits for its reply frame. A request that
+        times out is forgotten, and its reply is dropped if it comes later.
+        """
+        future = self.Submit(request)
+        try:
+            return future.result(self.timeout)
+        except FutureTimeoutError:
+            with self.pending_lock:
+                self.pending.pop(future.request_id, None)
+            raise
+
+    def ReadLoop(self) -> None:
+        """
+        Routes reply frames to the futures waiting on them until the
+        connection closes, then fails whatever is still outstanding.
+        """
+        reason = "server closed the connection"
+        try:
+            while True:
+                reply = frame.ReadFrame(
+                    self.sck, max_payload=self.settings.max_frame_size,
+                    verify=not self.settings.negotiated)
+                if reply is None:
+                    break
+                header = frame.ParseHeader(reply)
+                request_id = header.request_id
+                if request_id == 0 and header.opcode == frame.OP_PING:
+                    self.AnswerPing(reply)
+                    continue
+                if request_id == 0 and \
+                        header.opcode == frame.OP_PUSH_MESSAGES:
+                    self.ReceivePush(reply)
+                    continue
+                with self.pending_lock:
+                    future = self.pending.pop(request_id, None)
+                # replies nobody is waiting for (e.g. after a timeout) are
+                # dropped
+                if future is not None:
+                    future.set_result(reply)
+        except (OSError, frame.FrameError) as e:
+            reason = f"connection lost: {e}"
+
+        with self.pending_lock:
+            self.closed = reason
+            pending, self.pending = self.pending, {}
+        for future in pending.values():
+            future.set_exception(ConnectionError(reason))
+
+    def AnswerPing(self, ping: bytes) -> None:
+        """
+        Answers a keepalive ping from the server with a PingReply carrying
+        its nonce, sent with request id 0 like the ping.
+        """
+        request = socket_types.PingRequest(ping)
+        nonce = 0 if request.generated_error_code else request.nonce
+        with self.send_lock:
+            self.writer.Send(encode.PingReply(version=1, error_code="",
+                                              nonce=nonce))
+        self.pings_answered += 1
+
+    def ReceivePush(self, push: bytes) -> None:
+        """
+        Hands pushed messages to `on_messages` and acknowledges them. Pushes
+        that arrive without a callback are left unacknowledged, so the
+        server returns them to the inbox when the connection closes. An
+        exception raised by the callback is printed, and the messages it was
+        handed are acknowledged all the same, so that it cannot stop the
+        reader thread.
+        """
+        request = socket_types.PushRequest(push)
+        if request.generated_error_code or self.on_messages is None:
+            return
+        messages = request.messages
+        try:
+            self.on_messages(messages)
+        except Exception as e:
+            print(f"Push callback failed: {e!r}")
+        with self.send_lock:
+            self.writer.Send(encode.PushAck(
+                version=1, error_code="",
+                sequence=request.sequence + len(messages) - 1))
+
+    def Close(self) -> None:
+        """
+        Closes the connection, failing any requests still in flight.
+        """
+        try:
+            self.sck.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sck.close()
+        self.reader.join()
 
     def CreateAccount(self, create_account_request):
-        self.sck.send(create_account_request)
-        create_account_bytes = self.sck.recv(1024)
+        create_account_bytes = self.Call(create_account_request)
         return socket_types.AccountCreateReply(create_account_bytes)
-    
+
     def Login(self, login_request):
-        self.sck.send(login_request)
-        login_reply_bytes = self.sck.recv(1024)
+        login_reply_bytes = self.Call(login_request)
         return socket_types.LoginReply(login_reply_bytes)
-    
+
     def SendMessage(self, message_request):
-        self.sck.send(message_request)
-        message_reply_bytes = self.sck.recv(1024)
+        message_reply_bytes = self.Call(message_request)
         return socket_types.MessageReply(message_reply_bytes)
-    
+
+    def SendMessages(self, batch_message_request):
+        batch_message_reply_bytes = self.Call(batch_message_request)
+        return socket_types.BatchMessageReply(batch_message_reply_bytes)
+
     def ListAccounts(self, list_account_request):
-        self.sck.send(list_account_request)
-        list_account_reply_bytes = self.sck.recv(1024)
+        list_account_reply_bytes = self.Call(list_account_request)
         return socket_types.ListAccountReply(list_account_reply_bytes)
-    
+
     def DeleteAccount(self, delete_account_request):
-        self.sck.send(delete_account_request)
-        delete_account_reply_bytes = self.sck.recv(1024)
+        delete_account_reply_bytes = self.Call(delete_account_request)
         return socket_types.DeleteAccountReply(delete_account_reply_bytes)
 
+    def Ping(self, ping_request):
+        ping_reply_bytes = self.Call(ping_request)
+        return socket_types.PingReply(ping_reply_bytes)
+
+    def Subscribe(self, subscribe_request, on_messages):
+        """
+        Asks the server to push the user's messages to this stub.
+        `on_messages` is called on the reader thread with each list of
+        messages pushed, and must not block on this stub's replies.
+        """
+        self.on_messages = on_messages
+        subscribe_reply_bytes = self.Call(subscribe_request)
+        reply = socket_types.SubscribeReply(subscribe_reply_bytes)
+        if reply.error_code:
+            self.on_messages = None
+        return reply
+
     def DeliverMessages(self, refresh_request):
-        self.sck.send(refresh_request)
-        refresh_reply_bytes = self.sck.recv(1024)
+        refresh_reply_bytes = self.Call(refresh_request)
         return socket_types.RefreshReply(refresh_reply_bytes)
\ No newline at end of file
@@ -1,47 +1,428 @@
-def AccountCreateRequest(version, username, password, fullname):
-    opcode = 0
-    return f"{opcode}||{version}||{username}||{password}||{fullname}".encode("ascii")
+# Generated by wire_protocol/codegen.py from protos/*.proto.  DO NOT EDIT!
+from .frame import (HEADER, INT, LENGTH, MAGIC, PROTOCOL_VERSION,
+                    PackIntList, PackStrList, StrListSize)
 
-def AccountCreateReply(version, error_code, auth_token, fullname):
-    opcode = 0
-    return f"{opcode}||{version}||{error_code}||{auth_token}||{fullname}".encode("ascii")
 
-def LoginRequest(version, username, password):
-    opcode = 1
-    return f"{opcode}||{version}||{username}||{password}".encode("ascii")
+def AccountCreateRequestSegments(version, username, password, fullname, request_id=0):
+    username = str(username).encode("UTF-8")
+    password = str(password).encode("UTF-8")
+    fullname = str(fullname).encode("UTF-8")
+    length = 16 + len(username) + len(password) + len(fullname)
+    return [
+        HEADER.pack(MAGIC, PROTOCOL_VERSION, 0, 0, request_id, length),
+        INT.pack(version),
+        LENGTH.pack(len(username)), username,
+        LENGTH.pack(len(password)), password,
+        LENGTH.pack(len(fullname)), fullname,
+    ]
 
-def LoginReply(version, error_code, auth_token, fullname):
-    opcode = 1
-    return f"{opcode}||{version}||{error_code}||{auth_token}||{fullname}".encode("ascii")
 
-def MessageRequest(version, auth_token, username, recipient_username, message):
-    opcode = 2
-    return f"{opcode}||{version}||{auth_token}||{username}||{recipient_username}||{message}".encode("ascii")
+def AccountCreateRequest(version, username, password, fullname, request_id=0):
+    return b"".join(AccountCreateRequestSegments(version, username, password, fullname, request_id))
 
-def MessageReply(version, error_code):
-    opcode = 2
-    return f"{opcode}||{version}||{error_code}".encode("ascii")
 
-def ListAccountRequest(version, auth_token, username, number_of_accounts, regex):
-    opcode = 3
-    return f"{opcode}||{version}||{auth_token}||{username}||{number_of_accounts}||{regex}".encode("ascii")
+def AccountCreateReplySegments(version, error_code, auth_token, fullname, request_id=0):
+    error_code = str(error_code).encode("UTF-8")
+    auth_token = str(auth_token).encode("UTF-8")
+    fullname = str(fullname).encode("UTF-8")
+    length = 16 + len(error_code) + len(auth_token) + len(fullname)
+    return [
+        HEADER.pack(MAGIC, PROTOCOL_VERSION, 0, 0, request_id, length),
+        INT.pack(version),
+        LENGTH.pack(len(error_code)), error_code,
+        LENGTH.pack(len(auth_token)), auth_token,
+        LENGTH.pack(len(fullname)), fullname,
+    ]
 
-def ListAccountReply(version, error_code, account_names):
-    opcode = 3
-    return f"{opcode}||{version}||{error_code}||{account_names}".encode("ascii")
 
-def DeleteAccountRequest(version, auth_token, username):
-    opcode = 4
-    return f"{opcode}||{version}||{auth_token}||{username}".encode("ascii")
+def AccountCreateReply(version, error_code, auth_token, fullname, request_id=0):
+    return b"".join(AccountCreateReplySegments(version, error_code, auth_token, fullname, request_id))
 
-def DeleteAccountReply(version, error_code):
-    opcode = 4
-    return f"{opcode}||{version}||{error_code}".encode("ascii")
 
-def RefreshRequest(version, auth_token, username):
-    opcode = 5
-    return f"{opcode}||{version}||{auth_token}||{username}".encode("ascii")
+def LoginRequestSegments(version, username, password, request_id=0):
+    username = str(username).encode("UTF-8")
+    password = str(password).encode("UTF-8")
+    length = 12 + len(username) + len(password)
+    return [
+        HEADER.pack(MAGIC, PROTOCOL_VERSION, 1, 0, request_id, length),
+        INT.pack(version),
+        LENGTH.pack(len(username)), username,
+        LENGTH.pack(len(password)), password,
+    ]
 
-def RefreshReply(version, message, error_code):
-    opcode = 5
-    return f"{opcode}||{version}||{message}||{error_code}".encode("ascii")
\ No newline at end of file
+
+def LoginRequest(version, username, password, request_id=0):
+    return b"".join(LoginRequestSegments(version, username, password, request_id))
+
+
+def LoginReplySegments(version, error_code, auth_token, fullname, request_id=0):
+    error_code = str(error_code).encode("UTF-8")
+    auth_token = str(auth_token).encode("UTF-8")
+    fullname = str(fullname).encode("UTF-8")
+    length = 16 + len(error_code) + len(auth_token) + len(fullname)
+    return [
+        HEADER.pack(MAGIC, PROTOCOL_VERSION, 1, 0, request_id, length),
+        INT.pack(version),
+        LENGTH.pack(len(error_code)), error_code,
+        LENGTH.pack(len(auth_token)), auth_token,
+        LENGTH.pack(len(fullname)), fullname,
+    ]
+
+
+def LoginReply(version, error_code, auth_token, fullname, request_id=0):
+    return b"".join(LoginReplySegments(version, error_code, auth_token, fullname, request_id))
+
+
+def MessageRequestSegments(version, auth_token, username, recipient_username, message, request_id=0):
+    auth_token = str(auth_token).encode("UTF-8")
+    username = str(username).encode("UTF-8")
+    recipient_username = str(recipient_username).encode("UTF-8")
+    message = str(message).encode("UTF-8")
+    length = 20 + len(auth_token) + len(username) + len(recipient_username) + len(message)
+    return [
+        HEADER.pack(MAGIC, PROTOCOL_VERSION, 2, 0, request_id, length),
+        INT.pack(version),
+        LENGTH.pack(len(auth_token)), auth_token,
+        LENGTH.pack(len(username)), username,
+        LENGTH.pack(len(recipient_username)), recipient_username,
+        LENGTH.pack(len(message)), message,
+    ]
+
+
+def MessageRequest(version, auth_token, username, recipient_username, message, request_id=0):
+    return b"".join(MessageRequestSegments(version, auth_token, username, recipient_username, message, request_id))
+
+
+def MessageReplySegments(version, error_code, request_id=0):
+    error_code = str(error_code).encode("UTF-8")
+    length = 8 + len(error_code)
+    return [
+        HEADER.pack(MAGIC, PROTOCOL_VERSION, 2, 0, request_id, length),
+        INT.pack(version),
+        LENGTH.pack(len(error_code)), error_code,
+    ]
+
+
+def MessageReply(version, error_code, request_id=0):
+    return b"".join(MessageReplySegments(version, error_code, request_id))
+
+
+def ListAccountRequestSegments(version, auth_token, username, number_of_accounts, regex, request_id=0):
+    auth_token = str(auth_token).encode("UTF-8")
+    username = str(username).encode("UTF-8")
+    regex = str(regex).encode("UTF-8")
+    length = 20 + len(auth_token) + len(username) + len(regex)
+    return [
+        HEADER.pack(MAGIC, PROTOCOL_VERSION, 3, 0, request_id, length),
+        INT.pack(version),
+        LENGTH.pack(len(auth_token)), auth_token,
+        LENGTH.pack(len(username)), username,
+        INT.pack(number_of_accounts),
+        LENGTH.pack(len(regex)), regex,
+    ]
+
+
+def ListAccountRequest(version, auth_token, username, number_of_accounts, regex, request_id=0):
+    return b"".join(ListAccountRequestSegments(version, auth_token, username, number_of_accounts, regex, request_id))
+
+
+def ListAccountReplySegments(version, error_code, account_names, request_id=0):
+    error_code = str(error_code).encode("UTF-8")
+    account_names = str(account_names).encode("UTF-8")
+    length = 12 + len(error_code) + len(account_names)
+    return [
+        HEADER.pack(MAGIC, PROTOCOL_VERSION, 3, 0, request_id, length),
+        INT.pack(version),
+        LENGTH.pack(len(error_code)), error_code,
+        LENGTH.pack(len(account_names)), account_names,
+    ]
+
+
+def ListAccountReply(version, error_code, account_names, request_id=0):
+    return b"".join(ListAccountReplySegments(version, error_code, account_names, request_id))
+
+
+def DeleteAccountRequestSegments(version, auth_token, username, request_id=0):
+    auth_token = str(auth_token).encode("UTF-8")
+    username = str(username).encode("UTF-8")
+    length = 12 + len(auth_token) + len(username)
+    return [
+        HEADER.pack(MAGIC, PROTOCOL_VERSION, 4, 0, request_id, length),
+        INT.pack(version),
+        LENGTH.pack(len(auth_token)), auth_token,
+        LENGTH.pack(len(username)), username,
+    ]
+
+
+def DeleteAccountRequest(version, auth_token, username, request_id=0):
+    return b"".join(DeleteAccountRequestSegments(version, auth_token, username, request_id))
+
+
+def DeleteAccountReplySegments(version, error_code, request_id=0):
+    error_code = str(error_code).encode("UTF-8")
+    length = 8 + len(error_code)
+    return [
+        HEADER.pack(MAGIC, PROTOCOL_VERSION, 4, 0, request_id, length),
+        INT.pack(version),
+        LENGTH.pack(len(error_code)), error_code,
+    ]
+
+
+def DeleteAccountReply(version, error_code, request_id=0):
+    return b"".join(DeleteAccountReplySegments(version, error_code, request_id))
+
+
+def RefreshRequestSegments(version, auth_token, username, wait_ms, request_id=0):
+    auth_token = str(auth_token).encode("UTF-8")
+    username = str(username).encode("UTF-8")
+    length = 16 + len(auth_token) + len(username)
+    return [
+        HEADER.pack(MAGIC, PROTOCOL_VERSION, 5, 0, request_id, length),
+        INT.pack(version),
+        LENGTH.pack(len(auth_token)), auth_token,
+        LENGTH.pack(len(username)), username,
+        INT.pack(wait_ms),
+    ]
+
+
+def RefreshRequest(version, auth_token, username, wait_ms, request_id=0):
+    return b"".join(RefreshRequestSegments(version, auth_token, username, wait_ms, request_id))
+
+
+def RefreshReplySegments(version, message, error_code, request_id=0):
+    message = str(message).encode("UTF-8")
+    error_code = str(error_code).encode("UTF-8")
+    length = 12 + len(message) + len(error_code)
+    return [
+        HEADER.pack(MAGIC, PROTOCOL_VERSION, 5, 0, request_id, length),
+        INT.pack(version),
+        LENGTH.pack(len(message)), message,
+        LENGTH.pack(len(error_code)), error_code,
+    ]
+
+
+def RefreshReply(version, message, error_code, request_id=0):
+    return b"".join(RefreshReplySegments(version, message, error_code, request_id))
+
+
+def BatchMessageRequestSegments(version, auth_token, username, recipient_usernames, messages, request_id=0):
+    auth_token = str(auth_token).encode("UTF-8")
+    username = str(username).encode("UTF-8")
+    recipient_usernames = [str(v).encode("UTF-8") for v in recipient_usernames]
+    messages = [str(v).encode("UTF-8") for v in messages]
+    length = 20 + len(auth_token) + len(username) + StrListSize(recipient_usernames) + StrListSize(messages)
+    return [
+        HEADER.pack(MAGIC, PROTOCOL_VERSION, 6, 0, request_id, length),
+        INT.pack(version),
+        LENGTH.pack(len(auth_token)), auth_token,
+        LENGTH.pack(len(username)), username,
+        *PackStrList(recipient_usernames),
+        *PackStrList(messages),
+    ]
+
+
+def BatchMessageRequest(version, auth_token, username, recipient_usernames, messages, request_id=0):
+    return b"".join(BatchMessageRequestSegments(version, auth_token, username, recipient_usernames, messages, request_id))
+
+
+def BatchMessageReplySegments(version, error_code, status_codes, request_id=0):
+    error_code = str(error_code).encode("UTF-8")
+    length = 12 + len(error_code) + INT.size * len(status_codes)
+    return [
+        HEADER.pack(MAGIC, PROTOCOL_VERSION, 6, 0, request_id, length),
+        INT.pack(version),
+        LENGTH.pack(len(error_code)), error_code,
+        PackIntList(status_codes),
+    ]
+
+
+def BatchMessageReply(version, error_code, status_codes, request_id=0):
+    return b"".join(BatchMessageReplySegments(version, error_code, status_codes, request_id))
+
+
+def HandshakeRequestSegments(version, protocol_versions, codecs, compressions, max_frame_size, request_id=0):
+    codecs = [str(v).encode("UTF-8") for v in codecs]
+    compressions = [str(v).encode("UTF-8") for v in compressions]
+    length = 20 + INT.size * len(protocol_versions) + StrListSize(codecs) + StrListSize(compressions)
+    return [
+        HEADER.pack(MAGIC, PROTOCOL_VERSION, 7, 0, request_id, length),
+        INT.pack(version),
+        PackIntList(protocol_versions),
+        *PackStrList(codecs),
+        *PackStrList(compressions),
+        INT.pack(max_frame_size),
+    ]
+
+
+def HandshakeRequest(version, protocol_versions, codecs, compressions, max_frame_size, request_id=0):
+    return b"".join(HandshakeRequestSegments(version, protocol_versions, codecs, compressions, max_frame_size, request_id))
+
+
+def HandshakeReplySegments(version, error_code, protocol_version, codec, compression, max_frame_size, request_id=0):
+    error_code = str(error_code).encode("UTF-8")
+    codec = str(codec).encode("UTF-8")
+    compression = str(compression).encode("UTF-8")
+    length = 24 + len(error_code) + len(codec) + len(compression)
+    return [
+        HEADER.pack(MAGIC, PROTOCOL_VERSION, 7, 0, request_id, length),
+        INT.pack(version),
+        LENGTH.pack(len(error_code)), error_code,
+        INT.pack(protocol_version),
+        LENGTH.pack(len(codec)), codec,
+        LENGTH.pack(len(compression)), compression,
+        INT.pack(max_frame_size),
+    ]
+
+
+def HandshakeReply(version, error_code, protocol_version, codec, compression, max_frame_size, request_id=0):
+    return b"".join(HandshakeReplySegments(version, error_code, protocol_version, codec, compression, max_frame_size, request_id))
+
+
+def ShardDeliveryRequestSegments(version, recipient_usernames, messages, request_id=0):
+    recipient_usernames = [str(v).encode("UTF-8") for v in recipient_usernames]
+    messages = [str(v).encode("UTF-8") for v in messages]
+    length = 12 + StrListSize(recipient_usernames) + StrListSize(messages)
+    return [
+        HEADER.pack(MAGIC, PROTOCOL_VERSION, 8, 0, request_id, length),
+        INT.pack(version),
+        *PackStrList(recipient_usernames),
+        *PackStrList(messages),
+    ]
+
+
+def ShardDeliveryRequest(version, recipient_usernames, messages, request_id=0):
+    return b"".join(ShardDeliveryRequestSegments(version, recipient_usernames, messages, request_id))
+
+
+def ShardDeliveryReplySegments(version, error_code, status_codes, request_id=0):
+    error_code = str(error_code).encode("UTF-8")
+    length = 12 + len(error_code) + INT.size * len(status_codes)
+    return [
+        HEADER.pack(MAGIC, PROTOCOL_VERSION, 8, 0, request_id, length),
+        INT.pack(version),
+        LENGTH.pack(len(error_code)), error_code,
+        PackIntList(status_codes),
+    ]
+
+
+def ShardDeliveryReply(version, error_code, status_codes, request_id=0):
+    return b"".join(ShardDeliveryReplySegments(version, error_code, status_codes, request_id))
+
+
+def ShardListRequestSegments(version, number_of_accounts, regex, request_id=0):
+    regex = str(regex).encode("UTF-8")
+    length = 12 + len(regex)
+    return [
+        HEADER.pack(MAGIC, PROTOCOL_VERSION, 9, 0, request_id, length),
+        INT.pack(version),
+        INT.pack(number_of_accounts),
+        LENGTH.pack(len(regex)), regex,
+    ]
+
+
+def ShardListRequest(version, number_of_accounts, regex, request_id=0):
+    return b"".join(ShardListRequestSegments(version, number_of_accounts, regex, request_id))
+
+
+def ShardListReplySegments(version, error_code, account_names, request_id=0):
+    error_code = str(error_code).encode("UTF-8")
+    account_names = [str(v).encode("UTF-8") for v in account_names]
+    length = 12 + len(error_code) + StrListSize(account_names)
+    return [
+        HEADER.pack(MAGIC, PROTOCOL_VERSION, 9, 0, request_id, length),
+        INT.pack(version),
+        LENGTH.pack(len(error_code)), error_code,
+        *PackStrList(account_names),
+    ]
+
+
+def ShardListReply(version, error_code, account_names, request_id=0):
+    return b"".join(ShardListReplySegments(version, error_code, account_names, request_id))
+
+
+def PingRequestSegments(version, nonce, request_id=0):
+    length = 8
+    return [
+        HEADER.pack(MAGIC, PROTOCOL_VERSION, 10, 0, request_id, length),
+        INT.pack(version),
+        INT.pack(nonce),
+    ]
+
+
+def PingRequest(version, nonce, request_id=0):
+    return b"".join(PingRequestSegments(version, nonce, request_id))
+
+
+def PingReplySegments(version, error_code, nonce, request_id=0):
+    error_code = str(error_code).encode("UTF-8")
+    length = 12 + len(error_code)
+    return [
+        HEADER.pack(MAGIC, PROTOCOL_VERSION, 10, 0, request_id, length),
+        INT.pack(version),
+        LENGTH.pack(len(error_code)), error_code,
+        INT.pack(nonce),
+    ]
+
+
+def PingReply(version, error_code, nonce, request_id=0):
+    return b"".join(PingReplySegments(version, error_code, nonce, request_id))
+
+
+def SubscribeRequestSegments(version, auth_token, username, request_id=0):
+    auth_token = str(auth_token).encode("UTF-8")
+    username = str(username).encode("UTF-8")
+    length = 12 + len(auth_token) + len(username)
+    return [
+        HEADER.pack(MAGIC, PROTOCOL_VERSION, 11, 0, request_id, length),
+        INT.pack(version),
+        LENGTH.pack(len(auth_token)), auth_token,
+        LENGTH.pack(len(username)), username,
+    ]
+
+
+def SubscribeRequest(version, auth_token, username, request_id=0):
+    return b"".join(SubscribeRequestSegments(version, auth_token, username, request_id))
+
+
+def SubscribeReplySegments(version, error_code, request_id=0):
+    error_code = str(error_code).encode("UTF-8")
+    length = 8 + len(error_code)
+    return [
+        HEADER.pack(MAGIC, PROTOCOL_VERSION, 11, 0, request_id, length),
+        INT.pack(version),
+        LENGTH.pack(len(error_code)), error_code,
+    ]
+
+
+def SubscribeReply(version, error_code, request_id=0):
+    return b"".join(SubscribeReplySegments(version, error_code, request_id))
+
+
+def PushRequestSegments(version, sequence, messages, request_id=0):
+    messages = [str(v).encode("UTF-8") for v in messages]
+    length = 12 + StrListSize(messages)
+    return [
+        HEADER.pack(MAGIC, PROTOCOL_VERSION, 12, 0, request_id, length),
+        INT.pack(version),
+        INT.pack(sequence),
+        *PackStrList(messages),
+    ]
+
+
+def PushRequest(version, sequence, messages, request_id=0):
+    return b"".join(PushRequestSegments(version, sequence, messages, request_id))
+
+
+def PushAckSegments(version, error_code, sequence, request_id=0):
+    error_code = str(error_code).encode("UTF-8")
+    length = 12 + len(error_code)
+    return [
+        HEADER.pack(MAGIC, PROTOCOL_VERSION, 12, 0, request_id, length),
+        INT.pack(version),
+        LENGTH.pack(len(error_code)), error_code,
+        INT.pack(sequence),
+    ]
+
+
+def PushAck(version, error_code, sequence, request_id=0):
+    return b"".join(PushAckSegments(version, error_code, sequence, request_id))
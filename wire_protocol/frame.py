@@ -0,0 +1,422 @@
+import asyncio
+import socket
+import struct
+import zlib
+from collections import namedtuple
+
+# Every v2 request and reply travels as a single frame: a fixed size header
+# followed by `length` bytes of binary payload.
+#
+# Header layout (network byte order, 16 bytes):
+#   magic       2s  always MAGIC
+#   version     B   protocol version of the sender
+#   opcode      B   operation, see the OP_* constants below
+#   flags       B   bit set of the FLAG_* constants below
+#   (pad)       x
+#   request_id  I   echoed back unchanged in the matching reply
+#   length      I   number of payload bytes following the header
+#   (pad)       2x  keeps the payload 8 byte aligned
+#
+# Payload fields are written back to back in schema order. An int field is a
+# 4 byte signed integer, a str field is a 4 byte unsigned length followed by
+# that many bytes of UTF-8. A repeated field is a 4 byte unsigned element
+# count followed by the elements.
+#
+# A frame with FLAG_COMPRESSED set carries its payload as a zlib stream and
+# `length` counts the compressed bytes. Every v2 peer can read compressed
+# frames, but a peer only sends compressed replies on a connection whose
+# requests carry FLAG_ACCEPT_COMPRESSION.
+MAGIC = b"WP"
+PROTOCOL_VERSION = 2
+HEADER = struct.Struct("!2sBBBxII2x")
+INT = struct.Struct("!i")
+LENGTH = struct.Struct("!I")
+FLAGS_OFFSET = 4
+REQUEST_ID_OFFSET = 6
+
+# frames larger than this are rejected before any payload is read
+MAX_PAYLOAD_SIZE = 16 * 1024 * 1024
+
+OP_CREATE_ACCOUNT = 0
+OP_LOGIN = 1
+OP_SEND_MESSAGE = 2
+OP_LIST_ACCOUNTS = 3
+OP_DELETE_ACCOUNT = 4
+OP_REFRESH = 5
+OP_SEND_MESSAGES = 6
+OP_HANDSHAKE = 7
+OP_DELIVER_TO_SHARD = 8
+OP_LIST_SHARD_ACCOUNTS = 9
+OP_PING = 10
+OP_SUBSCRIBE = 11
+OP_PUSH_MESSAGES = 12
+
+FLAG_COMPRESSED = 0x01
+FLAG_ACCEPT_COMPRESSION = 0x02
+
+# payloads up to this size are never compressed, as the zlib overhead
+# outweighs the savings on small messages
+COMPRESSION_THRESHOLD = 1024
+COMPRESSION_LEVEL = 6
+
+
+class FrameError(ValueError):
+    """
+    Raised when a buffer does not hold a well formed v2 frame.
+    """
+
+
+FrameHeader = namedtuple(
+    "FrameHeader", ["version", "opcode", "flags", "request_id", "length"])
+
+
+def Int(value: int) -> bytes:
+    """
+    Encodes an int payload field.
+    """
+    return INT.pack(value)
+
+
+def Str(value: str) -> bytes:
+    """
+    Encodes a str payload field as a length prefixed UTF-8 string.
+    """
+    data = str(value).encode("UTF-8")
+    return LENGTH.pack(len(data)) + data
+
+
+def PackIntList(values: list) -> bytes:
+    """
+    Encodes a repeated int field.
+    """
+    return struct.pack(f"!I{len(values)}i", len(values), *values)
+
+
+def PackStrList(items: list) -> list:
+    """
+    Encodes a repeated str field whose elements are already UTF-8 bytes.
+
+    Returns:
+        list: The segments of the field, ready to be joined into a payload.
+    """
+    segments = [LENGTH.pack(len(items))]
+    for item in items:
+        segments.append(LENGTH.pack(len(item)))
+        segments.append(item)
+    return segments
+
+
+def StrListSize(items: list) -> int:
+    """
+    Size of the elements of a repeated str field, excluding the count.
+    """
+    return LENGTH.size * len(items) + sum(map(len, items))
+
+
+def Encode(opcode: int, *fields: bytes, request_id: int = 0) -> bytes:
+    """
+    Builds a complete frame from already encoded payload fields.
+
+    Args:
+        opcode (int): The operation carried by the frame.
+        fields (bytes): Payload fields produced by `Int` and `Str`.
+        request_id (int): Identifier echoed back in the reply.
+
+    Returns:
+        bytes: The header followed by the payload.
+    """
+    payload = b"".join(fields)
+    header = HEADER.pack(MAGIC, PROTOCOL_VERSION, opcode, 0,
+                         request_id, len(payload))
+    return header + payload
+
+
+def ParseHeader(buffer) -> FrameHeader:
+    """
+    Parses the header at the start of `buffer` without validating it. Only
+    meant for frames whose header has already been checked, or for
+    connections whose settings were agreed on in a handshake.
+    """
+    _, version, opcode, flags, request_id, length = HEADER.unpack_from(buffer)
+    return FrameHeader(version, opcode, flags, request_id, length)
+
+
+def DecodeHeader(buffer, max_payload: int = MAX_PAYLOAD_SIZE) -> FrameHeader:
+    """
+    Parses and validates the header at the start of `buffer`.
+
+    Args:
+        buffer (bytes-like): A buffer starting with a frame header.
+        max_payload (int): The largest payload length accepted.
+
+    Returns:
+        FrameHeader: The decoded header fields.
+
+    Raises:
+        FrameError: If the buffer is too short, the magic does not match,
+        the version is unsupported or the payload length is too large.
+    """
+    if len(buffer) < HEADER.size:
+        raise FrameError("frame shorter than header")
+    magic, version, opcode, flags, request_id, length = HEADER.unpack_from(
+        buffer)
+    if magic != MAGIC:
+        raise FrameError("bad frame magic")
+    if version != PROTOCOL_VERSION:
+        raise FrameError(f"unsupported protocol version {version}")
+    if length > max_payload:
+        raise FrameError(f"payload of {length} bytes exceeds limit")
+    return FrameHeader(version, opcode, flags, request_id, length)
+
+
+def SetRequestId(frame: bytes, request_id: int, flags: int = 0) -> bytes:
+    """
+    Returns `frame` with its header carrying `request_id` and with `flags`
+    added to its flags.
+    """
+    if request_id == 0 and flags == 0:
+        return frame
+    stamped = bytearray(frame)
+    LENGTH.pack_into(stamped, REQUEST_ID_OFFSET, request_id)
+    stamped[FLAGS_OFFSET] |= flags
+    return stamped
+
+
+def Compress(frame: bytes,
+             threshold: int = COMPRESSION_THRESHOLD,
+             level: int = COMPRESSION_LEVEL) -> bytes:
+    """
+    Deflates the payload of `frame` if it is larger than `threshold` bytes.
+
+    Returns:
+        bytes: A frame with FLAG_COMPRESSED set, or `frame` unchanged if it
+        is small, already compressed or does not shrink.
+    """
+    length = len(frame) - HEADER.size
+    if length <= threshold or frame[FLAGS_OFFSET] & FLAG_COMPRESSED:
+        return frame
+    compressed = zlib.compress(memoryview(frame)[HEADER.size:], level)
+    if len(compressed) >= length:
+        return frame
+
+    magic, version, opcode, flags, request_id, _ = HEADER.unpack_from(frame)
+    return HEADER.pack(magic, version, opcode, flags | FLAG_COMPRESSED,
+                       request_id, len(compressed)) + compressed
+
+
+def Decompress(frame: bytes, max_payload: int = MAX_PAYLOAD_SIZE) -> bytes:
+    """
+    Inflates the payload of a frame with FLAG_COMPRESSED set.
+
+    Returns:
+        bytes: An uncompressed frame, or `frame` unchanged if it was not
+        compressed.
+
+    Raises:
+        FrameError: If the payload is not a complete zlib stream or inflates
+        to more than `max_payload` bytes.
+    """
+    magic, version, opcode, flags, request_id, _ = HEADER.unpack_from(frame)
+    if not flags & FLAG_COMPRESSED:
+        return frame
+
+    inflater = zlib.decompressobj()
+    try:
+        payload = inflater.decompress(memoryview(frame)[HEADER.size:],
+                                      max_payload)
+    except zlib.error as e:
+        raise FrameError(f"bad compressed payload: {e}") from e
+    if not inflater.eof or inflater.unconsumed_tail:
+        raise FrameError("compressed payload is truncated or too large")
+    return HEADER.pack(magic, version, opcode, flags & ~FLAG_COMPRESSED,
+                       request_id, len(payload)) + payload
+
+
+# sendmsg accepts at most this many buffers per call (IOV_MAX on Linux)
+MAX_SEGMENTS = 1024
+
+
+def SendSegments(sck: socket.socket, segments: list) -> None:
+    """
+    Writes every byte of `segments` to the socket, in order, with as few
+    system calls as possible and without joining them first.
+
+    Uses `socket.sendmsg` where the platform has it and resumes after
+    partial writes, so large frames are never cut short. Elsewhere falls
+    back to one `sendall` per segment.
+    """
+    if not hasattr(sck, "sendmsg"):
+        for segment in segments:
+            sck.sendall(segment)
+        return
+
+    views = [memoryview(segment).cast("B") for segment in segments]
+    start = 0
+    while start < len(views):
+        sent = sck.sendmsg(views[start:start + MAX_SEGMENTS])
+        # skip the buffers written completely, trim the one written in part
+        while start < len(views) and sent >= len(views[start]):
+            sent -= len(views[start])
+            start += 1
+        if sent:
+            views[start] = views[start][sent:]
+
+
+def StampedSegments(frame, request_id: int, flags: int = 0,
+                    header: bytearray = None) -> list:
+    """
+    Splits a frame into a header carrying `request_id` and `flags` (added
+    to the frame's own flags) followed by the untouched payload.
+
+    Args:
+        frame (bytes-like or list): A complete frame, or a list of segments
+        whose first element is the frame header.
+        header (bytearray): Buffer to write the new header into, a fresh
+        one is allocated if None.
+
+    Returns:
+        list: The segments to send, in order.
+    """
+    if isinstance(frame, list):
+        original = frame[0]
+        payload = frame[1:]
+    else:
+        original = memoryview(frame)[:HEADER.size]
+        payload = [memoryview(frame)[HEADER.size:]]
+    if header is None:
+        header = bytearray(original)
+    else:
+        header[:] = original
+    LENGTH.pack_into(header, REQUEST_ID_OFFSET, request_id)
+    header[FLAGS_OFFSET] |= flags
+    return [header] + payload
+
+
+class FrameWriter:
+    """
+    Sends frames over one connection without copying them.
+
+    Replies are built before the request id they answer is known, and
+    copying a whole frame only to set its request id (as `SetRequestId`
+    does) costs as much as building it. The writer instead stamps the
+    request id and flags into a header buffer it reuses for every frame,
+    and sends that header and the unchanged payload (or the payload
+    segments from a `wire_protocol.encode` `...Segments` function) together
+    with `SendSegments`.
+
+    A writer is not thread safe; callers sharing a connection must hold a
+    lock around `Send`.
+    """
+
+    def __init__(self, sck: socket.socket):
+        self.sck = sck
+        self.header = bytearray(HEADER.size)
+
+    def Send(self, frame, request_id: int = 0, flags: int = 0) -> None:
+        """
+        Writes a frame, giving it `request_id` and adding `flags` to its
+        flags.
+
+        Args:
+            frame (bytes-like or list): A complete frame, or a list of
+            segments whose first element is the frame header.
+        """
+        SendSegments(self.sck, StampedSegments(frame, request_id, flags,
+                                               self.header))
+
+
+def RecvInto(sck: socket.socket, view: memoryview) -> int:
+    """
+    Fills `view` completely from the socket, looping over short reads.
+
+    Returns:
+        int: The number of bytes read, which is less than `len(view)` only
+        when the peer closed the connection.
+    """
+    received = 0
+    while received < len(view):
+        n = sck.recv_into(view[received:])
+        if n == 0:
+            break
+        received += n
+    return received
+
+
+def ReadFrame(sck: socket.socket, decompress: bool = True,
+              max_payload: int = MAX_PAYLOAD_SIZE, verify: bool = True):
+    """
+    Reads exactly one frame from the socket.
+
+    Args:
+        sck (socket.socket): A connected stream socket.
+        decompress (bool): Whether to inflate compressed frames.
+        max_payload (int): The largest payload accepted, before and after
+        inflating.
+        verify (bool): Whether to check the magic and version of the
+        header. Connections that completed a handshake skip the check, the
+        payload length is always checked.
+
+    Returns:
+        bytearray: The full frame (header and payload), or None if the peer
+        closed the connection cleanly between frames.
+
+    Raises:
+        FrameError: If the header or a compressed payload is malformed.
+        ConnectionError: If the peer closed the connection mid-frame.
+    """
+    header = bytearray(HEADER.size)
+    received = RecvInto(sck, memoryview(header))
+    if received == 0:
+        return None
+    if received < HEADER.size:
+        raise ConnectionError("connection closed inside frame header")
+
+    if verify:
+        length = DecodeHeader(header, max_payload).length
+    else:
+        length = ParseHeader(header).length
+        if length > max_payload:
+            raise FrameError(f"payload of {length} bytes exceeds limit")
+    frame = bytearray(HEADER.size + length)
+    frame[:HEADER.size] = header
+    if RecvInto(sck, memoryview(frame)[HEADER.size:]) < length:
+        raise ConnectionError("connection closed inside frame payload")
+    if decompress:
+        return Decompress(frame, max_payload)
+    return frame
+
+
+async def ReadFrameAsync(reader: asyncio.StreamReader, decompress: bool = True,
+                         max_payload: int = MAX_PAYLOAD_SIZE,
+                         verify: bool = True, prefix: bytes = b""):
+    """
+    Reads exactly one frame from an asyncio stream, like `ReadFrame`.
+
+    Args:
+        prefix (bytes): Leading bytes of the frame header that the caller
+        has already read from the stream.
+
+    Returns:
+        bytes: The full frame, or None if the peer closed the connection
+        cleanly between frames.
+    """
+    try:
+        header = prefix + await reader.readexactly(HEADER.size - len(prefix))
+    except asyncio.IncompleteReadError as e:
+        if not prefix and not e.partial:
+            return None
+        raise ConnectionError("connection closed inside frame header") from e
+
+    if verify:
+        length = DecodeHeader(header, max_payload).length
+    else:
+        length = ParseHeader(header).length
+        if length > max_payload:
+            raise FrameError(f"payload of {length} bytes exceeds limit")
+    try:
+        frame = header + await reader.readexactly(length)
+    except asyncio.IncompleteReadError as e:
+        raise ConnectionError("connection closed inside frame payload") from e
+    if decompress:
+        return Decompress(frame, max_payload)
+    return frame
@@ -0,0 +1,83 @@
+from . import frame
+
+# codecs a connection can use once the handshake is done: v2 binary frames,
+# or the original `||` deliminated text messages of protocol version 1
+CODEC_BINARY = "binary"
+CODEC_TEXT = "text"
+
+COMPRESSION_NONE = "none"
+COMPRESSION_ZLIB = "zlib"
+
+ERROR_NO_COMMON_VERSION = "ERROR No common protocol version."
+ERROR_NO_COMMON_CODEC = "ERROR No common codec."
+ERROR_LATE_HANDSHAKE = "ERROR Handshake must be the first request."
+
+# protocol versions this implementation can frame
+SUPPORTED_VERSIONS = (frame.PROTOCOL_VERSION,)
+
+
+class ConnectionSettings:
+    """
+    The settings in force on one connection.
+
+    A connection starts out with the defaults of a v2 connection that did
+    not handshake: binary frames whose headers are checked one by one, and
+    compression only once the peer sets FLAG_ACCEPT_COMPRESSION. `Negotiate`
+    replaces them with the values agreed on in a handshake, after which
+    frame headers are no longer validated individually.
+    """
+    __slots__ = ("protocol_version", "codec", "compression",
+                 "max_frame_size", "negotiated", "handshake_allowed")
+
+    def __init__(self, max_frame_size: int = frame.MAX_PAYLOAD_SIZE):
+        self.protocol_version = frame.PROTOCOL_VERSION
+        self.codec = CODEC_BINARY
+        self.compression = COMPRESSION_NONE
+        self.max_frame_size = max_frame_size
+        self.negotiated = False
+        # a handshake is only accepted as the first frame of a connection
+        self.handshake_allowed = True
+
+
+def Negotiate(request, settings: ConnectionSettings,
+              codecs: list, compressions: list) -> str:
+    """
+    Agrees on connection settings from the offer in a HandshakeRequest.
+
+    The highest protocol version both sides support wins. The codec and the
+    compression are the first entries of the server's preference lists
+    `codecs` and `compressions` that the client offered, and the frame size
+    limit is the smaller of the two. A client that offers no compression
+    gets none.
+
+    Args:
+        request (wp.socket_types.HandshakeRequest): The client's offer.
+        settings (ConnectionSettings): The connection's settings. Its
+        `max_frame_size` is the server's limit on entry, and every field is
+        updated when the negotiation succeeds.
+        codecs (list): Codecs the server supports, most preferred first.
+        compressions (list): Compressions the server supports, most
+        preferred first.
+
+    Returns:
+        str: An empty string on success, otherwise the error code to send
+        back, in which case `settings` is left unchanged.
+    """
+    versions = set(request.protocol_versions) & set(SUPPORTED_VERSIONS)
+    if not versions:
+        return ERROR_NO_COMMON_VERSION
+    offered_codecs = request.codecs
+    codec = next((c for c in codecs if c in offered_codecs), None)
+    if codec is None:
+        return ERROR_NO_COMMON_CODEC
+    offered_compressions = request.compressions
+    compression = next((c for c in compressions
+                        if c in offered_compressions), COMPRESSION_NONE)
+
+    settings.protocol_version = max(versions)
+    settings.codec = codec
+    settings.compression = compression
+    if 0 < request.max_frame_size < settings.max_frame_size:
+        settings.max_frame_size = request.max_frame_size
+    settings.negotiated = True
+    return ""
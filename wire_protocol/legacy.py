@@ -0,0 +1,107 @@
+"""
+Translation between the original text encoding of the socket protocol
+(protocol version 1) and v2 frames.
+
+A version 1 message is the opcode followed by every field in schema order,
+joined with `||` and sent as a single string. Clients built before framing
+existed speak nothing else, so the server translates their requests into
+frames, runs the regular handlers and translates the replies back.
+"""
+from . import frame
+from . import socket_types
+from .message import ERROR_ARG_TYPE, ERROR_ARGS_LENGTH
+
+SEPARATOR = "||"
+
+# operations that existed in protocol version 1
+TEXT_OPCODES = range(frame.OP_CREATE_ACCOUNT, frame.OP_REFRESH + 1)
+
+# how many fields text requests carry, for requests that have gained fields
+# since protocol version 1; the later fields take their default value
+TEXT_FIELD_COUNTS = {
+    frame.OP_REFRESH: 3,
+}
+
+
+class TextRequestError(ValueError):
+    """
+    Raised for a text request that is rejected before it reaches a handler.
+    `reply` holds the text reply to send back.
+    """
+
+    def __init__(self, reply: bytes):
+        super().__init__(reply)
+        self.reply = reply
+
+
+def IsTextRequest(prefix: bytes) -> bool:
+    """
+    Tells whether the first bytes sent on a connection start a version 1
+    text message, which always begins with the decimal opcode, rather than a
+    frame, which begins with `frame.MAGIC`.
+    """
+    return prefix[:1].isdigit()
+
+
+def TextReply(opcode: int, error_code: str) -> bytes:
+    """
+    Builds a text reply for `opcode` that carries only an error code.
+    """
+    values = [str(opcode)]
+    for name, kind in socket_types.REPLY_TYPES[opcode].FIELDS:
+        if name == "version":
+            values.append("1")
+        elif name == "error_code":
+            values.append(error_code)
+        else:
+            values.append("")
+    return SEPARATOR.join(values).encode("UTF-8")
+
+
+def TextToFrame(data: bytes) -> bytes:
+    """
+    Translates a text request into the equivalent v2 frame.
+
+    Raises:
+        UnicodeDecodeError: If the request is not valid UTF-8.
+        frame.FrameError: If the request does not start with a known
+        opcode.
+        TextRequestError: If the fields do not match the request schema.
+    """
+    args = data.decode("UTF-8").split(SEPARATOR)
+    try:
+        opcode = int(args[0])
+    except ValueError:
+        raise frame.FrameError("text request without an opcode") from None
+    if opcode not in TEXT_OPCODES:
+        raise frame.FrameError(f"unknown text opcode {opcode}")
+
+    schema = socket_types.REQUEST_TYPES[opcode].FIELDS
+    values = args[1:]
+    if len(values) != TEXT_FIELD_COUNTS.get(opcode, len(schema)):
+        raise TextRequestError(TextReply(opcode, ERROR_ARGS_LENGTH))
+    fields = []
+    for (name, kind), value in zip(schema, values):
+        if kind is int:
+            try:
+                fields.append(frame.Int(int(value)))
+            except ValueError:
+                raise TextRequestError(
+                    TextReply(opcode, ERROR_ARG_TYPE)) from None
+        else:
+            fields.append(frame.Str(value))
+    for name, kind in schema[len(values):]:
+        fields.append(frame.Int(0) if kind is int else frame.Str(""))
+    return frame.Encode(opcode, *fields)
+
+
+def FrameToText(reply: bytes) -> bytes:
+    """
+    Translates a v2 reply frame into the equivalent text reply.
+    """
+    opcode = frame.ParseHeader(reply).opcode
+    msg = socket_types.REPLY_TYPES[opcode](reply)
+    values = [str(opcode)]
+    for name, _ in msg.FIELDS:
+        values.append(str(getattr(msg, name)))
+    return SEPARATOR.join(values).encode("UTF-8")
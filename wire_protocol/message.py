@@ -0,0 +1,256 @@
+import struct
+import threading
+
+from . import frame
+
+ERROR_BYTES_INVALID = "ERROR bytes not decodable."
+ERROR_ARGS_LENGTH = "ERROR Incorrect number of arguments provided."
+ERROR_ARG_TYPE = "ERROR Argument provided is not valid for opcode."
+
+# per item status codes of a BatchMessageReply
+STATUS_DELIVERED = 0
+STATUS_INVALID_RECIPIENT = 1
+
+
+# placeholder for a field that has not been converted yet
+_UNDECODED = object()
+
+# wire layouts a field can have, see `SocketMessage._KINDS`
+_INT = 0
+_STR = 1
+_INT_LIST = 2
+_STR_LIST = 3
+
+
+class Repeated:
+    """
+    Schema type of a repeated field holding `kind` (int or str) elements.
+
+    On the wire a repeated field is a 4 byte element count followed by the
+    elements, each encoded like a single field of that type. It decodes to a
+    list.
+    """
+    __slots__ = ("kind",)
+
+    def __init__(self, kind):
+        self.kind = kind
+
+    def __repr__(self):
+        return f"Repeated({self.kind.__name__})"
+
+
+class WireField:
+    """
+    Descriptor for one field of a generated `SocketMessage` subclass.
+
+    The converted value is cached in the message's `_state` list, so only
+    the first read of a field pays for turning wire bytes into a Python
+    value.
+    """
+    __slots__ = ("index",)
+
+    def __init__(self, index):
+        self.index = index
+
+    def __get__(self, msg, owner=None):
+        if msg is None:
+            return self
+        val = msg._state[self.index]
+        if val is _UNDECODED:
+            val = msg._Convert(self.index)
+        return val
+
+
+class SocketMessage:
+    """
+    Base class of the generated socket message decoders.
+
+    Subclasses are generated from `protos/chat.proto` by
+    `wire_protocol/codegen.py` and only provide class level tables:
+    `OPCODE`, `FIELDS` (a tuple of (name, type) pairs in wire order) and one
+    `WireField` per field. The schema is frozen into tuples when the subclass
+    is created and shared by every instance, and all per message state lives
+    in `__slots__`, so instances carry no `__dict__`.
+
+    Decoding only walks the payload once to record where each field starts
+    and ends inside the receive buffer. A field is converted
+    to its Python value the first time it is read and cached afterwards, so
+    handlers that only look at `auth_token` and `username` never pay for
+    decoding (or copying) a large message body. Calling `decode` again reuses
+    the instance and its state list, see `MessagePool`.
+
+    Fields of a message that failed to decode read as None. A str field whose
+    bytes are not valid UTF-8 raises UnicodeDecodeError when it is read.
+    """
+    __slots__ = ("generated_error_code", "request_id", "_buffer", "_state")
+
+    OPCODE = None
+    FIELDS = ()
+
+    # derived from FIELDS by __init_subclass__
+    _KINDS = ()
+    _EMPTY_ROW = ()
+    _UNSET_ROW = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        kinds = {int: _INT, str: _STR}
+        fields = tuple((name, kind) for name, kind in cls.FIELDS)
+        codes = []
+        for name, kind in fields:
+            if isinstance(kind, Repeated) and kind.kind in kinds:
+                codes.append(kinds[kind.kind] + _INT_LIST)
+            elif kind in kinds:
+                codes.append(kinds[kind])
+            else:
+                raise TypeError(f"{cls.__name__}.{name}: unsupported type")
+        cls.FIELDS = fields
+        cls._KINDS = tuple(codes)
+        cls._EMPTY_ROW = (None,) * len(fields)
+        cls._UNSET_ROW = (_UNDECODED,) * len(fields)
+
+    def __init__(self, raw_bytes):
+        # one list holds everything that varies per message: the converted
+        # values of the n fields followed by the start and end offset of each
+        # field in the frame
+        self._state = [None] * (3 * len(self.FIELDS))
+        self.decode(raw_bytes)
+
+    def _Convert(self, index):
+        state = self._state
+        buffer = self._buffer
+        start = state[len(self.FIELDS) + 2 * index]
+        end = state[len(self.FIELDS) + 2 * index + 1]
+        kind = self._KINDS[index]
+        if kind == _INT:
+            val, = frame.INT.unpack_from(buffer, start)
+        elif kind == _STR:
+            val = str(memoryview(buffer)[start:end], "UTF-8")
+        elif kind == _INT_LIST:
+            count = (end - start) // frame.INT.size
+            val = list(struct.unpack_from(f"!{count}i", buffer, start))
+        else:
+            view = memoryview(buffer)
+            val = []
+            while start < end:
+                size, = frame.LENGTH.unpack_from(buffer, start)
+                start += frame.LENGTH.size
+                val.append(str(view[start:start + size], "UTF-8"))
+                start += size
+        state[index] = val
+        return val
+
+    def decode(self, raw_bytes):
+        """
+        Decodes a frame into this instance, replacing any previous contents.
+
+        Args:
+            raw_bytes (bytes-like): A complete frame. It must not be modified
+            while the message is in use, as fields are read from it lazily.
+        """
+        n = len(self.FIELDS)
+        state = self._state
+        state[:n] = self._EMPTY_ROW
+        self.generated_error_code = None
+        self.request_id = 0
+        self._buffer = None
+
+        try:
+            magic, version, opcode, flags, request_id, length = \
+                frame.HEADER.unpack_from(raw_bytes)
+        except struct.error:
+            self.generated_error_code = ERROR_BYTES_INVALID
+            return
+        if magic != frame.MAGIC or version != frame.PROTOCOL_VERSION:
+            self.generated_error_code = ERROR_BYTES_INVALID
+            return
+
+        if flags & frame.FLAG_COMPRESSED:
+            try:
+                raw_bytes = frame.Decompress(raw_bytes)
+            except frame.FrameError:
+                self.generated_error_code = ERROR_BYTES_INVALID
+                return
+            length = len(raw_bytes) - frame.HEADER.size
+        self.request_id = request_id
+
+        if opcode != self.OPCODE:
+            self.generated_error_code = ERROR_ARG_TYPE
+            return
+
+        end = frame.HEADER.size + length
+        if len(raw_bytes) != end:
+            self.generated_error_code = ERROR_ARGS_LENGTH
+            return
+
+        # offsets are absolute positions in the frame
+        offset = frame.HEADER.size
+        i = n
+        try:
+            for kind in self._KINDS:
+                if kind == _INT:
+                    state[i] = offset
+                    offset += frame.INT.size
+                elif kind == _STR:
+                    size, = frame.LENGTH.unpack_from(raw_bytes, offset)
+                    offset += frame.LENGTH.size
+                    state[i] = offset
+                    offset += size
+                elif kind == _INT_LIST:
+                    count, = frame.LENGTH.unpack_from(raw_bytes, offset)
+                    offset += frame.LENGTH.size
+                    state[i] = offset
+                    offset += count * frame.INT.size
+                else:
+                    count, = frame.LENGTH.unpack_from(raw_bytes, offset)
+                    offset += frame.LENGTH.size
+                    state[i] = offset
+                    for _ in range(count):
+                        size, = frame.LENGTH.unpack_from(raw_bytes, offset)
+                        offset += frame.LENGTH.size + size
+                        if offset > end:
+                            raise struct.error("element runs past frame")
+                state[i + 1] = offset
+                i += 2
+        except struct.error:
+            self.generated_error_code = ERROR_ARGS_LENGTH
+            return
+
+        if offset != end:
+            self.generated_error_code = ERROR_ARGS_LENGTH
+            return
+
+        self._buffer = raw_bytes
+        state[:n] = self._UNSET_ROW
+
+
+class MessagePool:
+    """
+    Per thread cache of reusable decoded messages for the server receive
+    loop.
+
+    `Decode` hands out the same instance of a message class every time it is
+    called on a thread, decoded in place, so steady state request handling
+    allocates no message objects at all. A pooled message is only valid until
+    the next `Decode` of the same class on the same thread, so handlers must
+    not keep it (or decode a second message of its class) past the request
+    they are serving.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def Decode(self, cls, raw_bytes):
+        """
+        Decodes `raw_bytes` as a `cls` message, reusing this thread's
+        instance when there is one.
+        """
+        messages = getattr(self._local, "messages", None)
+        if messages is None:
+            messages = self._local.messages = {}
+        msg = messages.get(cls)
+        if msg is None:
+            msg = messages[cls] = cls(raw_bytes)
+        else:
+            msg.decode(raw_bytes)
+        return msg
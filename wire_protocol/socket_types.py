@@ -1,143 +1,423 @@
-ERROR_BYTES_INVALID = "ERROR bytes not decodable."
-ERROR_ARGS_LENGTH = "ERROR Incorrect number of arguments provided."
-ERROR_ARG_TYPE = "ERROR Argument provided is not valid for opcode."
-
-class SocketMessage:
-    def __init__(self, fields, raw_bytes):
-        self.generated_error_code = None
-        self.fields = fields
-        for field in fields.keys():
-            assert field not in self.__dict__
-            setattr(self, field, None)
-        self.decode(raw_bytes)
-    
-    def decode(self, raw_bytes):
-        args = None
-        try:
-            args = raw_bytes.decode("UTF-8").split("||")[1:]
-        except UnicodeDecodeError:
-            self.generated_error_code = ERROR_BYTES_INVALID
-            return
-        if len(args) != len(self.fields):
-            self.generated_error_code = ERROR_ARGS_LENGTH
-            return
-        
-        for (field, cls), val in zip(self.fields.items(), args):
-            try:
-                setattr(self, field, cls(val))
-            except ValueError:
-                self.generated_error_code = ERROR_ARG_TYPE
-                return
+# Generated by wire_protocol/codegen.py from protos/*.proto.  DO NOT EDIT!
+from .message import (ERROR_ARG_TYPE, ERROR_ARGS_LENGTH,
+                      ERROR_BYTES_INVALID, Repeated, SocketMessage,
+                      WireField)
+
 
 class AccountCreateRequest(SocketMessage):
-    def __init__(self, raw_bytes):
-        fields = {
-            "version": int,
-            "username": str,
-            "password": str,
-            "fullname": str
-        }
-        super().__init__(fields, raw_bytes)    
+    __slots__ = ()
+    OPCODE = 0
+    FIELDS = (
+        ('version', int),
+        ('username', str),
+        ('password', str),
+        ('fullname', str),
+    )
+
+    version = WireField(0)
+    username = WireField(1)
+    password = WireField(2)
+    fullname = WireField(3)
+
 
 class AccountCreateReply(SocketMessage):
-    def __init__(self, raw_bytes):
-        fields = {
-            "version": int,
-            "error_code": str,
-            "auth_token": str,
-            "fullname": str
-        }
-        super().__init__(fields, raw_bytes)
+    __slots__ = ()
+    OPCODE = 0
+    FIELDS = (
+        ('version', int),
+        ('error_code', str),
+        ('auth_token', str),
+        ('fullname', str),
+    )
+
+    version = WireField(0)
+    error_code = WireField(1)
+    auth_token = WireField(2)
+    fullname = WireField(3)
+
 
 class LoginRequest(SocketMessage):
-    def __init__(self, raw_bytes):
-        fields = {
-            "version": int,
-            "username": str,
-            "password": str
-        }
-        super().__init__(fields, raw_bytes)
+    __slots__ = ()
+    OPCODE = 1
+    FIELDS = (
+        ('version', int),
+        ('username', str),
+        ('password', str),
+    )
+
+    version = WireField(0)
+    username = WireField(1)
+    password = WireField(2)
+
 
 class LoginReply(SocketMessage):
-    def __init__(self, raw_bytes):
-        fields = {
-            "version": int,
-            "error_code": str,
-            "auth_token": str,
-            "fullname": str
-        }
-        super().__init__(fields, raw_bytes)
+    __slots__ = ()
+    OPCODE = 1
+    FIELDS = (
+        ('version', int),
+        ('error_code', str),
+        ('auth_token', str),
+        ('fullname', str),
+    )
+
+    version = WireField(0)
+    error_code = WireField(1)
+    auth_token = WireField(2)
+    fullname = WireField(3)
+
 
 class MessageRequest(SocketMessage):
-    def __init__(self, raw_bytes):
-        fields = {
-            "version": int,
-            "auth_token": str,
-            "username": str,
-            "recipient_username": str,
-            "message": str
-        }
-        super().__init__(fields, raw_bytes)
+    __slots__ = ()
+    OPCODE = 2
+    FIELDS = (
+        ('version', int),
+        ('auth_token', str),
+        ('username', str),
+        ('recipient_username', str),
+        ('message', str),
+    )
+
+    version = WireField(0)
+    auth_token = WireField(1)
+    username = WireField(2)
+    recipient_username = WireField(3)
+    message = WireField(4)
+
 
 class MessageReply(SocketMessage):
-    def __init__(self, raw_bytes):
-        fields = {
-            "version": int,
-            "error_code": str
-        }
-        super().__init__(fields, raw_bytes)
+    __slots__ = ()
+    OPCODE = 2
+    FIELDS = (
+        ('version', int),
+        ('error_code', str),
+    )
+
+    version = WireField(0)
+    error_code = WireField(1)
+
 
 class ListAccountRequest(SocketMessage):
-    def __init__(self, raw_bytes):
-        fields = {
-            "version": int,
-            "auth_token": str,
-            "username": str,
-            "number_of_accounts": int,
-            "regex": str
-        }
-        super().__init__(fields, raw_bytes)
+    __slots__ = ()
+    OPCODE = 3
+    FIELDS = (
+        ('version', int),
+        ('auth_token', str),
+        ('username', str),
+        ('number_of_accounts', int),
+        ('regex', str),
+    )
+
+    version = WireField(0)
+    auth_token = WireField(1)
+    username = WireField(2)
+    number_of_accounts = WireField(3)
+    regex = WireField(4)
+
 
 class ListAccountReply(SocketMessage):
-    def __init__(self, raw_bytes):
-        fields = {
-            "version": int,
-            "error_code": str,
-            "account_names": str
-        }
-        super().__init__(fields, raw_bytes)
+    __slots__ = ()
+    OPCODE = 3
+    FIELDS = (
+        ('version', int),
+        ('error_code', str),
+        ('account_names', str),
+    )
+
+    version = WireField(0)
+    error_code = WireField(1)
+    account_names = WireField(2)
+
 
 class DeleteAccountRequest(SocketMessage):
-    def __init__(self, raw_bytes):
-        fields = {
-            "version": int,
-            "auth_token": str,
-            "username": str
-        }
-        super().__init__(fields, raw_bytes)
+    __slots__ = ()
+    OPCODE = 4
+    FIELDS = (
+        ('version', int),
+        ('auth_token', str),
+        ('username', str),
+    )
+
+    version = WireField(0)
+    auth_token = WireField(1)
+    username = WireField(2)
+
 
 class DeleteAccountReply(SocketMessage):
-    def __init__(self, raw_bytes):
-        fields = {
-            "version": int,
-            "error_code": str
-        }
-        super().__init__(fields, raw_bytes)
+    __slots__ = ()
+    OPCODE = 4
+    FIELDS = (
+        ('version', int),
+        ('error_code', str),
+    )
+
+    version = WireField(0)
+    error_code = WireField(1)
+
 
 class RefreshRequest(SocketMessage):
-    def __init__(self, raw_bytes):
-        fields = {
-            "version": int,
-            "auth_token": str,
-            "username": str
-        }
-        super().__init__(fields, raw_bytes)
+    __slots__ = ()
+    OPCODE = 5
+    FIELDS = (
+        ('version', int),
+        ('auth_token', str),
+        ('username', str),
+        ('wait_ms', int),
+    )
+
+    version = WireField(0)
+    auth_token = WireField(1)
+    username = WireField(2)
+    wait_ms = WireField(3)
+
 
 class RefreshReply(SocketMessage):
-    def __init__(self, raw_bytes):
-        fields = {
-            "version": int,
-            "message": str,
-            "error_code": str
-        }
-        super().__init__(fields, raw_bytes)
\ No newline at end of file
+    __slots__ = ()
+    OPCODE = 5
+    FIELDS = (
+        ('version', int),
+        ('message', str),
+        ('error_code', str),
+    )
+
+    version = WireField(0)
+    message = WireField(1)
+    error_code = WireField(2)
+
+
+class BatchMessageRequest(SocketMessage):
+    __slots__ = ()
+    OPCODE = 6
+    FIELDS = (
+        ('version', int),
+        ('auth_token', str),
+        ('username', str),
+        ('recipient_usernames', Repeated(str)),
+        ('messages', Repeated(str)),
+    )
+
+    version = WireField(0)
+    auth_token = WireField(1)
+    username = WireField(2)
+    recipient_usernames = WireField(3)
+    messages = WireField(4)
+
+
+class BatchMessageReply(SocketMessage):
+    __slots__ = ()
+    OPCODE = 6
+    FIELDS = (
+        ('version', int),
+        ('error_code', str),
+        ('status_codes', Repeated(int)),
+    )
+
+    version = WireField(0)
+    error_code = WireField(1)
+    status_codes = WireField(2)
+
+
+class HandshakeRequest(SocketMessage):
+    __slots__ = ()
+    OPCODE = 7
+    FIELDS = (
+        ('version', int),
+        ('protocol_versions', Repeated(int)),
+        ('codecs', Repeated(str)),
+        ('compressions', Repeated(str)),
+        ('max_frame_size', int),
+    )
+
+    version = WireField(0)
+    protocol_versions = WireField(1)
+    codecs = WireField(2)
+    compressions = WireField(3)
+    max_frame_size = WireField(4)
+
+
+class HandshakeReply(SocketMessage):
+    __slots__ = ()
+    OPCODE = 7
+    FIELDS = (
+        ('version', int),
+        ('error_code', str),
+        ('protocol_version', int),
+        ('codec', str),
+        ('compression', str),
+        ('max_frame_size', int),
+    )
+
+    version = WireField(0)
+    error_code = WireField(1)
+    protocol_version = WireField(2)
+    codec = WireField(3)
+    compression = WireField(4)
+    max_frame_size = WireField(5)
+
+
+class ShardDeliveryRequest(SocketMessage):
+    __slots__ = ()
+    OPCODE = 8
+    FIELDS = (
+        ('version', int),
+        ('recipient_usernames', Repeated(str)),
+        ('messages', Repeated(str)),
+    )
+
+    version = WireField(0)
+    recipient_usernames = WireField(1)
+    messages = WireField(2)
+
+
+class ShardDeliveryReply(SocketMessage):
+    __slots__ = ()
+    OPCODE = 8
+    FIELDS = (
+        ('version', int),
+        ('error_code', str),
+        ('status_codes', Repeated(int)),
+    )
+
+    version = WireField(0)
+    error_code = WireField(1)
+    status_codes = WireField(2)
+
+
+class ShardListRequest(SocketMessage):
+    __slots__ = ()
+    OPCODE = 9
+    FIELDS = (
+        ('version', int),
+        ('number_of_accounts', int),
+        ('regex', str),
+    )
+
+    version = WireField(0)
+    number_of_accounts = WireField(1)
+    regex = WireField(2)
+
+
+class ShardListReply(SocketMessage):
+    __slots__ = ()
+    OPCODE = 9
+    FIELDS = (
+        ('version', int),
+        ('error_code', str),
+        ('account_names', Repeated(str)),
+    )
+
+    version = WireField(0)
+    error_code = WireField(1)
+    account_names = WireField(2)
+
+
+class PingRequest(SocketMessage):
+    __slots__ = ()
+    OPCODE = 10
+    FIELDS = (
+        ('version', int),
+        ('nonce', int),
+    )
+
+    version = WireField(0)
+    nonce = WireField(1)
+
+
+class PingReply(SocketMessage):
+    __slots__ = ()
+    OPCODE = 10
+    FIELDS = (
+        ('version', int),
+        ('error_code', str),
+        ('nonce', int),
+    )
+
+    version = WireField(0)
+    error_code = WireField(1)
+    nonce = WireField(2)
+
+
+class SubscribeRequest(SocketMessage):
+    __slots__ = ()
+    OPCODE = 11
+    FIELDS = (
+        ('version', int),
+        ('auth_token', str),
+        ('username', str),
+    )
+
+    version = WireField(0)
+    auth_token = WireField(1)
+    username = WireField(2)
+
+
+class SubscribeReply(SocketMessage):
+    __slots__ = ()
+    OPCODE = 11
+    FIELDS = (
+        ('version', int),
+        ('error_code', str),
+    )
+
+    version = WireField(0)
+    error_code = WireField(1)
+
+
+class PushRequest(SocketMessage):
+    __slots__ = ()
+    OPCODE = 12
+    FIELDS = (
+        ('version', int),
+        ('sequence', int),
+        ('messages', Repeated(str)),
+    )
+
+    version = WireField(0)
+    sequence = WireField(1)
+    messages = WireField(2)
+
+
+class PushAck(SocketMessage):
+    __slots__ = ()
+    OPCODE = 12
+    FIELDS = (
+        ('version', int),
+        ('error_code', str),
+        ('sequence', int),
+    )
+
+    version = WireField(0)
+    error_code = WireField(1)
+    sequence = WireField(2)
+
+
+# decoder classes by opcode
+REQUEST_TYPES = {
+    0: AccountCreateRequest,
+    1: LoginRequest,
+    2: MessageRequest,
+    3: ListAccountRequest,
+    4: DeleteAccountRequest,
+    5: RefreshRequest,
+    6: BatchMessageRequest,
+    7: HandshakeRequest,
+    8: ShardDeliveryRequest,
+    9: ShardListRequest,
+    10: PingRequest,
+    11: SubscribeRequest,
+    12: PushRequest,
+}
+REPLY_TYPES = {
+    0: AccountCreateReply,
+    1: LoginReply,
+    2: MessageReply,
+    3: ListAccountReply,
+    4: DeleteAccountReply,
+    5: RefreshReply,
+    6: BatchMessageReply,
+    7: HandshakeReply,
+    8: ShardDeliveryReply,
+    9: ShardListReply,
+    10: PingReply,
+    11: SubscribeReply,
+    12: PushAck,
+}
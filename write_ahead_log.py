@@ -0,0 +1,490 @@
+"""
+A write-ahead log of a chat server's accounts and inboxes.
+
+Every change to the durable state of a server (an account created or deleted,
+a message enqueued, messages delivered) is appended to the log as a record,
+while the stripe lock that guards the change is held, so the log orders the
+changes of every user the way memory saw them. Restarting a server with the
+same log replays the records into its empty stripes. Tokens are not logged,
+so users log in again after a restart.
+
+Records are appended to a buffer in memory and written by a group commit
+thread, which waits `window` seconds after the first record of a batch for
+more to arrive and then writes and fsyncs the whole batch at once. A server
+does not reply to a request before the records it appended are on disk
+(`Commit`), so the cost of an fsync is shared by every request that arrived
+within the window. If a batch cannot be written or synced (a full disk, an
+I/O error) the log fails for good: every commit still waiting and every
+later append or commit raises `LogError`, rather than waiting for records
+that will never reach the disk.
+
+Records are numbered from 1 across the life of a log. A log file starts with
+a header holding the number of the records before it, so that a log can be
+rotated (`Rotate`) into a closed segment, named after its last record, and a
+fresh file that carries on the numbering. Segments are deleted once a
+snapshot covers them, see `snapshot.py`.
+
+On disk every record is a header of its payload length and the CRC-32 of the
+payload, followed by the payload: a one byte record kind and its fields, text
+as a length prefixed UTF-8 string and numbers as 8 byte integers. A record
+cut short by a crash is detected by its length or checksum, and the log is
+truncated before it when reopened.
+"""
+import asyncio
+import glob
+import os
+import struct
+import threading as mp
+import time
+import zlib
+from collections import deque
+
+LOG_HEADER = struct.Struct("<8sq")
+LOG_MAGIC = b"CHATWAL1"
+RECORD_HEADER = struct.Struct("<II")
+KIND = struct.Struct("<B")
+LENGTH = struct.Struct("<I")
+NUMBER = struct.Struct("<q")
+
+CREATE_ACCOUNT = 1
+DELETE_ACCOUNT = 2
+ENQUEUE = 3
+DELIVER = 4
+RETURN = 5
+
+# the fields of every record kind
+RECORD_FIELDS = {
+    # username, password, fullname
+    CREATE_ACCOUNT: (str, str, str),
+    # username
+    DELETE_ACCOUNT: (str,),
+    # recipient, message; appended to the end of the recipient's queue
+    ENQUEUE: (str, str),
+    # username, offset, count; removes `count` messages from the user's
+    # queue, starting `offset` messages from its front
+    DELIVER: (str, int, int),
+    # username, message; put back at the front of the user's queue
+    RETURN: (str, str),
+}
+
+DEFAULT_WINDOW = 0.0005
+
+
+class LogError(Exception):
+    pass
+
+
+def Record(kind: int, *fields) -> bytes:
+    """
+    Encodes one log record, header included.
+    """
+    parts = [KIND.pack(kind)]
+    for cls, value in zip(RECORD_FIELDS[kind], fields):
+        if cls is int:
+            parts.append(NUMBER.pack(value))
+        else:
+            value = value.encode("UTF-8")
+            parts.append(LENGTH.pack(len(value)))
+            parts.append(value)
+    payload = b"".join(parts)
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def DecodeRecord(payload) -> tuple:
+    """
+    Decodes the payload of one record.
+
+    Returns:
+        tuple: The record kind followed by its fields.
+    """
+    kind, = KIND.unpack_from(payload, 0)
+    if kind not in RECORD_FIELDS:
+        raise LogError(f"unknown record kind {kind}")
+    offset = KIND.size
+    fields = [kind]
+    for cls in RECORD_FIELDS[kind]:
+        if cls is int:
+            value, = NUMBER.unpack_from(payload, offset)
+            offset += NUMBER.size
+        else:
+            size, = LENGTH.unpack_from(payload, offset)
+            offset += LENGTH.size
+            value = str(payload[offset:offset + size], "UTF-8")
+            offset += size
+        fields.append(value)
+    return tuple(fields)
+
+
+def ReadRecords(data, start: int = 0):
+    """
+    Yields `(end, record)` for every complete record in `data` from offset
+    `start` on, where `end` is the offset just past the record. Stops at the
+    first record that is cut short or fails its checksum.
+    """
+    offset = start
+    while offset + RECORD_HEADER.size <= len(data):
+        length, checksum = RECORD_HEADER.unpack_from(data, offset)
+        end = offset + RECORD_HEADER.size + length
+        if end > len(data):
+            return
+        payload = data[offset + RECORD_HEADER.size:end]
+        if zlib.crc32(payload) != checksum:
+            return
+        yield end, DecodeRecord(payload)
+        offset = end
+
+
+def Apply(stripes, record: tuple) -> None:
+    """
+    Replays one record into the stripes of a server that is not serving
+    yet, so no locks are taken.
+    """
+    kind, username = record[0], record[1]
+    stripe = stripes.Of(username)
+    if kind == CREATE_ACCOUNT:
+        stripe.user_metadata_store[username] = (record[2], record[3])
+        stripe.created[username] = stripes.NextAccount()
+        stripe.user_inbox[username] = stripe.user_inbox.default_factory()
+        return
+    if kind == DELETE_ACCOUNT:
+        stripe.user_metadata_store.pop(username, None)
+        stripe.created.pop(username, None)
+        stripe.user_inbox.pop(username, None)
+        return
+    inbox = stripe.user_inbox.get(username)
+    if inbox is None:
+        return
+    if kind == ENQUEUE:
+        inbox.append(record[2])
+    elif kind == RETURN:
+        inbox.insert(0, record[2])
+    elif kind == DELIVER:
+        offset, count = record[2], record[3]
+        if isinstance(inbox, deque):
+            inbox.rotate(-offset)
+            for _ in range(min(count, len(inbox))):
+                inbox.popleft()
+            inbox.rotate(offset)
+        else:
+            del inbox[offset:offset + count]
+
+
+def ReadLog(path: str):
+    """
+    Reads a log file.
+
+    Returns:
+        tuple: The number of the records before the file and its contents
+        after the header, or None if there is no such file.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    if len(data) < LOG_HEADER.size:
+        # the file was created but its header never reached the disk
+        return None
+    magic, base = LOG_HEADER.unpack_from(data, 0)
+    if magic != LOG_MAGIC:
+        raise LogError(f"{path} is not a write-ahead log")
+    return base, memoryview(data)[LOG_HEADER.size:]
+
+
+def Segments(path: str) -> list:
+    """
+    Returns the rotated segments of the log at `path` as (number of their
+    last record, path) pairs, oldest first.
+    """
+    segments = []
+    for segment in glob.glob(glob.escape(path) + ".*"):
+        suffix = segment[len(path) + 1:]
+        if suffix.isdigit():
+            segments.append((int(suffix), segment))
+    return sorted(segments)
+
+
+def Recover(stripes, path: str, covered: dict = None,
+            floor: int = 0) -> tuple:
+    """
+    Replays the rotated segments and then the log at `path` into stripes
+    that hold nothing but a snapshot, if any, and cuts off a torn record at
+    the end of the log.
+
+    A record is skipped if the snapshot already covers it: if its number is
+    at most `covered[username]`, or at most `floor` for a username that
+    `covered` does not hold.
+
+    Returns:
+        tuple: The number of records replayed and the number of the last
+        record in the log, at least `floor`.
+    """
+    covered = covered or {}
+    replayed = 0
+    last = floor
+    for _, segment in Segments(path) + [(None, path)]:
+        log = ReadLog(segment)
+        if log is None:
+            continue
+        number, data = log
+        end = 0
+        for end, record in ReadRecords(data):
+            number += 1
+            if number > covered.get(record[1], floor):
+                Apply(stripes, record)
+                replayed += 1
+        last = max(last, number)
+        if segment == path and end < len(data):
+            with open(path, "r+b") as f:
+                f.truncate(LOG_HEADER.size + end)
+    return replayed, last
+
+
+def SyncDirectory(path: str) -> None:
+    """
+    Syncs the directory of `path`, so that a file created, renamed or
+    removed in it stays so after a crash.
+    """
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class WriteAheadLog:
+    """
+    An append only log file with a group commit thread.
+
+    Records are numbered in the order they are appended. `Append` returns
+    the number of the last record it added and remembers it for the calling
+    thread, so that a server can wait for everything a request logged with
+    `Commit` once the request's locks are released. A thread that must not
+    block, such as an event loop, calls `Defer` once, after which its
+    `Commit` calls return at once and it awaits `CommitAsync` instead.
+
+    Args:
+        path (str): The log file, created if missing and appended to.
+        window (float): Seconds the commit thread waits after the first
+        record of a batch before writing and syncing it.
+        number (int): The number of the last record already in the log.
+    """
+
+    def __init__(self, path: str, window: float = DEFAULT_WINDOW,
+                 number: int = 0):
+        self.path = path
+        self.window = window
+        self.file = self.Create(path, number)
+        # held while the file is written, synced or rotated
+        self.write_lock = mp.RLock()
+        self.lock = mp.Lock()
+        self.appended_cv = mp.Condition(self.lock)
+        self.durable_cv = mp.Condition(self.lock)
+        self.buffer = []
+        # numbers of the last record appended and of the last one on disk
+        self.appended = number
+        self.durable = number
+        # (number, loop, future) of the coroutines awaiting a commit
+        self.async_waiters = []
+        self.closed = False
+        # the error a batch failed with, after which the log is closed
+        self.error = None
+        self.local = mp.local()
+        # batches written, and records in them
+        self.commits = 0
+        self.records = 0
+        self.thread = mp.Thread(target=self.Run, daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def Create(path: str, number: int):
+        """
+        Opens the log file at `path` for appending, giving it a header that
+        starts its numbering after `number` if it is new.
+        """
+        log = open(path, "ab")
+        if log.tell() == 0:
+            log.write(LOG_HEADER.pack(LOG_MAGIC, number))
+            log.flush()
+            os.fsync(log.fileno())
+            SyncDirectory(path)
+        return log
+
+    def Append(self, *records: bytes) -> int:
+        """
+        Adds encoded records to the log.
+
+        Returns:
+            int: The number of the last record added.
+        """
+        with self.lock:
+            if self.closed:
+                raise self.Error("the log is closed")
+            self.buffer += records
+            self.appended += len(records)
+            number = self.appended
+            self.appended_cv.notify()
+        self.local.pending = number
+        return number
+
+    def Wait(self, number: int) -> None:
+        """
+        Blocks until the record numbered `number` is on disk.
+
+        Raises:
+            LogError: If the log failed before the record was written.
+        """
+        with self.lock:
+            while self.durable < number and not self.closed:
+                self.durable_cv.wait()
+            if self.durable < number and self.error is not None:
+                raise self.Error()
+
+    def Error(self, reason: str = None) -> LogError:
+        """
+        Returns the error to raise for a request the log cannot serve: the
+        failure of a batch if there was one, otherwise `reason`.
+        """
+        if self.error is not None:
+            return LogError(f"the log failed: {self.error}")
+        return LogError(reason)
+
+    def Defer(self) -> None:
+        """
+        Makes `Commit` a no-op on the calling thread, which awaits
+        `CommitAsync` instead.
+        """
+        self.local.deferred = True
+
+    def Commit(self) -> None:
+        """
+        Waits until every record the calling thread appended is on disk.
+        """
+        if getattr(self.local, "deferred", False):
+            return
+        number = getattr(self.local, "pending", 0)
+        if number:
+            self.local.pending = 0
+            self.Wait(number)
+
+    async def CommitAsync(self) -> None:
+        """
+        The coroutine counterpart of `Commit`, for an event loop thread.
+        """
+        number = getattr(self.local, "pending", 0)
+        if not number:
+            return
+        self.local.pending = 0
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.lock:
+            if self.durable < number and self.error is not None:
+                raise self.Error()
+            if self.durable >= number or self.closed:
+                return
+            self.async_waiters.append((number, loop, future))
+        await future
+
+    def Run(self) -> None:
+        while True:
+            with self.lock:
+                while not self.buffer and not self.closed:
+                    self.appended_cv.wait()
+                if not self.buffer:
+                    return
+            if self.window > 0:
+                time.sleep(self.window)
+            try:
+                self.Flush()
+            except LogError:
+                # the log is closed, and its waiters failed, by `Fail`
+                return
+
+    def Flush(self) -> int:
+        """
+        Writes and syncs every buffered record.
+
+        Returns:
+            int: The number of the last record on disk.
+
+        Raises:
+            LogError: If the records cannot be written or synced, or an
+            earlier batch could not be.
+        """
+        with self.write_lock:
+            with self.lock:
+                if self.error is not None:
+                    raise self.Error()
+                batch, self.buffer = self.buffer, []
+                number = self.appended
+            if not batch:
+                return number
+            try:
+                self.file.write(b"".join(batch))
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            except OSError as e:
+                self.Fail(e)
+                raise self.Error() from e
+            with self.lock:
+                self.durable = number
+                self.commits += 1
+                self.records += len(batch)
+                self.durable_cv.notify_all()
+                waiters = self.async_waiters
+                self.async_waiters = [w for w in waiters if w[0] > number]
+        for waiting, loop, future in waiters:
+            if waiting <= number:
+                loop.call_soon_threadsafe(
+                    lambda f=future: f.done() or f.set_result(None))
+        return number
+
+    def Fail(self, error: OSError) -> None:
+        """
+        Closes the log after a batch failed with `error`, and fails every
+        commit waiting for it.
+        """
+        with self.lock:
+            self.error = error
+            self.closed = True
+            self.buffer = []
+            self.appended_cv.notify()
+            self.durable_cv.notify_all()
+            waiters, self.async_waiters = self.async_waiters, []
+        for _, loop, future in waiters:
+            loop.call_soon_threadsafe(
+                lambda f=future: f.done() or f.set_exception(self.Error()))
+
+    def Rotate(self) -> int:
+        """
+        Closes the log file as a segment named after its last record and
+        carries on in a new file. Appends go on meanwhile; only their
+        commits wait for the switch.
+
+        Returns:
+            int: The number of the last record in the closed segment.
+        """
+        with self.write_lock:
+            number = self.Flush()
+            self.file.close()
+            os.replace(self.path, f"{self.path}.{number}")
+            self.file = self.Create(self.path, number)
+        return number
+
+    def Close(self) -> None:
+        """
+        Writes the records still buffered and closes the file.
+        """
+        with self.lock:
+            self.closed = True
+            self.appended_cv.notify()
+        self.thread.join()
+        if self.error is None:
+            self.Flush()
+        with self.lock:
+            self.durable_cv.notify_all()
+            waiters, self.async_waiters = self.async_waiters, []
+        for _, loop, future in waiters:
+            loop.call_soon_threadsafe(
+                lambda f=future: f.done() or f.set_result(None))
+        self.file.close()